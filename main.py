@@ -6,7 +6,7 @@ from src.avails import const
 from src.configurations import bootup, configure
 from src.core import Dock, connections, connectivity, requests
 from src.core.async_runner import AnotherRunner
-from src.managers import profilemanager
+from src.managers import filemanager, profilemanager
 from src.managers.statemanager import State, StateManager
 from src.webpage_handlers import pagehandle
 
@@ -19,9 +19,10 @@ def initial_states():
     s5 = State("launching webpage", pagehandle.initiate_page_handle, is_blocking=True)
     s6 = State("waiting for profile choice", pagehandle.PROFILE_WAIT.wait)
     s7 = State("configuring this remote peer object", bootup.configure_this_remote_peer)
-    s8 = State("initiating comms", connections.initiate_connections, is_blocking=True)
-    s9 = State("initiating requests", requests.initiate, is_blocking=True)
-    s10 = State("connectivity checker", connectivity.initiate)
+    s8 = State("loading transfer journal", filemanager.initiate_journal)
+    s9 = State("initiating comms", connections.initiate_connections, is_blocking=True)
+    s10 = State("initiating requests", requests.initiate, is_blocking=True)
+    s11 = State("connectivity checker", connectivity.initiate)
     return tuple(locals().values())
 
 
@@ -1,5 +1,6 @@
 import asyncio as _asyncio
 import logging
+import os as _os
 import socket
 import socket as _socket
 import struct
@@ -87,6 +88,89 @@ class Socket(_socket.socket):
     async def arecvfrom(self, buffsize):
         return await self.__loop.sock_recvfrom(self, buffsize)
 
+    def sendmsg_all(self, buffers):
+        """
+        Gather version of ``sendall``, sends all the ``buffers`` one after another without joining them
+
+        Partial sends are continued from where the kernel stopped, falls back to
+        a ``sendall`` per buffer where ``sendmsg`` is not available (windows)
+
+        Parameters:
+            buffers (Sequence[bytes | bytearray | memoryview]): buffers to send in order
+        """
+        if not _HAS_SENDMSG:
+            for buf in buffers:
+                self.sendall(buf)
+            return
+
+        views = _as_byte_views(buffers)
+        while views:
+            sent = self.sendmsg(views[:_IOV_MAX])
+            views = _advance_views(views, sent)
+
+    async def asendmsg_all(self, buffers):
+        """
+        Asynchronous version of :meth:`sendmsg_all`
+
+        Parameters:
+            buffers (Sequence[bytes | bytearray | memoryview]): buffers to send in order
+        """
+        if not _HAS_SENDMSG:
+            for buf in buffers:
+                await self.__loop.sock_sendall(self, buf)
+            return
+
+        sent = 0
+        if len(buffers) <= _IOV_MAX:
+            # fast path, most of the time kernel takes everything in one go
+            try:
+                sent = self.sendmsg(buffers)
+            except (BlockingIOError, InterruptedError):
+                pass
+            if sent == sum(len(buf) for buf in buffers):
+                return
+
+        views = _advance_views(_as_byte_views(buffers), sent)
+        while views:
+            await self._wait_writable()
+            try:
+                sent = self.sendmsg(views[:_IOV_MAX])
+            except (BlockingIOError, InterruptedError):
+                continue
+            views = _advance_views(views, sent)
+
+    async def _wait_writable(self):
+        fut = self.__loop.create_future()
+        fd = self.fileno()
+        self.__loop.add_writer(fd, lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            self.__loop.remove_writer(fd)
+
+
+_HAS_SENDMSG = hasattr(_socket.socket, 'sendmsg')
+try:
+    _IOV_MAX = _os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+
+
+def _as_byte_views(buffers):
+    return [view for view in (memoryview(buf).cast('B') for buf in buffers) if view.nbytes]
+
+
+def _advance_views(views, sent):
+    """Drops ``sent`` bytes from the front of ``views``"""
+    index = 0
+    while index < len(views) and sent >= views[index].nbytes:
+        sent -= views[index].nbytes
+        index += 1
+    views = views[index:]
+    if sent:
+        views[0] = views[0][sent:]
+    return views
+
 
 class NetworkProtocol(ABC):
     __slots__ = ()
@@ -273,6 +357,15 @@ class Sender(_PauseMixIn, _ResumeMixIn):
         await self._stopper.wait()
         return await self.send_func(self.sock, buf)
 
+    async def sendfile(self, file: IO[bytes], offset: int, count: int):
+        """Sends ``count`` bytes of ``file`` starting at ``offset``, contents are copied by the kernel
+
+        Raises:
+            asyncio.SendfileNotAvailableError: if the platform or socket does not support sendfile
+        """
+        await self._stopper.wait()
+        return await _asyncio.get_running_loop().sock_sendfile(self.sock, file, offset, count, fallback=False)
+
 
 class Receiver(_PauseMixIn, _ResumeMixIn):
     __slots__ = 'sock', 'recv_func', '_stopper'
@@ -287,6 +380,11 @@ class Receiver(_PauseMixIn, _ResumeMixIn):
         await self._stopper.wait()
         return await self.recv_func(self.sock, nbytes)
 
+    async def recv_into(self, buffer) -> int:
+        """Receives into ``buffer`` (any writable buffer), returns number of bytes received, 0 on EOF"""
+        await self._stopper.wait()
+        return await _asyncio.get_running_loop().sock_recv_into(self.sock, buffer)
+
 
 def create_connection_sync(address, addr_family=None, sock_type=None, timeout=None) -> Socket:
     try:
@@ -41,6 +41,7 @@ PORT_PAGE_SERVE = 40000
 PATH_CURRENT = '../..'
 PATH_LOG = '../../logs'
 PATH_PROFILES = '../../profiles'
+PATH_TRANSFERS = '../../profiles/transfers'
 PATH_PAGE = '../webpage'
 PATH_DOWNLOAD = path.join(path.expanduser('~'), 'Downloads')
 PATH_CONFIG = f'..\\configurations\\{DEFAULT_CONFIG_FILE}'
@@ -54,6 +55,7 @@ FILE_ERROR_EXT = '.pc-unconfirmedownload'
 debug = False
 
 PROTOCOL = None
+REQ_BATCHING = False  # use batched datagram endpoint for requests, see transports.BatchedDatagramTransport
 
 if TYPE_CHECKING:
     from src.avails.connect import TCPProtocol
@@ -67,8 +69,51 @@ MAX_CALL_BACKS = 5
 MAX_RETIRES = 7
 MAX_DATAGRAM_RECV_SIZE = 1024 * 256  # 256 KB
 MAX_DATAGRAM_SEND_SIZE = 1024 * 63  # 63 KB
+FRAME_READER_BUFFER_SIZE = 1024 * 64  # 64 KB, grows to fit the largest frame seen on that connection
+MAX_DATAGRAM_SIZE = 1024 * 64  # 64 KB, any udp payload fits
+DATAGRAM_BATCH_SIZE = 64  # datagrams drained per readiness event by batched endpoint
+CONNECTION_POOL_SIZE = 16  # message stream connections kept open, one per peer
+CONNECTION_IDLE_TIMEOUT = 120  # seconds
+CONNECTION_HEALTH_CHECK_INTERVAL = 15  # seconds
+FILE_TRANSFER_STRIPES = 1  # connections used per file transfer, files are split into ranges across them
+FILE_MAX_STRIPES = 8  # most stripes this end takes when receiving, senders asking for more get this many
+FILE_SENDFILE = True  # let the kernel copy file contents into sockets (os.sendfile), falls back to mmap
+FILE_RECV_INTO = True  # receive file contents into preallocated buffers, writes overlap with receiving
+FILE_PWRITE = False  # write received chunks at their offsets with os.pwrite, where available
+FILE_RECV_BUFFERS = 3  # buffers per file being received with FILE_RECV_INTO
+FILE_VERIFY = True  # hash chunks of files at both ends while transferring, corrupted chunks are sent again
+FILE_VERIFY_ATTEMPTS = 3  # rounds of resending corrupted chunks before giving up on a file
+HASH_CHUNK_SIZE = 1024 * 1024  # 1 MB, chunks hashed (and resent when corrupted) as a unit
+FILE_DELTA = True  # files the receiver has an older version of only send what changed, see files.delta
+FILE_DELTA_MIN_SIZE = 1024 * 1024  # 1 MB, smaller files are sent whole
+FILE_COMPRESSION = 'zlib'  # zlib, lzma or none, compresses what looks compressible, see files.compression
+FILE_COMPRESS_AHEAD = 3  # chunks being compressed while one is sent
+FILE_PREALLOCATE = True  # received files are allocated at full size up front, see files.allocation
+FILE_SPARSE = True  # holes of sparse files are neither sent nor allocated
+FILE_BATCH = True  # small files of a transfer are sent together, see files.batching
+FILE_SMALL_FILE_SIZE = 1024 * 256  # 256 KB, smaller files are packed together into batches
+FILE_BATCH_SIZE = 1024 * 1024  # 1 MB, batches of small files are flushed at this size
+MIN_CHUNK_SIZE = 1024 * 64  # 64 KB, bounds of adaptive chunk sizes of file transfers
+MAX_CHUNK_SIZE = 1024 * 1024 * 2  # 2 MB
+CHUNK_TARGET_LATENCY = 0.1  # seconds, chunks taking longer than this to send/write shrink chunk size
+TRANSFER_RATE_LIMIT = 0  # bytes per second all transfers share, 0 for no limit, see transfers.scheduler
+TRANSFER_BURST = 0.05  # seconds worth of rate limit an idle transfer may send at once
+TRANSFER_WINDOW = MAX_CHUNK_SIZE * 4  # bytes of file chunks being sent at once, across all transfers
+TRANSFER_STALL_TIMEOUT = 1  # seconds, a chunk still being sent after this no longer counts against the window
+DIR_PIPELINED = True  # directory transfers send a manifest up front and stream files without per file acks
+DIR_ACK_WINDOW = 512  # files a pipelined directory sender may get ahead of acknowledgements
+DIR_SMALL_FILE_SIZE = 1024 * 256  # 256 KB, smaller files are packed together into batches
+DIR_BATCH_SIZE = 1024 * 1024  # 1 MB, batches of small files are flushed at this size
+DIR_MANIFEST_BATCH = 2048  # manifest entries per frame
+DIR_SCAN_QUEUE_SIZE = 8  # batches of scanned entries a directory scan may get ahead of sending
+DIR_READ_AHEAD = 4  # batches/files read ahead while sending a directory
+DIR_CHECKPOINT_INTERVAL = 1  # seconds, how often directory manifests are checkpointed to disk
+TRANSFER_JOURNAL = True  # file transfers are journaled to be resumed after a restart, see files.journal
+TRANSFER_JOURNAL_INTERVAL = 1  # seconds, journal records are written in batches this far apart
+TRANSFER_JOURNAL_COMPACT_SIZE = 1024 * 1024  # 1 MB, journal log is compacted into its snapshot past this size
 # MAX_OTM_BUFFERING = 1024 * 1024 * 10  # 10 MB
-MAX_OTM_BUFFERING = 20  # 20 chunks
+MAX_OTM_BUFFERING = 20  # 20 chunks, queued per child link of an otm relay
+OTM_LAG_TIMEOUT = 0.5  # seconds a child's queue may stay full while its siblings keep up, before it catches up on its own
 
 GLOBAL_TTL_FOR_GOSSIP = 6
 NODE_POV_GOSSIP_TTL = 3
@@ -1,12 +1,15 @@
 import asyncio
 import contextlib
+import logging
 import socket
-from collections import OrderedDict, defaultdict
+import time
+from collections import Counter, OrderedDict, defaultdict
 from itertools import count
-from typing import Iterable, TYPE_CHECKING, Union, ValuesView
-from weakref import WeakSet
+from typing import Iterable, Optional, TYPE_CHECKING, ValuesView
+from weakref import WeakSet, WeakValueDictionary
 
 import src.avails.connect as connect
+import src.avails.constants as const
 from src.avails.bases import HasID, HasIdProperty, HasPeerId
 
 """
@@ -16,9 +19,11 @@ This module contains simple storages used across the peer connect
 3. SafeSet
 4. FileDict
 5. SocketStore
-6. SocketCache
+6. ConnectionPool
 """
 
+_logger = logging.getLogger(__name__)
+
 
 class PeerDict(dict):
     __slots__ = '__lock',
@@ -100,6 +105,9 @@ class TransfersBookKeeper:
     def add_to_scheduled(self, key, transfer_handle: HasID | HasIdProperty):
         self.__scheduled[key] = transfer_handle
 
+    def remove_scheduled(self, key):
+        return self.__scheduled.pop(key, None)
+
     def add_to_continued(self, peer_id: str, file_pool):
         self.__current[peer_id].discard(file_pool)
         self.__continued[peer_id].add(file_pool)
@@ -119,6 +127,9 @@ class TransfersBookKeeper:
     def _get_continued_file(self, peer_id: str, file_id):
         return next(file for file in self.__continued[peer_id] if file.id == file_id)
 
+    def get_continued(self, peer_id: str):
+        return list(self.__continued.get(peer_id, ()))
+
     def get_scheduled(self, file_id):
         return self.__scheduled.get(file_id, None)
 
@@ -153,6 +164,12 @@ class TransfersBookKeeper:
     def get_new_id(cls):
         return str(next(cls._id_counter))
 
+    @classmethod
+    def skip_ids(cls, used_ids):
+        """Makes ids handed out from here on larger than any of ``used_ids`` (ids of transfers from last run)"""
+        start = max((int(used_id) for used_id in used_ids if str(used_id).isdigit()), default=-1) + 1
+        cls._id_counter = count(max(start, next(cls._id_counter)))
+
     def check_running(self, peer_id):
         if running := self._get_running_transfers(peer_id):
             return running[0]
@@ -188,61 +205,218 @@ class SocketStore:
                 sock.close()
 
 
-class SocketCache:
-    """
-    Maintains a pool of active sockets between peers
+class PooledConnection:
+    """One message stream connection to a peer, shared by everyone talking to that peer
 
+    Messages are WireData frames dispatched by header at the other end,
+    so text messages and other requests share this connection (file and directory transfers,
+    their control messages included, still open connections of their own),
+    sends are serialized so that frames of different senders never interleave
+
+    Attributes:
+        peer_id(str): peer at the other end
+        transport(StreamTransport): framed transport over the socket
+        initiator(str): id of the peer that made this connection, None if not known (older peers)
+        reader_task(asyncio.Task): task reading incoming frames of this connection, if any
+        last_used(float): monotonic time of last send or receive
     """
+    __slots__ = 'peer_id', 'transport', 'initiator', 'reader_task', 'last_used', '_send_lock', '__weakref__'
 
-    def __init__(self, max_limit=4):
-        self.socket_cache: dict[str: connect.Socket] = OrderedDict()
-        self.max_limit = max_limit
+    def __init__(self, peer_id, transport, initiator=None):
+        self.peer_id = peer_id
+        self.transport = transport
+        self.initiator = initiator
+        self.reader_task = None
+        self.last_used = time.monotonic()
+        self._send_lock = asyncio.Lock()
 
-    def add_peer_sock(self, peer_id: str, peer_socket):
-        if len(self.socket_cache) >= self.max_limit:
-            self.socket_cache.popitem(last=False)
-        self.socket_cache[peer_id] = peer_socket
-        return peer_socket
+    async def send(self, data: bytes):
+        async with self._send_lock:
+            await self.transport.send(data)
+        self.touch()
 
-    def get_socket(self, peer_id) -> Union[connect.Socket, None]:
-        sock = self.socket_cache.pop(peer_id, None)
-        if sock:
-            self.socket_cache[peer_id] = sock
-        return sock
+    def touch(self):
+        self.last_used = time.monotonic()
 
-    def is_connected(self, peer_id) -> Union[connect.Socket, bool]:
+    @property
+    def socket(self) -> connect.Socket:
+        return self.transport.socket
+
+    def is_alive(self):
+        """Cheap liveness probe, a single non-blocking peek on the socket"""
         try:
-            sock = self.socket_cache[peer_id]
-            if connect.is_socket_connected(sock):
-                return sock
-            return False
-        except KeyError:
+            return self.socket.recv(1, socket.MSG_PEEK) != b''
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
             return False
 
+    def close(self):
+        reader_task = self.reader_task
+        if reader_task is not None and not reader_task.done() and reader_task is not asyncio.current_task():
+            reader_task.cancel()
+        with contextlib.suppress(OSError):
+            self.socket.close()
+
+    def __repr__(self):
+        return f"<PooledConnection(peer_id={self.peer_id}, idle={time.monotonic() - self.last_used:.1f}s)>"
+
+
+def _crossed(previous, connection):
+    """Whether ``previous`` is alive and ``connection`` was made by the other end, both ends connected at once"""
+    if previous.initiator is None or connection.initiator is None:
+        return False
+    return previous.initiator != connection.initiator and previous.is_alive()
+
+
+class ConnectionPool:
+    """Maintains a pool of message stream connections between peers, one per peer
+
+    Lookups are plain dictionary lookups, liveness of connections is checked by a background
+    task (see :meth:`__aenter__`) which also closes connections idle for longer than ``idle_timeout``,
+    when the pool is full least recently used connection is evicted
+
+    Args:
+        max_size(int): max number of connections held, defaults to ``const.CONNECTION_POOL_SIZE``
+        idle_timeout(float): seconds, defaults to ``const.CONNECTION_IDLE_TIMEOUT``
+        check_interval(float): seconds between health checks, defaults to ``const.CONNECTION_HEALTH_CHECK_INTERVAL``
+
+    Attributes:
+        metrics(Counter): hits, misses, evictions, idle_evictions, dead (found by health checks)
+            and crossed (both ends connected at once)
+    """
+
+    def __init__(self, max_size=None, idle_timeout=None, check_interval=None):
+        # defaults are looked up late, configurations are loaded after this gets created
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._check_interval = check_interval
+        self._connections: OrderedDict[str, PooledConnection] = OrderedDict()
+        self._connect_locks = WeakValueDictionary()
+        self._health_check_task = None
+        self.metrics = Counter()
+
+    @property
+    def max_size(self):
+        return self._max_size or const.CONNECTION_POOL_SIZE
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout or const.CONNECTION_IDLE_TIMEOUT
+
+    @property
+    def check_interval(self):
+        return self._check_interval or const.CONNECTION_HEALTH_CHECK_INTERVAL
+
+    def get(self, peer_id) -> Optional[PooledConnection]:
+        connection = self._connections.get(peer_id)
+        if connection is None:
+            self.metrics['misses'] += 1
+            return None
+
+        self.metrics['hits'] += 1
+        self._connections.move_to_end(peer_id)
+        return connection
+
+    def add(self, peer_id, transport, initiator=None) -> PooledConnection:
+        """Adds a connection for ``peer_id``, replacing (and closing) any previous one
+
+        If both ends connected to each other at once, both keep the one made by the lower peer id,
+        the other one is left out of the pool and only the end that made it closes it,
+        the end that did not reads it till then, so nothing sent over it is lost
+
+        Args:
+            peer_id(str): id of the peer at the other end
+            transport(StreamTransport): framed transport wrapping connected socket
+            initiator(str): id of the peer that made the connection, None if not known (older peers)
+
+        Returns:
+            PooledConnection: connection pooled for ``peer_id``, the previous one if that one is kept
+        """
+        connection = PooledConnection(peer_id, transport, initiator)
+        if previous := self._connections.pop(peer_id, None):
+            if _crossed(previous, connection):
+                self.metrics['crossed'] += 1
+                if previous.initiator < initiator:
+                    self._connections[peer_id] = previous
+                    return previous
+                if previous.initiator != peer_id:  # made by this end, other end reads it till it is closed
+                    previous.close()
+            else:
+                previous.close()
+
+        while len(self._connections) >= self.max_size:
+            _, evicted = self._connections.popitem(last=False)
+            self.metrics['evictions'] += 1
+            _logger.debug(f"[POOL] evicting {evicted}")
+            evicted.close()
+
+        with contextlib.suppress(OSError):
+            # let the kernel find out about peers that vanished, health checks only peek
+            transport.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        self._connections[peer_id] = connection
+        return connection
+
+    def discard(self, connection: PooledConnection):
+        """Removes and closes ``connection``, only if it is still the one pooled for its peer"""
+        if self._connections.get(connection.peer_id) is connection:
+            del self._connections[connection.peer_id]
+        connection.close()
+
     def remove_and_close(self, peer_id):
-        # with self.__thread_lock:
-        try:
-            sock = self.socket_cache[peer_id]
-            del self.socket_cache[peer_id]
-            sock.close()
-        except KeyError:
-            return
-        except (OSError, socket.error):
-            del self.socket_cache[peer_id]
+        if connection := self._connections.pop(peer_id, None):
+            connection.close()
+
+    def lock_for(self, peer_id) -> asyncio.Lock:
+        """Returns a lock to hold while connecting to ``peer_id``, so that concurrent callers share one connection"""
+        lock = self._connect_locks.get(peer_id)
+        if lock is None:
+            lock = self._connect_locks[peer_id] = asyncio.Lock()
+        return lock
+
+    def check_health(self):
+        """Closes connections that are idle for too long or found dead"""
+        now = time.monotonic()
+        idle_timeout = self.idle_timeout
+        for connection in list(self._connections.values()):
+            if now - connection.last_used > idle_timeout:
+                self.metrics['idle_evictions'] += 1
+            elif not connection.is_alive():
+                self.metrics['dead'] += 1
+            else:
+                continue
+            _logger.debug(f"[POOL] dropping {connection}")
+            self.discard(connection)
+
+    async def _health_check_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            self.check_health()
+            _logger.debug(f"[POOL] size={len(self)}, {dict(self.metrics)}")
+
+    async def __aenter__(self):
+        self._health_check_task = asyncio.create_task(self._health_check_loop(), name="connection pool health check")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._health_check_task is not None:
+            self._health_check_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._health_check_task
+            self._health_check_task = None
+        self.clear()
 
     def clear(self):
-        self.__close_all_socks()
-        self.socket_cache.clear()
+        for connection in list(self._connections.values()):
+            connection.close()
+        self._connections.clear()
 
-    def __close_all_socks(self):
-        for sock in list(self.socket_cache.values()):
-            try:
-                sock.close()
-            except Exception:  # noqa
-                pass
+    def __len__(self):
+        return len(self._connections)
 
     def __contains__(self, item: str):
-        return item in self.socket_cache
+        return item in self._connections
 
-    def __del__(self):
-        self.__close_all_socks()
+    def __repr__(self):
+        return f"<ConnectionPool(size={len(self)}/{self.max_size}, {dict(self.metrics)})>"
@@ -75,6 +75,22 @@ async def recv_int(get_bytes: typing.Callable[[int], Awaitable[bytes]], type=SHO
         raise ValueError(f"unable to receive integer") from ce
 
 
+async def recv_exactly(get_bytes: typing.Callable[[int], Awaitable[bytes]], count):
+    """Receives exactly ``count`` bytes from ``get_bytes``, which may return fewer bytes than asked for
+
+    Raises:
+        ConnectionResetError: if the other end closes before ``count`` bytes arrive
+    """
+    chunks = []
+    while count > 0:
+        chunk = await get_bytes(count)
+        if not chunk:
+            raise ConnectionResetError(f"connection closed with {count} bytes remaining")
+        chunks.append(chunk)
+        count -= len(chunk)
+    return b''.join(chunks)
+
+
 def get_timeouts(initial=0.001, factor=2, max_retries=const.MAX_RETIRES, max_value=5.0):
     """
     Generate exponential backoff timeout values.
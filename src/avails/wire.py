@@ -11,6 +11,7 @@ Any Class that wraps data is immutable, once created not modifications are allow
 """
 
 import dataclasses
+import io
 import json as _json
 import struct
 from asyncio import BaseTransport
@@ -20,7 +21,7 @@ from typing import NamedTuple, Optional, Union
 
 import umsgpack
 
-from src.avails.connect import Socket as _Socket, is_socket_connected
+from src.avails.connect import Socket as _Socket
 from src.avails.exceptions import InvalidPacket
 from src.avails.useables import wait_for_sock_read
 from src.avails.waiters import Actuator, const as _const
@@ -31,13 +32,25 @@ _controller = Actuator()
 class Wire:
     @staticmethod
     async def send_async(sock: _Socket, data: bytes):
-        data_size = struct.pack("!I", len(data))
-        return await sock.asendall(data_size + data)
+        if len(data) < _GATHER_THRESHOLD:
+            # copying a small payload is cheaper than building an iovec for it
+            return await sock.asendall(_FRAME_HEADER.pack(len(data)) + data)
+        # size prefix and payload leave as separate buffers, payload is never copied
+        return await sock.asendmsg_all((_FRAME_HEADER.pack(len(data)), data))
 
     @staticmethod
     def send(sock: _Socket, data: bytes):
-        data_size = struct.pack("!I", len(data))
-        return sock.sendall(data_size + data)
+        if len(data) < _GATHER_THRESHOLD:
+            return sock.sendall(_FRAME_HEADER.pack(len(data)) + data)
+        return sock.sendmsg_all((_FRAME_HEADER.pack(len(data)), data))
+
+    @staticmethod
+    async def send_frames_async(sock: _Socket, frames):
+        """Sends all the ``frames`` in a single gather send, see :class:`FrameWriter`"""
+        writer = FrameWriter(sock)
+        for frame in frames:
+            writer.queue(frame)
+        return await writer.flush()
 
     @staticmethod
     def send_datagram(sock: _Socket | BaseTransport, address, data: bytes):
@@ -52,15 +65,28 @@ class Wire:
 
     @staticmethod
     async def receive_async(sock: _Socket):
-        try:
-            data_size = struct.unpack("!I", await sock.arecv(4))[0]
-            data = await sock.arecv(data_size)
-            return data
-        except struct.error:
-            if is_socket_connected(sock):
-                raise
-            else:
+        """Receives exactly one frame from ``sock``
+
+        Reads only the bytes belonging to that frame, so the socket can be handed over to raw reads afterwards,
+        use :class:`FrameReader` for connections that carry only frames
+
+        Raises:
+            OSError: if connection broke in between the frame
+        """
+        data_size = _FRAME_HEADER.unpack(await Wire._receive_exactly_async(sock, _FRAME_HEADER.size))[0]
+        return await Wire._receive_exactly_async(sock, data_size)
+
+    @staticmethod
+    async def _receive_exactly_async(sock: _Socket, length):
+        data = bytearray(length)
+        view = memoryview(data)
+        received = 0
+        while received < length:
+            got = await sock.arecv_into(view[received:])
+            if not got:
                 raise OSError("connection broken")
+            received += got
+        return data
 
     @staticmethod
     def receive(sock: _Socket, timeout=None, controller=_controller):
@@ -105,38 +131,357 @@ class Wire:
         return Wire.load_datagram(data), addr
 
 
+_FRAME_HEADER = struct.Struct("!I")
+_GATHER_THRESHOLD = 16 * 1024
+
+
+class FrameReader:
+    """Reads length prefixed frames (see :class:`Wire`) from a stream socket
+
+    Keeps a reusable ``bytearray`` per connection and fills it using ``sock_recv_into``,
+    taking whatever the kernel has ready, so a burst of small frames costs a single event loop round trip
+    and short reads of large frames are continued until the frame is complete
+
+    Frames are handed out as ``memoryview`` slices over that buffer, no copies are made
+
+    Note:
+        * a frame returned is valid only until the next read on this reader, copy it if it has to live longer
+        * reader consumes greedily, once attached to a socket all the reads on that socket should go through it
+        * a frame larger than ``buffer_size`` grows the buffer, it is shrunk back once drained
+
+    """
+
+    __slots__ = '_sock', '_buffer_size', '_buffer', '_view', '_start', '_end'
+
+    def __init__(self, sock: _Socket, buffer_size=_const.FRAME_READER_BUFFER_SIZE):
+        self._sock = sock
+        self._buffer_size = buffer_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # start of unconsumed bytes
+        self._end = 0  # end of bytes received so far
+
+    async def read_frame(self) -> memoryview:
+        """Reads a full frame
+
+        Raises:
+            ConnectionResetError: if other end closed the connection in between
+        """
+        data_size = _FRAME_HEADER.unpack(await self.read_exactly(_FRAME_HEADER.size))[0]
+        return await self.read_exactly(data_size)
+
+    async def read_exactly(self, length) -> memoryview:
+        if self._end - self._start < length:
+            await self._fill(length)
+
+        start = self._start
+        self._start += length
+        return self._view[start: self._start]
+
+    async def _fill(self, length):
+        if len(self._buffer) > self._buffer_size >= self._end - self._start + length:
+            self._shrink()
+
+        if self._start + length > len(self._buffer):
+            self._make_room(length)
+
+        while self._end - self._start < length:
+            received = await self._sock.arecv_into(self._view[self._end:])
+            if not received:
+                raise ConnectionResetError("connection closed while reading a frame")
+            self._end += received
+
+    def _make_room(self, length):
+        pending = self._end - self._start
+        if length > len(self._buffer):
+            # a fresh buffer is allocated, views handed out earlier keep pointing to the old one
+            new_buffer = bytearray(max(length, 2 * len(self._buffer)))
+            new_buffer[:pending] = self._view[self._start: self._end]
+            self._buffer = new_buffer
+            self._view = memoryview(new_buffer)
+        else:
+            self._buffer[:pending] = self._buffer[self._start: self._end]
+        self._start = 0
+        self._end = pending
+
+    def _shrink(self):
+        # past an oversized frame, do not hold on to that much memory per connection
+        pending = self._end - self._start
+        new_buffer = bytearray(self._buffer_size)
+        new_buffer[:pending] = self._view[self._start: self._end]
+        self._buffer = new_buffer
+        self._view = memoryview(new_buffer)
+        self._start = 0
+        self._end = pending
+
+    @property
+    def buffered(self):
+        """Number of bytes received but not yet consumed"""
+        return self._end - self._start
+
+
+class FrameWriter:
+    """Queues frames and flushes them with one gather send
+
+    Size prefixes and payloads are queued as separate buffers, so queued payloads are not copied,
+    callers should not mutate a payload until :meth:`flush` returns
+
+    Usage:
+        >>> writer = FrameWriter(sock)
+        >>> writer.queue(bytes(first_message))
+        >>> writer.queue(bytes(second_message))
+        >>> await writer.flush()
+    """
+
+    __slots__ = '_sock', '_buffers', '_pending'
+
+    def __init__(self, sock: _Socket):
+        self._sock = sock
+        self._buffers = []
+        self._pending = 0
+
+    def queue(self, data: bytes | bytearray | memoryview):
+        self._buffers.append(_FRAME_HEADER.pack(len(data)))
+        self._buffers.append(data)
+        self._pending += _FRAME_HEADER.size + len(data)
+
+    async def flush(self):
+        if not self._buffers:
+            return
+        buffers, self._buffers, self._pending = self._buffers, [], 0
+        await self._sock.asendmsg_all(buffers)
+
+    @property
+    def pending(self):
+        """Number of bytes queued but not yet flushed"""
+        return self._pending
+
+    def __len__(self):
+        return len(self._buffers) // 2
+
+
+# Binary envelope of WireData
+#
+#   | 0xC1 | ENVELOPE VERSION(1) | FLAGS(1) | HEADER CODE(1) | MSG ID (varint)? | PEER ID(20)? | EXTRAS? | BODY |
+#
+# 0xC1 is never used by msgpack, the older format (a msgpack list) can never start with it
+# header code is looked up from a registry built by `register_headers`, 0 is None, 0xFF means not registered
+# and the header goes by name in EXTRAS, so does a code that this peer does not know of
+# msg id goes as a varint when it is an int or a decimal string (most of them are)
+# peer id goes as a fixed 20 byte node id when it is a decimal string of a kademlia id
+# anything that does not fit into this prefix is moved into EXTRAS, a msgpack map
+# BODY is msgpack of WireData.body
+
+_ENVELOPE_MARKER = b"\xc1"
+_ENVELOPE_VERSION = 1
+_ENVELOPE_PREFIX = struct.Struct("!cBBB")
+_NODE_ID_LEN = 20  # kademlia ids are sha1 digests
+
+_F_MSG_ID_INT = 0x01
+_F_MSG_ID_DECIMAL = 0x02
+_F_PEER_ID = 0x04
+_F_EXTRAS = 0x08
+
+_NO_HEADER_CODE = 0x00
+_UNREGISTERED_HEADER_CODE = 0xFF
+
+_header_to_code = {None: _NO_HEADER_CODE}
+_code_to_header = {_NO_HEADER_CODE: None}
+
+
+def register_headers(header_codes):
+    """Registers one byte codes of headers
+
+    Codes are part of the wire format, every peer has to use the same code for a header,
+    so they are given explicitly and never change, a header with no code goes by name
+
+    Args:
+        header_codes(dict[str | bytes, int]): code of every header, from 1 to 0xFE
+
+    Raises:
+        ValueError: if a code is out of range, or a header or code is already registered otherwise
+    """
+    for header, code in header_codes.items():
+        if not _NO_HEADER_CODE < code < _UNREGISTERED_HEADER_CODE:
+            raise ValueError(f"header code {code} of {header!r} is out of range")
+        if _header_to_code.get(header, code) != code or _code_to_header.get(code, header) != header:
+            raise ValueError(f"header {header!r} or code {code} is already registered otherwise")
+        _header_to_code[header] = code
+        _code_to_header[code] = header
+
+
+def _is_decimal_id(value):
+    return isinstance(value, str) and value.isascii() and value.isdigit() and (value == '0' or value[0] != '0')
+
+
+def _write_varint(out: bytearray, number: int):
+    while number > 0x7F:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def _read_varint(data, offset):
+    number = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def _encode_envelope(header, msg_id, peer_id, version, body):
+    flags = 0
+    extras = {}
+    out = bytearray()
+
+    try:
+        header_code = _header_to_code[header]
+    except (KeyError, TypeError):
+        header_code = _UNREGISTERED_HEADER_CODE
+        extras['h'] = header
+
+    if isinstance(msg_id, int) and not isinstance(msg_id, bool) and msg_id >= 0:
+        flags |= _F_MSG_ID_INT
+        _write_varint(out, msg_id)
+    elif _is_decimal_id(msg_id):
+        flags |= _F_MSG_ID_DECIMAL
+        _write_varint(out, int(msg_id))
+    elif msg_id is not None:
+        extras['i'] = msg_id
+
+    # short ids are cheaper as msgpack strings than as 20 fixed bytes
+    if _is_decimal_id(peer_id) and len(peer_id) > _NODE_ID_LEN and int(peer_id).bit_length() <= _NODE_ID_LEN * 8:
+        flags |= _F_PEER_ID
+        out += int(peer_id).to_bytes(_NODE_ID_LEN)
+    elif peer_id is not None:
+        extras['p'] = peer_id
+
+    if version != WireData._version:
+        extras['v'] = version
+
+    if extras:
+        flags |= _F_EXTRAS
+        out += umsgpack.dumps(extras)
+
+    out += umsgpack.dumps(body)
+    return _ENVELOPE_PREFIX.pack(_ENVELOPE_MARKER, _ENVELOPE_VERSION, flags, header_code) + out
+
+
+def _decode_envelope(data: bytes | bytearray | memoryview):
+    _, envelope_version, flags, header_code = _ENVELOPE_PREFIX.unpack_from(data)
+    if envelope_version != _ENVELOPE_VERSION:
+        raise ValueError(f"unknown envelope version {envelope_version}")
+
+    offset = _ENVELOPE_PREFIX.size
+
+    msg_id = None
+    if flags & (_F_MSG_ID_INT | _F_MSG_ID_DECIMAL):
+        msg_id, offset = _read_varint(data, offset)
+        if flags & _F_MSG_ID_DECIMAL:
+            msg_id = str(msg_id)
+
+    peer_id = None
+    if flags & _F_PEER_ID:
+        peer_id = str(int.from_bytes(data[offset: offset + _NODE_ID_LEN]))
+        offset += _NODE_ID_LEN
+
+    # fixed part above is read in place, umsgpack takes only bytes so the msgpack tail is copied out once
+    tail = bytes(memoryview(data)[offset:])
+    extras = {}
+    if flags & _F_EXTRAS:
+        fp = io.BytesIO(tail)
+        extras = umsgpack.load(fp)
+        if not isinstance(extras, dict):
+            raise ValueError("envelope extras is not a map")
+        tail = tail[fp.tell():]
+
+    try:
+        header = _code_to_header[header_code]
+    except KeyError:
+        if 'h' not in extras:
+            raise ValueError(f"unknown header code {header_code} with no header name") from None
+        header = extras['h']
+
+    msg_id = extras.get('i', msg_id)
+    peer_id = extras.get('p', peer_id)
+    version = extras.get('v', WireData._version)
+    return header, msg_id, peer_id, version, tail
+
+
+def _decode_body(raw_body):
+    try:
+        body = umsgpack.loads(raw_body)
+    except (ValueError, umsgpack.UnpackException) as exp:
+        raise InvalidPacket from exp
+    if not isinstance(body, dict):
+        raise InvalidPacket(f"expected a map as WireData body, got {type(body)}")
+    return body
+
+
 class WireData:
     _version = _const.VERSIONS["WIRE"]
 
-    __slots__ = 'id', '_header', 'version', 'body', 'peer_id'
+    __slots__ = 'id', '_header', 'version', '_body', '_raw_body', 'peer_id'
 
     def __init__(self, header=None, msg_id=None, peer_id=None, version=_version, **kwargs):
         self._header = header
         self.id = msg_id
         self.peer_id = peer_id
         self.version = version
-        self.body = kwargs
+        self._body = kwargs
+        self._raw_body = None
 
     def __bytes__(self):
-        list_of_attributes = [
-            self._header,
-            self.id,
-            self.version,
-            self.body,
-            self.peer_id,
-        ]
-        return umsgpack.dumps(list_of_attributes)
+        return _encode_envelope(self._header, self.id, self.peer_id, self.version, self.body)
 
     @classmethod
-    def load_from(cls, data: bytes):
+    def load_from(cls, data: bytes | bytearray | memoryview, *, lazy=False):
+        """Loads WireData from either the binary envelope or the older msgpack list format
+
+        Args:
+            data: serialized WireData, envelope's fixed fields are read in place,
+                its msgpack part is copied out once as umsgpack only takes bytes
+            lazy(bool): if True, only header, id, peer_id and version are decoded here,
+                body is decoded on first access of ``WireData.body``,
+                any error in body surfaces as InvalidPacket at that point
+
+        Raises:
+            InvalidPacket: if data is ill-formed
+        """
         try:
-            list_of_attributes = umsgpack.loads(data)
-            header, _id, version, body, peer_id = list_of_attributes
-        except (ValueError, umsgpack.UnpackException) as exp:
+            if data[:1] == _ENVELOPE_MARKER:
+                header, _id, peer_id, version, raw_body = _decode_envelope(data)
+                body = None if lazy else _decode_body(raw_body)
+            else:
+                if isinstance(data, memoryview):
+                    data = data.tobytes()
+                header, _id, version, body, peer_id = umsgpack.loads(data)
+                raw_body = None
+        except (ValueError, IndexError, KeyError, struct.error, umsgpack.UnpackException) as exp:
             raise InvalidPacket from exp
 
+        if body is None:
+            self = cls(header, _id, peer_id, version=version)
+            self._body = None
+            self._raw_body = raw_body
+            return self
+
         return cls(header, _id, peer_id, version=version, **body)
 
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = _decode_body(self._raw_body)
+            self._raw_body = None
+        return self._body
+
+    @property
+    def is_body_decoded(self):
+        return self._body is not None
+
     def match_header(self, data):
         return self._header == data
 
@@ -165,13 +510,14 @@ class WireData:
         }
 
     def __str__(self):
-        return f"<WireData(header={self._header}, id={self.id}, body={self.body})>"
+        body = self._body if self.is_body_decoded else f"<{len(self._raw_body)} bytes not decoded>"
+        return f"<WireData(header={self._header}, id={self.id}, body={body})>"
 
     def __repr__(self):
         return str(self)
 
 
-def unpack_datagram(data_payload) -> Optional[WireData]:
+def unpack_datagram(data_payload, *, lazy=False) -> Optional[WireData]:
     """Utility function to unpack raw datagram
 
         from `datagram_received` callback from asyncio' s DatagramProtocol
@@ -180,12 +526,13 @@ def unpack_datagram(data_payload) -> Optional[WireData]:
         into WireData and handle exceptions
     Args:
         data_payload(bytes) : byte string to unpack
+        lazy(bool) : defer decoding of body, see `WireData.load_from`
     Raises:
         InvalidPacket if unpacking failed
     """
     try:
         data = Wire.load_datagram(data_payload)
-        loaded = WireData.load_from(data)
+        loaded = WireData.load_from(data, lazy=lazy)
         return loaded
     except umsgpack.UnpackException as ue:
         raise InvalidPacket("Ill-formed data: %s. Error: %s" % (data_payload, ue)) from ue
@@ -470,15 +817,55 @@ class OTMInformResponse(PalmTreeInformResponse):
 
 
 class OTMChunk(NamedTuple):
-    chunk_number: int
-    data: bytes
+    """A frame of an otm session, relays write it and forward it as it arrived::
+
+        | KIND(1) | SEQ(8) | OFFSET(8) | LEN(4) | DATA(LEN) |
+
+    Args:
+        kind(int) : METADATA (file items of session), DATA (bytes at ``offset``) or END
+        seq(int) : frames of a session are numbered from 0 in the order they are sent
+        offset(int) : where ``data`` goes in all files of session back to back,
+                      METADATA and END carry total bytes of session
+        data(bytes) : payload
+    """
+
+    kind: int
+    seq: int
+    offset: int
+    data: bytes = b''
 
-    # type: int
+    METADATA = 0
+    DATA = 1
+    END = 2
+    HEADER = struct.Struct("!BQQI")
+
+    def header(self):
+        return self.HEADER.pack(self.kind, self.seq, self.offset, len(self.data))
 
     def __bytes__(self):
-        return umsgpack.dumps(self)
+        return self.header() + self.data
+
+    @staticmethod
+    def unpack_header(header: bytes):
+        """
+        Returns:
+            tuple[int, int, int, int]: kind, seq, offset and length of data that follows
+
+        Raises:
+            InvalidPacket: if header is ill-formed
+        """
+        try:
+            kind, seq, offset, length = OTMChunk.HEADER.unpack(header)
+        except struct.error as se:
+            raise InvalidPacket(f"ill-formed otm chunk header: {header!r}") from se
+        if kind > OTMChunk.END:
+            raise InvalidPacket(f"unknown otm chunk kind {kind}")
+        return kind, seq, offset, length
 
     @staticmethod
     def load_from(data: bytes):
-        unpacked_data = umsgpack.loads(data)
-        return OTMChunk(*unpacked_data)
+        kind, seq, offset, length = OTMChunk.unpack_header(data[:OTMChunk.HEADER.size])
+        payload = data[OTMChunk.HEADER.size:]
+        if len(payload) != length:
+            raise InvalidPacket(f"otm chunk of {len(payload)} bytes, header says {length}")
+        return OTMChunk(kind, seq, offset, payload)
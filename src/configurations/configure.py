@@ -22,6 +22,35 @@ def set_constants(config_map: configparser.ConfigParser) -> bool:
     const.PORT_REQ = config_map.getint('NERD_OPTIONS', 'req_port')
     const.PORT_PAGE = config_map.getint('NERD_OPTIONS', 'page_port')
     const.PAGE_SERVE_PORT = config_map.getint('NERD_OPTIONS', 'page_serve_port')
+    const.REQ_BATCHING = config_map.getboolean('NERD_OPTIONS', 'req_batching', fallback=const.REQ_BATCHING)
+    const.CONNECTION_POOL_SIZE = config_map.getint(
+        'NERD_OPTIONS', 'connection_pool_size', fallback=const.CONNECTION_POOL_SIZE
+    )
+    const.CONNECTION_IDLE_TIMEOUT = config_map.getint(
+        'NERD_OPTIONS', 'connection_idle_timeout', fallback=const.CONNECTION_IDLE_TIMEOUT
+    )
+    const.FILE_TRANSFER_STRIPES = config_map.getint(
+        'NERD_OPTIONS', 'file_transfer_stripes', fallback=const.FILE_TRANSFER_STRIPES
+    )
+    const.FILE_MAX_STRIPES = config_map.getint('NERD_OPTIONS', 'file_max_stripes', fallback=const.FILE_MAX_STRIPES)
+    const.FILE_SENDFILE = config_map.getboolean('NERD_OPTIONS', 'file_sendfile', fallback=const.FILE_SENDFILE)
+    const.FILE_RECV_INTO = config_map.getboolean('NERD_OPTIONS', 'file_recv_into', fallback=const.FILE_RECV_INTO)
+    const.FILE_PWRITE = config_map.getboolean('NERD_OPTIONS', 'file_pwrite', fallback=const.FILE_PWRITE)
+    const.FILE_VERIFY = config_map.getboolean('NERD_OPTIONS', 'file_verify', fallback=const.FILE_VERIFY)
+    const.FILE_DELTA = config_map.getboolean('NERD_OPTIONS', 'file_delta', fallback=const.FILE_DELTA)
+    const.FILE_COMPRESSION = config_map.get('NERD_OPTIONS', 'file_compression', fallback=const.FILE_COMPRESSION)
+    const.FILE_PREALLOCATE = config_map.getboolean(
+        'NERD_OPTIONS', 'file_preallocate', fallback=const.FILE_PREALLOCATE
+    )
+    const.FILE_SPARSE = config_map.getboolean('NERD_OPTIONS', 'file_sparse', fallback=const.FILE_SPARSE)
+    const.FILE_BATCH = config_map.getboolean('NERD_OPTIONS', 'file_batch', fallback=const.FILE_BATCH)
+    const.TRANSFER_RATE_LIMIT = config_map.getint(
+        'NERD_OPTIONS', 'transfer_rate_limit', fallback=const.TRANSFER_RATE_LIMIT
+    )
+    const.TRANSFER_JOURNAL = config_map.getboolean(
+        'NERD_OPTIONS', 'transfer_journal', fallback=const.TRANSFER_JOURNAL
+    )
+    const.DIR_PIPELINED = config_map.getboolean('NERD_OPTIONS', 'dir_pipelined', fallback=const.DIR_PIPELINED)
 
     const.PROTOCOL = connect.TCPProtocol if config_map['NERD_OPTIONS']['protocol'] == 'tcp' else connect.UDPProtocol
     const.IP_VERSION = socket.AF_INET6 if config_map['NERD_OPTIONS']['ip_version'] == '6' else socket.AF_INET
@@ -68,6 +97,7 @@ def print_constants():
 def set_paths():
     const.PATH_CURRENT = Path(os.getcwd())
     const.PATH_PROFILES = Path(const.PATH_CURRENT, 'profiles')
+    const.PATH_TRANSFERS = Path(const.PATH_PROFILES, 'transfers')
     const.PATH_LOG = Path(const.PATH_CURRENT, 'logs')
     const.PATH_PAGE = Path(const.PATH_CURRENT, 'src', 'webpage')
     const.PATH_CONFIG = Path(const.PATH_CURRENT, 'src', 'configurations', const.DEFAULT_CONFIG_FILE)
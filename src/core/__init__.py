@@ -4,8 +4,8 @@ from enum import IntEnum
 from typing import Optional, TYPE_CHECKING
 
 from src.avails import (
-    BaseDispatcher, PeerDict as _PeerDict,
-    RemotePeer as _RemotePeer, SocketCache as _SocketCache
+    BaseDispatcher, ConnectionPool as _ConnectionPool,
+    PeerDict as _PeerDict, RemotePeer as _RemotePeer
 )
 
 
@@ -18,7 +18,7 @@ class DISPATCHS(IntEnum):
 
 
 class Dock:
-    connected_peers = _SocketCache()
+    connected_peers = _ConnectionPool()
     peer_list = _PeerDict()
     state_manager_handle = None
     global_gossip = None
@@ -9,13 +9,13 @@ from inspect import isawaitable
 from types import ModuleType
 from typing import Callable, Optional
 
-from src.avails import (BaseDispatcher, InvalidPacket, RemotePeer, SocketCache, SocketStore, Wire, WireData, connect,
-                        const, use)
+from src.avails import (BaseDispatcher, ConnectionPool, InvalidPacket, PooledConnection, RemotePeer, SocketStore, Wire,
+                        WireData, connect, const, use)
 from src.avails.events import ConnectionEvent, StreamDataEvent
 from src.avails.mixins import QueueMixIn, singleton_mixin
 from src.core import DISPATCHS, Dock, get_this_remote_peer
 from src.managers.directorymanager import DirConnectionHandler
-from src.managers.filemanager import FileConnectionHandler, OTMConnectionHandler
+from src.managers.filemanager import FileConnectionHandler, OTMConnectionHandler, OTMRepairHandler
 from src.transfers import HEADERS
 from src.transfers.transports import StreamTransport
 from src.webpage_handlers import pagehandle
@@ -24,12 +24,17 @@ _logger = logging.getLogger(__name__)
 
 
 async def initiate_connections():
+    await Dock.exit_stack.enter_async_context(Dock.connected_peers)  # starts health checks of pooled connections
     acceptor = Acceptor(finalizer=Dock.finalizing.is_set, connected_peers=Dock.connected_peers)
     await Dock.exit_stack.enter_async_context(acceptor)
     acceptor.data_dispatcher.register_handler(
         HEADERS.CMD_TEXT,
         pagehandle.MessageHandler()
     )
+    acceptor.data_dispatcher.register_handler(
+        HEADERS.CMD_CLOSING_HEADER,
+        ConnectionCloseHandler(Dock.connected_peers)
+    )
 
     Dock.dispatchers[DISPATCHS.CONNECTIONS] = acceptor.connection_dispatcher
     Dock.dispatchers[DISPATCHS.STREAM_DATA] = acceptor.data_dispatcher
@@ -37,8 +42,8 @@ async def initiate_connections():
 
     register_handler(HEADERS.CMD_FILE_CONN, FileConnectionHandler())
     register_handler(HEADERS.CMD_RECV_DIR, DirConnectionHandler())
-    register_handler(HEADERS.CMD_CLOSING_HEADER, ConnectionCloseHandler(Dock.connected_peers))
     register_handler(HEADERS.OTM_UPDATE_STREAM_LINK, OTMConnectionHandler())
+    register_handler(HEADERS.OTM_REPAIR, OTMRepairHandler())
     # acceptor.connection_dispatcher.register_handler(HEADERS.GOSSIP_UPDATE_STREAM_LINK)
     await acceptor.initiate()
 
@@ -70,33 +75,62 @@ class StreamDataDispatcher(QueueMixIn, BaseDispatcher):
             await r
 
 
-def ProcessDataHandler(data_dispatcher, finalizer: Callable[[], bool]):
+def ProcessDataHandler(data_dispatcher, finalizer: Callable[[], bool], connection_pool: ConnectionPool = None):
     """
     Iterates over a tcp stream
     if some data event occurs then calls data_dispatcher and submits that event
 
     Args:
         data_dispatcher(StreamDataDispatcher): any callable that reacts to event
-        finalizer(Callable[[], bool]): a flag to check while looping, should return False to stop loop
+        finalizer(Callable[[], bool]): a flag to check while looping, should return True to stop loop
+        connection_pool(ConnectionPool): if given, the connection is pooled for the peer in handshake
+            while it is being read, so that this peer can reuse it to send messages back
 
     """
 
     async def handler(event: ConnectionEvent):
-        with event.transport.socket:
-            stream_socket = event.transport
-            while finalizer():
-                raw_data = await stream_socket.recv()
+        connection = None
+        if connection_pool is not None:
+            # older peers put their id only in msg_id, crossed connections are not worked out with them
+            pooled = connection_pool.add(
+                event.handshake.peer_id or event.handshake.id, event.transport, initiator=event.handshake.peer_id
+            )
+            if pooled.transport is event.transport:
+                connection = pooled
+                connection.reader_task = asyncio.current_task()
+            # else this end's own connection is kept, other end closes this one, read it till then
+        try:
+            with event.transport.socket:
+                await read_frames(event.transport, data_dispatcher, finalizer, connection)
+        finally:
+            if connection is not None:
+                connection_pool.discard(connection)
 
-                data = WireData.load_from(raw_data)
+    return handler
 
-                _logger.info(f"[STREAM DATA] new data {data}")  # debug
-                data_event = StreamDataEvent(data, stream_socket)
-                data_dispatcher(data_event)
 
-    return handler
+async def read_frames(stream_transport, data_dispatcher, finalizer, connection: PooledConnection = None):
+    """Reads WireData frames from ``stream_transport`` and dispatches them until the connection is closed"""
+    while not finalizer():
+        try:
+            raw_data = await stream_transport.recv()
+        except OSError as oe:
+            _logger.debug(f"[STREAM DATA] connection ended {oe}")
+            return
 
+        try:
+            data = WireData.load_from(raw_data)
+        except InvalidPacket:
+            _logger.warning("[STREAM DATA] ignoring invalid packet", exc_info=True)
+            continue
+
+        if connection is not None:
+            connection.touch()
+        _logger.debug("[STREAM DATA] new data %s", data)
+        data_dispatcher(StreamDataEvent(data, stream_transport))
 
-def ConnectionCloseHandler(connected_peers: SocketCache):
+
+def ConnectionCloseHandler(connected_peers: ConnectionPool):
     async def handler(event: StreamDataEvent):
         event.transport.socket.close()
         connected_peers.remove_and_close(event.data.peer_id)
@@ -130,7 +164,7 @@ class Acceptor:
         self.connected_peers = connected_peers
         self.connection_dispatcher = ConnectionDispatcher(None, finalizer)
         self.data_dispatcher = StreamDataDispatcher(None, finalizer)
-        data_handler = ProcessDataHandler(self.data_dispatcher, finalizer)
+        data_handler = ProcessDataHandler(self.data_dispatcher, finalizer, connected_peers)
         self.connection_dispatcher.register_handler(HEADERS.CMD_VERIFY_HEADER, data_handler)
 
     async def initiate(self):
@@ -201,7 +235,6 @@ class Acceptor:
         self._exit_stack.enter_context(initial_conn)
         con_event = ConnectionEvent(transport, handshake)
         self.connection_dispatcher(con_event)
-        self.connected_peers.add_peer_sock(handshake.peer_id, initial_conn)
 
     @classmethod
     async def _perform_handshake(cls, initial_conn):
@@ -248,45 +281,53 @@ class Acceptor:
 
 
 class Connector:
-    _current_connected = connect.Socket()
-
-    # :todo: make this more advanced such that it can handle multiple requests related to same socket
+    """Hands out pooled message stream connections to peers, see :class:`ConnectionPool`"""
 
     @classmethod
-    async def get_connection(cls, peer_obj: RemotePeer) -> connect.Socket:
-        use.echo_print('a connection request made to :', peer_obj.uri)  # debug
-        if sock := Dock.connected_peers.is_connected(peer_obj.peer_id):
-            pr_str = (f"[CONNECTIONS] cache hit !{textwrap.fill(peer_obj.username, width=10)}"
-                      f" and socket is connected"
-                      f"{sock.getpeername()}")
-            _logger.info(pr_str)
-            cls._current_connected = sock
-            return sock
-        del sock
-        peer_sock = await cls._add_connection(peer_obj)
-        await cls._verifier(peer_sock)
-        _logger.debug(
-            ("cache miss --current :",
-             f"{textwrap.fill(peer_obj.username, width=10)}",
-             f"{peer_sock.getpeername()[:2]}",
-             f"{peer_sock.getsockname()[:2]}")
-        )
-        Dock.connected_peers.add_peer_sock(peer_obj.peer_id, peer_sock)
-        cls._current_connected = peer_sock
-        # use.echo_print(f"handle signal to page, that we can't reach {peer_obj.username}, or he is offline")
-        return peer_sock
+    async def get_connection(cls, peer_obj: RemotePeer) -> PooledConnection:
+        pool = Dock.connected_peers
+        async with pool.lock_for(peer_obj.peer_id):
+            if connection := pool.get(peer_obj.peer_id):
+                _logger.debug(f"[CONNECTIONS] pool hit {textwrap.fill(peer_obj.username, width=10)} {connection}")
+                return connection
+
+            peer_sock = await connect.connect_to_peer(peer_obj, timeout=1, retries=3)
+            await cls._verifier(peer_sock)
+            _logger.debug(
+                ("pool miss --current :",
+                 f"{textwrap.fill(peer_obj.username, width=10)}",
+                 f"{peer_sock.getpeername()[:2]}",
+                 f"{peer_sock.getsockname()[:2]}")
+            )
+            transport = StreamTransport(peer_sock)
+            connection = pool.add(peer_obj.peer_id, transport, initiator=get_this_remote_peer().peer_id)
+            if connection.transport is not transport:
+                # other end connected meanwhile and its connection is kept, see ConnectionPool.add
+                peer_sock.close()
+                return connection
+            connection.reader_task = asyncio.create_task(
+                cls._read_connection(connection),
+                name=f"reader for pooled connection {peer_obj.peer_id}"
+            )
+            return connection
 
     @classmethod
-    async def _add_connection(cls, peer_obj: RemotePeer) -> connect.Socket:
-        connection_socket = await connect.connect_to_peer(peer_obj, timeout=1, retries=3)
-        Dock.connected_peers.add_peer_sock(peer_obj.id, connection_socket)
-        return connection_socket
+    async def _read_connection(cls, connection: PooledConnection):
+        # the other end can send messages back on this connection
+        data_dispatcher = Dock.dispatchers[DISPATCHS.STREAM_DATA]
+        try:
+            with connection.socket:
+                await read_frames(connection.transport, data_dispatcher, Dock.finalizing.is_set, connection)
+        finally:
+            Dock.connected_peers.discard(connection)
 
     @classmethod
     async def _verifier(cls, connection_socket):
+        this_peer_id = get_this_remote_peer().peer_id
         verification_data = WireData(
             header=HEADERS.CMD_VERIFY_HEADER,
-            msg_id=get_this_remote_peer().peer_id,
+            msg_id=this_peer_id,
+            peer_id=this_peer_id,
         )
         await Wire.send_async(connection_socket, bytes(verification_data))
         _logger.info(f"Sent verification to {connection_socket.getpeername()}")  # debug
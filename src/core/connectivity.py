@@ -8,6 +8,7 @@ from src.avails import RemotePeer, WireData, connect, const, use
 from src.avails.mixins import QueueMixIn, singleton_mixin
 from src.core import DISPATCHS, Dock
 from src.transfers import HEADERS
+from src.transfers.scheduler import Priority, get_scheduler
 
 _logger = logging.getLogger(__name__)
 
@@ -64,9 +65,11 @@ class Connectivity(QueueMixIn):
         request.status = ConnectivityCheckState.REQ_CHECK
         succeeded = True
 
-        req_dispatcher.transport.sendto(ping_data, request.peer.req_uri)
         try:
-            await asyncio.wait_for(fut, const.PING_TIMEOUT)
+            # file chunks would delay the reply and get peer taken for gone, they wait till it is answered
+            async with get_scheduler().slot(request.peer.peer_id, len(bytes(ping_data)), Priority.CONTROL):
+                req_dispatcher.transport.sendto(ping_data, request.peer.req_uri)
+                await asyncio.wait_for(fut, const.PING_TIMEOUT)
         except TimeoutError:
             # try a tcp connection if network is terrible with UDP
 
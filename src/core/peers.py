@@ -96,6 +96,7 @@ from src.avails import GossipMessage, RemotePeer, use
 from src.avails.remotepeer import convert_peer_id_to_byte_id
 from src.avails.useables import get_unique_id
 from src.core import Dock, connectivity, get_gossip, get_this_remote_peer
+from src.managers import filemanager
 from src.transfers import GOSSIP
 from src.webpage_handlers import webpage
 
@@ -351,14 +352,21 @@ async def get_remote_peer_at_every_cost(peer_id) -> Optional[RemotePeer]:
     return peer_obj
 
 
+_resume_offers = set()  # filemanager.offer_resume tasks, kept till they are done
+
+
 # Callbacks called by kademila's routing mechanisms
 
+
 def new_peer(peer):
     Dock.peer_list.add_peer(peer)
     try:
         webpage.update_peer(peer).send(None)
     except StopIteration:
         pass
+    use.spawn_task(
+        filemanager.offer_resume, peer, bookeep=_resume_offers.add, done_callback=_resume_offers.discard
+    )
 
 
 def remove_peer(peer):
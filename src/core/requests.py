@@ -13,7 +13,7 @@ from src.core import DISPATCHS, Dock, _kademlia, discover, gossip
 from src.core.discover import DiscoveryReplyHandler, DiscoveryRequestHandler
 from src.managers.statemanager import State
 from src.transfers import DISCOVERY, REQUESTS_HEADERS
-from src.transfers.transports import RequestsTransport
+from src.transfers.transports import RequestsTransport, create_batched_datagram_endpoint
 
 _logger = logging.getLogger(__name__)
 
@@ -82,10 +82,11 @@ async def initiate():
 async def setup_endpoint(bind_address, multicast_address, req_dispatcher):
     loop = asyncio.get_running_loop()
     base_socket = await _create_listen_socket(bind_address, multicast_address)
-    transport, _ = await loop.create_datagram_endpoint(
-        functools.partial(RequestsEndPoint, req_dispatcher),
-        sock=base_socket
-    )
+    protocol_factory = functools.partial(RequestsEndPoint, req_dispatcher)
+    if const.REQ_BATCHING:
+        transport, _ = await create_batched_datagram_endpoint(protocol_factory, sock=base_socket)
+    else:
+        transport, _ = await loop.create_datagram_endpoint(protocol_factory, sock=base_socket)
     return transport
 
 
@@ -190,12 +191,13 @@ class RequestsEndPoint(asyncio.DatagramProtocol):
     def datagram_received(self, actual_data, addr):
         code, stripped_data = actual_data[:1], actual_data[1:]
         try:
-            req_data = unpack_datagram(stripped_data)
+            # body is decoded only if some handler asks for it
+            req_data = unpack_datagram(stripped_data, lazy=True)
         except InvalidPacket as ip:
             _logger.info(f"error:", exc_info=ip)
             return
 
-        _logger.info(f"received: {code} from : {addr}, {req_data.dict=}")
+        _logger.debug("received: %s from : %s, %s", code, addr, req_data)
         event = RequestEvent(root_code=code, request=req_data, from_addr=addr)
         self.dispatcher(event)
 
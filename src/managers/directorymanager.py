@@ -5,6 +5,7 @@ import os
 import pathlib
 import struct
 import traceback
+import uuid
 from contextlib import aclosing
 from pathlib import Path
 
@@ -13,13 +14,15 @@ from src.avails.events import ConnectionEvent
 from src.avails.exceptions import TransferRejected
 from src.core import Dock, get_this_remote_peer
 from src.core.handles import TaskHandle
-from src.transfers import HEADERS
-from src.transfers.files import DirReceiver, DirSender, rename_directory_with_increment
+from src.transfers import HEADERS, TransferState, thread_pool_for_disk_io
+from src.transfers.files import DirManifest, DirReceiver, DirSender, rename_directory_with_increment
+from src.transfers.scheduler import Priority, ScheduledSender
 from src.transfers.status import StatusMixIn
 from src.webpage_handlers import webpage
 
 transfers_book = TransfersBookKeeper()
 _logger = logging.getLogger(__name__)
+_PIPELINED_ACCEPTED = b'\x02'  # confirmation byte, receiver agrees upon pipelined mode
 
 
 async def open_dir_selector():
@@ -31,25 +34,23 @@ async def open_dir_selector():
 async def send_directory(remote_peer, dir_path):
     dir_path = Path(dir_path)
     transfer_id = transfers_book.get_new_id()
+    resume_id = use.get_unique_id()
     dir_recv_signal_packet = WireData(
         header=HEADERS.CMD_RECV_DIR,
         peer_id=get_this_remote_peer().peer_id,
         transfer_id=transfer_id,
         dir_name=dir_path.name,
+        pipelined=const.DIR_PIPELINED,
+        resume_id=resume_id,
+        compression=const.FILE_COMPRESSION,
     )
     # from src.core.connections import Connector
     # connection = await Connector.get_connection(remote_peer)
 
-    connection = await connect.connect_to_peer(
-        remote_peer,
-        to_which=connect.CONN_URI,
-        timeout=1,
-        retries=3
-    )
-
+    connection = await _connect(remote_peer, dir_recv_signal_packet)
     with connection:
-        await Wire.send_async(connection, bytes(dir_recv_signal_packet))
-        await _get_confirmation(connection)
+        confirmation = await _get_confirmation(connection)
+        pipelined = confirmation == _PIPELINED_ACCEPTED  # older peers just accept
 
         status_mixin = StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ)
         sender = DirSender(
@@ -57,20 +58,86 @@ async def send_directory(remote_peer, dir_path):
             transfer_id,
             dir_path,
             status_mixin,
+            pipelined=pipelined,
+            manifest_path=_manifest_path(resume_id, 'sending') if pipelined else None,
+            compression=const.FILE_COMPRESSION,
         )
-        sender.connection_made(connect.Sender(connection),connect.Receiver(connection))
+        send_func = ScheduledSender(connection, remote_peer.peer_id, Priority.BULK)
+        sender.connection_made(send_func, connect.Receiver(connection))
         _logger.info(f"sending directory: {dir_path} to {remote_peer}")
-        yield_decision = status_mixin.should_yield
-        async with aclosing(sender.send_files()) as s:
+        await _run_sender(sender, sender.send_files())
+        _logger.info(f"completed sending directory {dir_path} to {remote_peer}")
+
+
+async def resume_directory(peer_id, transfer_id):
+    """Resumes a paused (pipelined) directory transfer to ``peer_id`` over a new connection
+
+    receiver reports back what it has written, only the rest is sent, see ``DirSender.continue_transfer``
+    """
+    sender = transfers_book.get_transfer(peer_id, transfer_id)
+    if not isinstance(sender, DirSender) or sender.manifest_path is None:
+        raise ValueError(f"no resumable directory transfer {transfer_id} to {peer_id}")
+
+    resume_signal_packet = WireData(
+        header=HEADERS.CMD_RECV_DIR,
+        peer_id=get_this_remote_peer().peer_id,
+        transfer_id=transfer_id,
+        dir_name=sender.root_path.name,
+        pipelined=True,
+        resume_id=sender.manifest_path.stem,  # manifests are named after resume ids
+        resume=True,
+        compression=sender.compression,
+    )
+    connection = await _connect(sender.peer_obj, resume_signal_packet)
+    with connection:
+        await _get_confirmation(connection)
+        send_func = ScheduledSender(connection, sender.peer_obj.peer_id, Priority.BULK)
+        sender.connection_made(send_func, connect.Receiver(connection))
+        _logger.info(f"resuming directory: {sender.root_path} to {sender.peer_obj}")
+        await _run_sender(sender, sender.continue_transfer())
+        _logger.info(f"completed sending directory {sender.root_path} to {sender.peer_obj}")
+
+
+async def _connect(remote_peer, signal_packet):
+    connection = await connect.connect_to_peer(
+        remote_peer,
+        to_which=connect.CONN_URI,
+        timeout=1,
+        retries=3
+    )
+    try:
+        await Wire.send_async(connection, bytes(signal_packet))
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+async def _run_sender(sender, sending):
+    peer_id = sender.peer_obj.peer_id
+    status_mixin = sender.status_updater
+    yield_decision = status_mixin.should_yield
+    transfers_book.add_to_current(peer_id, sender)
+    try:
+        async with aclosing(sending) as s:
             async for _ in s:
                 if yield_decision():
                     await webpage.transfer_update(
-                        remote_peer.peer_id,
-                        transfer_id,
+                        peer_id,
+                        sender.id,
                         sender.current_file,
                     )
-        status_mixin.close()
-        _logger.info(f"completed sending directory {dir_path} to {remote_peer}")
+    finally:
+        if sender.state in (TransferState.COMPLETED, TransferState.ABORTING):
+            transfers_book.add_to_completed(peer_id, sender)
+            status_mixin.close()
+        else:
+            # kept for resume_directory
+            transfers_book.add_to_continued(peer_id, sender)
+
+
+def _manifest_path(resume_id, side):
+    return Path(const.PATH_TRANSFERS, f"{resume_id}.{side}")
 
 
 async def _get_confirmation(connection):
@@ -79,6 +146,7 @@ async def _get_confirmation(connection):
         if confirmation == b'\x00':
             _logger.info("not sending directory, other end rejected")
             raise TransferRejected()
+        return confirmation
     except asyncio.TimeoutError:
         _logger.info(f"not sending directory, did not receive confirmation within {timeout} seconds")
         raise
@@ -103,27 +171,47 @@ def DirConnectionHandler():
         transfer_id = peer.peer_id + transfer_id
 
         connection = event.transport.socket
-        dir_name = event.handshake.body['dir_name']
-        dir_path = rename_directory_with_increment(const.PATH_DOWNLOAD, Path(dir_name))
-
+        resume_id = event.handshake.body.get('resume_id')
+        pipelined = event.handshake.body.get('pipelined', False)
         sender = connect.Sender(connection)
         recv = connect.Receiver(connection)
-        status_iter = StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ)
-        receiver = DirReceiver(
-            peer,
-            transfer_id,
-            dir_path,
-            status_iter,
-        )
+
+        if event.handshake.body.get('resume', False):
+            receiver = await _paused_receiver(peer, transfer_id, resume_id)
+            if receiver is None:
+                with connection:
+                    await sender(b'\x00')
+                return
+            receiver.compression = event.handshake.body.get('compression')  # not kept in manifest
+            receiver.preallocate = const.FILE_PREALLOCATE
+            receiving = receiver.continue_transfer
+        else:
+            dir_name = event.handshake.body['dir_name']
+            dir_path = rename_directory_with_increment(const.PATH_DOWNLOAD, Path(dir_name))
+            keep_manifest = pipelined and _is_resume_id(resume_id)
+            receiver = DirReceiver(
+                peer,
+                transfer_id,
+                dir_path,
+                StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ),
+                pipelined=pipelined,
+                manifest_path=_manifest_path(resume_id, 'receiving') if keep_manifest else None,
+                compression=event.handshake.body.get('compression'),  # older peers send contents as they are
+                preallocate=const.FILE_PREALLOCATE,
+            )
+            receiving = receiver.recv_files
+
+        status_iter = receiver.status_updater
         receiver.connection_made(sender, recv)
         try:
             with connection:
-                await sender(b'\x01')  # :todo: get confirmation from user
+                # :todo: get confirmation from user
+                await sender(_PIPELINED_ACCEPTED if pipelined else b'\x01')
                 transfers_book.add_to_current(transfer_id, receiver)
                 _logger.info(
-                    f"receiving directory from {peer}, saving at {use.shorten_path(dir_path, 40)}"
+                    f"receiving directory from {peer}, saving at {use.shorten_path(receiver.download_path, 40)}"
                 )
-                async with aclosing(receiver.recv_files()) as loop:
+                async with aclosing(receiving()) as loop:
                     yield_decision = status_iter.should_yield
                     async for _ in loop:
                         if yield_decision():
@@ -135,6 +223,9 @@ def DirConnectionHandler():
                 _logger.info(f"directory received from {peer}")
                 transfers_book.add_to_completed(transfer_id, receiver)
         except Exception as e:
+            if receiver.state is TransferState.PAUSED and receiver.manifest is not None:
+                # sender comes back with the same resume id, see resume_directory
+                transfers_book.add_to_scheduled((peer.peer_id, resume_id), receiver)
             if const.debug:
                 traceback.print_exc()
             print("*" * 80, e)
@@ -142,6 +233,34 @@ def DirConnectionHandler():
     return handler
 
 
+async def _paused_receiver(peer, transfer_id, resume_id):
+    """Receiver to resume for ``resume_id``, paused one in memory or one made from manifest kept on disk"""
+    if not _is_resume_id(resume_id):
+        return None
+    if receiver := transfers_book.remove_scheduled((peer.peer_id, resume_id)):
+        return receiver
+
+    manifest_path = _manifest_path(resume_id, 'receiving')
+    try:
+        loop = asyncio.get_running_loop()
+        manifest = await loop.run_in_executor(thread_pool_for_disk_io, DirManifest.load, manifest_path)
+    except (OSError, ValueError) as exp:
+        _logger.info(f"not resuming directory from {peer}, no manifest at {manifest_path}", exc_info=exp)
+        return None
+    if manifest.peer_id != peer.peer_id:
+        _logger.warning(f"not resuming directory, {manifest_path} belongs to {manifest.peer_id}, not {peer}")
+        return None
+    return DirReceiver.from_manifest(peer, transfer_id, manifest, StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ))
+
+
+def _is_resume_id(resume_id):
+    # resume ids end up in file names
+    try:
+        return isinstance(resume_id, str) and str(uuid.UUID(resume_id)) == resume_id
+    except ValueError:
+        return False
+
+
 @use.NotInUse
 class DirectoryTaskHandle(TaskHandle):
     chunk_size = 1024
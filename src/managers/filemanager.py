@@ -9,15 +9,29 @@ from src.avails import OTMInformResponse, OTMSession, RemotePeer, TransfersBookK
     const
 from src.avails.events import ConnectionEvent
 from src.avails.exceptions import TransferIncomplete, TransferRejected
+from src.avails.remotepeer import convert_peer_id_to_byte_id
 from src.core import Dock, get_this_remote_peer, peers
 from src.transfers import HEADERS, TransferState, files, otm
+from src.transfers.scheduler import Priority, ScheduledSender
 from src.transfers.status import StatusMixIn
 from src.webpage_handlers import webpage
 
 transfers_book = TransfersBookKeeper()
+journal = files.TransferJournal(None)  # kept in memory till initiate_journal
 
 _logger = logging.getLogger(__name__)
 
+_OPTIONS_ACCEPTED = b'\x02'  # confirmation byte, options receiver agrees upon follow it in a frame
+# what a transfer falls back to for options receiver did not agree upon, older peers reply with none of them
+_PLAIN_OPTIONS = {
+    'stripes': 1,
+    'verify': False,
+    'delta': False,
+    'compression': None,
+    'sparse': False,
+    'batch': False,
+}
+
 
 @asynccontextmanager
 async def send_files_to_peer(peer_id, selected_files):
@@ -35,6 +49,7 @@ async def send_files_to_peer(peer_id, selected_files):
     if file_sender_handle := transfers_book.check_running(peer_id):
         # if any transfer is running just attach FileItems to that transfer
         file_sender_handle.attach_files(selected_files)
+        journal.attached(file_sender_handle, selected_files)
         return
 
     file_sender, status_updater = await _send_setup(peer_id, selected_files)
@@ -46,17 +61,49 @@ async def send_files_to_peer(peer_id, selected_files):
 
             async for _ in sender:
                 if yield_decision():
-                    await webpage.transfer_update(
-                        peer_id,
-                        file_sender.id,
-                        file_sender.current_file
-                    )
+                    await _sending_update(file_sender, peer_id)
 
     finally:
         await _send_finalize(file_sender, peer_id)
         status_updater.close()
 
 
+async def resume_files_to_peer(peer_id, transfer_id):
+    """Resumes a paused file transfer to ``peer_id`` over a new connection,
+    including ones brought back from journal after a restart
+
+    receiver reports back what it has, only the rest is sent, see ``files.Sender.continue_transfer``
+
+    Raises:
+        ValueError: if there is no paused file transfer ``transfer_id`` to ``peer_id``
+    """
+    file_sender = transfers_book.get_transfer(peer_id, transfer_id)
+    if not isinstance(file_sender, files.Sender) or file_sender.state != TransferState.PAUSED:
+        raise ValueError(f"no paused file transfer {transfer_id} to {peer_id}")
+    if peer_obj := Dock.peer_list.get_peer(peer_id):
+        file_sender.peer_obj = peer_obj
+
+    transfers_book.add_to_current(peer_id, file_sender)
+    yield_decision = file_sender.status_updater.should_yield
+    try:
+        async with _handle_sending(file_sender, peer_id, resume=True) as sender:
+            async for _ in sender:
+                if yield_decision():
+                    await _sending_update(file_sender, peer_id)
+    finally:
+        await _send_finalize(file_sender, peer_id)
+
+
+async def _sending_update(file_sender, peer_id):
+    journal.progressed(file_sender)
+    await webpage.transfer_update(
+        peer_id,
+        file_sender.id,
+        file_sender.current_file,
+        file_sender.chunk_sizer,
+    )
+
+
 async def _send_setup(peer_id, selected_files):
     status_updater = StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ)
     file_sender = files.Sender(
@@ -64,20 +111,29 @@ async def _send_setup(peer_id, selected_files):
         transfers_book.get_new_id(),
         selected_files,
         status_updater,
+        stripes=const.FILE_TRANSFER_STRIPES,
+        verify=const.FILE_VERIFY,
+        delta=const.FILE_DELTA,
+        compression=const.FILE_COMPRESSION,
+        sparse=const.FILE_SPARSE,
+        batch=const.FILE_BATCH,
     )
     transfers_book.add_to_current(peer_id=peer_id, transfer_handle=file_sender)
+    journal.started(file_sender)
     return file_sender, status_updater
 
 
 @asynccontextmanager
-async def _handle_sending(file_sender, peer_id):
+async def _handle_sending(file_sender, peer_id, resume=False):
     async with AsyncExitStack() as stack:
         try:
             may_be_confirmed = True
-            await stack.enter_async_context(prepare_connection(file_sender))
+            await stack.enter_async_context(prepare_connection(file_sender, resume))
             accepted = await asyncio.wait_for(file_sender.recv_func(1), const.DEFAULT_TRANSFER_TIMEOUT)
             if accepted == b'\x00':
                 may_be_confirmed = False
+            elif not resume:  # a resumed one goes on with what was agreed upon before
+                await _agree_upon_options(file_sender, accepted)
         except OSError as oe:  # unable to connect
             if const.debug:
                 traceback.print_exc()
@@ -89,32 +145,21 @@ async def _handle_sending(file_sender, peer_id):
         if may_be_confirmed is False:
             raise TransferRejected
 
-        yield await stack.enter_async_context(aclosing(file_sender.send_files()))
+        if file_sender.stripes > 1:
+            await prepare_stripes(file_sender, stack)
+
+        sending = file_sender.continue_transfer() if resume else file_sender.send_files()
+        yield await stack.enter_async_context(aclosing(sending))
 
 
 @asynccontextmanager
-async def prepare_connection(sender_handle):
-    _logger.debug(f"changing state to connection")  # debug
-    sender_handle.state = TransferState.CONNECTING
+async def prepare_connection(sender_handle, resume=False):
+    if not resume:  # a paused one stays paused till continue_transfer
+        _logger.debug(f"changing state to connection")  # debug
+        sender_handle.state = TransferState.CONNECTING
     try:
-        with await connect.connect_to_peer(
-                sender_handle.peer_obj,
-                connect.CONN_URI,
-                timeout=2,
-                retries=2,
-        ) as connection:
-            connection.setsockopt(socket.SOL_SOCKET, socket.TCP_NODELAY, 1)
-            handshake = WireData(
-                header=HEADERS.CMD_FILE_CONN,
-                version=sender_handle.version,
-                file_id=sender_handle.id,
-                peer_id=get_this_remote_peer().peer_id,
-            )
-
-            await Wire.send_async(connection, bytes(handshake))
-            _logger.debug("authorization header sent for file connection", extra={'id': sender_handle.id})
-
-            send_func = connect.Sender(connection)
+        with await _connect_for_file(sender_handle, stripe=0, resume=resume) as connection:
+            send_func = ScheduledSender(connection, sender_handle.peer_obj.peer_id, Priority.INTERACTIVE)
             recv_func = connect.Receiver(connection)
             sender_handle.connection_made(send_func, recv_func)
             _logger.debug(f"connection established")
@@ -127,17 +172,106 @@ async def prepare_connection(sender_handle):
         raise
 
 
+async def _connect_for_file(sender_handle, stripe, resume=False):
+    connection = await connect.connect_to_peer(
+        sender_handle.peer_obj,
+        connect.CONN_URI,
+        timeout=2,
+        retries=2,
+    )
+    try:
+        connection.setsockopt(socket.SOL_SOCKET, socket.TCP_NODELAY, 1)
+        handshake = WireData(
+            header=HEADERS.CMD_FILE_CONN,
+            version=sender_handle.version,
+            file_id=sender_handle.id,
+            peer_id=get_this_remote_peer().peer_id,
+            stripes=sender_handle.stripes,
+            stripe=stripe,
+            verify=sender_handle.verify,
+            delta=sender_handle.delta,
+            compression=sender_handle.compression,
+            sparse=sender_handle.sparse,
+            batch=sender_handle.batch,
+            total_size=sum(file_item.size for file_item in sender_handle.file_list),
+            resume=resume,
+        )
+
+        await Wire.send_async(connection, bytes(handshake))
+    except OSError:
+        connection.close()
+        raise
+    _logger.debug("authorization header sent for file connection", extra={'id': sender_handle.id})
+    return connection
+
+
+async def prepare_stripes(sender_handle, exit_stack):
+    """Opens connections for stripes 1..N-1 of a striped transfer, see ``files.striped``
+
+    Stripes that fail to connect are left out, transfer goes on with the ones connected so far
+    """
+    for index in range(1, sender_handle.stripes):
+        try:
+            connection = exit_stack.enter_context(await _connect_for_file(sender_handle, stripe=index))
+            accepted = await asyncio.wait_for(connection.arecv(1), const.DEFAULT_TRANSFER_TIMEOUT)
+        except (OSError, TimeoutError) as exp:
+            _logger.warning(f"could not connect stripe {index}, going on with {index} stripes", exc_info=exp)
+            return
+        if accepted != b'\x01':
+            _logger.warning(f"stripe {index} rejected, going on with {index} stripes")
+            return
+        send_func = ScheduledSender(connection, sender_handle.peer_obj.peer_id, Priority.INTERACTIVE)
+        sender_handle.stripe_made(index, send_func, connect.Receiver(connection))
+
+
+async def _agree_upon_options(file_sender, confirmation):
+    """Takes options receiver went along with, the ones it did not are turned off
+
+    Args:
+        file_sender(files.Sender): handle options were asked for in its file connection handshake
+        confirmation(bytes): byte receiver confirmed with, older peers confirm with ``\x01`` and nothing after it
+    """
+    accepted = {}
+    if confirmation == _OPTIONS_ACCEPTED:
+        reply = await asyncio.wait_for(Wire.receive_async(file_sender.recv_func.sock), const.DEFAULT_TRANSFER_TIMEOUT)
+        accepted = WireData.load_from(reply).body
+    for name, plain in _PLAIN_OPTIONS.items():
+        setattr(file_sender, name, accepted.get(name, plain))
+    journal.started(file_sender)  # recorded again, a resumed transfer has to go on with the same options
+    _logger.debug(f"options agreed upon {accepted}", extra={'id': file_sender.id})
+
+
+def _accepted_options(file_req):
+    """Options asked for in ``file_req`` this end goes along with, as configured in ``const``"""
+    asked = file_req.body
+    try:
+        codec = files.compression.get_codec(asked.get('compression'))
+    except ValueError:  # a codec this end does not know
+        codec = None
+    return {
+        'stripes': max(1, min(asked.get('stripes', 1), const.FILE_MAX_STRIPES)),
+        'verify': bool(asked.get('verify', False) and const.FILE_VERIFY),
+        'delta': bool(asked.get('delta', False) and const.FILE_DELTA),
+        'compression': codec.name if codec and const.FILE_COMPRESSION != 'none' else None,
+        'sparse': bool(asked.get('sparse', False) and const.FILE_SPARSE),
+        'batch': bool(asked.get('batch', False) and const.FILE_BATCH),
+    }
+
+
 async def _send_finalize(file_sender, peer_id):
     if file_sender.state in (TransferState.COMPLETED, TransferState.ABORTING):
         transfers_book.add_to_completed(peer_id, file_sender)
+        journal.finished(file_sender)
     elif file_sender.state in (TransferState.PAUSED, TransferState.CONNECTING):
         transfers_book.add_to_continued(peer_id, file_sender)
+        journal.progressed(file_sender)
 
 
 @asynccontextmanager
-async def file_receiver(file_req: WireData, connection, status_updater):
+async def file_receiver(file_req: WireData, options, connection, status_updater):
     """
-    Just a wrapper which does bookkeeping for FileReceiver object
+    Just a wrapper which does bookkeeping for FileReceiver object,
+    ``options`` are the ones agreed upon with sender, see ``_accepted_options``
     """
 
     peer_id = file_req.peer_id
@@ -147,21 +281,103 @@ async def file_receiver(file_req: WireData, connection, status_updater):
         peer_obj,
         file_req['file_id'],
         const.PATH_DOWNLOAD,
-        status_updater
+        status_updater,
+        preallocate=const.FILE_PREALLOCATE,
+        total_size=file_req.body.get('total_size', 0),
+        **options,
     )
     sender = connect.Sender(connection)
     receiver = connect.Receiver(connection)
 
     file_handle.connection_made(sender, receiver)
+    journal.started(file_handle)
 
-    transfers_book.add_to_current(file_req.id, file_handle)
+    async with _receiving(file_handle, file_req):
+        yield file_handle
 
-    yield file_handle
+
+@asynccontextmanager
+async def resumed_file_receiver(file_req: WireData, connection):
+    """Bookkeeping for a paused files.Receiver that sender resumes over ``connection``,
+    including ones brought back from journal after a restart
+
+    Yields:
+        files.Receiver object, None if there is no such paused receiver
+    """
+    peer_id = file_req.peer_id
+    file_handle = transfers_book.get_transfer(peer_id, f"{peer_id} {file_req['file_id']}")
+    if not isinstance(file_handle, files.Receiver) or file_handle.state != TransferState.PAUSED:
+        yield None
+        return
+    if peer_obj := Dock.peer_list.get_peer(peer_id):
+        file_handle.peer = peer_obj
+
+    loop = asyncio.get_running_loop()
+    file_handle.connection_wait = loop.create_future()
+    file_handle.finished = loop.create_future()
+    file_handle.connection_made(connect.Sender(connection), connect.Receiver(connection))
+
+    async with _receiving(file_handle, file_req):
+        yield file_handle
+
+
+@asynccontextmanager
+async def _receiving(file_handle, file_req):
+    peer_id = file_req.peer_id
+    transfers_book.add_to_current(peer_id, file_handle)
+    if file_handle.stripes > 1:
+        # other stripes look this handle up, see FileConnectionHandler
+        transfers_book.add_to_scheduled((peer_id, file_req['file_id']), file_handle)
+
+    try:
+        yield
+    finally:
+        if file_handle.stripes > 1:
+            transfers_book.remove_scheduled((peer_id, file_req['file_id']))
+            if not file_handle.finished.done():
+                file_handle.finished.set_result(None)
 
     if file_handle.state == TransferState.COMPLETED:
-        transfers_book.add_to_completed(file_req.id, file_handle)
+        transfers_book.add_to_completed(peer_id, file_handle)
+        journal.finished(file_handle)
     if file_handle.state == TransferState.PAUSED:
-        transfers_book.add_to_continued(file_req.id, file_handle)
+        transfers_book.add_to_continued(peer_id, file_handle)
+        journal.progressed(file_handle)
+
+
+async def initiate_journal():
+    """Opens file transfer journal under ``const.PATH_TRANSFERS`` and brings back paused transfers of last run,
+    they are offered to be resumed once their peers are reachable again, see :func:`offer_resume`
+    """
+    global journal
+    if not const.TRANSFER_JOURNAL:
+        return
+    journal = await Dock.exit_stack.enter_async_context(files.TransferJournal(const.PATH_TRANSFERS))
+    for entry in list(journal.entries.values()):
+        peer_obj = Dock.peer_list.get_peer(entry.peer_id) or RemotePeer(convert_peer_id_to_byte_id(entry.peer_id))
+        status_updater = StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ)
+        try:
+            handle = files.journal.restore(entry, peer_obj, status_updater, preallocate=const.FILE_PREALLOCATE)
+        except (ValueError, KeyError) as exp:
+            _logger.warning(f"not resuming {entry}: {exp}")
+            journal.forget(entry.key)
+            continue
+        transfers_book.add_to_continued(entry.peer_id, handle)
+        _logger.info(f"brought back paused transfer {entry}")
+    # ids handed out from here on must not clash with ones brought back
+    TransfersBookKeeper.skip_ids(entry.transfer_id for entry in journal.entries.values() if entry.side == files.journal.SEND)
+
+
+async def offer_resume(peer):
+    """Hands ``peer`` to paused file transfers with it and tells page which of them can be resumed,
+    page resumes one with ``HANDLE.RESUME_TRANSFER``
+    """
+    for handle in transfers_book.get_continued(peer.peer_id):
+        if isinstance(handle, files.Receiver) and handle.state == TransferState.PAUSED:
+            handle.peer = peer  # it is up to the sender to resume
+        elif isinstance(handle, files.Sender) and handle.state == TransferState.PAUSED:
+            handle.peer_obj = peer
+            await webpage.transfer_resumable(peer.peer_id, handle.id, handle.current_file)
 
 
 def start_new_otm_file_transfer(files_list: list[Path], peers: list[RemotePeer]):
@@ -210,31 +426,32 @@ def FileConnectionHandler():
             file_req = event.handshake
             _logger.info("new file connection arrived", extra={'id': file_req['file_id']})
 
+            if stripe := file_req.body.get('stripe', 0):
+                return await _attach_stripe(event.transport.socket, file_req, stripe)
+
+            if file_req.body.get('resume', False):
+                return await _resume_receiving(event.transport.socket, file_req)
+
             # if not await webpage.get_transfer_ok(event.handshake.peer_id):  # :todo: ask webpage
             #     await event.transport.send(b'\x00')
             #     return
 
-            await event.transport.socket.asendall(b'\x01')
+            options = _accepted_options(file_req)
+            await event.transport.socket.asendall(_OPTIONS_ACCEPTED)
+            await Wire.send_async(event.transport.socket, bytes(WireData(header=HEADERS.CMD_FILE_CONN, **options)))
 
-            _logger.debug(f"scheduling file transfer request {file_req!r}")
+            _logger.debug(f"scheduling file transfer request {file_req!r}, agreed upon {options}")
 
             try:
                 async with AsyncExitStack() as exit_stack:
                     status_updater = StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ)
                     receiver_handle = await exit_stack.enter_async_context(file_receiver(
                         file_req,
+                        options,
                         event.transport.socket,
                         status_updater,
                     ))
-                    receiver = await exit_stack.enter_async_context(aclosing(receiver_handle.recv_files()))
-                    yield_decision = status_updater.should_yield
-                    async for _ in receiver:
-                        if yield_decision():
-                            await webpage.transfer_update(
-                                file_req.peer_id,
-                                receiver_handle.id,
-                                receiver_handle.current_file
-                            )
+                    await _receive(receiver_handle, file_req, receiver_handle.recv_files())
                 status_updater.close()
             except TransferIncomplete as e:
                 await webpage.transfer_incomplete(
@@ -247,6 +464,58 @@ def FileConnectionHandler():
     return handler
 
 
+async def _resume_receiving(connection, file_req):
+    try:
+        async with resumed_file_receiver(file_req, connection) as receiver_handle:
+            if receiver_handle is None:
+                _logger.warning(f"no paused file transfer to resume", extra={'id': file_req['file_id']})
+                await connection.asendall(b'\x00')
+                return
+            await connection.asendall(b'\x01')
+            await _receive(receiver_handle, file_req, receiver_handle.continue_transfer())
+        receiver_handle.status_updater.close()
+    except TransferIncomplete as e:
+        await webpage.transfer_incomplete(
+            file_req.peer_id,
+            receiver_handle.id,
+            receiver_handle.current_file,
+            detail=e
+        )
+
+
+async def _receive(receiver_handle, file_req, receiving):
+    yield_decision = receiver_handle.status_updater.should_yield
+    async with aclosing(receiving) as receiver:
+        async for _ in receiver:
+            if yield_decision():
+                journal.progressed(receiver_handle)
+                await webpage.transfer_update(
+                    file_req.peer_id,
+                    receiver_handle.id,
+                    receiver_handle.current_file,
+                    receiver_handle.chunk_sizer,
+                )
+
+
+async def _attach_stripe(connection, file_req, stripe):
+    key = (file_req.peer_id, file_req['file_id'])
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + const.DEFAULT_TRANSFER_TIMEOUT
+    # stripe 0 can still be setting up the receiver
+    while (receiver_handle := transfers_book.get_scheduled(key)) is None and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+
+    if receiver_handle is None or stripe >= receiver_handle.stripes:
+        _logger.warning(f"no striped transfer found for stripe {stripe}", extra={'id': file_req['file_id']})
+        await connection.asendall(b'\x00')
+        return
+
+    await connection.asendall(b'\x01')
+    receiver_handle.stripe_made(stripe, connect.Sender(connection), connect.Receiver(connection))
+    # connection is closed by the caller as soon as we return
+    await receiver_handle.finished
+
+
 def OTMConnectionHandler():
     async def handler(event: ConnectionEvent):
         """
@@ -257,11 +526,29 @@ def OTMConnectionHandler():
         link_data = event.handshake
         _logger.info("updating otm connection", extra={'addr': connection.getpeername()})
         session_id = link_data['session_id']
-        otm_relay = transfers_book.get_scheduled(session_id)
-        if otm_relay:
-            await otm_relay.otm_add_stream_link(connection, link_data)
+        handle = transfers_book.get_scheduled(session_id)
+        if handle:
+            await handle.relay.otm_add_stream_link(connection, link_data)
         else:
             _logger.error(f"otm session not found with id={session_id}")
             _logger.error(f"ignoring request from {connection.getpeername()}")
 
     return handler
+
+
+def OTMRepairHandler():
+    async def handler(event: ConnectionEvent):
+        """
+        Serves ranges an otm receiver is missing, out of what this peer has of that session
+        """
+        with event.transport.socket as connection:
+            request = event.handshake
+            session_id = request['session_id']
+            handle = transfers_book.get_scheduled(session_id)
+            if handle is None:
+                _logger.error(f"otm session not found with id={session_id}, not serving repair")
+                return
+            _logger.info("serving otm repair", extra={'addr': connection.getpeername()})
+            await handle.relay.otm_serve_repair(connection, request)
+
+    return handler
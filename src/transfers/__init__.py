@@ -1,10 +1,14 @@
 import enum
 from concurrent.futures.thread import ThreadPoolExecutor
 
+from src.avails import wire as _wire
 from src.transfers._headers import *
 from src.transfers.rumor import *
 
+_wire.register_headers(WIRE_HEADER_CODES)
+
 thread_pool_for_disk_io = ThreadPoolExecutor()
+thread_pool_for_hashing = ThreadPoolExecutor(thread_name_prefix='hashing')
 
 
 class TransferState(enum.Enum):
@@ -24,6 +24,10 @@ class HEADERS:
     OTM_FILE_TRANSFER = "one to many file transfer request"
     OTM_UPDATE_STREAM_LINK = "otm_add_stream_link"
 
+    # added after WIRE_HEADER_CODES was frozen, these go by name
+    OTM_REPAIR = "otm_serve_repair"
+    GOSSIP_SESSION_STATE_ACK = "gossip_update_state_ack"
+
 
 class REQUESTS_HEADERS:
     __slots__ = ()
@@ -50,3 +54,45 @@ class GOSSIP:
     SEARCH_REQ = "\x01"
     SEARCH_REPLY = "\x02"
     CREATE_SESSION = "\x03"
+
+
+# one byte code of every header in WireData's binary envelope, see wire.register_headers
+# these are part of the wire format: a code is never changed or reused,
+# headers left out of this table (added after it was frozen) travel by name
+WIRE_HEADER_CODES = {
+    HEADERS.REQ_FOR_LIST: 0x01,
+    HEADERS.REDIRECT: 0x02,
+    HEADERS.SERVER_OK: 0x03,
+    HEADERS.REMOVAL_PING: 0x04,
+    HEADERS.CMD_RECV_FILE_AGAIN: 0x05,
+    HEADERS.CMD_VERIFY_HEADER: 0x06,
+    HEADERS.CMD_RECV_FILE: 0x07,
+    HEADERS.CMD_CLOSING_HEADER: 0x08,
+    HEADERS.CMD_TEXT: 0x09,
+    HEADERS.CMD_RECV_DIR: 0x0A,
+    HEADERS.CMD_FILE_CONN: 0x0B,
+    HEADERS.CMD_DIR_CONN: 0x0C,
+    HEADERS.GOSSIP_CREATE_SESSION: 0x0D,
+    HEADERS.GOSSIP_DOWNGRADE_CONN: 0x0E,
+    HEADERS.GOSSIP_UPGRADE_CONN: 0x0F,
+    HEADERS.GOSSIP_SESSION_STATE_UPDATE: 0x10,
+    HEADERS.GOSSIP_UPDATE_STREAM_LINK: 0x11,
+    HEADERS.GOSSIP_LINK_OK: 0x12,
+    HEADERS.GOSSIP_TREE_CHECK: 0x13,
+    HEADERS.GOSSIP_TREE_REJECT: 0x14,
+    HEADERS.GOSSIP_TREE_GATHER: 0x15,
+    HEADERS.OTM_FILE_TRANSFER: 0x16,
+    HEADERS.OTM_UPDATE_STREAM_LINK: 0x17,
+    REQUESTS_HEADERS.REDIRECT: 0x18,
+    REQUESTS_HEADERS.LIST_SYNC: 0x19,
+    REQUESTS_HEADERS.ACTIVE_PING: 0x1A,
+    REQUESTS_HEADERS.REQ_FOR_LIST: 0x1B,
+    REQUESTS_HEADERS.I_AM_ACTIVE: 0x1C,
+    REQUESTS_HEADERS.KADEMLIA: 0x1D,  # same values as DISCOVERY.NETWORK_FIND
+    REQUESTS_HEADERS.DISCOVERY: 0x1E,  # and DISCOVERY.NETWORK_FIND_REPLY
+    REQUESTS_HEADERS.GOSSIP: 0x1F,
+    GOSSIP.MESSAGE: 0x20,
+    GOSSIP.SEARCH_REQ: 0x21,
+    GOSSIP.SEARCH_REPLY: 0x22,
+    GOSSIP.CREATE_SESSION: 0x23,
+}
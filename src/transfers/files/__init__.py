@@ -1,3 +1,5 @@
+from ._manifest import DirManifest
 from .directory import DirReceiver, DirSender, rename_directory_with_increment
+from .journal import TransferJournal
 from .receiver import Receiver
 from .sender import Sender
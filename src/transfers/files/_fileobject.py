@@ -1,3 +1,5 @@
+import socket
+import struct
 from pathlib import Path
 
 import umsgpack
@@ -27,13 +29,14 @@ class FileItem:
         path: The Path object representing the file's path.
         seeked: A variable indicating how much of the file has been read or processed.
         original_ext: Preserves the original file extension for potential renaming.
+        merkle_root: Root of chunk digests once the file is verified (see files.integrity), None till then.
 
     Note:
         The add_error_ext method renames the file to include an error extension, while remove_error_ext restores the original name.
         Both methods handle edge cases, such as ensuring the original extension exists before attempting to restore it.
 
     """
-    __slots__ = '_name', 'size', 'path', 'seeked', 'original_ext'
+    __slots__ = '_name', 'size', 'path', 'seeked', 'original_ext', 'merkle_root'
 
     def __init__(self, path, seeked):
         """Initializes the file object, fetching its size and name from the filesystem.
@@ -44,6 +47,7 @@ class FileItem:
         """
         self.path: Path = path
         self.seeked = seeked
+        self.merkle_root = None
         if self.path.exists():
             self.size = self.path.stat().st_size
         self._name = self.path.name
@@ -59,7 +63,7 @@ class FileItem:
 
     @staticmethod
     def load_from(data: bytes, file_parent_path):
-        name, size, seeked = umsgpack.loads(data)
+        name, size, seeked, *merkle_root = umsgpack.loads(data)
 
         if const.IS_WINDOWS:
             name = name.replace('\\', '_')
@@ -67,10 +71,13 @@ class FileItem:
         file = FileItem(Path(file_parent_path, name), seeked)
         file._name = name
         file.size = size
+        file.merkle_root = merkle_root[0] if merkle_root else None
         return file
 
     def __bytes__(self):
-        return umsgpack.dumps(tuple(self))
+        if self.merkle_root is None:
+            return umsgpack.dumps(tuple(self))
+        return umsgpack.dumps((*self, self.merkle_root))
 
     def __iter__(self):
         return iter((self.name, self.size, self.seeked))
@@ -124,6 +131,85 @@ class FileItem:
         return (self.name, self.size, self.path)[item]
 
 
+class FileRange:
+    """A byte range ``[start, end)`` of a :class:`FileItem`, sent over one stripe of a striped transfer
+
+    Duck types FileItem for ``send_actual_file`` and ``recv_file_contents``,
+    ``size`` is end of the range and ``seeked`` is the absolute offset up to which the range is transferred,
+    so resuming a range works the same way as resuming a file
+
+    Attributes:
+        file_item(FileItem): file this range belongs to
+        start(int): offset this range started at (in this session)
+        seeked(int): offset up to which this range is transferred
+        size(int): end of this range (exclusive)
+    """
+    __slots__ = 'file_item', 'start', 'seeked', 'size'
+    _header = struct.Struct('!QQ')
+    header_size = _header.size
+
+    def __init__(self, file_item, seeked, end):
+        self.file_item = file_item
+        self.start = seeked
+        self.seeked = seeked
+        self.size = end
+
+    @property
+    def path(self):
+        return self.file_item.path
+
+    @property
+    def transferred(self):
+        return self.seeked - self.start
+
+    @property
+    def is_complete(self):
+        return self.seeked >= self.size
+
+    def __bytes__(self):
+        return self._header.pack(self.seeked, self.size)
+
+    @classmethod
+    def load_from(cls, data: bytes, file_item):
+        seeked, end = cls._header.unpack(data)
+        if not 0 <= seeked <= end <= file_item.size:
+            raise ValueError(f"range {seeked}-{end} is out of bounds of {file_item!r}")
+        return cls(file_item, seeked, end)
+
+    def __repr__(self):
+        return f"FileRange({self.start}-{self.size}, seeked={self.seeked})"
+
+
+def split_ranges(file_item: FileItem, count, *, min_size=1024 * 1024):
+    """Splits the remaining part of ``file_item`` (from ``seeked`` to end) into at most ``count`` ranges
+
+    Args:
+        file_item(FileItem): file to split
+        count(int): max number of ranges
+        min_size(int): ranges are never made smaller than this, small files end up with fewer ranges
+
+    Returns:
+        list[FileRange]: contiguous ranges in order of offsets
+    """
+    start, end = file_item.seeked, file_item.size
+    remaining = end - start
+    if remaining <= 0:
+        return [FileRange(file_item, start, end)]
+    count = max(1, min(count, remaining // min_size))
+    step = -(-remaining // count)  # ceil
+    return [FileRange(file_item, offset, min(offset + step, end)) for offset in range(start, end, step)]
+
+
+def contiguous_seeked(ranges: list[FileRange]):
+    """Offset up to which all the ``ranges`` (contiguous and in order) are transferred, fit for ``FileItem.seeked``"""
+    seeked = ranges[0].start
+    for file_range in ranges:
+        seeked = file_range.seeked
+        if not file_range.is_complete:
+            break
+    return seeked
+
+
 def add_error_ext(file_item: FileItem, root_path, error_ext):
     """
         Handles file error by renaming the file with an error extension.
@@ -206,3 +292,62 @@ def calculate_chunk_size(
                 max_file_size - min_file_size)
 
     return int(buffer_size - (buffer_size % 1024))
+
+
+class AdaptiveChunkSize:
+    """Chunk size of a transfer, adjusted from how long each chunk takes to send or write
+
+    Additive increase, multiplicative decrease (AIMD):
+    a full sized chunk that took less than ``target_latency`` grows size by ``min_size``,
+    any chunk that took longer halves it, keeping each chunk around ``target_latency`` on slow
+    links/disks (so timeouts, pause and progress stay responsive) while fast ones get large chunks
+
+    Attributes:
+        size(int): chunk size to use for the next chunk
+        throughput(float): moving average of bytes per second
+    """
+    __slots__ = 'size', 'min_size', 'max_size', 'target_latency', 'throughput', '_socket_buffer'
+
+    def __init__(self, initial=None, *, min_size=None, max_size=None, target_latency=None):
+        self.min_size = min_size or const.MIN_CHUNK_SIZE
+        self.max_size = max(self.min_size, max_size or const.MAX_CHUNK_SIZE)
+        self.target_latency = target_latency or const.CHUNK_TARGET_LATENCY
+        self.size = min(self.max_size, max(self.min_size, initial or self.min_size))
+        self.throughput = 0.0
+        self._socket_buffer = 0
+
+    def update(self, nbytes, elapsed):
+        """Accounts a chunk of ``nbytes`` that took ``elapsed`` seconds
+
+        Returns:
+            int: chunk size to use next
+        """
+        if elapsed > 0:
+            rate = nbytes / elapsed
+            self.throughput = 0.8 * self.throughput + 0.2 * rate if self.throughput else rate
+
+        if elapsed > self.target_latency:
+            self.size = max(self.min_size, self.size // 2)
+        elif nbytes >= self.size:
+            # short chunks (end of file) say nothing about larger ones
+            self.size = min(self.max_size, self.size + self.min_size)
+        return self.size
+
+    def fit_socket_buffer(self, sock, option):
+        """Raises ``option`` (SO_SNDBUF or SO_RCVBUF) of ``sock`` to hold two chunks, never lowers it
+
+        kernels that autotune socket buffers stop doing so once they are set,
+        so buffers are only set when they are found to be smaller than needed
+        """
+        wanted = 2 * self.size
+        if sock is None or wanted <= self._socket_buffer:
+            return
+        self._socket_buffer = wanted
+        try:
+            if sock.getsockopt(socket.SOL_SOCKET, option) < wanted:
+                sock.setsockopt(socket.SOL_SOCKET, option, wanted)
+        except OSError:
+            pass
+
+    def __repr__(self):
+        return f"AdaptiveChunkSize(size={self.size}, throughput={stringify_size(self.throughput)}/s)"
@@ -0,0 +1,186 @@
+import array
+import asyncio
+import os
+import struct
+import time
+from pathlib import Path
+
+import umsgpack
+
+from src.avails import const
+from src.transfers import thread_pool_for_disk_io
+
+_MAGIC = b'PCDM'  # PeerConnect directory manifest
+_HEADER = struct.Struct('!4sI')  # MAGIC | LEN OF ENTRIES
+
+
+class DirManifest:
+    """Files of a directory transfer along with bytes confirmed of each, kept on disk to resume from
+
+    on disk::
+
+        MAGIC(4) | LEN(4) | [ROOT, PEER ID, [[PARENT, NAME, SIZE, MTIME], ...]] | CONFIRMED(8) per file ...
+
+    entries are written once, confirmed bytes are updated in place (only the span that changed since
+    last flush is written), so checkpointing a directory of millions of files costs a few bytes per flush
+
+    ``path`` can be None, nothing is persisted then (resume only works within the process)
+
+    Attributes:
+        path(Path | None): file this manifest is kept in
+        root(Path): directory entries are relative to
+        peer_id(str): other end of the transfer
+        entries(list[list]): [PARENT, NAME, SIZE, MTIME (ns)] of files in transfer order
+        confirmed(array.array): bytes of each file the receiver has written
+    """
+    __slots__ = 'path', 'root', 'peer_id', 'entries', 'confirmed', '_dirty', '_flushed_at', '_confirmed_at'
+
+    def __init__(self, path, root, peer_id, entries, confirmed=None):
+        self.path = path
+        self.root = Path(root)
+        self.peer_id = peer_id
+        self.entries = entries
+        self.confirmed = confirmed if confirmed is not None else array.array('Q', bytes(8 * len(entries)))
+        self._dirty = None  # (start, end) indexes of confirmed changed since last flush
+        self._flushed_at = 0
+        self._confirmed_at = 0  # offset of confirmed bytes in file
+
+    def __len__(self):
+        return len(self.entries)
+
+    def file_path(self, index):
+        parent, name, *_ = self.entries[index]
+        return Path(self.root, parent, name)
+
+    def size(self, index):
+        return self.entries[index][2]
+
+    def confirm(self, index, nbytes):
+        """Records that ``nbytes`` of file at ``index`` are written by the receiver"""
+        self.confirmed[index] = nbytes
+        if self._dirty is None:
+            self._dirty = index, index + 1
+        else:
+            start, end = self._dirty
+            self._dirty = min(start, index), max(end, index + 1)
+
+    def checkpoints(self):
+        """Packs confirmed bytes into ``[COMPLETE RANGES, PARTIALS]``
+
+        complete files go as flat ``[START, END, ...]`` index ranges and partially written ones as flat
+        ``[INDEX, CONFIRMED, ...]``, keeping the checkpoint set small for directories that are mostly done
+        """
+        complete, partial = [], []
+        for index, (entry, confirmed) in enumerate(zip(self.entries, self.confirmed)):
+            if confirmed == 0:
+                continue
+            if confirmed < entry[2]:
+                partial += index, confirmed
+            elif complete and complete[-1] == index:
+                complete[-1] = index + 1
+            else:
+                complete += index, index + 1
+        return [complete, partial]
+
+    def apply_checkpoints(self, checkpoints):
+        """Takes confirmed bytes reported by the receiver (see ``checkpoints``) as this manifest's own"""
+        complete, partial = checkpoints
+        confirmed = array.array('Q', bytes(8 * len(self.entries)))
+        try:
+            for start, end in zip(complete[::2], complete[1::2]):
+                for index in range(start, end):
+                    confirmed[index] = self.entries[index][2]
+            for index, nbytes in zip(partial[::2], partial[1::2]):
+                confirmed[index] = min(nbytes, self.entries[index][2])
+        except (IndexError, TypeError, OverflowError) as exp:
+            raise ValueError(f"checkpoints do not fit manifest of {len(self)} files") from exp
+        self.confirmed = confirmed
+        self._dirty = 0, len(confirmed)
+
+    async def save(self):
+        """Writes the whole manifest, replacing the one on disk"""
+        if self.path is None:
+            return
+        header = umsgpack.dumps([str(self.root), self.peer_id, self.entries])
+        self._confirmed_at = _HEADER.size + len(header)
+        contents = _HEADER.pack(_MAGIC, len(header)) + header + self.confirmed.tobytes()
+        await asyncio.get_running_loop().run_in_executor(thread_pool_for_disk_io, _replace, self.path, contents)
+        self._dirty = None
+        self._flushed_at = time.monotonic()
+
+    async def flush(self, *, force=False):
+        """Writes confirmed bytes changed since last flush, at most once in ``const.DIR_CHECKPOINT_INTERVAL``
+
+        Args:
+            force(bool): flush irrespective of the interval (pausing, on errors)
+        """
+        if self.path is None or self._dirty is None or self._confirmed_at == 0:
+            return
+        if not force and time.monotonic() - self._flushed_at < const.DIR_CHECKPOINT_INTERVAL:
+            return
+        start, end = self._dirty
+        self._dirty = None
+        self._flushed_at = time.monotonic()
+        await asyncio.get_running_loop().run_in_executor(
+            thread_pool_for_disk_io,
+            _write_at, self.path, self._confirmed_at + 8 * start, self.confirmed[start:end].tobytes(),
+        )
+
+    async def remove(self):
+        """Removes manifest from disk, nothing is persisted from here on"""
+        if self.path is None:
+            return
+        path, self.path = self.path, None
+        await asyncio.get_running_loop().run_in_executor(thread_pool_for_disk_io, _unlink, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads manifest kept at ``path``, blocking
+
+        Raises:
+            ValueError: if the file is not a manifest or is cut short
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            magic, header_len = _HEADER.unpack_from(data)
+            root, peer_id, entries = umsgpack.loads(data[_HEADER.size:_HEADER.size + header_len])
+        except (struct.error, umsgpack.UnpackException) as exp:
+            raise ValueError(f"{path} is not a directory manifest") from exp
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a directory manifest")
+
+        confirmed_at = _HEADER.size + header_len
+        confirmed = array.array('Q')
+        confirmed.frombytes(data[confirmed_at:confirmed_at + 8 * len(entries)])
+        if len(confirmed) != len(entries):
+            raise ValueError(f"{path} is cut short")
+
+        manifest = cls(Path(path), root, peer_id, entries, confirmed)
+        manifest._confirmed_at = confirmed_at
+        return manifest
+
+    def __repr__(self):
+        return f"DirManifest({self.root}, files={len(self)}, path={self.path})"
+
+
+def _replace(path, contents):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(contents)
+    os.replace(temp_path, path)
+
+
+def _write_at(path, offset, data):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,127 @@
+"""Preallocated and sparse files on the receiving end
+
+receiver creates a file at its full size as soon as its file item arrives, blocks are reserved up front
+(``os.posix_fallocate``, plain truncate where that is not there) so that the filesystem lays the file out
+in one go instead of growing it a write at a time, and a disk that cannot hold the file fails the
+transfer right away rather than halfway through
+
+when both ends agree upon ``sparse`` in the handshake, sender looks up the ranges of each file that hold
+data (``SEEK_DATA``/``SEEK_HOLE``) and only those are sent, per file, after the file item::
+
+    | RANGE COUNT(4) | SEEKED(8) | END(8) | ... for every range of data, ranges in order
+
+holes in between are never sent nor allocated, they stay holes in the received file
+
+"""
+import errno
+import os
+import shutil
+
+from src.transfers.files._fileobject import FileRange, stringify_size
+
+MIN_HOLE_SIZE = 64 * 1024  # smaller holes are sent as zeros, not worth a range of their own
+
+_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL}
+
+
+def data_ranges(file_item):
+    """Ranges of ``file_item`` from ``seeked`` to ``size`` that hold data, holes left out (blocking)
+
+    Returns:
+        list[FileRange]: ranges in order, the whole remaining file if holes can not be looked up
+    """
+    start, end = file_item.seeked, file_item.size
+    whole = [FileRange(file_item, start, end)]
+    if not hasattr(os, 'SEEK_DATA') or start >= end:
+        return whole
+
+    spans = []
+    with open(file_item.path, 'rb') as f:
+        offset = start
+        while offset < end:
+            try:
+                data = os.lseek(f.fileno(), offset, os.SEEK_DATA)
+            except OSError as oe:
+                if oe.errno == errno.ENXIO:  # nothing but a hole up to end of file
+                    break
+                return whole
+            if data >= end:
+                break
+            hole = min(os.lseek(f.fileno(), data, os.SEEK_HOLE), end)
+            if spans and data - spans[-1][1] < MIN_HOLE_SIZE:
+                spans[-1][1] = hole
+            else:
+                spans.append([data, hole])
+            offset = hole
+
+    if spans and spans[0][0] - start < MIN_HOLE_SIZE:
+        spans[0][0] = start
+    if spans and end - spans[-1][1] < MIN_HOLE_SIZE:
+        spans[-1][1] = end
+    return [FileRange(file_item, data, hole) for data, hole in spans]
+
+
+def is_whole(ranges, file_item):
+    """Whether ``ranges`` cover all of ``file_item`` from ``seeked``, no holes to skip"""
+    return len(ranges) == 1 and ranges[0].seeked == file_item.seeked and ranges[0].size == file_item.size
+
+
+def ensure_space(path, needed):
+    """
+    Raises:
+        OSError: (ENOSPC) if filesystem holding ``path`` has less than ``needed`` bytes free
+    """
+    free = shutil.disk_usage(path).free
+    if needed > free:
+        raise OSError(
+            errno.ENOSPC,
+            f"not enough space, {stringify_size(needed)} needed but {stringify_size(free)} free",
+            str(path),
+        )
+
+
+def allocate(file_item, ranges=None, *, preallocate=True):
+    """Creates file of ``file_item`` at its full size before any of its contents arrive (blocking)
+
+    only ``ranges`` (all of file if None) take up space, whatever lies outside them stays a hole,
+    file is created with ``xb`` like any received file, and removed again if it could not be allocated
+
+    Args:
+        file_item(FileItem): file to create, ``seeked`` is expected to be 0
+        ranges(list[FileRange]): ranges that hold data, see :func:`data_ranges`
+        preallocate(bool): reserve blocks of ``ranges``, otherwise only the size is set
+
+    Raises:
+        OSError: (ENOSPC) if there is not enough space for ``ranges``
+    """
+    if ranges is None:
+        ranges = [FileRange(file_item, 0, file_item.size)]
+    ensure_space(file_item.path.parent, sum(file_range.size - file_range.seeked for file_range in ranges))
+
+    try:
+        with open(file_item.path, 'xb') as f:
+            os.truncate(f.fileno(), file_item.size)
+            if preallocate and hasattr(os, 'posix_fallocate'):
+                for file_range in ranges:
+                    if not _fallocate(f.fileno(), file_range.seeked, file_range.size - file_range.seeked):
+                        break
+    except FileExistsError:
+        raise
+    except OSError:
+        file_item.path.unlink(missing_ok=True)
+        raise
+
+
+def _fallocate(fd, offset, length):
+    """Reserves ``length`` bytes at ``offset``, False if filesystem does not support that"""
+    if length <= 0:
+        return True
+    try:
+        os.posix_fallocate(fd, offset, length)
+    except OSError as oe:
+        if oe.errno in _UNSUPPORTED:
+            return False
+        if oe.errno == errno.ENOSPC:
+            raise OSError(errno.ENOSPC, f"not enough space to allocate {stringify_size(length)}") from oe
+        raise
+    return True
@@ -0,0 +1,112 @@
+"""Small files of a file transfer sent together
+
+when both ends agree upon ``batch`` in the handshake, runs of small files (``const.FILE_SMALL_FILE_SIZE``)
+that are sent from scratch go in one frame instead of a flag, a file item and contents each::
+
+    | BATCH(1B) | ITEMS LEN(4) | [FILE ITEM, ...] | CONTENTS of every file back to back | DIGEST(16) |
+                                                                            DIGEST only if ``verify``
+
+in place of ``\\x01`` that comes before each file otherwise, batches are flushed at ``const.FILE_BATCH_SIZE``,
+receiver writes every file of a batch in one go in ``thread_pool_for_disk_io`` once all of it arrived
+(and matched DIGEST), so that a batch is either on disk as a whole or not at all,
+and both ends keep one progress bar for the whole transfer instead of one per file
+
+"""
+import hashlib
+import struct
+
+import umsgpack
+
+from src.avails import const, use
+from src.avails.exceptions import TransferIncomplete
+from src.transfers.files._fileobject import FileItem, validatename
+from src.transfers.files.integrity import DIGEST_SIZE
+
+BATCH_CODE = b'\x02'
+MAX_BATCH_COUNT = 1024  # files per batch
+_ITEMS_LEN = struct.Struct('!I')
+_MAX_ITEMS_LEN = MAX_BATCH_COUNT * 1024  # file names are way shorter than this, a bound on what is received
+
+
+def plan_batch(file_items, start):
+    """Run of small files in ``file_items`` from ``start`` that go in one batch, empty if there is none"""
+    batch, batch_bytes = [], 0
+    for file_item in file_items[start:]:
+        if file_item.seeked != 0 or file_item.size > const.FILE_SMALL_FILE_SIZE:
+            break
+        batch.append(file_item)
+        batch_bytes += file_item.size
+        if batch_bytes >= const.FILE_BATCH_SIZE or len(batch) >= MAX_BATCH_COUNT:
+            break
+    return batch
+
+
+def read_batch(file_items, verify):
+    """Reads ``file_items`` into a batch frame (blocking)
+
+    Raises:
+        TransferIncomplete: if a file got shorter than it was when listed
+    """
+    items = umsgpack.dumps([bytes(file_item) for file_item in file_items])
+    frame = [BATCH_CODE, _ITEMS_LEN.pack(len(items)), items]
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for file_item in file_items:
+        with open(file_item.path, 'rb') as f:
+            data = f.read(file_item.size)
+        if len(data) != file_item.size:
+            raise TransferIncomplete(f"{file_item.path} got shorter than {file_item.size} bytes while sending")
+        frame.append(data)
+        if verify:
+            digest.update(data)
+    if verify:
+        frame.append(digest.digest())
+    return b''.join(frame)
+
+
+async def recv_batch(recv_function, download_path, verify):
+    """Receives a batch frame (after its code) sent with :func:`read_batch`
+
+    Returns:
+        tuple[list[FileItem], bytes, bytes | None]: file items, contents of all of them back to back, digest
+
+    Raises:
+        TransferIncomplete: if batch is out of bounds
+    """
+    items_len, = _ITEMS_LEN.unpack(await use.recv_exactly(recv_function, _ITEMS_LEN.size))
+    if not 0 < items_len <= _MAX_ITEMS_LEN:
+        raise TransferIncomplete(f"batch of {items_len} bytes of file items is out of bounds")
+    try:
+        raw_items = umsgpack.loads(await use.recv_exactly(recv_function, items_len))
+        file_items = [FileItem.load_from(raw_item, download_path) for raw_item in raw_items]
+    except (umsgpack.UnpackException, TypeError, ValueError) as exp:
+        raise TransferIncomplete("ill formed batch") from exp
+
+    total = sum(file_item.size for file_item in file_items)
+    too_large = any(not 0 <= file_item.size <= const.FILE_SMALL_FILE_SIZE for file_item in file_items)
+    too_large = too_large or total > const.FILE_BATCH_SIZE + const.FILE_SMALL_FILE_SIZE  # can overshoot by a file
+    if not 0 < len(file_items) <= MAX_BATCH_COUNT or too_large:
+        raise TransferIncomplete(f"batch of {len(file_items)} files ({total} bytes) is out of bounds")
+
+    contents = await use.recv_exactly(recv_function, total) if total else b''
+    digest = await use.recv_exactly(recv_function, DIGEST_SIZE) if verify else None
+    return file_items, contents, digest
+
+
+def write_batch(file_items, contents, digest, download_path):
+    """Writes every file of a batch under ``download_path`` (blocking), files get unique names as single ones do
+
+    nothing is written if ``digest`` (if any) does not match ``contents``
+
+    Raises:
+        TransferIncomplete: if batch is corrupted
+    """
+    if digest is not None and hashlib.blake2b(contents, digest_size=DIGEST_SIZE).digest() != digest:
+        raise TransferIncomplete(f"batch of {len(file_items)} files is corrupted")
+    view = memoryview(contents)
+    offset = 0
+    for file_item in file_items:
+        validatename(file_item=file_item, root_path=download_path)
+        with open(file_item.path, 'xb') as f:
+            f.write(view[offset:offset + file_item.size])
+        offset += file_item.size
+        file_item.seeked = file_item.size
@@ -0,0 +1,239 @@
+"""On the fly compression of file contents
+
+both ends agree upon a codec (``zlib`` or ``lzma``, or none) in the connection handshake,
+sender then judges each file (or batch of small files) by the entropy of its first chunk,
+whatever already looks compressed goes as it is, the rest goes as a stream of chunks::
+
+    | KIND(1) | RAW LEN(4) | LEN(4) | DATA |  ... until RAW LENs add up to the file
+      KIND: STORED (DATA is RAW LEN bytes as they are) or COMPRESSED
+
+every chunk is compressed on its own, so chunks compress in parallel in ``thread_pool_for_disk_io``
+(codecs release the GIL) and resuming a file starts a fresh stream at any offset,
+the level follows whichever of compressing and sending is the slower one, see :class:`AdaptiveLevel`,
+receiver decompresses in its own pool, the event loop never runs a codec
+
+"""
+import collections
+import lzma
+import math
+import struct
+import time
+import zlib
+
+from src.avails import use
+from src.avails.exceptions import TransferIncomplete
+
+STORED = b'\x00'
+COMPRESSED = b'\x01'
+ENTROPY_SAMPLE_SIZE = 64 * 1024
+ENTROPY_LIMIT = 7.5  # bits per byte, samples above this are taken as already compressed
+PROBE_EVERY = 16  # chunks, while storing, one chunk is compressed to see whether it pays off again
+
+_CHUNK_HEADER = struct.Struct('!cII')  # KIND | RAW LEN | LEN
+
+
+class Codec:
+    """A stdlib compressor with its range of levels
+
+    Attributes:
+        name(str): name both ends agree upon in the handshake
+        min_level(int): fastest level
+        max_level(int): smallest output
+    """
+    __slots__ = 'name', 'min_level', 'max_level', '_compress', '_decompressor'
+
+    def __init__(self, name, min_level, max_level, compress, decompressor):
+        self.name = name
+        self.min_level = min_level
+        self.max_level = max_level
+        self._compress = compress
+        self._decompressor = decompressor
+
+    def compress(self, data, level):
+        return self._compress(data, level)
+
+    def decompress(self, data, raw_len):
+        """Decompresses ``data`` that is expected to come out as ``raw_len`` bytes, never more
+
+        Raises:
+            ValueError: if ``data`` does not decompress into ``raw_len`` bytes
+        """
+        decompressor = self._decompressor()
+        try:
+            raw = decompressor.decompress(data, raw_len)
+            if not decompressor.eof:
+                # output is capped at raw_len, end of stream (checksums) may still be pending
+                raw += decompressor.decompress(getattr(decompressor, 'unconsumed_tail', b''), 1)
+        except (zlib.error, lzma.LZMAError) as exp:
+            raise ValueError(f"corrupted {self.name} chunk") from exp
+        if len(raw) != raw_len or not decompressor.eof:
+            raise ValueError(f"{self.name} chunk does not decompress into {raw_len} bytes")
+        return raw
+
+    def __repr__(self):
+        return f"Codec({self.name})"
+
+
+CODECS = {
+    'zlib': Codec('zlib', 1, 9, lambda data, level: zlib.compress(data, level), zlib.decompressobj),
+    'lzma': Codec(
+        'lzma', 0, 9,
+        lambda data, level: lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_NONE, preset=level),
+        lzma.LZMADecompressor,
+    ),
+}
+
+
+def get_codec(name):
+    """Codec called ``name``, None if ``name`` is None or 'none' (no compression)
+
+    Raises:
+        ValueError: if there is no such codec
+    """
+    if name is None or name == 'none':
+        return None
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"unknown compression {name!r}") from None
+
+
+def entropy(sample):
+    """Shannon entropy of ``sample`` in bits per byte"""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in collections.Counter(sample).values())
+
+
+def worth_compressing(sample):
+    """Whether ``sample`` (first chunk of something) looks like it compresses"""
+    return entropy(sample[:ENTROPY_SAMPLE_SIZE]) < ENTROPY_LIMIT
+
+
+def read_sample(path, offset):
+    """First ``ENTROPY_SAMPLE_SIZE`` bytes of file at ``path`` from ``offset`` (blocking)"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(ENTROPY_SAMPLE_SIZE)
+
+
+def pack_chunk(data, codec, level):
+    """Compresses ``data`` into a chunk (blocking, run it in a thread)
+
+    ``data`` is stored as it is if ``level`` is None or if it does not get any smaller
+
+    Returns:
+        tuple[bytes, float]: chunk, seconds spent compressing
+    """
+    if level is None:
+        return _CHUNK_HEADER.pack(STORED, len(data), len(data)) + data, 0.0
+    started = time.perf_counter()
+    compressed = codec.compress(data, level)
+    elapsed = time.perf_counter() - started
+    if len(compressed) >= len(data):
+        return _CHUNK_HEADER.pack(STORED, len(data), len(data)) + data, elapsed
+    return _CHUNK_HEADER.pack(COMPRESSED, len(data), len(compressed)) + compressed, elapsed
+
+
+async def recv_chunk(recv_function, limit):
+    """Receives a chunk made by :func:`pack_chunk`, that holds at most ``limit`` raw bytes
+
+    Returns:
+        tuple[bytes, int, bytes]: KIND, RAW LEN, DATA (still compressed, see :func:`unpack_chunk`)
+
+    Raises:
+        TransferIncomplete: if chunk is out of bounds
+    """
+    kind, raw_len, data_len = _CHUNK_HEADER.unpack(await use.recv_exactly(recv_function, _CHUNK_HEADER.size))
+    if kind not in (STORED, COMPRESSED) or not 0 < raw_len <= limit or (kind == STORED and data_len != raw_len):
+        raise TransferIncomplete(f"bad chunk {kind=} {raw_len=} {data_len=} of at most {limit} bytes")
+    return kind, raw_len, await use.recv_exactly(recv_function, data_len)
+
+
+def unpack_chunk(codec, kind, raw_len, data):
+    """Raw bytes of a chunk received with :func:`recv_chunk` (blocking, run it in a thread)
+
+    Raises:
+        TransferIncomplete: if chunk does not decompress into RAW LEN bytes
+    """
+    if kind == STORED:
+        return data
+    try:
+        return codec.decompress(data, raw_len)
+    except ValueError as ve:
+        raise TransferIncomplete(str(ve)) from ve
+
+
+class AdaptiveLevel:
+    """Compression level of a transfer, from how fast chunks compress against how fast the link takes them
+
+    compression runs ahead of sending, so the slower of the two sets the pace:
+    level goes up while sending is slower (cpu to spare, smaller chunks pay off) and down while compressing is,
+    chunks are stored as they are (level None) once even the lowest level does not beat sending raw bytes,
+    while storing, every ``PROBE_EVERY``th chunk is compressed at the lowest level to see whether that changed
+
+    Attributes:
+        level(int | None): level of the next chunk, None to store it as it is
+        compress_rate(float): moving average of raw bytes compressed per second at ``level``
+        send_rate(float): moving average of bytes sent per second
+        ratio(float): moving average of compressed size over raw size
+    """
+    __slots__ = 'codec', 'level', 'compress_rate', 'send_rate', 'ratio', '_chunks'
+
+    def __init__(self, codec, level=None):
+        self.codec = codec
+        self.level = codec.min_level if level is None else level
+        self.compress_rate = 0.0
+        self.send_rate = 0.0
+        self.ratio = 1.0
+        self._chunks = 0
+
+    def next_level(self):
+        """Level to compress the next chunk with, None to store it"""
+        self._chunks += 1
+        if self.level is None and self._chunks % PROBE_EVERY == 0:
+            return self.codec.min_level
+        return self.level
+
+    def compressed(self, level, raw_len, chunk_len, elapsed):
+        """Accounts a chunk of ``raw_len`` bytes that came out as ``chunk_len`` in ``elapsed`` seconds at ``level``"""
+        measuring = self.codec.min_level if self.level is None else self.level
+        if level is None or elapsed <= 0 or level != measuring:
+            return
+        self.compress_rate = _average(self.compress_rate, raw_len / elapsed)
+        self.ratio = 0.8 * self.ratio + 0.2 * min(1.0, chunk_len / raw_len)
+
+    def sent(self, nbytes, elapsed):
+        """Accounts ``nbytes`` that took ``elapsed`` seconds to send, adjusts level"""
+        if elapsed <= 0:
+            return
+        self.send_rate = _average(self.send_rate, nbytes / elapsed)
+        if not self.compress_rate:
+            return
+
+        # seconds per raw byte
+        compressing = 1 / self.compress_rate
+        sending_compressed = self.ratio / self.send_rate
+        sending_raw = 1 / self.send_rate
+        if self.level is None:
+            if max(compressing, sending_compressed) < 0.9 * sending_raw:
+                self._set_level(self.codec.min_level)
+        elif max(compressing, sending_compressed) >= sending_raw:
+            self._set_level(None if self.level == self.codec.min_level else self.level - 1)
+        elif compressing > sending_compressed and self.level > self.codec.min_level:
+            self._set_level(self.level - 1)
+        elif 2 * compressing < sending_compressed and self.level < self.codec.max_level:
+            self._set_level(self.level + 1)
+
+    def _set_level(self, level):
+        if level is not None:
+            self.compress_rate = 0.0  # rate was of the previous level
+        self.level = level
+
+    def __repr__(self):
+        return f"AdaptiveLevel({self.codec.name}, level={self.level}, ratio={self.ratio:.2f})"
+
+
+def _average(average, value):
+    return 0.8 * average + 0.2 * value if average else value
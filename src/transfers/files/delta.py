@@ -0,0 +1,358 @@
+"""Delta transfer of files the receiver already has an older version of (rsync style)
+
+receiver splits its older version (the file sitting at the name being received) into blocks and sends
+a weak rolling checksum (adler32) and a strong digest (BLAKE2b) of each, sender rolls the weak checksum over
+its file byte by byte looking for those blocks and sends only what it could not find::
+
+    receiver | COUNT(4) | BLOCK SIZE(4) | WEAK(4) ... | STRONG(16) ... |   COUNT 0: nothing to build on
+    sender   | OP(1) | ARGS | ...
+               COPY    | INDEX(4) | COUNT(4) |  COUNT blocks of the older version from block INDEX
+               LITERAL | LEN(4) | BYTES |
+               END
+
+the new file is built next to the older one (which is left untouched, as any other received file would),
+files with COUNT 0 go the usual way (striped or not)
+
+Rolling is done a window at a time with ``itertools.accumulate`` and ``map`` over memoryviews,
+keeping the per byte work out of the interpreter loop, it still costs far more per byte than sending it does,
+so sender only rolls where it pays off: not at all if the next block is where it was (edited in place),
+and less and less often through a run of new data (after 1, 2, 4, 8 ... blocks not found, the first block
+not found goes as it is, shifted data costs a block more that way but runs of edited blocks need no rolling),
+both ends do their hashing in ``thread_pool_for_hashing``
+
+"""
+import array
+import asyncio
+import hashlib
+import math
+import mmap
+import operator
+import os
+import struct
+import sys
+import zlib
+from itertools import accumulate, compress, count, islice, repeat
+
+from src.avails import const, use
+from src.avails.exceptions import TransferIncomplete
+from src.transfers import thread_pool_for_disk_io
+
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 256 * 1024
+SEGMENT_SIZE = 4 * 1024 * 1024  # source bytes looked through per call of DeltaEncoder.encode
+STRONG_SIZE = 16
+
+_END, _COPY, _LITERAL = b'\x00', b'\x01', b'\x02'
+_HEADER = struct.Struct('!II')  # COUNT | BLOCK SIZE
+_COPY_ARGS = struct.Struct('!II')  # INDEX | COUNT
+_LEN = struct.Struct('!I')
+_ADLER_MOD = 65521
+
+
+def block_size_for(size):
+    """Square root of ``size`` (rounded down to a power of two) within block size bounds, as rsync does"""
+    return min(max(1 << (math.isqrt(size).bit_length() - 1) if size else 0, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+
+class Signature:
+    """Block signatures of the receiver's older version of a file
+
+    Attributes:
+        block_size(int): bytes per block, trailing bytes short of a block are left out
+        weak(array.array): adler32 of each block
+        strong(list[bytes]): BLAKE2b digest of each block
+        blocks(dict[int, list[int]]): weak checksum -> indices of blocks with it
+    """
+    __slots__ = 'block_size', 'weak', 'strong', 'blocks'
+
+    def __init__(self, block_size, weak, strong):
+        self.block_size = block_size
+        self.weak = weak
+        self.strong = strong
+        self.blocks = {}
+        for index, value in enumerate(weak):
+            self.blocks.setdefault(value, []).append(index)
+
+    def __len__(self):
+        return len(self.weak)
+
+    def find(self, block, preferred=None):
+        """Index of a block with the same contents as ``block`` (a memoryview), ``preferred`` if it is one of them
+
+        Returns:
+            int | None: index of the block, None if there is no such block
+        """
+        indices = self.blocks.get(zlib.adler32(block))
+        if indices is None:
+            return None
+        strong = hashlib.blake2b(block, digest_size=STRONG_SIZE).digest()
+        if preferred in indices and self.strong[preferred] == strong:
+            return preferred
+        for index in indices:
+            if self.strong[index] == strong:
+                return index
+        return None
+
+    def __bytes__(self):
+        weak = array.array('I', self.weak)
+        if sys.byteorder == 'little':
+            weak.byteswap()
+        return _HEADER.pack(len(self), self.block_size) + weak.tobytes() + b''.join(self.strong)
+
+
+def wanted(file_item):
+    """Whether ``file_item`` goes as a delta when both ends agreed on delta transfers,
+    smaller files are not worth a round trip and resumed ones carry on from where they stopped"""
+    return file_item.seeked == 0 and file_item.size >= const.FILE_DELTA_MIN_SIZE
+
+
+def make_signature(path, block_size=None, limit=None):
+    """Signature of file at ``path``, an empty one if there is no such file (blocking)
+
+    Args:
+        path(Path): older version of the file
+        block_size(int): bytes per block, ``block_size_for`` size of the file by default
+        limit(int): only first ``limit`` bytes are signed, size of the incoming file,
+            sender takes no more blocks than that file can hold (see ``recv_signature``)
+    """
+    weak = array.array('I')
+    strong = []
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return Signature(block_size or MIN_BLOCK_SIZE, weak, strong)
+
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if limit is not None:
+            size = min(size, limit)
+        block_size = block_size or block_size_for(size)
+        if size < block_size:
+            return Signature(block_size, weak, strong)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            for start in range(0, size - block_size + 1, block_size):
+                with view[start:start + block_size] as block:
+                    weak.append(zlib.adler32(block))
+                    strong.append(hashlib.blake2b(block, digest_size=STRONG_SIZE).digest())
+    return Signature(block_size, weak, strong)
+
+
+async def recv_signature(recv_function, size):
+    """Receives a signature sent as ``bytes(signature)``
+
+    Args:
+        recv_function: receiving end of the connection
+        size(int): size of the file being sent, bounds the number of blocks accepted
+
+    Raises:
+        ValueError: if block size or block count is out of bounds
+    """
+    block_count, block_size = _HEADER.unpack(await use.recv_exactly(recv_function, _HEADER.size))
+    if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        raise ValueError(f"block size {block_size} out of bounds")
+    if block_count > size // MIN_BLOCK_SIZE + 1:
+        raise ValueError(f"{block_count} blocks for a file of {size} bytes")
+    weak = array.array('I')
+    if block_count == 0:
+        return Signature(block_size, weak, [])
+
+    weak.frombytes(await use.recv_exactly(recv_function, block_count * weak.itemsize))
+    if sys.byteorder == 'little':
+        weak.byteswap()
+    data = await use.recv_exactly(recv_function, block_count * STRONG_SIZE)
+    strong = [data[offset:offset + STRONG_SIZE] for offset in range(0, len(data), STRONG_SIZE)]
+    return Signature(block_size, weak, strong)
+
+
+class DeltaEncoder:
+    """Turns a file into delta ops against ``signature``, a segment at a time (blocking, run it in a thread)
+
+    Usage::
+
+        with DeltaEncoder(file_item.path, file_item.size, signature) as encoder:
+            while not encoder.done:
+                await send_function(await run_in_executor(encoder.encode))  # END goes along with the last ops
+
+    Attributes:
+        pos(int): bytes of the file turned into ops so far
+        copied(int): bytes of those that were found in the older version
+    """
+    __slots__ = (
+        'size', 'signature', 'pos', 'copied', '_literal_start', '_run', '_misses', '_file', '_mapped', '_view',
+    )
+
+    def __init__(self, path, size, signature):
+        self.signature = signature
+        self.pos = 0
+        self.copied = 0
+        self._literal_start = 0
+        self._run = None  # [INDEX, COUNT] of the copy op being extended
+        self._misses = 0  # blocks not found since last copy
+        self._file = open(path, 'rb')
+        try:
+            self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+        self._view = memoryview(self._mapped)
+        self.size = min(size, len(self._mapped))
+
+    @property
+    def done(self):
+        return self.pos >= self.size
+
+    def encode(self, segment_size=SEGMENT_SIZE):
+        """Looks through the next ``segment_size`` bytes (a block or so more), returns packed ops"""
+        ops = bytearray()
+        view, block_size = self._view, self.signature.block_size
+        segment_end = min(self.pos + segment_size, self.size)
+
+        while self.pos < segment_end:
+            if self.pos + block_size > self.size:
+                self.pos = self.size  # tail short of a block
+                break
+            index = self.signature.find(view[self.pos:self.pos + block_size], self._preferred)
+            if index is not None:
+                self._copy(ops, index)
+                continue
+            rolling = self._misses and self._misses & (self._misses - 1) == 0 and not self._next_block_found()
+            self.pos += self._roll() if rolling else block_size
+            self._misses += 1
+
+        self._flush_literal(ops)
+        if self.done:
+            self._flush_run(ops)
+            ops += _END
+        return bytes(ops)
+
+    @property
+    def _preferred(self):
+        """Block right after the last one copied, where an unchanged file goes on"""
+        return self._run[0] + self._run[1] if self._run else None
+
+    def _next_block_found(self):
+        start = self.pos + self.signature.block_size
+        end = start + self.signature.block_size
+        return end <= self.size and self.signature.find(self._view[start:end]) is not None
+
+    def _roll(self):
+        """Rolls the weak checksum forward from ``pos`` up to a block, returns how far a known block starts
+        (or how far it rolled without finding one)"""
+        view, block_size = self._view, self.signature.block_size
+        pos = self.pos
+        window = min(block_size, self.size - block_size - pos)
+        if window <= 0:
+            return self.size - pos
+
+        start = zlib.adler32(view[pos:pos + block_size])
+        outs, ins = view[pos:pos + window], view[pos + block_size:pos + block_size + window]
+        # a_k - 1 and b_k of adler32 at pos + k: a_k+1 = a_k - out + in, b_k+1 = b_k - block_size * out + a_k+1 - 1
+        a_minus_one = list(accumulate(map(operator.sub, ins, outs), initial=(start & 0xffff) - 1))
+        b = accumulate(
+            map(operator.sub, islice(a_minus_one, 1, None), map(operator.mul, outs, repeat(block_size))),
+            initial=start >> 16,
+        )
+        weak = map(
+            operator.or_,
+            map(operator.lshift, map(operator.mod, b, repeat(_ADLER_MOD)), repeat(16)),
+            map(operator.mod, map(operator.add, a_minus_one, repeat(1)), repeat(_ADLER_MOD)),
+        )
+        for offset in compress(count(), map(self.signature.blocks.__contains__, weak)):
+            if offset and self.signature.find(view[pos + offset:pos + offset + block_size]) is not None:
+                return offset
+        return window
+
+    def _copy(self, ops, index):
+        self._flush_literal(ops)
+        if self._run and self._run[0] + self._run[1] == index:
+            self._run[1] += 1
+        else:
+            self._flush_run(ops)
+            self._run = [index, 1]
+        self.pos += self.signature.block_size
+        self.copied += self.signature.block_size
+        self._literal_start = self.pos
+        self._misses = 0
+
+    def _flush_literal(self, ops):
+        if self._literal_start < self.pos:
+            self._flush_run(ops)
+            ops += _LITERAL + _LEN.pack(self.pos - self._literal_start)
+            ops += self._view[self._literal_start:self.pos]
+            self._literal_start = self.pos
+
+    def _flush_run(self, ops):
+        if self._run:
+            ops += _COPY + _COPY_ARGS.pack(*self._run)
+            self._run = None
+
+    def close(self):
+        self._view.release()
+        self._mapped.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def recv_delta(recv_function, file_item, basis, signature, *, th_pool=thread_pool_for_disk_io):
+    """Builds ``file_item`` out of ops sent by :class:`DeltaEncoder` and blocks of ``basis``
+
+    Raises:
+        TransferIncomplete: if ops do not fit ``signature`` or ``file_item``
+
+    Yields:
+        int: bytes of ``file_item`` written so far
+    """
+    loop = asyncio.get_running_loop()
+    block_size = signature.block_size
+    with open(basis, 'rb') as source, open(file_item.path, 'xb', buffering=0) as target:
+        while (op := await use.recv_exactly(recv_function, 1)) != _END:
+            if op == _COPY:
+                index, block_count = _COPY_ARGS.unpack(await use.recv_exactly(recv_function, _COPY_ARGS.size))
+                if index + block_count > len(signature):
+                    raise TransferIncomplete(f"copy of blocks {index}+{block_count} out of {len(signature)}")
+                length = block_count * block_size
+                await loop.run_in_executor(th_pool, _copy_range, source, target, index * block_size, length)
+            elif op == _LITERAL:
+                length, = _LEN.unpack(await use.recv_exactly(recv_function, _LEN.size))
+                data = await use.recv_exactly(recv_function, length)
+                await loop.run_in_executor(th_pool, _write_all, target, data)
+            else:
+                raise TransferIncomplete(f"unknown delta op {op}")
+            file_item.seeked += length
+            if file_item.seeked > file_item.size:
+                raise TransferIncomplete(f"delta of {file_item} runs past its size")
+            yield file_item.seeked
+
+
+def _copy_range(source, target, offset, length):
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while length > 0:
+                copied = os.copy_file_range(source.fileno(), target.fileno(), length, offset)
+                if not copied:
+                    raise TransferIncomplete(f"{source.name} got shorter while building delta")
+                offset += copied
+                length -= copied
+            return
+        except OSError:
+            pass  # not supported between these files, nothing is copied by a failing call
+
+    source.seek(offset)
+    while length > 0:
+        data = source.read(min(length, SEGMENT_SIZE))
+        if not data:
+            raise TransferIncomplete(f"{source.name} got shorter while building delta")
+        _write_all(target, data)
+        length -= len(data)
+
+
+def _write_all(target, data):
+    view = memoryview(data)
+    while view:
+        view = view[target.write(view):]
+
@@ -1,5 +1,13 @@
 import asyncio
+import contextlib
+import functools
+import itertools
+import os
 import struct
+import threading
+import time
+from collections import deque
+from concurrent import futures
 from contextlib import aclosing
 from pathlib import Path
 from typing import override
@@ -7,16 +15,32 @@ from typing import override
 import umsgpack
 
 from src.avails import const, use
-from src.avails.exceptions import TransferIncomplete
+from src.avails.exceptions import InvalidStateError, TransferIncomplete
 from src.avails.useables import recv_int
-from src.transfers import TransferState
-from src.transfers.files._fileobject import FileItem
-from src.transfers.files.receiver import Receiver
-from src.transfers.files.sender import Sender
+from src.transfers import TransferState, thread_pool_for_disk_io
+from src.transfers._logger import logger as _logger
+from src.transfers.files import allocation, compression
+from src.transfers.files._fileobject import AdaptiveChunkSize, FileItem, calculate_chunk_size
+from src.transfers.files._manifest import DirManifest
+from src.transfers.files.receiver import Receiver, recv_compressed, recv_file_contents
+from src.transfers.files.sender import Sender, send_actual_file, send_compressed
 from src.transfers.status import StatusMixIn
 
 _FILE_CODE = b'\x01'
 _PATH_CODE = b'\x02'
+# pipelined mode, see DirSender
+_MANIFEST_CODE = b'\x03'
+_BATCH_CODE = b'\x04'
+_END_CODE = b'\x00'
+# resuming pipelined mode
+_CHECKPOINT_CODE = b'\x05'
+_RESUME_CODE = b'\x06'
+# compressed contents, see files.compression
+_ZBATCH_CODE = b'\x07'
+_ZFILE_CODE = b'\x08'
+_FRAME_LEN = struct.Struct('!I')
+_ACK = struct.Struct('!Q')
+_DIRECTORY_SIZE = -1  # size of directory entries in manifest
 
 
 def rename_directory_with_increment(root_path: Path, relative_path: Path):
@@ -50,6 +74,236 @@ def rename_directory_with_increment(root_path: Path, relative_path: Path):
     return new_path
 
 
+def _frame(code, payload):
+    return code + _FRAME_LEN.pack(len(payload)) + payload
+
+
+class _ScanStopped(Exception):
+    pass
+
+
+def _walk(root_path, put, stopped):
+    """Walks ``root_path`` with ``os.scandir`` (in a worker thread), hands over batches of entries to ``put``
+
+    entries are ``(PARENT, NAME, SIZE, MTIME, PATH)``, directories come before their contents,
+    symlinked directories are not followed
+    """
+    batch = []
+    stack = [(root_path, '.')]
+    while stack:
+        directory, parent = stack.pop()
+        with os.scandir(directory) as dir_entries:
+            for entry in dir_entries:
+                name = entry.name.replace('\\', '_') if const.IS_LINUX else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    batch.append((parent, name, _DIRECTORY_SIZE, 0, Path(entry.path)))
+                    stack.append((entry.path, name if parent == '.' else f"{parent}/{name}"))
+                elif entry.is_file():
+                    stat = entry.stat()
+                    batch.append((parent, name, stat.st_size, stat.st_mtime_ns, Path(entry.path)))
+
+                if len(batch) >= const.DIR_MANIFEST_BATCH:
+                    put(batch)
+                    batch = []
+        if stopped.is_set():
+            raise _ScanStopped
+    if batch:
+        put(batch)
+
+
+async def _scan_tree(root_path: Path):
+    """Scans ``root_path`` off the event loop, yields batches of entries as they are found
+
+    a worker thread walks the tree and feeds a bounded queue (``const.DIR_SCAN_QUEUE_SIZE`` batches),
+    so scanning stays ahead of the consumer without holding the whole tree in memory
+
+    Yields:
+        list[tuple[str, str, int, int, Path]]: PARENT, NAME, SIZE (-1 for directories), MTIME (ns), PATH of entries
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=const.DIR_SCAN_QUEUE_SIZE)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except futures.TimeoutError:
+                if stopped.is_set():
+                    future.cancel()
+                    raise _ScanStopped
+
+    def walk():
+        try:
+            _walk(root_path, put, stopped)
+            put(done)
+        except _ScanStopped:
+            pass
+        except Exception as exp:
+            with contextlib.suppress(_ScanStopped):
+                put(exp)
+
+    walker = loop.run_in_executor(thread_pool_for_disk_io, walk)
+    try:
+        while (batch := await queue.get()) is not done:
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        stopped.set()
+        await walker
+
+
+def _plan_units(manifest, pending):
+    """Groups ``pending`` files, (INDEX, OFFSET) into ``manifest``, into units sent one after the other
+
+    small files sent from scratch are packed into batches of up to ``const.DIR_BATCH_SIZE`` bytes and
+    half a window of files, large files and files resuming from an offset go one at a time
+
+    Yields:
+        tuple[int, bytes, list[tuple[int, int]]]: count of pending files sent once this unit is sent, code,
+        (INDEX, OFFSET)s
+    """
+    batch, batch_bytes = [], 0
+    max_batch_count = max(1, const.DIR_ACK_WINDOW // 2)
+    for position, (index, offset) in enumerate(pending):
+        size = manifest.size(index)
+        if offset == 0 and size < const.DIR_SMALL_FILE_SIZE:
+            batch.append((index, offset))
+            batch_bytes += size
+            if batch_bytes >= const.DIR_BATCH_SIZE or len(batch) >= max_batch_count:
+                yield position + 1, _BATCH_CODE, batch
+                batch, batch_bytes = [], 0
+            continue
+
+        if batch:
+            yield position, _BATCH_CODE, batch
+            batch, batch_bytes = [], 0
+        yield position + 1, _FILE_CODE, [(index, offset)]
+
+    if batch:
+        yield len(pending), _BATCH_CODE, batch
+
+
+def _read_batch(manifest, batch, codec=None, level=None):
+    """Reads ``batch`` into a BATCH frame, or a ZBATCH one if ``codec`` is given and contents look compressible
+
+    Returns:
+        tuple[bytes, FileItem, float]: frame, file item of the last file (for status updates),
+        seconds spent compressing
+    """
+    contents = [struct.pack('!I', len(batch))]
+    for index, _ in batch:
+        path, size = manifest.file_path(index), manifest.size(index)
+        with open(path, 'rb') as f:
+            data = f.read(size)
+        if len(data) != size:
+            raise TransferIncomplete(f"{path} got shorter than {size} bytes while sending")
+        contents.append(data)
+    path, size = manifest.file_path(batch[-1][0]), manifest.size(batch[-1][0])
+    file_item = FileItem(path, size)
+    file_item.size = size
+    payload = b''.join(contents)
+    if codec is not None and compression.worth_compressing(memoryview(payload)[4:]):
+        chunk, elapsed = compression.pack_chunk(payload, codec, level)
+        return _ZBATCH_CODE + chunk, file_item, elapsed
+    return _frame(_BATCH_CODE, payload), file_item, 0.0
+
+
+def _compressible(file_item):
+    return compression.worth_compressing(compression.read_sample(file_item.path, file_item.seeked))
+
+
+def _prefetch_file(manifest, items):
+    (index, offset), = items
+    file_item = FileItem(manifest.file_path(index), offset)
+    file_item.size = manifest.size(index)  # as promised in manifest
+    if hasattr(os, 'posix_fadvise'):
+        # start pulling contents into page cache, sendfile finds them there
+        with open(file_item.path, 'rb') as f:
+            os.posix_fadvise(f.fileno(), offset, file_item.size - offset, os.POSIX_FADV_WILLNEED)
+    return file_item
+
+
+def _resume_plan(manifest):
+    """Files of ``manifest`` yet to be sent as flat ``[INDEX, OFFSET, SIZE, ...]``, stats every file (blocking)
+
+    files changed since the manifest was made start over with their current size, missing ones are left out
+    """
+    plan = []
+    for index, entry in enumerate(manifest.entries):
+        path = manifest.file_path(index)
+        try:
+            stat = path.stat()
+        except OSError:
+            _logger.warning(f"{path} is gone, leaving it out of resumed transfer")
+            continue
+
+        confirmed = manifest.confirmed[index]
+        if (stat.st_size, stat.st_mtime_ns) != (entry[2], entry[3]):
+            entry[2], entry[3] = stat.st_size, stat.st_mtime_ns
+            manifest.confirm(index, confirmed := 0)
+
+        # empty files carry no checkpoint, they are created again
+        if confirmed < entry[2] or entry[2] == 0:
+            plan += index, confirmed, entry[2]
+    return plan
+
+
+def _verify_checkpoints(manifest):
+    """Lowers confirmed bytes of files to what is found on disk, returns ``manifest.checkpoints()`` (blocking)"""
+    for index, confirmed in enumerate(manifest.confirmed):
+        if confirmed == 0:
+            continue
+        try:
+            on_disk = manifest.file_path(index).stat().st_size
+        except OSError:
+            on_disk = 0
+        if on_disk < confirmed:
+            manifest.confirm(index, on_disk)
+    return manifest.checkpoints()
+
+
+def _resume_items(manifest, plan):
+    """FileItems of files in ``plan`` (see ``_resume_plan``) with sizes and offsets the sender asks for (blocking)
+
+    files starting over are removed first, whatever is on disk of them was never confirmed
+
+    Raises:
+        ValueError: if plan does not fit in the manifest or asks to resume beyond what was confirmed
+    """
+    indices, file_items = [], []
+    for index, offset, size in zip(plan[::3], plan[1::3], plan[2::3]):
+        if not 0 <= index < len(manifest) or not 0 <= offset <= min(size, manifest.confirmed[index]):
+            raise ValueError(f"cannot resume file {index} from {offset}")
+        manifest.entries[index][2] = size
+        manifest.confirm(index, offset)
+        path = manifest.file_path(index)
+        if offset == 0:
+            path.unlink(missing_ok=True)
+        file_item = FileItem(path, offset)
+        file_item.size = size
+        indices.append(index)
+        file_items.append(file_item)
+    return indices, file_items
+
+
+def _write_batch(file_items, contents: memoryview):
+    offset = 0
+    for file_item in file_items:
+        with open(file_item.path, 'xb') as f:
+            f.write(contents[offset:offset + file_item.size])
+        offset += file_item.size
+        file_item.seeked = file_item.size
+
+
+def _make_dirs(paths):
+    for path in paths:
+        path.mkdir(parents=True, exist_ok=True)
+
+
 class DirSender(Sender):
     """
                 |  DIR -> INT(4) | PARENT | NAME | goto `code`
@@ -57,35 +311,76 @@ class DirSender(Sender):
     (1B) | code |
                 |
                 |  FILE -> INT(4) | PARENT | NAME | FILE_SIZE(8) | FILE CONTENTS | goto `code`
+
+    every file is acknowledged by the receiver before the next one is sent
+
+    pipelined mode, no per file round trips::
+
+        | MANIFEST(1B) | LEN(4) | [[PARENT, NAME, SIZE, MTIME], ...] |  ... until every entry of tree is sent
+        | BATCH(1B) | LEN(4) | COUNT(4) | CONTENTS of next COUNT files back to back |  small files
+        | FILE(1B) | CONTENTS of next file |  large files
+        | ZBATCH(1B) | COMPRESSED CHUNK of what BATCH carries |  when a codec is agreed upon,
+        | ZFILE(1B) | COMPRESSED CHUNKS of next file |  see files.compression
+        | END(1B) |
+
+    sizes come from the manifest (-1 for directories), so contents carry no per file headers,
+    receiver acknowledges cumulatively with COUNT OF FILES WRITTEN(8) every quarter of ``const.DIR_ACK_WINDOW``,
+    sender never gets more than ``const.DIR_ACK_WINDOW`` files ahead of the last acknowledgement
+
+    resuming pipelined mode, over a new connection (see ``continue_transfer``)::
+
+        receiver -> | CHECKPOINT(1B) | LEN(4) | [COMPLETE RANGES, PARTIALS] |  see DirManifest.checkpoints
+        sender   -> | RESUME(1B) | LEN(4) | [INDEX, OFFSET, SIZE, ...] |  files still to send
+                    | BATCH / FILE ... | END(1B) |  as above, over files in RESUME frame
+
+    both ends keep a DirManifest of files (and bytes the receiver confirmed) on disk at ``manifest_path``
     """
 
     timeout = const.DEFAULT_TRANSFER_TIMEOUT
 
-    def __init__(self, peer_obj, transfer_id, root_path, status_updater):
+    def __init__(
+            self, peer_obj, transfer_id, root_path, status_updater, pipelined=False, manifest_path=None,
+            compression=None,
+    ):
         """
         Args:
             root_path(Path): root path to read from and start the transfer
             transfer_id(str): transfer id that synchronized both sides
             status_updater(StatusMixIn): StatusMixIn object to update status of transfer
+            pipelined(bool): use pipelined mode, both ends should agree upon this
+            manifest_path(Path | None): where to keep manifest for resuming (pipelined mode), not kept if None
+            compression(str | None): name of codec both ends agreed upon, see files.compression
         """
-        super().__init__(peer_obj, transfer_id, [], status_updater)
+        super().__init__(peer_obj, transfer_id, [], status_updater, compression=compression)
         self.root_path = root_path
-        self.dir_iterator = self.root_path.rglob('*')
         self._current_file = None
+        self.pipelined = pipelined
+        self.manifest_path = manifest_path
+        self.manifest = None
+        self._pending = []  # (INDEX, OFFSET) into manifest of files being sent
+        self._acked = 0
+        self._ack_arrived = asyncio.Event()
+        self._ack_reader = None
 
     async def send_files(self):
         self.send_files_task = asyncio.current_task()
 
-        for item in self.dir_iterator:
-            if self.to_stop:
-                break
+        if self.pipelined:
+            async with aclosing(self._send_pipelined()) as sender:
+                async for sent in sender:
+                    yield sent
+            return
 
-            if item.is_dir():
-                await self.__send_code_parts(_PATH_CODE, item)
-                self._current_file = FileItem(item, 0)
-                continue
+        async with aclosing(self._scanned_entries()) as entries:
+            async for _, _, size, _, item in entries:
+                if self.to_stop:
+                    break
+
+                if size == _DIRECTORY_SIZE:
+                    await self.__send_code_parts(_PATH_CODE, item)
+                    self._current_file = FileItem(item, 0)
+                    continue
 
-            if item.is_file():
                 self._current_file = await self._send_file_item(item)
                 if self.current_file.size > 0:
                     async with aclosing(self.send_one_file(self.current_file)) as sender:
@@ -96,6 +391,186 @@ class DirSender(Sender):
 
         await self.send_func(b'\x00')  # code to inform end of transfer
 
+    async def _scanned_entries(self):
+        async with aclosing(_scan_tree(self.root_path)) as scanner:
+            async for batch in scanner:
+                for entry in batch:
+                    yield entry
+
+    async def _send_pipelined(self):
+        self.state = TransferState.SENDING
+        entries, directory_count = [], 0
+        try:
+            # manifest goes out batch by batch while the rest of the tree is still being scanned
+            async with aclosing(_scan_tree(self.root_path)) as scanner:
+                async for batch in scanner:
+                    await self.send_func(_frame(_MANIFEST_CODE, umsgpack.dumps([entry[:4] for entry in batch])))
+                    for parent, name, size, mtime, _ in batch:
+                        if size == _DIRECTORY_SIZE:
+                            directory_count += 1
+                        else:
+                            entries.append([parent, name, size, mtime])
+        except Exception as exp:
+            self.handle_exception(exp)
+
+        self.manifest = DirManifest(self.manifest_path, self.root_path, self.peer_obj.peer_id, entries)
+        await self.manifest.save()
+        _logger.info(f"{self._log_prefix} sending {len(entries)} files, {directory_count} directories")
+
+        async with aclosing(self._send_pending([(index, 0) for index in range(len(entries))])) as sender:
+            async for sent in sender:
+                yield sent
+
+    async def _send_pending(self, pending):
+        """Sends contents of ``pending`` files ((INDEX, OFFSET) into manifest) followed by END,
+        returns once every one of them is acknowledged
+        """
+        self._pending = pending
+        self._acked = 0
+        remaining = sum(self.manifest.size(index) - offset for index, offset in pending)
+        self.status_updater.status_setup(f"sending: {self.root_path.name}", 0, remaining)
+        self.chunk_sizer = self.chunk_sizer or AdaptiveChunkSize(calculate_chunk_size(const.DIR_BATCH_SIZE))
+        codec = compression.get_codec(self.compression)
+        if codec is not None and self.compression_level is None:
+            self.compression_level = compression.AdaptiveLevel(codec)
+        self._ack_reader = asyncio.create_task(self._read_acks(len(pending)))
+        try:
+            async with aclosing(self._send_contents(pending)) as sender:
+                async for sent in sender:
+                    self.status_updater.update_status(sent)
+                    yield sent
+                    if self.to_stop:
+                        return
+            await self.send_func(_END_CODE)
+            await self._wait_for_ack(len(pending))
+        except Exception as exp:
+            self.handle_exception(exp)
+        finally:
+            self._ack_reader.cancel()
+            await self.manifest.flush(force=True)
+
+        _logger.info(f"{self._log_prefix} sent {len(pending)} files")
+        self.state = TransferState.COMPLETED
+        await self.manifest.remove()
+
+    async def _send_contents(self, pending):
+        """Sends contents of ``pending`` files in units made by ``_plan_units``,
+        next ``const.DIR_READ_AHEAD`` units are read (or prefetched) in disk io pool while the current one is sent
+        """
+        loop = asyncio.get_running_loop()
+        units = _plan_units(self.manifest, pending)
+        read_ahead = deque()
+        sent_bytes = 0
+        level = self.compression_level
+
+        def prefetch():
+            for end, code, items in itertools.islice(units, const.DIR_READ_AHEAD - len(read_ahead)):
+                if code == _BATCH_CODE:
+                    chunk_level = level.next_level() if level else None
+                    reader = functools.partial(_read_batch, codec=level and level.codec, level=chunk_level)
+                else:
+                    chunk_level, reader = None, _prefetch_file
+                reading = loop.run_in_executor(thread_pool_for_disk_io, reader, self.manifest, items)
+                read_ahead.append((end, code, items, chunk_level, reading))
+
+        try:
+            prefetch()
+            while read_ahead:
+                end, code, items, chunk_level, reading = read_ahead.popleft()
+                prefetch()
+                # never more than a window of files ahead of the receiver
+                await self._wait_for_ack(end - const.DIR_ACK_WINDOW)
+
+                if code == _BATCH_CODE:
+                    frame, self._current_file, elapsed = await reading
+                    raw_len = sum(self.manifest.size(index) for index, _ in items)
+                    started = time.perf_counter()
+                    await self.send_func(frame)
+                    if level and frame[:1] == _ZBATCH_CODE:
+                        level.compressed(chunk_level, raw_len, len(frame), elapsed)
+                        level.sent(len(frame), time.perf_counter() - started)
+                    sent_bytes += raw_len
+                    yield sent_bytes
+                    continue
+
+                self._current_file = file_item = await reading
+                offset = file_item.seeked
+                if level and await loop.run_in_executor(thread_pool_for_disk_io, _compressible, file_item):
+                    await self.send_func(_ZFILE_CODE)
+                    sending = send_compressed(self.send_func, file_item, level, chunk_sizer=self.chunk_sizer)
+                else:
+                    await self.send_func(_FILE_CODE)
+                    sending = send_actual_file(self.send_func, file_item, chunk_sizer=self.chunk_sizer)
+                async with aclosing(sending) as sender:
+                    async for seeked in sender:
+                        yield sent_bytes + seeked - offset
+                sent_bytes += file_item.size - offset
+        finally:
+            for *_, reading in read_ahead:
+                reading.cancel()
+
+    async def _read_acks(self, file_count):
+        try:
+            while self._acked < file_count:
+                acked = await recv_int(self.recv_func, use.LONG_INT)
+                for index, _ in self._pending[self._acked:acked]:
+                    self.manifest.confirm(index, self.manifest.size(index))
+                self._acked = acked
+                self._ack_arrived.set()
+                await self.manifest.flush()
+        except ValueError as ve:
+            raise TransferIncomplete("stopped receiving acknowledgements") from ve
+        finally:
+            self._ack_arrived.set()  # wake up waiters, to find out about this
+
+    async def _wait_for_ack(self, file_count):
+        while self._acked < file_count:
+            if self._ack_reader.done():
+                self._ack_reader.result()  # raises if acks stopped because of an error
+                raise TransferIncomplete(f"acknowledged {self._acked}/{file_count} files")
+            self._ack_arrived.clear()
+            try:
+                await asyncio.wait_for(self._ack_arrived.wait(), self.timeout)
+            except TimeoutError as te:
+                raise TransferIncomplete(f"no acknowledgement within {self.timeout}s") from te
+
+    async def continue_transfer(self):
+        """Resumes a paused pipelined transfer over a new connection (passed into ``connection_made``)
+
+        receiver reports what it has written, files that are complete are skipped
+        and partially written ones are sent from where they stopped
+        """
+        if self.state is not TransferState.PAUSED or self.to_stop is True:
+            raise InvalidStateError(f"{self.state=}, {self.to_stop=}")
+        if not self.pipelined or self.manifest is None:
+            raise InvalidStateError(f"nothing to resume from, {self.pipelined=}, {self.manifest=}")
+
+        _logger.debug(f"{self._log_prefix} changing state to sending, resuming")
+        self.state = TransferState.SENDING
+        self.send_files_task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        try:
+            if await self.recv_func(1) != _CHECKPOINT_CODE:
+                raise TransferIncomplete("expected checkpoints from receiver")
+            self.manifest.apply_checkpoints(umsgpack.loads(await self._recv_frame()))
+            plan = await loop.run_in_executor(thread_pool_for_disk_io, _resume_plan, self.manifest)
+            await self.manifest.save()  # files that changed are in with their current size and mtime
+            await self.send_func(_frame(_RESUME_CODE, umsgpack.dumps(plan)))
+        except (ValueError, umsgpack.UnpackException) as exp:
+            self._raise_transfer_incomplete_and_change_state(exp, "failed to agree upon checkpoints")
+        except Exception as exp:
+            self.handle_exception(exp)
+
+        pending = list(zip(plan[::3], plan[1::3]))
+        _logger.info(f"{self._log_prefix} resuming, {len(pending)}/{len(self.manifest)} files to send")
+        async with aclosing(self._send_pending(pending)) as sender:
+            async for sent in sender:
+                yield sent
+
+    async def _recv_frame(self):
+        frame_len, = _FRAME_LEN.unpack(await use.recv_exactly(self.recv_func, _FRAME_LEN.size))
+        return await use.recv_exactly(self.recv_func, frame_len)
+
     @override
     async def _send_file_item(self, file_path):
         await self.__send_code_parts(_FILE_CODE, file_path)
@@ -109,8 +584,7 @@ class DirSender(Sender):
         parent = rel_path.parent
         name = rel_path.name
 
-        if const.IS_WINDOWS:
-            parent = parent.as_posix()
+        parent = parent.as_posix()  # msgpack does not know about paths
         if const.IS_LINUX:
             name = name.replace('\\', '_')
 
@@ -126,13 +600,28 @@ class DirSender(Sender):
         return parent, name
 
     def pause(self):
-        pass
+        """Holds sending in place, connection is kept, see ``resume``"""
+        self.state = TransferState.PAUSED
+        self.send_func.pause()
+        self.recv_func.pause()
 
-    def continue_transfer(self):
-        pass
+    def resume(self):
+        self.state = TransferState.SENDING
+        self.send_func.resume()
+        self.recv_func.resume()
 
     async def cancel(self):
-        pass
+        if self.state not in (TransferState.SENDING, TransferState.PAUSED):
+            raise InvalidStateError(f"{self.state}")
+
+        self.to_stop = True
+        self.state = TransferState.ABORTING
+        if self.send_func is not None:
+            # a paused transfer has to move on to find out that it is stopped
+            self.send_func.resume()
+            self.recv_func.resume()
+        if self.manifest is not None:
+            await self.manifest.remove()
 
     @property
     def current_file(self):
@@ -154,13 +643,36 @@ class DirReceiver(Receiver):
 
     """
 
-    def __init__(self, peer_obj, transfer_id, download_path, status_iter):
-        super().__init__(peer_obj, transfer_id, download_path, status_iter)
+    def __init__(
+            self, peer_obj, transfer_id, download_path, status_iter, pipelined=False, manifest_path=None,
+            compression=None, preallocate=False,
+    ):
+        super().__init__(
+            peer_obj, transfer_id, download_path, status_iter, compression=compression, preallocate=preallocate
+        )
+        self.pipelined = pipelined
+        self.manifest_path = manifest_path
+        self.manifest = None
+        self._file_items = []  # FileItems of files in manifest order, pipelined mode
+
+    @classmethod
+    def from_manifest(cls, peer_obj, transfer_id, manifest, status_iter):
+        """Paused receiver of a pipelined transfer kept in ``manifest``, ready for ``continue_transfer``"""
+        receiver = cls(peer_obj, transfer_id, manifest.root, status_iter, pipelined=True, manifest_path=manifest.path)
+        receiver.manifest = manifest
+        receiver.state = TransferState.PAUSED
+        return receiver
 
     async def recv_files(self):
         self.state = TransferState.RECEIVING
         self.recv_files_task = asyncio.current_task()
 
+        if self.pipelined:
+            async with aclosing(self._recv_pipelined()) as receiver:
+                async for received in receiver:
+                    yield received
+            return
+
         while True:
             if not (code := await self._should_proceed()):
                 break
@@ -180,6 +692,135 @@ class DirReceiver(Receiver):
                 self._current_file = FileItem(full_path, 0)
                 yield full_path, None
 
+    async def _recv_pipelined(self):
+        loop = asyncio.get_running_loop()
+        entries = []
+        try:
+            while (code := await self.recv_func(1)) == _MANIFEST_CODE:
+                batch = umsgpack.loads(await self._recv_frame())
+                # FileItem stats its path, a frame worth of those stays off the loop
+                await loop.run_in_executor(thread_pool_for_disk_io, self._add_to_manifest, batch, entries)
+        except Exception as exp:
+            self.handle_exception(exp)
+
+        # manifest is complete by the time contents start, a disk that can not hold all of it fails right away
+        try:
+            needed = sum(file_item.size for file_item in self._file_items)
+            await loop.run_in_executor(thread_pool_for_disk_io, allocation.ensure_space, self.download_path, needed)
+        except Exception as exp:
+            _logger.error(f"{self._log_prefix} {exp}")
+            self.handle_exception(exp)
+        self.manifest = DirManifest(self.manifest_path, self.download_path, self.peer.peer_id, entries)
+        await self.manifest.save()
+        async with aclosing(self._recv_pending(code, range(len(entries)), self._file_items)) as receiver:
+            async for received in receiver:
+                yield received
+
+    async def _recv_pending(self, code, indices, file_items):
+        """Receives contents of ``file_items`` (at ``indices`` of manifest) starting with ``code``, up to END"""
+        loop = asyncio.get_running_loop()
+        manifest = self.manifest
+        files_done, acked, received_bytes = 0, 0, 0
+        ack_every = max(1, const.DIR_ACK_WINDOW // 4)
+        total = sum(file_item.size - file_item.seeked for file_item in file_items)
+        self.status_updater.status_setup(f"[DIR] {self.download_path.name}", 0, total)
+        self.chunk_sizer = self.chunk_sizer or AdaptiveChunkSize(calculate_chunk_size(const.DIR_BATCH_SIZE))
+
+        try:
+            while code != _END_CODE:
+                if code in (_BATCH_CODE, _ZBATCH_CODE):
+                    contents = memoryview(await self._recv_batch(code))
+                    count, = struct.unpack_from('!I', contents)
+                    if files_done + count > len(file_items):
+                        raise TransferIncomplete(f"batch of {count} files overruns manifest")
+                    batch_items = file_items[files_done:files_done + count]
+                    await loop.run_in_executor(thread_pool_for_disk_io, _write_batch, batch_items, contents[4:])
+                    for position in range(files_done, files_done + count):
+                        manifest.confirm(indices[position], file_items[position].size)
+                    files_done += count
+                    received_bytes += len(contents) - 4
+                    self._current_file = batch_items[-1] if batch_items else self._current_file
+                elif code in (_FILE_CODE, _ZFILE_CODE):
+                    self._current_file = file_item = file_items[files_done]
+                    index, offset = indices[files_done], file_item.seeked
+                    mode = await self._allocate(file_item, None)
+                    if code == _ZFILE_CODE:
+                        receiving = recv_compressed(self.recv_func, file_item, self._codec(), mode=mode)
+                    else:
+                        receiving = recv_file_contents(
+                            self.recv_func, file_item, mode=mode, chunk_sizer=self.chunk_sizer
+                        )
+                    async with aclosing(receiving) as receiver:
+                        async for seeked in receiver:
+                            manifest.confirm(index, seeked)
+                            self.status_updater.update_status(received_bytes + seeked - offset)
+                            yield
+                            await manifest.flush()
+                    if file_item.seeked < file_item.size:
+                        raise TransferIncomplete(f"{file_item} ended at {file_item.seeked}")
+                    manifest.confirm(index, file_item.size)
+                    files_done += 1
+                    received_bytes += file_item.size - offset
+                else:
+                    raise TransferIncomplete(f"unexpected code {code!r} in directory stream")
+
+                self.status_updater.update_status(received_bytes)
+                if files_done - acked >= ack_every:
+                    await self.send_func(_ACK.pack(files_done))
+                    acked = files_done
+                await manifest.flush()
+                yield
+                code = await self.recv_func(1)
+
+            await self.send_func(_ACK.pack(files_done))
+        except Exception as exp:
+            self.handle_exception(exp)
+        finally:
+            await manifest.flush(force=True)
+
+        self.state = TransferState.COMPLETED
+        _logger.info(f"{self._log_prefix} received {files_done} files")
+        await manifest.remove()
+
+    async def _recv_frame(self):
+        frame_len, = _FRAME_LEN.unpack(await use.recv_exactly(self.recv_func, _FRAME_LEN.size))
+        return await use.recv_exactly(self.recv_func, frame_len)
+
+    async def _recv_batch(self, code):
+        """Contents of a BATCH frame, decompressed in disk io pool if it came as ZBATCH"""
+        if code == _BATCH_CODE:
+            return await self._recv_frame()
+        codec = self._codec()
+        limit = 4 + const.DIR_BATCH_SIZE + const.DIR_SMALL_FILE_SIZE  # COUNT | batch can overshoot by a file
+        kind, raw_len, data = await compression.recv_chunk(self.recv_func, limit)
+        return await asyncio.get_running_loop().run_in_executor(
+            thread_pool_for_disk_io, compression.unpack_chunk, codec, kind, raw_len, data
+        )
+
+    def _codec(self):
+        if (codec := compression.get_codec(self.compression)) is None:
+            raise TransferIncomplete("compressed contents without a codec agreed upon")
+        return codec
+
+    def _add_to_manifest(self, batch, entries):
+        """Adds files of ``batch`` to ``entries`` (and FileItems) and creates its directories, runs in disk io pool"""
+        directories = []
+        for parent, name, size, *mtime in batch:
+            if const.IS_WINDOWS:
+                name = name.replace("\\", "_")
+            if '..' in Path(parent).parts or name in ('', '.', '..'):
+                raise TransferIncomplete(f"refusing to write outside of {self.download_path}: {parent}/{name}")
+
+            path = Path(self.download_path, parent, name)
+            if size == _DIRECTORY_SIZE:
+                directories.append(path)
+                continue
+            entries.append([parent, name, size, mtime[0] if mtime else 0])
+            file_item = FileItem(path, 0)
+            file_item.size = size
+            self._file_items.append(file_item)
+        _make_dirs(directories)
+
     @override
     async def _recv_file_item(self):
         parent, item_name = await self._recv_parts()
@@ -213,4 +854,36 @@ class DirReceiver(Receiver):
         self.recv_func.resume()
 
     async def continue_transfer(self):
+        """Resumes a paused pipelined transfer over a new connection (passed into ``connection_made``)
+
+        reports back what is found written on disk, receives files the sender asks to resume with
+        """
+        if self.state is not TransferState.PAUSED or self.to_stop is True:
+            raise InvalidStateError(f"{self.state=}, {self.to_stop=}")
+        if not self.pipelined or self.manifest is None:
+            raise InvalidStateError(f"nothing to resume from, {self.pipelined=}, {self.manifest=}")
+
+        _logger.debug(f"{self._log_prefix} changing state to receiving, resuming")
         self.state = TransferState.RECEIVING
+        self.recv_files_task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        try:
+            checkpoints = await loop.run_in_executor(thread_pool_for_disk_io, _verify_checkpoints, self.manifest)
+            await self.send_func(_frame(_CHECKPOINT_CODE, umsgpack.dumps(checkpoints)))
+            if await self.recv_func(1) != _RESUME_CODE:
+                raise TransferIncomplete("expected files to resume from sender")
+            plan = umsgpack.loads(await self._recv_frame())
+            indices, file_items = await loop.run_in_executor(
+                thread_pool_for_disk_io, _resume_items, self.manifest, plan
+            )
+            await self.manifest.save()  # sizes may have changed at sender's end
+            code = await self.recv_func(1)
+        except (ValueError, umsgpack.UnpackException) as exp:
+            self._raise_transfer_incomplete_and_change_state(exp, "failed to agree upon checkpoints")
+        except Exception as exp:
+            self.handle_exception(exp)
+
+        _logger.info(f"{self._log_prefix} resuming, {len(file_items)}/{len(self.manifest)} files to receive")
+        async with aclosing(self._recv_pending(code, indices, file_items)) as receiver:
+            async for received in receiver:
+                yield received
@@ -0,0 +1,163 @@
+"""Chunk level integrity of file transfers
+
+files are split into chunks of ``const.HASH_CHUNK_SIZE`` bytes, each hashed with BLAKE2b as soon as
+it is complete on disk, both ends hash what is on their disk (sender its file, receiver what it has written)
+in ``thread_pool_for_hashing`` while the rest of the file is still being transferred,
+hashlib releases the GIL while hashing, so chunks hash in parallel with each other and with the transfer
+
+After contents of a file::
+
+    sender   | COUNT(4) | DIGEST(16) ... for every chunk | MERKLE ROOT(32) |
+    receiver | COUNT(4) | INDEX(4) ... of chunks that did not match |
+    sender   | CONTENTS of every chunk asked for, in order |  ... until receiver asks for none
+
+receiver gives up with ``TransferIncomplete`` after ``const.FILE_VERIFY_ATTEMPTS`` rounds,
+``FileItem.merkle_root`` is set at both ends once the file is verified
+
+"""
+import asyncio
+import hashlib
+import struct
+from concurrent import futures
+
+from src.avails import const, use
+from src.transfers import thread_pool_for_hashing
+
+DIGEST_SIZE = 16
+ROOT_SIZE = 32
+_COUNT = struct.Struct('!I')
+_READ_SIZE = 256 * 1024
+
+
+def merkle_root(digests):
+    """Root of a binary hash tree over chunk ``digests``, an odd node out is carried up as it is"""
+    level = list(digests) or [hashlib.blake2b(b'', digest_size=DIGEST_SIZE).digest()]
+    while len(level) > 1:
+        paired = [
+            hashlib.blake2b(level[index] + level[index + 1], digest_size=DIGEST_SIZE).digest()
+            for index in range(0, len(level) - 1, 2)
+        ]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return hashlib.blake2b(level[0], digest_size=ROOT_SIZE).digest()
+
+
+def hash_range(path, start, end):
+    """BLAKE2b digest of bytes ``[start, end)`` of file at ``path``, fewer bytes if file is shorter (blocking)"""
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    buffer = bytearray(min(_READ_SIZE, max(end - start, 1)))
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            read = f.readinto(view[:min(remaining, len(view))])
+            if not read:
+                break
+            digest.update(view[:read])
+            remaining -= read
+    return digest.digest()
+
+
+class ChunkHasher:
+    """Hashes chunks of a file in ``th_pool`` as the transfer makes them complete
+
+    Usage::
+
+        with ChunkHasher(file_item.path, file_item.size) as hasher:
+            ...
+            hasher.advance(file_item.seeked)  # as the transfer goes
+            ...
+            digests = await hasher.digests()
+
+    Attributes:
+        chunk_size(int): bytes per chunk, ``const.HASH_CHUNK_SIZE`` by default
+        chunk_count(int): number of chunks, at least one (empty files hash as a single empty chunk)
+    """
+    __slots__ = 'path', 'size', 'chunk_size', 'chunk_count', '_th_pool', '_futures'
+
+    def __init__(self, path, size, *, chunk_size=None, th_pool=thread_pool_for_hashing):
+        self.path = path
+        self.size = size
+        self.chunk_size = chunk_size or const.HASH_CHUNK_SIZE
+        self.chunk_count = max(1, -(-size // self.chunk_size))
+        self._th_pool = th_pool
+        self._futures = []  # digest futures, in chunk order
+
+    def chunk_bounds(self, index):
+        """``(start, end)`` offsets of chunk at ``index``
+
+        Raises:
+            ValueError: if there is no such chunk
+        """
+        if not 0 <= index < self.chunk_count:
+            raise ValueError(f"chunk {index} out of {self.chunk_count}")
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, self.size)
+
+    def advance(self, seeked):
+        """File is complete up to ``seeked``, hashes chunks that are complete and not yet hashed"""
+        complete = self.chunk_count if seeked >= self.size else seeked // self.chunk_size
+        for index in range(len(self._futures), complete):
+            self._futures.append(self._th_pool.submit(hash_range, self.path, *self.chunk_bounds(index)))
+
+    def rehash(self, indices):
+        """Hashes chunks at ``indices`` again, after they are rewritten"""
+        for index in indices:
+            self._futures[index] = self._th_pool.submit(hash_range, self.path, *self.chunk_bounds(index))
+
+    async def digests(self):
+        """Digests of every chunk, hashes whatever is not yet hashed (whole file is expected to be complete)"""
+        self.advance(self.size)
+        return [await asyncio.wrap_future(future) for future in self._futures]
+
+    async def mismatches(self, expected):
+        """Indices of chunks whose digests differ from ``expected``"""
+        return [index for index, (ours, theirs) in enumerate(zip(await self.digests(), expected)) if ours != theirs]
+
+    def close(self):
+        for future in self._futures:
+            future.cancel()
+        # chunks already being hashed read the file, let them finish before it is gone or reopened
+        futures.wait(self._futures)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def pack_digests(digests):
+    return _COUNT.pack(len(digests)) + b''.join(digests) + merkle_root(digests)
+
+
+async def recv_digests(recv_function, chunk_count):
+    """Receives digests sent with :func:`pack_digests`
+
+    Returns:
+        tuple[list[bytes], bytes]: chunk digests, merkle root
+
+    Raises:
+        ValueError: if digests do not add up to ``chunk_count`` or to the merkle root sent along
+    """
+    count, = _COUNT.unpack(await use.recv_exactly(recv_function, _COUNT.size))
+    if count != chunk_count:
+        raise ValueError(f"expected digests of {chunk_count} chunks, got {count}")
+    data = await use.recv_exactly(recv_function, count * DIGEST_SIZE + ROOT_SIZE)
+    digests = [data[offset:offset + DIGEST_SIZE] for offset in range(0, count * DIGEST_SIZE, DIGEST_SIZE)]
+    root = data[count * DIGEST_SIZE:]
+    if merkle_root(digests) != root:
+        raise ValueError("chunk digests do not add up to merkle root")
+    return digests, root
+
+
+def pack_indices(indices):
+    return _COUNT.pack(len(indices)) + b''.join(_COUNT.pack(index) for index in indices)
+
+
+async def recv_indices(recv_function):
+    count, = _COUNT.unpack(await use.recv_exactly(recv_function, _COUNT.size))
+    data = await use.recv_exactly(recv_function, count * _COUNT.size)
+    return [index for index, in _COUNT.iter_unpack(data)]
@@ -0,0 +1,348 @@
+"""File transfers kept on disk, so that paused ones can be resumed after a restart
+
+every file transfer (either side) is journaled under ``const.PATH_TRANSFERS`` as an append-only log::
+
+    | LEN(4) | [KIND, SIDE, PEER ID, TRANSFER ID, ...] | ... one record after another
+      KIND: ADD (options, download path, file paths) | PROGRESS (state) | ATTACH (index, file paths) | REMOVE
+
+and a snapshot, the log compacted into ``[[SIDE, PEER ID, TRANSFER ID, OPTIONS, DOWNLOAD PATH, PATHS, STATE], ...]``,
+snapshot is written aside and swapped in (``os.replace``) before log is truncated, so a crash at any point
+leaves either the old or the new snapshot along with a log that still applies on top of it
+
+handles only tell :class:`TransferJournal` what changed, records are collected in memory (PROGRESS of a
+transfer replaces its previous one) and written in one go every ``const.TRANSFER_JOURNAL_INTERVAL`` seconds
+in ``thread_pool_for_disk_io``, the event loop never touches the disk
+
+only a transfer whose state was taken while it was paused can be resumed from where it stopped, one that was
+cut short (process killed) is dropped, its journaled state can be behind what was received by up to an interval,
+resuming from it would have receiver write files it already has (or contents into the wrong file) once more
+
+"""
+import asyncio
+import logging
+import os
+import struct
+from pathlib import Path
+
+import umsgpack
+
+from src.avails import const
+from src.transfers import TransferState, thread_pool_for_disk_io
+from src.transfers.files._fileobject import FileItem, FileRange
+from src.transfers.files.receiver import Receiver
+from src.transfers.files.sender import Sender
+
+SEND = 's'
+RECV = 'r'
+LOG_NAME = 'files.journal'
+SNAPSHOT_NAME = 'files.snapshot'
+
+_ADD, _PROGRESS, _ATTACH, _REMOVE = range(4)
+_LEN = struct.Struct('!I')
+_SENDER_OPTIONS = 'stripes', 'verify', 'delta', 'compression', 'sparse', 'batch'
+_RECEIVER_OPTIONS = _SENDER_OPTIONS + ('total_size',)
+
+_logger = logging.getLogger(__name__)
+
+
+class JournalEntry:
+    """What is known of one transfer, as of the last record
+
+    Attributes:
+        side(str): SEND or RECV
+        options(dict): keyword arguments handle was made with
+        download_path(str | None): where files are received to (RECV)
+        paths(list[str]): files being sent (SEND)
+        state(dict): progress, see :func:`handle_state`
+    """
+    __slots__ = 'side', 'peer_id', 'transfer_id', 'options', 'download_path', 'paths', 'state'
+
+    def __init__(self, side, peer_id, transfer_id, options, download_path=None, paths=(), state=None):
+        self.side = side
+        self.peer_id = peer_id
+        self.transfer_id = transfer_id
+        self.options = options
+        self.download_path = download_path
+        self.paths = list(paths)
+        self.state = state or {}
+
+    @property
+    def key(self):
+        return self.side, self.peer_id, self.transfer_id
+
+    @property
+    def resumable(self):
+        return bool(self.state.get('paused'))
+
+    def __iter__(self):
+        return iter((
+            self.side, self.peer_id, self.transfer_id, self.options, self.download_path, list(self.paths), self.state
+        ))
+
+    def __repr__(self):
+        return f"<JournalEntry {self.side} peer={self.peer_id} id={self.transfer_id} state={self.state}>"
+
+
+def entry_of(handle):
+    if isinstance(handle, Sender):
+        options = {name: getattr(handle, name) for name in _SENDER_OPTIONS}
+        paths = [str(file_item.path) for file_item in handle.file_list]
+        return JournalEntry(SEND, handle.peer_obj.peer_id, handle.id, options, paths=paths)
+    options = {name: getattr(handle, name) for name in _RECEIVER_OPTIONS}
+    return JournalEntry(RECV, handle.peer.peer_id, handle._file_id, options, str(handle.download_path))  # noqa
+
+
+def _key_of(handle):
+    if isinstance(handle, Sender):
+        return SEND, handle.peer_obj.peer_id, handle.id
+    return RECV, handle.peer.peer_id, handle._file_id  # noqa
+
+
+def handle_state(handle):
+    """Progress of ``handle`` that is needed to resume it, empty if there is nothing to resume from yet"""
+    paused = handle.state == TransferState.PAUSED
+    if isinstance(handle, Sender):
+        return {
+            'index': handle._current_file_index,  # noqa
+            'sent_before': handle._sent_before,  # noqa
+            'paused': paused,
+        }
+    current = handle.current_file
+    if current is None:
+        return {}
+    return {
+        'file': bytes(current),
+        'files_done': handle._files_done,  # noqa
+        'received_before': handle._received_before,  # noqa
+        'ranges': [offset for file_range in handle._ranges for offset in (file_range.seeked, file_range.size)],  # noqa
+        'paused': paused,
+    }
+
+
+def restore(entry, peer_obj, status_updater, *, preallocate=False):
+    """Makes a paused handle out of ``entry``, to be resumed with ``continue_transfer``
+
+    Raises:
+        ValueError: if ``entry`` can not be resumed (files are gone, or its state can not be trusted)
+    """
+    if not entry.resumable:
+        raise ValueError(f"{entry} was not paused, can not tell where it stopped")
+    state = entry.state
+
+    if entry.side == SEND:
+        missing = [path for path in entry.paths if not os.path.isfile(path)]
+        if missing:
+            raise ValueError(f"{len(missing)} files of {entry} are gone, such as {missing[0]}")
+        handle = Sender(peer_obj, entry.transfer_id, entry.paths, status_updater, **entry.options)
+        handle._current_file_index = min(state['index'], len(handle.file_list))
+        handle._sent_before = state['sent_before']
+        for file_item in handle.file_list[:handle._current_file_index]:  # noqa
+            file_item.seeked = file_item.size
+    else:
+        handle = Receiver(
+            peer_obj, entry.transfer_id, Path(entry.download_path), status_updater,
+            preallocate=preallocate, **entry.options
+        )
+        try:
+            current = FileItem.load_from(state['file'], entry.download_path)
+        except (umsgpack.UnpackException, TypeError, ValueError) as exp:
+            raise ValueError(f"state of {entry} is ill formed") from exp
+        if current.seeked and not current.path.exists():
+            raise ValueError(f"{current.path} of {entry} is gone")
+        ranges = state['ranges']
+        handle._ranges = [FileRange(current, start, end) for start, end in zip(ranges[::2], ranges[1::2])]
+        handle.file_items.append(current)
+        handle._current_file = current
+        handle._files_done = state['files_done']
+        handle._received_before = state['received_before']
+
+    handle.state = TransferState.PAUSED
+    return handle
+
+
+class TransferJournal:
+    """Journal of file transfers kept in ``directory``, see module docstring
+
+    ``directory`` can be None, entries are only kept in memory then (nothing survives a restart)
+
+    Attributes:
+        entries(dict): (side, peer id, transfer id) -> :class:`JournalEntry` of every transfer not finished yet
+    """
+    __slots__ = 'directory', 'entries', 'interval', 'compact_size', '_pending', '_progress', '_log_size', \
+        '_changed', '_flusher'
+
+    def __init__(self, directory, *, interval=None, compact_size=None):
+        self.directory = Path(directory) if directory is not None else None
+        self.entries = {}
+        self.interval = const.TRANSFER_JOURNAL_INTERVAL if interval is None else interval
+        self.compact_size = const.TRANSFER_JOURNAL_COMPACT_SIZE if compact_size is None else compact_size
+        self._pending = []  # records in order they were made
+        self._progress = {}  # key -> latest PROGRESS record, written after _pending
+        self._log_size = 0
+        self._changed = asyncio.Event()
+        self._flusher = None
+
+    async def __aenter__(self):
+        if self.directory is None:
+            return self
+        loop = asyncio.get_running_loop()
+        self.entries = await loop.run_in_executor(thread_pool_for_disk_io, self._load)
+        await loop.run_in_executor(thread_pool_for_disk_io, self._write_snapshot, self._snapshot())
+        self._log_size = 0
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._flusher is None:
+            return
+        self._flusher.cancel()
+        try:
+            await self._flusher
+        except asyncio.CancelledError:
+            pass
+        await self.flush()
+
+    def resumable(self, peer_id=None):
+        return [
+            entry for entry in self.entries.values()
+            if entry.resumable and (peer_id is None or entry.peer_id == peer_id)
+        ]
+
+    def started(self, handle):
+        entry = entry_of(handle)
+        self.entries[entry.key] = entry
+        self._record(_ADD, entry.key, entry.options, entry.download_path, entry.paths)
+
+    def progressed(self, handle):
+        entry = self.entries.get(_key_of(handle))
+        if entry is None:
+            return
+        entry.state = handle_state(handle)
+        if self.directory is not None:
+            self._progress[entry.key] = [_PROGRESS, *entry.key, entry.state]
+            self._changed.set()
+
+    def attached(self, handle, paths):
+        entry = self.entries.get(_key_of(handle))
+        if entry is None:
+            return
+        paths = [str(path) for path in paths]
+        start = len(entry.paths)
+        entry.paths.extend(paths)
+        self._record(_ATTACH, entry.key, start, paths)  # at an index, replaying it twice does no harm
+
+    def finished(self, handle):
+        self.forget(_key_of(handle))
+
+    def forget(self, key):
+        """Drops transfer ``key`` from journal, it is not to be resumed"""
+        if self.entries.pop(key, None) is None:
+            return
+        self._progress.pop(key, None)
+        self._record(_REMOVE, key)
+
+    def _record(self, kind, key, *fields):
+        if self.directory is None:
+            return
+        self._pending.append([kind, *key, *fields])
+        self._changed.set()
+
+    async def flush(self):
+        """Writes records made so far, compacts log into snapshot once it grows past ``compact_size``"""
+        if not (self._pending or self._progress):
+            return
+        records = self._pending + list(self._progress.values())
+        self._pending, self._progress = [], {}
+        data = b''.join(_LEN.pack(len(packed)) + packed for packed in map(umsgpack.dumps, records))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(thread_pool_for_disk_io, self._append, data)
+        self._log_size += len(data)
+        if self._log_size >= self.compact_size:
+            await loop.run_in_executor(thread_pool_for_disk_io, self._write_snapshot, self._snapshot())
+            self._log_size = 0
+
+    async def _flush_periodically(self):
+        while True:
+            await self._changed.wait()
+            await asyncio.sleep(self.interval)  # gather whatever else changes meanwhile
+            self._changed.clear()
+            try:
+                await self.flush()
+            except OSError as oe:
+                _logger.error("could not write transfer journal", exc_info=oe)
+
+    def _snapshot(self):
+        return umsgpack.dumps([list(entry) for entry in self.entries.values()])
+
+    @property
+    def _log_path(self):
+        return self.directory / LOG_NAME
+
+    @property
+    def _snapshot_path(self):
+        return self.directory / SNAPSHOT_NAME
+
+    def _append(self, data):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self._log_path, 'ab') as f:
+            f.write(data)
+
+    def _write_snapshot(self, snapshot):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temp_path = self._snapshot_path.with_suffix('.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(snapshot)
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._snapshot_path)
+        with open(self._log_path, 'wb'):
+            pass  # everything in log is in snapshot now
+
+    def _load(self):
+        """Reads snapshot and applies log on top of it (blocking)"""
+        entries = {}
+        try:
+            with open(self._snapshot_path, 'rb') as f:
+                for fields in umsgpack.loads(f.read()):
+                    entry = JournalEntry(*fields)
+                    entries[entry.key] = entry
+        except FileNotFoundError:
+            pass
+        except (umsgpack.UnpackException, TypeError, ValueError) as exp:
+            _logger.error(f"transfer journal snapshot {self._snapshot_path} is ill formed, ignoring it", exc_info=exp)
+
+        try:
+            with open(self._log_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return entries
+        offset = 0
+        while offset + _LEN.size <= len(data):
+            length, = _LEN.unpack_from(data, offset)
+            record = data[offset + _LEN.size:offset + _LEN.size + length]
+            if len(record) < length:
+                break  # torn by a crash while appending
+            try:
+                _apply(entries, umsgpack.loads(record))
+            except (umsgpack.UnpackException, TypeError, ValueError, IndexError) as exp:
+                _logger.error(f"transfer journal record at {offset} is ill formed, ignoring rest", exc_info=exp)
+                break
+            offset += _LEN.size + length
+        return entries
+
+
+def _apply(entries, record):
+    kind, side, peer_id, transfer_id, *fields = record
+    key = side, peer_id, transfer_id
+    if kind == _ADD:
+        entries[key] = JournalEntry(side, peer_id, transfer_id, *fields)
+    elif kind == _REMOVE:
+        entries.pop(key, None)
+    elif (entry := entries.get(key)) is None:
+        return
+    elif kind == _PROGRESS:
+        entry.state, = fields
+    elif kind == _ATTACH:
+        start, paths = fields
+        entry.paths[start:] = paths
+    else:
+        raise ValueError(f"unknown journal record {kind}")
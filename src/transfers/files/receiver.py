@@ -1,21 +1,31 @@
 import asyncio
+import contextlib
 import functools
 import os
+import socket
 import struct
+import time
+from collections import deque
+from concurrent import futures
 from contextlib import aclosing, contextmanager
 
 from src.avails import const, use
 from src.avails.exceptions import CancelTransfer, InvalidStateError, TransferIncomplete
-from src.transfers import TransferState, thread_pool_for_disk_io
+from src.transfers import TransferState, thread_pool_for_disk_io, thread_pool_for_hashing
 from src.transfers._logger import logger as _logger
 from src.transfers.abc import AbstractReceiver, CommonAExitMixIn, CommonExceptionHandlersMixIn
-from src.transfers.files._fileobject import FileItem, calculate_chunk_size, validatename
+from src.transfers.files import allocation, batching, compression, delta, integrity, striped
+from src.transfers.files._fileobject import AdaptiveChunkSize, FileItem, FileRange, calculate_chunk_size, \
+    validatename
 
 
 class Receiver(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractReceiver):
     version = const.VERSIONS['FO']
 
-    def __init__(self, peer_obj, file_id, download_path, status_updater):
+    def __init__(
+            self, peer_obj, file_id, download_path, status_updater, stripes=1, verify=False, delta=False,
+            compression=None, sparse=False, preallocate=False, batch=False, total_size=0,
+    ):
         self.recv_files_task = None
         self.state = TransferState.PREPARING
         self.peer = peer_obj
@@ -28,6 +38,21 @@ class Receiver(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractReceiver)
         self.send_func = None
         self.recv_func = None
         self.status_updater = status_updater
+        self.stripes = stripes
+        self.verify = verify  # chunks are hashed and checked against sender's digests, see files.integrity
+        self.delta = delta  # files we have an older version of are built from it, see files.delta
+        self.compression = compression  # name of codec agreed upon, see files.compression
+        self.sparse = sparse  # sender only sends ranges that hold data, see files.allocation
+        self.preallocate = preallocate  # files are allocated at full size before their contents arrive
+        self.batch = batch  # small files come together, with one progress bar for all files, see files.batching
+        self.total_size = total_size  # bytes of all files sender listed, for that progress bar
+        self._files_done = 0  # files received as a whole, reported back while resuming in batch mode
+        self._received_before = 0  # bytes of those files
+        self._stripe_links = {}  # stripe index -> receiver function, 0 is the one passed into connection_made
+        self._stripe_arrived = asyncio.Event()
+        self._ranges = []  # ranges of current file when striped, reported back while resuming
+        self.finished = asyncio.get_event_loop().create_future()  # stripe connections are held open until this
+        self.chunk_sizer = None  # carried across files, what is learnt about the disk stays
         self._expected_errors = set()
 
     async def recv_files(self):
@@ -43,13 +68,16 @@ class Receiver(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractReceiver)
 
         _logger.debug(f"{self._log_prefix} changing state to RECEIVING")
         self.state = TransferState.RECEIVING
+        if self.batch:
+            self.status_updater.status_setup(f"[FILES] {self.id}", 0, self.total_size)
 
-        while True:
-            if not await self._should_proceed():
-                break
-            async with aclosing(self._recv_file_once()) as loop:
+        try:
+            async with aclosing(self._recv_remaining()) as loop:
                 async for _ in loop:
                     yield _
+        finally:
+            if not self.finished.done():
+                self.finished.set_result(None)
 
         self.state = TransferState.COMPLETED
         _logger.info(f'completed transfer: {self.file_items}')
@@ -64,6 +92,8 @@ class Receiver(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractReceiver)
             # check again, what if context switch happened
             if self.to_stop:
                 return b''
+            if not what:
+                raise TransferIncomplete("connection closed before end of transfer")
         except Exception as e:
             self.handle_exception(e)
         else:
@@ -74,20 +104,57 @@ class Receiver(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractReceiver)
 
             return what
 
+    async def _recv_remaining(self):
+        while True:
+            if not (code := await self._should_proceed()):
+                break
+            receiving = self._recv_batch_once() if code == batching.BATCH_CODE else self._recv_file_once()
+            async with aclosing(receiving) as loop:
+                async for _ in loop:
+                    yield _
+
     async def _recv_file_once(self):
+        previous = self._current_file
         try:
             self._current_file = await self._recv_file_item()
         except Exception as exp:
             self.handle_exception(exp)
+        if self._current_file.seeked and previous is not None and previous.seeked < previous.size:
+            self._current_file.name = previous.name  # resumed, goes on in the file it was being written to
 
         self.file_items.append(self._current_file)
         if self._current_file.size <= 0:
             self._current_file.path.touch(exist_ok=True)
+            self._file_done(self._current_file)
             return
 
         async with aclosing(self._receive_single_file()) as file_receiver:
             async for _ in file_receiver:
                 yield
+        if self._current_file.seeked >= self._current_file.size:
+            self._file_done(self._current_file)
+
+    async def _recv_batch_once(self):
+        if not self.batch:
+            raise TransferIncomplete("batch of files without batching agreed upon")
+        try:
+            file_items, contents, digest = await batching.recv_batch(self.recv_func, self.download_path, self.verify)
+            await asyncio.get_running_loop().run_in_executor(
+                thread_pool_for_disk_io, batching.write_batch, file_items, contents, digest, self.download_path
+            )
+        except Exception as exp:
+            self.handle_exception(exp)
+
+        self.file_items.extend(file_items)
+        self._current_file = file_items[-1]
+        for file_item in file_items:
+            self._file_done(file_item)
+        self.status_updater.update_status(self._received_before)
+        yield
+
+    def _file_done(self, file_item):
+        self._files_done += 1
+        self._received_before += file_item.size
 
     async def _recv_file_item(self):
         try:
@@ -103,30 +170,196 @@ class Receiver(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractReceiver)
             return file_item
 
     async def _receive_single_file(self):
-        validatename(file_item=self.current_file, root_path=self.download_path)
-        receiver = recv_file_contents(self.recv_func, self.current_file)
-        self.status_updater.status_setup(self._status_string_prefix, self.current_file.seeked, self.current_file.size)
-
-        status_updater = self.status_updater.update_status
-
-        async with aclosing(receiver) as file_receiver:
+        basis, signature = self.current_file.path, None
+        if self.delta and delta.wanted(self.current_file):
             try:
-                async for received_len in file_receiver:
-                    status_updater(received_len)
-                    yield
-                    if self.to_stop:
-                        break
+                signature = await self._send_signature(basis, self.current_file.size)
             except Exception as exp:
-                # raise early
                 self.handle_exception(exp)
+        if not self.current_file.seeked:
+            validatename(file_item=self.current_file, root_path=self.download_path)
+        if self.chunk_sizer is None:
+            self.chunk_sizer = AdaptiveChunkSize(calculate_chunk_size(self.current_file.size))
+        ranges = None
+        if self.sparse and not (signature or self.stripes > 1):
+            ranges = await self._recv_data_ranges(self.current_file)
+        mode = await self._allocate(self.current_file, ranges) if not signature else None
+        if signature:
+            receiver = delta.recv_delta(self.recv_func, self.current_file, basis, signature)
+        elif self.stripes > 1:
+            receiver = self._recv_striped(self.current_file)
+        elif ranges is not None and not allocation.is_whole(ranges, self.current_file):
+            receiver = self._recv_ranges(self.current_file, ranges)
+        elif codec := await self._recv_compression_flag():
+            receiver = recv_compressed(self.recv_func, self.current_file, codec, mode=mode)
+        else:
+            receiver = recv_file_contents(self.recv_func, self.current_file, mode=mode, chunk_sizer=self.chunk_sizer)
+        if self.batch:
+            status_updater = functools.partial(self._update_aggregate_status, self._received_before)
+        else:
+            self.status_updater.status_setup(
+                self._status_string_prefix, self.current_file.seeked, self.current_file.size
+            )
+            status_updater = self.status_updater.update_status
+        file_item = self.current_file
+        hashing = integrity.ChunkHasher(file_item.path, file_item.size) if self.verify else contextlib.nullcontext()
+
+        with hashing as hasher:
+            async with aclosing(receiver) as file_receiver:
+                try:
+                    async for received_len in file_receiver:
+                        status_updater(received_len)
+                        if hasher:
+                            hasher.advance(file_item.seeked)
+                        yield
+                        if self.to_stop:
+                            break
+                except Exception as exp:
+                    # raise early
+                    self.handle_exception(exp)
+
+            if file_item.seeked < file_item.size:
+                if self.to_stop is True:
+                    # if we are expected to finalize then no need to raise TransferIncomplete
+                    return
+
+                # we don't reach to this point (mostly)
+                raise TransferIncomplete("exiting before completion of transfer")
+
+            if hasher:
+                try:
+                    await self._verify_file(file_item, hasher)
+                except Exception as exp:
+                    self.handle_exception(exp)
+
+    def _update_aggregate_status(self, received_before, received):
+        self.status_updater.update_status(received_before + received)
+
+    async def _recv_data_ranges(self, file_item):
+        try:
+            return await striped.recv_ranges(self.recv_func, file_item)
+        except ValueError as ve:
+            raise TransferIncomplete(f"bad data ranges for {file_item}") from ve
+        except Exception as exp:
+            self.handle_exception(exp)
+
+    async def _allocate(self, file_item, ranges):
+        """Creates ``file_item`` at full size up front if asked to or if it has holes, see files.allocation
 
-        if self.current_file.seeked < self.current_file.size:
-            if self.to_stop is True:
-                # if we are expected to finalize then no need to raise TransferIncomplete
+        Returns:
+            str: mode to open the file in for writing contents, None for the default one
+        """
+        holes = ranges is not None and not allocation.is_whole(ranges, file_item)
+        if file_item.seeked > 0 or not (self.preallocate or holes):
+            return None
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                thread_pool_for_disk_io,
+                functools.partial(allocation.allocate, file_item, ranges, preallocate=self.preallocate),
+            )
+        except Exception as exp:
+            _logger.error(f"{self._log_prefix} could not allocate {file_item}: {exp}")
+            self.handle_exception(exp)
+        return 'rb+'
+
+    async def _recv_ranges(self, file_item, ranges):
+        for file_range in ranges:
+            file_item.seeked = file_range.seeked  # holes are already there
+            receiving = recv_file_contents(self.recv_func, file_range, mode='rb+', chunk_sizer=self.chunk_sizer)
+            async with aclosing(receiving) as receiver:
+                async for _ in receiver:
+                    file_item.seeked = file_range.seeked
+                    yield file_item.seeked
+            if not file_range.is_complete:
+                raise TransferIncomplete(f"{file_range} of {file_item} ended early")
+        file_item.seeked = file_item.size
+        yield file_item.seeked
+
+    async def _recv_compression_flag(self):
+        """Codec contents of current file come compressed with, None if they come as they are"""
+        codec = compression.get_codec(self.compression)
+        if codec is None:
+            return None
+        try:
+            flag = await self.recv_func(1)
+        except Exception as exp:
+            self.handle_exception(exp)
+        if flag not in (compression.COMPRESSED, compression.STORED):
+            raise TransferIncomplete(f"expected compression flag, got {flag!r}")
+        return codec if flag == compression.COMPRESSED else None
+
+    async def _send_signature(self, basis, size):
+        """Sends block signature of ``basis`` (older version of current file) covering up to ``size`` bytes,
+        an empty one if there is none"""
+        signature = await asyncio.get_running_loop().run_in_executor(
+            thread_pool_for_hashing, functools.partial(delta.make_signature, basis, limit=size)
+        )
+        await self.send_func(bytes(signature))
+        return signature
+
+    async def _verify_file(self, file_item, hasher):
+        """Checks chunks of ``file_item`` against sender's digests, receives corrupted ones again"""
+        try:
+            digests, root = await integrity.recv_digests(self.recv_func, hasher.chunk_count)
+        except ValueError as ve:
+            raise TransferIncomplete(f"could not verify {file_item}") from ve
+
+        for attempt in range(const.FILE_VERIFY_ATTEMPTS + 1):
+            corrupted = await hasher.mismatches(digests)
+            if not corrupted:
+                await self.send_func(integrity.pack_indices([]))
+                file_item.merkle_root = root
                 return
+            if attempt == const.FILE_VERIFY_ATTEMPTS:
+                break
 
-            # we don't reach to this point (mostly)
-            raise TransferIncomplete("exiting before completion of transfer")
+            _logger.warning(f"{self._log_prefix} {len(corrupted)} corrupted chunks in {file_item}, asking again")
+            await self.send_func(integrity.pack_indices(corrupted))
+            for index in corrupted:
+                chunk = FileRange(file_item, *hasher.chunk_bounds(index))
+                receiving = recv_file_contents(self.recv_func, chunk, mode='rb+', chunk_sizer=self.chunk_sizer)
+                async with aclosing(receiving) as receiver:
+                    async for _ in receiver:
+                        pass
+                if chunk.seeked < chunk.size:
+                    raise TransferIncomplete(f"{chunk} of {file_item} ended early")
+            hasher.rehash(corrupted)
+
+        raise TransferIncomplete(f"{file_item} still corrupted after {const.FILE_VERIFY_ATTEMPTS} attempts")
+
+    async def _recv_striped(self, file_item):
+        stripe_count, self._ranges = await striped.recv_layout(self.recv_func, file_item)
+        try:
+            await asyncio.wait_for(self._wait_for_stripes(stripe_count), const.DEFAULT_TRANSFER_TIMEOUT)
+        except TimeoutError as te:
+            raise TransferIncomplete(f"only {len(self._stripe_links)}/{stripe_count} stripes connected") from te
+
+        # every stripe opens the file on its own to write at offsets
+        file_item.path.touch(exist_ok=True)
+
+        stripes = (
+            self._recv_stripe(self._stripe_links[index], assigned, self.chunk_sizer)
+            for index, assigned in enumerate(striped.assign_ranges(self._ranges, stripe_count))
+        )
+        async with aclosing(striped.run_stripes(stripes, self._ranges)) as status:
+            async for received in status:
+                yield received
+
+        if file_item.seeked >= file_item.size:
+            self._ranges = []
+
+    async def _wait_for_stripes(self, stripe_count):
+        while not all(index in self._stripe_links for index in range(stripe_count)):
+            self._stripe_arrived.clear()
+            await self._stripe_arrived.wait()
+
+    @staticmethod
+    async def _recv_stripe(recv_function, ranges, chunk_sizer):
+        for file_range in ranges:
+            receiving = recv_file_contents(recv_function, file_range, mode='rb+', chunk_sizer=chunk_sizer)
+            async with aclosing(receiving) as receiver:
+                async for _ in receiver:
+                    pass
 
     async def continue_transfer(self):
         if not self.state == TransferState.PAUSED or self.to_stop is True:
@@ -139,24 +372,39 @@ class Receiver(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractReceiver)
         await self.connection_wait
 
         try:
+            if self.batch:
+                # files received as a whole, sender goes on from the one after them
+                await self.send_func(struct.pack('!I', self._files_done))
+                current = self.current_file
+                seeked = current.seeked if current and current.seeked < current.size else 0
+                self.status_updater.status_setup(f"[FILES] {self.id}", self._received_before + seeked, self.total_size)
+            else:
+                seeked = self.current_file.seeked
             # synchronizing last received file seek
-            await self.send_func(struct.pack('!Q', self.current_file.seeked))
+            await self.send_func(struct.pack('!Q', seeked))
+            if self.stripes > 1:
+                # and every range of that file, so that each range resumes where it stopped
+                await self.send_func(striped.pack_ranges(self._ranges))
         except Exception as exp:
             self.handle_exception(exp)
 
-        while True:
-            if not self._should_proceed():
-                break
+        # getting remaining files
+        async with aclosing(self._recv_remaining()) as file_receiver:
+            async for items in file_receiver:
+                yield items
 
-            # getting remaining files
-            async with aclosing(self._recv_file_once()) as file_receiver:
-                async for items in file_receiver:
-                    yield items
+        self.state = TransferState.COMPLETED
 
     def connection_made(self, sender, receiver):
         self.connection_wait.set_result((sender, receiver))
         self.send_func = sender
         self.recv_func = receiver
+        self.stripe_made(0, sender, receiver)
+
+    def stripe_made(self, index, sender, receiver):  # noqa
+        """Connection for stripe ``index`` of a striped transfer arrived"""
+        self._stripe_links[index] = receiver
+        self._stripe_arrived.set()
 
     async def cancel(self):
         if self.state is not TransferState.RECEIVING:
@@ -180,17 +428,36 @@ class Receiver(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractReceiver)
         return f"{self.peer.peer_id} {self._file_id}"
 
 
-async def recv_file_contents(recv_function, file_item, *, chunk_size=None):
+async def recv_file_contents(
+        recv_function,
+        file_item,
+        *,
+        chunk_size=None,
+        mode=None,
+        use_recv_into=None,
+        use_pwrite=None,
+        chunk_sizer=None,
+):
     """Receive a file over a network connection and write it to disk.
 
     if ``FileItem.seeked`` attribute is non-zero then the file at ``file_item.path`` is checked for existence
     if not found then FileNoFoundError is raised.
     if found then opened in **rb+** mode
 
+    chunk sizes adapt to how long chunks take to write (see ``AdaptiveChunkSize``) unless chunk_size is provided
+
+    if ``recv_function`` supports it (``connect.Receiver.recv_into``) contents are received into
+    a few preallocated buffers and written to disk while the next buffer fills, see ``_recv_into_buffers``
+
     Args:
         recv_function (Callable): A function to receive data.
         file_item (FileItem): An object containing file metadata.
-        chunk_size(int): The size of each chunk passed into ``recv_function``
+        chunk_size(int): fixed size of each chunk passed into ``recv_function``
+        mode(str): mode to open the file in, see ``_setup_transfer`` for defaults
+        use_recv_into(bool): whether to receive into buffers, defaults to ``const.FILE_RECV_INTO``
+        use_pwrite(bool): whether to write with ``os.pwrite`` while receiving into buffers,
+            defaults to ``const.FILE_PWRITE``
+        chunk_sizer(AdaptiveChunkSize): chunk size controller to use, pass one to carry it across files
         # progress (ProgressTracker): An object to track progress of file writing.
         # stopping_flag(Callable): gets called to check when looping over byte chunks received from ``recv_function``
 
@@ -200,40 +467,213 @@ async def recv_file_contents(recv_function, file_item, *, chunk_size=None):
     Yields:
         int: updated remaining file size to be received
     """
+    if use_recv_into is None:
+        use_recv_into = const.FILE_RECV_INTO
+    if chunk_sizer is None:
+        chunk_sizer = _make_chunk_sizer(file_item, chunk_size)
+
+    if use_recv_into and hasattr(recv_function, 'recv_into'):
+        receiver = _recv_into_buffers(recv_function, file_item, chunk_sizer, mode, use_pwrite)
+    else:
+        receiver = _recv_chunks(recv_function, file_item, chunk_sizer, mode)
 
-    with _setup_transfer(chunk_size, file_item) as t:  # noqa
-        chunk_size, file_size, f_writer, remaining_bytes = t
+    async with aclosing(receiver) as file_receiver:
+        async for received in file_receiver:
+            yield received
+
+
+async def recv_compressed(recv_function, file_item, codec, *, mode=None, th_pool=thread_pool_for_disk_io):
+    """Receives a file sent with ``send_compressed``, each chunk is decompressed and written in ``th_pool``
+    while the next one is received
+
+    ``file_item.seeked`` only moves once a chunk is written, as with ``_recv_into_buffers``
+
+    Yields:
+        int: bytes of the file received so far
+    """
+    with _setup_transfer(file_item, mode=mode) as t:  # noqa
+        file_size, _, remaining_bytes, fd = t
+        write = _write_through(fd)
+        writing = None  # (future, offset up to which file is written once done)
+        try:
+            while remaining_bytes > 0:
+                kind, raw_len, data = await compression.recv_chunk(recv_function, remaining_bytes)
+                if writing:
+                    await asyncio.wrap_future(writing[0])
+                    file_item.seeked = writing[1]
+                remaining_bytes -= raw_len
+                future = th_pool.submit(_unpack_and_write, write, codec, kind, raw_len, data)
+                writing = future, file_size - remaining_bytes
+                yield file_size - remaining_bytes
+
+            if writing:
+                await asyncio.wrap_future(writing[0])
+        finally:
+            # file is closed on the way out, a write still running must not outlive it
+            if writing:
+                futures.wait([writing[0]])
+                if writing[0].exception() is None:
+                    file_item.seeked = writing[1]
+
+
+def _unpack_and_write(write, codec, kind, raw_len, data):
+    write(compression.unpack_chunk(codec, kind, raw_len, data))
+
+
+def _make_chunk_sizer(file_item, chunk_size=None):
+    if chunk_size:
+        return AdaptiveChunkSize(chunk_size, min_size=chunk_size, max_size=chunk_size)
+    return AdaptiveChunkSize(calculate_chunk_size(file_item.size))
+
+
+async def _recv_chunks(recv_function, file_item, chunk_sizer, mode):
+    sock = getattr(recv_function, 'sock', None)
+    with _setup_transfer(file_item, mode=mode) as t:  # noqa
+        file_size, f_writer, remaining_bytes, _ = t
 
         while remaining_bytes > 0:
-            data = await recv_function(min(chunk_size, remaining_bytes))
+            data = await recv_function(min(chunk_sizer.size, remaining_bytes))
             if not data:
                 break
 
+            started = time.perf_counter()
             await f_writer(data)  # Attempt to write data to file
+            chunk_sizer.update(len(data), time.perf_counter() - started)
+            chunk_sizer.fit_socket_buffer(sock, socket.SO_RCVBUF)
 
             remaining_bytes -= len(data)
             file_item.seeked += len(data)
             yield file_size - remaining_bytes
 
 
+async def _recv_into_buffers(recv_function, file_item, chunk_sizer, mode, use_pwrite, th_pool=thread_pool_for_disk_io):
+    """Receives into ``const.FILE_RECV_BUFFERS`` buffers that fit the largest chunk ``chunk_sizer`` allows,
+    a filled buffer is handed over to ``th_pool`` for writing and the next free one starts filling
+
+    ``file_item.seeked`` only moves once a write completes, so that a resumed transfer never skips
+    bytes that did not reach the disk
+    """
+    if use_pwrite is None:
+        use_pwrite = const.FILE_PWRITE
+    use_pwrite = use_pwrite and hasattr(os, 'pwrite')
+
+    sock = getattr(recv_function, 'sock', None)
+    with _setup_transfer(file_item, mode=mode) as t:  # noqa
+        file_size, _, remaining_bytes, fd = t
+        buffer_count = max(2, const.FILE_RECV_BUFFERS)
+
+        if use_pwrite:
+            # no shared file position, writes at different offsets can run together
+            write_at = _timed(functools.partial(_pwrite_all, fd.fileno()))
+            max_writes = buffer_count - 1
+        else:
+            # file position moves with every write, keeping writes in order
+            write_at = _timed(_ignore_offset(_write_through(fd)))
+            max_writes = 1
+
+        buffers = deque(
+            memoryview(bytearray(min(chunk_sizer.max_size, remaining_bytes)))
+            for _ in range(buffer_count if remaining_bytes > chunk_sizer.max_size else 1)
+        )
+        writes = deque()  # (future, buffer, offset up to which file is written once done)
+        offset = file_item.seeked
+
+        try:
+            while remaining_bytes > 0:
+                while not buffers or len(writes) >= max_writes:
+                    await _finish_write(writes, buffers, file_item, chunk_sizer)
+
+                chunk_sizer.fit_socket_buffer(sock, socket.SO_RCVBUF)
+                buffer = buffers.popleft()
+                filled = await _fill_buffer(recv_function, buffer[:min(chunk_sizer.size, remaining_bytes)])
+                if not filled:
+                    break
+
+                writes.append((th_pool.submit(write_at, buffer[:filled], offset), buffer, offset + filled))
+                offset += filled
+                remaining_bytes -= filled
+                yield file_size - remaining_bytes
+
+            while writes:
+                await _finish_write(writes, buffers, file_item, chunk_sizer)
+        finally:
+            # file is closed on the way out, writes still running must not outlive it
+            futures.wait([future for future, _, _ in writes])
+            for future, _, written_upto in writes:
+                if future.exception() is not None:
+                    break
+                file_item.seeked = written_upto
+
+
+async def _finish_write(writes, buffers, file_item, chunk_sizer):
+    future, buffer, written_upto = writes.popleft()
+    nbytes, elapsed = await asyncio.wrap_future(future)
+    chunk_sizer.update(nbytes, elapsed)
+    file_item.seeked = written_upto
+    buffers.append(buffer)
+
+
+async def _fill_buffer(recv_function, view):
+    filled = 0
+    while filled < len(view):
+        received = await recv_function.recv_into(view[filled:])
+        if not received:
+            break
+        filled += received
+    return filled
+
+
+def _pwrite_all(fileno, view, offset):
+    while view:
+        written = os.pwrite(fileno, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _timed(write_at):
+    def timed_write_at(view, offset):
+        started = time.perf_counter()
+        write_at(view, offset)
+        return len(view), time.perf_counter() - started
+
+    return timed_write_at
+
+
+def _write_through(fd):
+    """``fd.write`` that leaves nothing in python's buffer, written bytes can be read back (hashed) right away"""
+
+    def write(data):
+        fd.write(data)
+        fd.flush()
+
+    return write
+
+
+def _ignore_offset(write):
+    def write_at(view, _):
+        write(view)
+
+    return write_at
+
+
 @contextmanager
-def _setup_transfer(chunk_size, file_item, *, th_pool=thread_pool_for_disk_io):
-    mode = 'xb' if file_item.seeked == 0 else 'rb+'  # Create a new file or open for reading and writing
+def _setup_transfer(file_item, *, mode=None, th_pool=thread_pool_for_disk_io):
+    if mode is None:
+        mode = 'xb' if file_item.seeked == 0 else 'rb+'  # Create a new file or open for reading and writing
     # Check for the existence of the file for resuming
     # A reason for going with more specific modes like xb or rb+ rather than using "w" modes
     # by any chance if the file_item is misconfigured and the file held by file_item is important
     # all the contents are cleared
 
-    if file_item.seeked > 0 and not os.path.exists(file_item.path):
+    if mode == 'rb+' and not os.path.exists(file_item.path):
         print(f"File {file_item.path} not found for resuming transfer.")  # debug
         raise FileNotFoundError(f"File {file_item.path} not found for resuming transfer.")
 
-    chunk_size = chunk_size or calculate_chunk_size(file_item.size)
     remaining_bytes = file_item.size
     loop = asyncio.get_running_loop()
 
     with open(file_item.path, mode) as fd:
         fd.seek(file_item.seeked)
-        async_writer = functools.partial(loop.run_in_executor, th_pool, fd.write)
+        async_writer = functools.partial(loop.run_in_executor, th_pool, _write_through(fd))
         remaining_bytes -= file_item.seeked
-        yield chunk_size, file_item.size, async_writer, remaining_bytes
+        yield file_item.size, async_writer, remaining_bytes, fd
@@ -1,23 +1,33 @@
 import asyncio
+import contextlib
 import functools
 import mmap
+import socket
 import struct
+import time
+from collections import deque
+from concurrent import futures
 from contextlib import aclosing
 from pathlib import Path
 
 from src.avails import const, use
-from src.avails.exceptions import CancelTransfer, InvalidStateError
-from src.transfers import TransferState, thread_pool_for_disk_io
+from src.avails.exceptions import CancelTransfer, InvalidStateError, TransferIncomplete
+from src.transfers import TransferState, thread_pool_for_disk_io, thread_pool_for_hashing
 from src.transfers._logger import logger as _logger
 from src.transfers.abc import AbstractSender, CommonAExitMixIn, CommonExceptionHandlersMixIn
-from src.transfers.files._fileobject import FileItem, calculate_chunk_size
+from src.transfers.files import allocation, batching, compression, delta, integrity, striped
+from src.transfers.files._fileobject import AdaptiveChunkSize, FileItem, FileRange, calculate_chunk_size, \
+    split_ranges
 
 
 class Sender(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractSender):
     version = const.VERSIONS['FO']
     timeout = const.DEFAULT_TRANSFER_TIMEOUT
 
-    def __init__(self, peer_obj, transfer_id, file_list, status_updater):
+    def __init__(
+            self, peer_obj, transfer_id, file_list, status_updater, stripes=1, verify=False, delta=False,
+            compression=None, sparse=False, batch=False,
+    ):
         self.send_files_task = None
         self.state = TransferState.PREPARING
         self.file_list = [
@@ -31,6 +41,17 @@ class Sender(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractSender):
         self._current_file_index = 0
         self.send_func = None
         self.recv_func = None
+        self.stripes = stripes
+        self.verify = verify  # chunks are hashed and checked by receiver, see files.integrity
+        self.delta = delta  # files receiver has an older version of go as deltas, see files.delta
+        self.compression = compression  # name of codec agreed upon, see files.compression
+        self.compression_level = None  # carried across files like chunk_sizer
+        self.sparse = sparse  # only ranges of files that hold data are sent, see files.allocation
+        self.batch = batch  # small files go together, with one progress bar for all files, see files.batching
+        self._sent_before = 0  # bytes of files before current one, for that progress bar
+        self._stripe_links = {}  # stripe index -> sender function, 0 is the one passed into connection_made
+        self._ranges = []  # ranges of current file when striped, kept for resuming
+        self.chunk_sizer = None  # carried across files, what is learnt about the link stays
         self._expected_errors = set()
 
     async def send_files(self):
@@ -38,17 +59,30 @@ class Sender(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractSender):
         self.state = TransferState.SENDING
         self.send_files_task = asyncio.current_task()
 
-        for index in range(self._current_file_index, len(self.file_list)):
+        if self.batch:
+            self._setup_aggregate_status()
+
+        index = self._current_file_index
+        while index < len(self.file_list):
 
             if self.to_stop:
                 break
-            file_item = self.file_list[index]
             self._current_file_index = index
+            if self.batch and len(batch := batching.plan_batch(self.file_list, index)) > 1:
+                await self._send_batch(batch)
+                index += len(batch)
+                self._current_file_index = index - 1
+                yield self._sent_before
+                continue
+
+            file_item = self.file_list[index]
             await self._send_file_item(file_item)
             async with aclosing(self.send_one_file(file_item)) as loop:
                 async for _ in loop:
                     yield _
             print("file sent", file_item)  # debug
+            self._sent_before += file_item.size
+            index += 1
 
         # end of transfer, signalling that there are no more files
         try:
@@ -61,23 +95,167 @@ class Sender(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractSender):
 
     async def send_one_file(self, file_item):
         try:
-            self.status_updater.status_setup(
-                prefix=f"sending: {file_item}",
-                initial_limit=file_item.seeked,
-                final_limit=file_item.size
+            if self.batch:
+                updater = functools.partial(self._update_aggregate_status, self._sent_before)
+            else:
+                self.status_updater.status_setup(
+                    prefix=f"sending: {file_item}",
+                    initial_limit=file_item.seeked,
+                    final_limit=file_item.size
+                )
+                updater = self.status_updater.update_status
+            if self.chunk_sizer is None:
+                self.chunk_sizer = AdaptiveChunkSize(calculate_chunk_size(file_item.size))
+            signature = await self._recv_signature(file_item) if self.delta and delta.wanted(file_item) else None
+            striping = self.stripes > 1 and file_item.size > 0  # receiver only touches empty files
+            holes, compressing = False, False
+            if file_item.size > 0 and not (signature or striping):
+                if self.sparse:
+                    ranges = await self._send_data_ranges(file_item)
+                    holes = not allocation.is_whole(ranges, file_item)
+                if not holes:
+                    compressing = await self._send_compression_flag(file_item)
+            if signature:
+                sending = self._send_delta(file_item, signature)
+            elif striping:
+                sending = self._send_striped(file_item)
+            elif holes:
+                sending = self._send_ranges(file_item, ranges)  # noqa
+            elif compressing:
+                sending = send_compressed(
+                    self.send_func, file_item, self.compression_level, chunk_sizer=self.chunk_sizer
+                )
+            else:
+                sending = send_actual_file(self.send_func, file_item, chunk_sizer=self.chunk_sizer)
+            verifying = self.verify and file_item.size > 0  # receiver does not wait for contents of empty files
+            hashing = integrity.ChunkHasher(file_item.path, file_item.size) if verifying else contextlib.nullcontext()
+            with hashing as hasher:
+                async with aclosing(sending) as send_file:
+                    async for seeked in send_file:
+                        updater(seeked)
+                        if hasher:
+                            hasher.advance(file_item.seeked)
+                        if self.to_stop:
+                            return
+                        yield seeked
+                if hasher:
+                    await self._serve_repairs(file_item, hasher)
+        except Exception as exp:
+            self.handle_exception(exp)
+
+    def _setup_aggregate_status(self):
+        """One progress bar for all the files, from where the transfer is (re)starting"""
+        has_current = self._current_file_index < len(self.file_list)
+        current = self.file_list[self._current_file_index] if has_current else None
+        self._sent_before = sum(file_item.size for file_item in self.file_list[:self._current_file_index])
+        self.status_updater.status_setup(
+            prefix=f"sending: {len(self.file_list)} files",
+            initial_limit=self._sent_before + (current.seeked if current else 0),
+            final_limit=sum(file_item.size for file_item in self.file_list),
+        )
+
+    def _update_aggregate_status(self, sent_before, seeked):
+        self.status_updater.update_status(sent_before + seeked)
+
+    async def _send_batch(self, batch):
+        try:
+            frame = await asyncio.get_running_loop().run_in_executor(
+                thread_pool_for_disk_io, batching.read_batch, batch, self.verify
             )
-            updater = self.status_updater.update_status
-            async with aclosing(send_actual_file(
-                    self.send_func,
-                    file_item,
-            )) as send_file:
-                async for seeked in send_file:
-                    updater(seeked)
-                    if self.to_stop:
-                        break
-                    yield seeked
+            await self.send_func(frame)
         except Exception as exp:
             self.handle_exception(exp)
+        for file_item in batch:
+            file_item.seeked = file_item.size
+            self._sent_before += file_item.size
+        self.status_updater.update_status(self._sent_before)
+
+    async def _serve_repairs(self, file_item, hasher):
+        """Sends chunk digests of ``file_item``, then sends again whichever chunks receiver finds corrupted"""
+        digests = await hasher.digests()
+        await self.send_func(integrity.pack_digests(digests))
+        while indices := await integrity.recv_indices(self.recv_func):
+            _logger.warning(f"{self._log_prefix} receiver found {len(indices)} corrupted chunks of {file_item}")
+            for index in indices:
+                chunk = FileRange(file_item, *hasher.chunk_bounds(index))
+                async with aclosing(send_actual_file(self.send_func, chunk, chunk_sizer=self.chunk_sizer)) as sender:
+                    async for _ in sender:
+                        pass
+        file_item.merkle_root = integrity.merkle_root(digests)
+
+    async def _send_compression_flag(self, file_item):
+        """Tells receiver whether contents of ``file_item`` come compressed, if a codec is agreed upon at all"""
+        codec = compression.get_codec(self.compression)
+        if codec is None:
+            return False
+        if self.compression_level is None:
+            self.compression_level = compression.AdaptiveLevel(codec)
+        sample = await asyncio.get_running_loop().run_in_executor(
+            thread_pool_for_disk_io, compression.read_sample, file_item.path, file_item.seeked
+        )
+        compressing = compression.worth_compressing(sample)
+        await self.send_func(compression.COMPRESSED if compressing else compression.STORED)
+        return compressing
+
+    async def _send_data_ranges(self, file_item):
+        """Tells receiver which ranges of ``file_item`` hold data, the rest is left as holes"""
+        ranges = await asyncio.get_running_loop().run_in_executor(
+            thread_pool_for_disk_io, allocation.data_ranges, file_item
+        )
+        await self.send_func(striped.pack_ranges(ranges))
+        return ranges
+
+    async def _send_ranges(self, file_item, ranges):
+        for file_range in ranges:
+            file_item.seeked = file_range.seeked  # holes are already there at receiver
+            async with aclosing(send_actual_file(self.send_func, file_range, chunk_sizer=self.chunk_sizer)) as sender:
+                async for _ in sender:
+                    file_item.seeked = file_range.seeked
+                    yield file_item.seeked
+        file_item.seeked = file_item.size
+        yield file_item.seeked
+
+    async def _recv_signature(self, file_item):
+        try:
+            return await delta.recv_signature(self.recv_func, file_item.size)
+        except ValueError as ve:
+            raise TransferIncomplete(f"bad block signature for {file_item}") from ve
+
+    async def _send_delta(self, file_item, signature):
+        loop = asyncio.get_running_loop()
+        with delta.DeltaEncoder(file_item.path, file_item.size, signature) as encoder:
+            while not encoder.done:
+                ops = await loop.run_in_executor(thread_pool_for_hashing, encoder.encode)
+                await self.send_func(ops)
+                file_item.seeked = encoder.pos
+                yield file_item.seeked
+
+        if file_item.seeked < file_item.size:
+            raise TransferIncomplete(f"{file_item.path} got shorter than {file_item.size} bytes while sending")
+        _logger.info(f"{self._log_prefix} sent delta of {file_item}, {encoder.copied} bytes were at receiver")
+
+    async def _send_striped(self, file_item):
+        stripe_count = len(self._stripe_links)
+        if not self._ranges:
+            self._ranges = split_ranges(file_item, stripe_count)
+
+        await self.send_func(striped.pack_layout(self._ranges, stripe_count))
+        stripes = (
+            self._send_stripe(self._stripe_links[index], assigned, self.chunk_sizer)
+            for index, assigned in enumerate(striped.assign_ranges(self._ranges, stripe_count))
+        )
+        async with aclosing(striped.run_stripes(stripes, self._ranges)) as status:
+            async for sent in status:
+                yield sent
+
+        self._ranges = []
+
+    @staticmethod
+    async def _send_stripe(send_function, ranges, chunk_sizer):
+        for file_range in ranges:
+            async with aclosing(send_actual_file(send_function, file_range, chunk_sizer=chunk_sizer)) as sender:
+                async for _ in sender:
+                    pass
 
     async def _send_file_item(self, file_item):
         try:
@@ -95,15 +273,29 @@ class Sender(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractSender):
 
         _logger.debug(f'FILE[{self._file_id}] changing state to sending')
         self.state = TransferState.SENDING
-        start_file = self.file_list[self._current_file_index]
-
         # synchronizing last file sent
         try:
-            start_file.seeked = await use.recv_int(self.recv_func, use.LONG_INT)
+            if self.batch:
+                # receiver counts files it has as a whole, a batch it did not get is sent again from its first file
+                files_done = await use.recv_int(self.recv_func)
+                if files_done > len(self.file_list):
+                    raise ValueError(f"receiver has {files_done} of {len(self.file_list)} files")
+                for file_item in self.file_list[files_done:]:
+                    file_item.seeked = 0
+                self._current_file_index = files_done
+            seeked = await use.recv_int(self.recv_func, use.LONG_INT)
+            if self._current_file_index < len(self.file_list):
+                start_file = self.file_list[self._current_file_index]
+                start_file.seeked = seeked
+                if self.stripes > 1:
+                    # receiver reports back ranges of that file as far as it has written them
+                    self._ranges = await striped.recv_ranges(self.recv_func, start_file)
+                if not self.batch:
+                    self.status_updater.status_setup(
+                        f"resuming file:{start_file}", start_file.seeked, start_file.size
+                    )
         except ValueError as ve:
             self._raise_transfer_incomplete_and_change_state(ve)
-        else:
-            self.status_updater.status_setup(f"resuming file:{start_file}", start_file.seeked, start_file.size)
 
         # continuing with remaining transfer
         async with aclosing(self.send_files()) as file_sender:
@@ -125,6 +317,11 @@ class Sender(CommonAExitMixIn, CommonExceptionHandlersMixIn, AbstractSender):
     def connection_made(self, sender, receiver):
         self.send_func = sender
         self.recv_func = receiver
+        self._stripe_links[0] = sender
+
+    def stripe_made(self, index, sender, receiver):  # noqa
+        """Connection for stripe ``index`` (> 0) of a striped transfer is made"""
+        self._stripe_links[index] = sender
 
     @property
     def id(self):
@@ -142,26 +339,141 @@ async def send_actual_file(
         chunk_len=None,
         timeout=10,
         th_pool=thread_pool_for_disk_io,
+        use_sendfile=None,
+        chunk_sizer=None,
 ):
     """Sends file to other end using ``send_function``
 
     Opens file in **rb** mode from the ``path`` attribute from ``file item``
     reads ``seeked`` attribute of ``file item`` to start the transfer from
     calls ``send_function`` and awaits on it every time this function tries to send a chunk
-    if chunk_size parameter is not provided then calculates chunk size by calling ``calculate_chunk_size``
+    chunk sizes adapt to how long chunks take to send (see ``AdaptiveChunkSize``), starting from
+    ``calculate_chunk_size``, unless chunk_len is provided
+
+    if ``send_function`` supports it (``connect.Sender.sendfile``) file is sent with ``os.sendfile``
+    chunk by chunk, without copying file contents into python, falls back to reading chunks through mmap
+    when sendfile is not available
 
     Args:
         send_function(Callable): function to call when a chunk is ready
         file(FileItem): file to send
-        chunk_len(int): length of each chunk passed into ``send_function`` for each call
+        chunk_len(int): fixed length of each chunk passed into ``send_function`` for each call
         timeout(int): timeout in seconds used to wait upon send_function
         th_pool(ThreadPoolExecutor): thread pool executor to use while reading the file
+        use_sendfile(bool): whether to try sendfile, defaults to ``const.FILE_SENDFILE``
+        chunk_sizer(AdaptiveChunkSize): chunk size controller to use, pass one to carry it across files
+
+    Yields:
+        number indicating the file size sent
+    """
+
+    if chunk_sizer is None:
+        chunk_sizer = _make_chunk_sizer(file, chunk_len)
+    if use_sendfile is None:
+        use_sendfile = const.FILE_SENDFILE
+
+    if use_sendfile and hasattr(send_function, 'sendfile'):
+        try:
+            async with aclosing(_send_with_sendfile(send_function, file, chunk_sizer, timeout)) as sender:
+                async for seek in sender:
+                    yield seek
+            return
+        except asyncio.SendfileNotAvailableError as snae:
+            # raised before anything is sent in that chunk, file.seeked is still accurate
+            _logger.debug(f"sendfile not available, falling back to mmap: {snae}")
+
+    async with aclosing(_send_with_mmap(send_function, file, chunk_sizer, timeout, th_pool)) as sender:
+        async for seek in sender:
+            yield seek
+
+
+async def send_compressed(send_function, file, level, *, chunk_sizer, timeout=10, th_pool=thread_pool_for_disk_io):
+    """Sends file the way ``send_actual_file`` does, as chunks compressed at ``level`` (see files.compression)
+
+    next ``const.FILE_COMPRESS_AHEAD`` chunks are read and compressed in ``th_pool`` while the current one is sent
+
+    Args:
+        send_function(Callable): function to call when a chunk is ready
+        file(FileItem): file to send, from ``seeked``
+        level(compression.AdaptiveLevel): level controller, carried across files
+        chunk_sizer(AdaptiveChunkSize): raw bytes per chunk
+        timeout(int): timeout in seconds used to wait upon send_function
+        th_pool(ThreadPoolExecutor): thread pool executor to read and compress in
 
     Yields:
         number indicating the file size sent
     """
+    sock = getattr(send_function, 'sock', None)
+    compressing = deque()  # (future, level, end of chunk)
+    with open(file.path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as f_mapped:
+            offset = seek = file.seeked
+            try:
+                while seek < file.size:
+                    while len(compressing) < max(1, const.FILE_COMPRESS_AHEAD) and offset < file.size:
+                        end = min(offset + chunk_sizer.size, file.size)
+                        chunk_level = level.next_level()
+                        future = th_pool.submit(_read_and_pack, f_mapped, offset, end, level.codec, chunk_level)
+                        compressing.append((future, chunk_level, end))
+                        offset = end
+
+                    future, chunk_level, end = compressing.popleft()
+                    chunk, elapsed = await asyncio.wrap_future(future)
+                    level.compressed(chunk_level, end - seek, len(chunk), elapsed)
+
+                    started = time.perf_counter()
+                    await asyncio.wait_for(send_function(chunk), timeout)
+                    elapsed = time.perf_counter() - started
+                    level.sent(len(chunk), elapsed)
+                    # sizer counts raw bytes, a compressed chunk is always shorter than the size asked for
+                    chunk_sizer.update(end - seek, elapsed)
+                    chunk_sizer.fit_socket_buffer(sock, socket.SO_SNDBUF)
+                    seek = end
+                    file.seeked = seek
+                    yield seek
+            finally:
+                # file is unmapped on the way out, chunks still being read must not outlive it
+                for future, *_ in compressing:
+                    future.cancel()
+                futures.wait([future for future, *_ in compressing])
+
+
+def _read_and_pack(f_mapped, start, end, codec, level):
+    data = f_mapped[start:end]
+    if len(data) != end - start:
+        raise TransferIncomplete(f"file got shorter than {end} bytes while sending")
+    return compression.pack_chunk(data, codec, level)
+
+
+def _make_chunk_sizer(file, chunk_len=None):
+    if chunk_len:
+        return AdaptiveChunkSize(chunk_len, min_size=chunk_len, max_size=chunk_len)
+    return AdaptiveChunkSize(calculate_chunk_size(file.size))
+
+
+async def _send_with_sendfile(send_function, file, chunk_sizer, timeout):
+    sock = getattr(send_function, 'sock', None)
+    with open(file.path, 'rb') as f:
+        seek = file.seeked
+        # bounded by file.size, file can be a FileRange
+        while seek < file.size:
+            # chunk by chunk, so that progress is reported and pause/cancel get a chance in between
+            started = time.perf_counter()
+            sent = await asyncio.wait_for(
+                send_function.sendfile(f, seek, min(chunk_sizer.size, file.size - seek)),
+                timeout
+            )
+            if not sent:
+                raise TransferIncomplete(f"{file.path} got shorter than {file.size} bytes while sending")
+            chunk_sizer.update(sent, time.perf_counter() - started)
+            chunk_sizer.fit_socket_buffer(sock, socket.SO_SNDBUF)
+            seek += sent
+            file.seeked = seek
+            yield seek
+
 
-    chunk_size = chunk_len or calculate_chunk_size(file.size)
+async def _send_with_mmap(send_function, file, chunk_sizer, timeout, th_pool):
+    sock = getattr(send_function, 'sock', None)
     with open(file.path, 'rb') as f:
         with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as f_mapped:
             seek = file.seeked
@@ -171,10 +483,16 @@ async def send_actual_file(
                 f_mapped.__getitem__
             )
 
-            for offset in range(seek, file.size, chunk_size):
-                chunk = await asyncify(slice(offset, offset + chunk_size))
+            while seek < file.size:
+                # bounded by file.size, file can be a FileRange
+                chunk = await asyncify(slice(seek, min(seek + chunk_sizer.size, file.size)))
+                if not chunk:
+                    raise TransferIncomplete(f"{file.path} got shorter than {file.size} bytes while sending")
 
+                started = time.perf_counter()
                 await asyncio.wait_for(send_function(chunk), timeout)
+                chunk_sizer.update(len(chunk), time.perf_counter() - started)
+                chunk_sizer.fit_socket_buffer(sock, socket.SO_SNDBUF)
                 seek += len(chunk)
                 file.seeked = seek
                 yield seek
@@ -0,0 +1,84 @@
+"""Striped file transfers
+
+A striped transfer uses several connections (stripes) for one file transfer,
+connection with stripe index 0 is the usual file connection that carries control messages
+(file items, end of transfer), every file is split into byte ranges (:class:`FileRange`)
+that are sent over all the stripes concurrently and written at their offsets at the receiving end
+
+Per file, after the file item on stripe 0::
+
+    stripe 0   | STRIPE COUNT(4) | RANGE COUNT(4) | SEEKED(8) | END(8) | ... for every range
+    stripe i   | CONTENTS of every range ``j`` where ``j % STRIPE COUNT == i``, in order |
+
+while resuming, receiver reports ranges in the same format (without stripe count)
+as far as it has written them, see ``Receiver.continue_transfer``
+
+"""
+import asyncio
+import struct
+
+from src.transfers.files._fileobject import FileRange, contiguous_seeked
+
+_COUNT = struct.Struct('!I')
+_STATUS_INTERVAL = 0.1  # seconds between status yields while stripes are running
+
+
+def pack_ranges(ranges):
+    return _COUNT.pack(len(ranges)) + b''.join(bytes(file_range) for file_range in ranges)
+
+
+async def recv_ranges(recv_function, file_item):
+    range_count, = _COUNT.unpack(await recv_function(_COUNT.size))
+    return [
+        FileRange.load_from(await recv_function(FileRange.header_size), file_item)
+        for _ in range(range_count)
+    ]
+
+
+def pack_layout(ranges, stripe_count):
+    return _COUNT.pack(stripe_count) + pack_ranges(ranges)
+
+
+async def recv_layout(recv_function, file_item):
+    """Receives stripe count and ranges of ``file_item`` sent with :func:`pack_layout`"""
+    stripe_count, = _COUNT.unpack(await recv_function(_COUNT.size))
+    return stripe_count, await recv_ranges(recv_function, file_item)
+
+
+def assign_ranges(ranges, stripe_count):
+    """Ranges each stripe is responsible for, both ends compute the same assignment"""
+    return [ranges[index::stripe_count] for index in range(stripe_count)]
+
+
+def transferred_before(ranges):
+    """Bytes of file already transferred, everything outside the remaining parts of ``ranges``"""
+    return ranges[0].file_item.size - sum(file_range.size - file_range.start for file_range in ranges)
+
+
+async def run_stripes(stripe_coroutines, ranges):
+    """Runs transfers of all the stripes concurrently
+
+    Args:
+        stripe_coroutines: one coroutine per stripe, each transferring ranges assigned to it
+        ranges(list[FileRange]): all the ranges of file, updated by the coroutines as they progress
+
+    Yields:
+        int: bytes of file transferred so far, suitable for ``StatusMixIn.update_status``
+
+    Raises:
+        the first exception raised by any stripe, remaining stripes are cancelled
+    """
+    base = transferred_before(ranges)
+    pending = {asyncio.ensure_future(coroutine) for coroutine in stripe_coroutines}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=_STATUS_INTERVAL, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            ranges[0].file_item.seeked = contiguous_seeked(ranges)
+            yield base + sum(file_range.transferred for file_range in ranges)
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -1,16 +1,19 @@
 import asyncio
 import enum
-import math
+import itertools
+import time
 from asyncio import Future
 from collections import defaultdict
 from typing import Optional
 
 from src.avails import (RemotePeer, WireData, connect, const, use, wire)
 from src.avails.connect import UDPProtocol, get_free_port
+from src.avails.exceptions import InvalidPacket
 # from src.avails.remotepeer import RemotePeer
 from src.avails.wire import PalmTreeSession, Wire
 from src.core import Dock, get_this_remote_peer, peers
 from src.transfers import HEADERS
+from src.transfers.otm import topology
 from src.transfers.otm.tree import TreeLink
 
 
@@ -26,6 +29,18 @@ class PalmTreeLink(TreeLink):
     async def send(self, data):
         return await self._connection.asendall(data)
 
+    async def send_parts(self, buffers):
+        """Sends ``buffers`` one after another without joining them"""
+        return await self._connection.asendmsg_all(buffers)
+
+    def clear(self):
+        if self.is_passive:
+            # datagram transport is relay's own, shared by every passive link, it is closed with the session
+            self.status = TreeLink.OFFLINE
+            self._connection = None
+            return
+        super().clear()
+
     def __del__(self):
         self.clear()
 
@@ -59,13 +74,14 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
         session_init(): Initializes the session by creating a datagram endpoint.
         connection_made(): Establishes connection when datagram connection is made.
         datagram_received(): Handles incoming data packets, routes to functions.
-        gossip_update_state(): Updates gossip state with links to other peers.
+        gossip_update_state(): Updates gossip state with links to other peers, acks it.
         gossip_tree_check(): Validates and forwards tree check packet.
         gossip_tree_reject(): Handles rejection of a gossip tree connection.
         gossip_downgrade_connection(): Downgrades an active link to passive.
         gossip_upgrade_connection(): Upgrades a passive link to active.
         gossip_add_stream_link(): Adds a stream connection for an incoming peer.
         gossip_gossip_tree_gather(): sends a reply to initiator peer according to protocol
+        forward_links_settled(): Waits till peers a tree check went to have linked up or turned it down.
         stop_session(): Cleans up and closes the session.
         print_state(): Prints relay state for debugging purposes.
     """
@@ -83,6 +99,9 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
         self.session_task = None
         self.all_tasks = []
         self.session: PalmTreeSession = session
+        # session.fanout is narrowed down to links this relay has, which can change with every state update
+        self._max_fanout = session.fanout
+        self._state_update_id = 0  # of the latest state update applied
 
         self.passive_endpoint_addr = passive_endpoint_addr
 
@@ -103,6 +122,8 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
 
         # this is to keep a reference to actual sender just a helper for classes inheriting this class
         self._read_link: Optional[TreeLink] = None
+        # set while waiting for parent to reconnect, see _parent_link_broken
+        self._parent_link_back: Optional[Future[TreeLink]] = None
 
         # this set is used to book keep an id reference to the peers from whom we are expecting an incoming connection
         self.__expected_parent_peers = set()
@@ -111,6 +132,8 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
         # references from all links should be sorted out based on connectivity
         self.active_links: dict[str, TreeLink] = {}
         self.passive_links: dict[str, TreeLink] = {}
+        # set whenever a peer a tree check went to links up or turns it down, see forward_links_settled
+        self._forward_links_changed = asyncio.Event()
         self.state = RelayState.INITIAL
 
     async def session_init(self):
@@ -161,19 +184,43 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
     async def gossip_update_state(self, state_data, addr=None):
         """
         Updates the relay's links to other peers based on gossip data, sets
-        relay state to LINKS_INITIALIZED.
+        relay state to LINKS_INITIALIZED and acks it back to ``addr``.
+
+        Implementation Detail:
+            sender lays peers out again if some did not ack (PalmTreeProtocol.update_states), a later
+            update replaces links of the one before, links to peers in both are kept as they are,
+            an update older than the one applied is only acked, it can be a retry whose ack got lost
 
         Args:
             state_data (WireData): Contains peer addresses for relay status_setup.
             addr (tuple): Address of the peer initiating the update.
         """
-        if self.state >= RelayState.LINKS_INITIALIZED:
+        if self.state >= RelayState.TREE_CHECK_DONE:
             self.print_state("state mismatched, rejecting state update", self.state)
             return
 
-        addresses = state_data["addresses_mapping"]
+        update_id = state_data.body.get("update_id")  # None when sender updates its own relay
+        if update_id is not None and update_id < self._state_update_id:
+            self.print_state("got an older state update, only acking it", update_id, addr)
+        else:
+            self._state_update_id = update_id or self._state_update_id
+            self._update_links(state_data["addresses_mapping"])
+            self.print_state("updated gossip state", addr)
 
+        if addr:
+            state_ack = WireData(
+                header=HEADERS.GOSSIP_SESSION_STATE_ACK,
+                msg_id=get_this_remote_peer().peer_id,
+                update_id=update_id,
+            )
+            Wire.send_datagram(self.transport, addr, bytes(state_ack))
+
+    def _update_links(self, addresses):
+        all_links = {}
         for peer_id, passive_addr, active_addr in addresses:
+            if peer_id in self.all_links:
+                all_links[peer_id] = self.all_links[peer_id]
+                continue
             active_link = self.link_init_class(
                 self.active_endpoint_addr,
                 tuple(active_addr),
@@ -188,10 +235,10 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
                 link_type=TreeLink.PASSIVE,
             )
             passive_link.status = TreeLink.ONLINE
-            self.all_links[peer_id] = (passive_link, active_link)
+            all_links[peer_id] = (passive_link, active_link)
 
-        self.session.fanout = min(len(self.all_links), self.session.fanout)
-        self.print_state("updated gossip state", addr)
+        self.all_links = all_links
+        self.session.fanout = min(len(self.all_links), self._max_fanout)
         self.state = RelayState.LINKS_INITIALIZED
 
     async def gossip_tree_check(self, tree_check_packet, addr):
@@ -355,6 +402,10 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
             data (WireData): Contains peer data for rejected tree connection.
             addr (tuple): Address of rejecting peer.
         """
+        rejected_link = self.active_links.get(data.id)
+        if rejected_link and not rejected_link.is_online:
+            del self.active_links[data.id]
+            self._forward_links_changed.set()
 
         if len(self.all_links) <= self._tree_check_window_index:
             return  # we already checked all our all_links no need to do anything
@@ -462,9 +513,37 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
         if peer_id not in self.active_links:
             return
         link = self.active_links[peer_id]
-        what = await self._activate_link(link)
+        try:
+            what = await self._activate_link(link)
+        except OSError:
+            what = False
         if what is False:
             self.print_state("failed to make a stream connection")
+            self.active_links.pop(peer_id, None)
+        self._forward_links_changed.set()
+
+    async def forward_links_settled(self):
+        """
+        Waits till every peer this relay sent a tree check to has linked up or turned it down,
+        at most ``session.link_wait_timeout``, frames sent before that would miss children still linking up
+
+        Implementation Detail:
+            a relay forwards tree checks (see gossip_tree_check) as soon as its parent link comes up,
+            which is before parent can send anything on it
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.session.link_wait_timeout
+        while self._pending_forward_links():
+            self._forward_links_changed.clear()
+            try:
+                await asyncio.wait_for(self._forward_links_changed.wait(), deadline - loop.time())
+            except TimeoutError:
+                self.print_state("some peers did not link up in time", self._pending_forward_links())
+                return
+
+    def _pending_forward_links(self):
+        parent_link = self._parent_link_fut.result() if self._parent_link_fut.done() else None
+        return [link for link in self.active_links.values() if link is not parent_link and not link.is_online]
 
     # this function is invoked when connection came from other side
     async def gossip_add_stream_link(self, connection, data: WireData):
@@ -499,6 +578,9 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
             active_link.clear()
             active_link.connection = connection
             self.print_state(f"updated stream link {data['peer_addr']}")
+            if self._parent_link_back and not self._parent_link_back.done():
+                if active_link is self._parent_link_fut.result():
+                    self._parent_link_back.set_result(active_link)
             return
 
         if self._parent_link_fut.done():
@@ -516,7 +598,29 @@ class PalmTreeRelay(asyncio.DatagramProtocol):
         # stream connections are assumed to be active links for now
 
     async def _parent_link_broken(self):
-        ...
+        """
+        Waits for parent to come back on the link that broke, at most ``session.link_wait_timeout``.
+
+        Implementation Detail:
+            parent link stays the same link object, a new stream connection from parent peer
+            replaces its connection (see gossip_add_stream_link), no other peer is accepted as parent
+
+        Returns:
+            bool: True if parent link is online again
+        """
+        parent_link = self._parent_link_fut.result()
+        parent_link.status = TreeLink.LAGGING
+        self._parent_link_back = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._parent_link_back, self.session.link_wait_timeout)
+        except TimeoutError:
+            self.print_state(f"parent link did not come back {parent_link}")
+            parent_link.clear()
+            return False
+        finally:
+            self._parent_link_back = None
+        self.print_state(f"parent link is back {parent_link}")
+        return True
 
     def _get_forward_links(self):
         """
@@ -602,11 +706,11 @@ class PalmTreeProtocol:
     def __init__(self, center_peer, session, peers_list):
         """
 
-        Builds tree using top down approach
+        Builds tree using top down approach, confirmed peers are laid out by ``topology.latency_tree``
+        using round trips measured while informing them, laid out again as more of them confirm
         # call order :
-        # inform peers
-        # self.mediator.start_session
-        # update states
+        # inform peers, self.mediator.session_init alongside
+        # update states, peers confirmed so far get theirs while others are still replying, waits for acks
         # trigger_spanning_formation
         # gather_tree
 
@@ -622,12 +726,18 @@ class PalmTreeProtocol:
 
         self.peer_list = peers_list
         self.center_peer = center_peer
-        self.adjacency_list: dict[str: list[RemotePeer]] = defaultdict(list)
+        self.adjacency_list: dict[str: list[str]] = defaultdict(list)
         self.confirmed_peers: dict[str, wire.PalmTreeInformResponse] = {}
-        self.create_hypercube()
+        self.rtts: dict[str, float] = {}  # round trip to every confirmed peer, from inform requests
         self.session = session
-        self.session.adjacent_peers = self.adjacency_list[self.center_peer.id]
         self.gathered_tree = None
+        # relay narrows session.fanout down to links it has, trees are laid out again if peers drop
+        self._fanout = session.fanout
+
+        self._informing: set[asyncio.Future] = set()  # inform requests not yet replied to or timed out
+        self._state_acks: dict[int, Future] = {}
+        self._state_update_ids = itertools.count(1)  # increasing, relays apply only the latest one they got
+        self._state_sock = None
 
         if self.mediator_class is None:
             self.mediator_class = PalmTreeRelay
@@ -638,48 +748,31 @@ class PalmTreeProtocol:
             center_peer.uri,
         )
 
-    def create_hypercube(self):
-        """Create the hypercube topology of peers"""
-        center_peer_included_list = [self.center_peer] + self.peer_list
-        peer_id_to_peer_mapping = dict(enumerate(center_peer_included_list))
-
-        dimensions = (
-                             2 ** math.ceil(math.log2(len(center_peer_included_list)))
-                     ).bit_length() - 1
-
-        for i in range(len(center_peer_included_list)):
-            for j in range(dimensions):
-                neighbor = i ^ (1 << j)
-                if neighbor < len(center_peer_included_list):
-                    peer = peer_id_to_peer_mapping[i]
-                    neigh = peer_id_to_peer_mapping[neighbor]
-                    self.adjacency_list[peer.id].append(neigh.id)
-
     async def inform_peers(self, trigger_header: WireData):
+        """Sends every peer an inform request, relay's datagram endpoint comes up alongside,
+        replies are taken in by :meth:`update_states` as they arrive
+        """
+        session_ready = asyncio.ensure_future(self.relay.session_init())
 
         # updating center peer's data
-        self.confirmed_peers[self.center_peer.id] = wire.PalmTreeInformResponse(
-            self.center_peer.id,
+        self.confirmed_peers[self.center_peer.peer_id] = wire.PalmTreeInformResponse(
+            self.center_peer.peer_id,
             self.relay.passive_endpoint_addr,
             self.relay.active_endpoint_addr,
             self.session.key,
         )
 
-        req_tasks = [
-            self._trigger_schedular_of_peer(bytes(trigger_header), peer)
+        self._informing = {
+            asyncio.ensure_future(self._trigger_schedular_of_peer(bytes(trigger_header), peer))
             for peer in self.peer_list
-        ]
+        }
+        await session_ready
 
-        for f in asyncio.as_completed(req_tasks):
-            what, conformation = await f
-            if what is True:
-                self.confirmed_peers[conformation.peer_id] = conformation
-            else:
-                discard_peer_id = conformation.peer_id
-                for peer_id in self.adjacency_list[discard_peer_id]:
-                    self.adjacency_list[peer_id].remove(discard_peer_id)
-                del self.adjacency_list[discard_peer_id]
-        # send an audit event to page confirming peers
+    def build_tree(self):
+        """Lays out confirmed peers with ``topology.latency_tree``, by their round trips"""
+        rtts = {peer_id: self.rtts[peer_id] for peer_id in self.confirmed_peers if peer_id != self.center_peer.peer_id}
+        self.adjacency_list = defaultdict(list, topology.latency_tree(self.center_peer.peer_id, rtts, self._fanout))
+        self.session.adjacent_peers = self.adjacency_list[self.center_peer.peer_id]
 
     async def _trigger_schedular_of_peer(self, trigger_request, peer):
         """
@@ -695,6 +788,7 @@ class PalmTreeProtocol:
             loop, peer.req_uri, self.session.link_wait_timeout
         )
         with connection:
+            sent_at = time.perf_counter()
             Wire.send_datagram(connection, peer.req_uri, trigger_request)
             try:
                 data, addr = await asyncio.wait_for(
@@ -704,43 +798,142 @@ class PalmTreeProtocol:
                 return False, peer
 
             reply_data = wire.PalmTreeInformResponse.load_from(data)
+            # every peer is asked on a socket of its own, a reply on it times the round trip to that peer
+            self.rtts[reply_data.peer_id] = time.perf_counter() - sent_at
             return True, reply_data
 
     async def update_states(self):
-        await self.__update_internal_mediator_state()
+        """Lays out peers as they confirm and sends every peer in tree its adjacent peers till it acks
+
+        Implementation Detail:
+            peers confirmed so far are laid out and sent their states while the rest are still replying,
+            replies that come within the slowest round trip seen so far are taken in together,
+            a peer that never acks is taken out, every change lays the tree out again and peers whose
+            adjacent peers changed get their state again, which replaces the one before
+            (see PalmTreeRelay.gossip_update_state), so no one links to a peer that is gone
+
+        Returns:
+            int: number of peers that were taken out
+        """
+        taken_out = 0
+        acked_states = {}  # adjacent peers every peer has acked
+        sending = {}  # peer id -> (task sending its state, adjacent peers in it)
+        loop = asyncio.get_running_loop()
+        with UDPProtocol.create_async_sock(loop, const.IP_VERSION) as self._state_sock:
+            self._state_sock.bind((self.center_peer.ip, 0))
+            acks_reader = asyncio.create_task(self._read_state_acks())
+            try:
+                changed = True
+                while True:
+                    if changed:
+                        self.build_tree()
+                        await self.__update_internal_mediator_state()
+                        self._send_changed_states(acked_states, sending)
+                    if not (self._informing or sending):
+                        return taken_out
+
+                    done, _ = await asyncio.wait(
+                        self._informing | {task for task, _ in sending.values()},
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    if self._informing - done and self.rtts:
+                        more, _ = await asyncio.wait(self._informing - done, timeout=max(self.rtts.values()))
+                        done |= more
+
+                    changed = False
+                    for f in done & self._informing:
+                        self._informing.discard(f)
+                        what, conformation = f.result()
+                        if what is True:
+                            self.confirmed_peers[conformation.peer_id] = conformation
+                            changed = True
+                    for peer_id, (task, adjacent_peers) in list(sending.items()):
+                        if not task.done():
+                            continue
+                        del sending[peer_id]
+                        if task.result():
+                            acked_states[peer_id] = adjacent_peers
+                            continue
+                        self.relay.print_state(f"taking {peer_id} out of tree, it did not ack its state")
+                        del self.confirmed_peers[peer_id]
+                        taken_out += 1
+                        changed = True
+            finally:
+                acks_reader.cancel()
+                for task, _ in sending.values():
+                    task.cancel()
+
+    def _send_changed_states(self, acked_states, sending):
+        """Sends confirmed peers whose adjacent peers are not the ones they acked or are being sent, their state"""
+        for peer_id in self.confirmed_peers:
+            if peer_id == self.center_peer.peer_id:
+                continue
+            adjacent_peers = list(self.adjacency_list[peer_id])
+            if peer_id in sending:
+                task, being_sent = sending[peer_id]
+                if being_sent == adjacent_peers:
+                    continue
+                task.cancel()  # a later state replaces it anyway
+                del sending[peer_id]
+            if acked_states.get(peer_id) == adjacent_peers:
+                continue
+            sending[peer_id] = asyncio.ensure_future(self._send_state_till_acked(peer_id)), adjacent_peers
+
+    async def _send_state_till_acked(self, peer_id):
+        """
+        Sends state update to ``peer_id`` again and again until it acks
+
+        Returns:
+            bool: False if it never acked
+        """
+        update_id = next(self._state_update_ids)
         states_data = WireData(
             header=HEADERS.GOSSIP_SESSION_STATE_UPDATE,
-            addresses_mapping=None,
+            msg_id=self.center_peer.peer_id,
+            update_id=update_id,
+            addresses_mapping=self._addresses_of(peer_id),
         )
-        with connect.UDPProtocol.create_sync_sock(const.IP_VERSION) as s:
-            for peer_id in set(self.confirmed_peers) - {self.center_peer.id}:
-                response_data = self.confirmed_peers[peer_id]
-                peer_ids = self.adjacency_list[peer_id]
-                peer_responses = [self.confirmed_peers.get(p_id) for p_id in peer_ids]
-
-                states_data["addresses_mapping"] = [
-                    (p_id, peer_response.passive_addr, peer_response.active_addr)
-                    for p_id, peer_response in zip(peer_ids, peer_responses)
-                    if peer_response
-                ]
-                Wire.send_datagram(s, response_data.passive_addr, bytes(states_data))
+        passive_addr = self.confirmed_peers[peer_id].passive_addr
+        acked = self._state_acks[update_id] = asyncio.get_running_loop().create_future()
+        try:
+            for timeout in use.get_timeouts(
+                    initial=0.1, max_retries=5, max_value=self.session.link_wait_timeout
+            ):
+                Wire.send_datagram(self._state_sock, passive_addr, bytes(states_data))
+                try:
+                    await asyncio.wait_for(asyncio.shield(acked), timeout)
+                    return True
+                except TimeoutError:
+                    pass
+            return False
+        finally:
+            del self._state_acks[update_id]
+
+    async def _read_state_acks(self):
+        while True:
+            data, addr = await self._state_sock.arecvfrom(const.MAX_DATAGRAM_RECV_SIZE)
+            try:
+                state_ack = wire.unpack_datagram(data)
+                update_id = state_ack["update_id"]
+            except (InvalidPacket, KeyError, TypeError) as e:
+                # one stray datagram should not lose acks coming after it
+                self.relay.print_state(f"ignoring a datagram that is not a state ack from {addr}", e)
+                continue
+            acked = self._state_acks.get(update_id)
+            if acked and not acked.done():
+                acked.set_result(state_ack.id)
+
+    def _addresses_of(self, peer_id):
+        return [
+            (p_id, self.confirmed_peers[p_id].passive_addr, self.confirmed_peers[p_id].active_addr)
+            for p_id in self.adjacency_list[peer_id]
+        ]
 
     async def __update_internal_mediator_state(self):
         await self.relay.gossip_update_state(
             WireData(
                 header=HEADERS.GOSSIP_SESSION_STATE_UPDATE,
-                addresses_mapping=(
-                    (peer_id, peer_response.passive_addr, peer_response.active_addr)
-                    for peer_id, peer_response in zip(
-                    self.adjacency_list[self.center_peer.id],
-                    map(
-                        lambda x: self.confirmed_peers.get(x),
-                        self.adjacency_list[self.center_peer.id],
-                    ),
-                )
-                    if peer_response
-                ),  # keeping this as a generator because it's gonna
-                #    directly iterated over in the underlying function
+                addresses_mapping=self._addresses_of(self.center_peer.peer_id),
             )
         )
 
@@ -748,7 +941,7 @@ class PalmTreeProtocol:
         tree_check_message_id = use.get_unique_id(str)
         spanning_trigger_header = WireData(
             header=HEADERS.GOSSIP_TREE_CHECK,
-            msg_id=self.center_peer.id,
+            msg_id=self.center_peer.peer_id,
             message_id=tree_check_message_id,
             session_id=self.session.session_id,
         )
@@ -757,7 +950,7 @@ class PalmTreeProtocol:
         #     # :todo: handle the case where all the peers adjacent to center peer went offline
         #     pass
         self.relay.forward_tree_check_packet(
-            self.center_peer.id, spanning_trigger_header
+            self.center_peer.peer_id, spanning_trigger_header
         )
 
     async def gather_tree(self):
@@ -766,7 +959,7 @@ class PalmTreeProtocol:
         with UDPProtocol.create_async_sock(loop, const.IP_VERSION) as s:
             tree_gather_packet = WireData(
                 header=HEADERS.GOSSIP_TREE_GATHER,
-                msg_id=self.center_peer.id,
+                msg_id=self.center_peer.peer_id,
                 level=0,
                 parent=None,
                 reply_addr=s.getsockname(),
@@ -1,34 +1,36 @@
-import array
 import asyncio
-from bisect import bisect_left
-from contextlib import ExitStack, asynccontextmanager
-from itertools import islice
+import threading
+from contextlib import ExitStack, contextmanager, nullcontext
+from pathlib import Path
 from typing import AsyncGenerator, BinaryIO
 
 import umsgpack
 
-from src.avails import OTMSession, const
-from src.transfers.files._fileobject import FileItem
+from src.avails import OTMChunk, OTMSession, const
+from src.transfers import thread_pool_for_disk_io
+from src.transfers.files._fileobject import FileItem, validatename
 from src.transfers.otm.relay import OTMFilesRelay
+from src.transfers.otm.spans import Ranges, file_ends, spans
 
 
 class FilesReceiver:
 
-    def __init__(self, session, passive_endpoint, active_endpoint):
+    def __init__(self, session, passive_endpoint, active_endpoint, download_path=None):
         self.file_items = []
         self.session: OTMSession = session
+        self.download_path = Path(download_path or const.PATH_DOWNLOAD)
         self.relay = OTMFilesRelay(
-            self,
             session,
             passive_endpoint,
             active_endpoint,
+            file_receiver=self,
         )
         self._relay_task = asyncio.create_task(self.relay.start_read_side())
-        self.current_file_index = 0  # index pointing to file item that is currently under transfer
-        self.chunk_count = 0
-        self._left_out_chunk = bytearray()
-        self._file_sizes_summed = None
-        self._file_descriptors: dict[FileItem, BinaryIO] = {}
+        self.received = 0  # bytes written so far
+        self.ranges = Ranges()  # of all files back to back, that are written
+        self._file_ends = []  # offset where each file ends, in all files back to back
+        self._file_descriptors: list[BinaryIO] = []
+        self._seek_lock = threading.Lock()  # writes and reads for catching up children share file positions
         self.total_byte_count = None
 
     def update_metadata(self, metadata_packet):
@@ -41,84 +43,64 @@ class FilesReceiver:
         # a list of bytes
         loaded_data = umsgpack.loads(file_data)
         self.file_items = [
-            FileItem.load_from(file_item, const.PATH_DOWNLOAD)
+            FileItem.load_from(file_item, self.download_path)
             for file_item in loaded_data
         ]
-
-        sums = [self.file_items[0].size]
-        for file_item in islice(self.file_items, 1, len(self.file_items)):
-            sums.append(sums[-1] + file_item.size)
-
-        self._file_sizes_summed = array.array('I', sums)
-        self.total_byte_count = sums[-1]
-
-    async def _write_chunk(self, chunk):
-        file_item = self.file_items[self.current_file_index]
-        writer = self._file_descriptors[file_item].write
-        chunked_chunk = chunk[0: min(file_item.size - file_item.seeked, len(chunk))]
-        writer(chunked_chunk)  # possible: Storage Unavailable
-        file_item.seeked += len(chunked_chunk)
-
-        if len(chunk) - len(chunked_chunk) > 0:
-            self.current_file_index += 1
-            if self.current_file_index == len(self.file_items):
-                return  # end of transfer
-
-            # we got a chunk that belong to two different files
-            await self._write_chunk(chunk[len(chunked_chunk):])
-
-    async def data_receiver(self) -> AsyncGenerator[None, tuple[int, bytes]]:
-
+        self._file_ends = file_ends(self.file_items)
+        self.total_byte_count = self._file_ends[-1] if self._file_ends else 0
+
+    def _write_chunk(self, chunk: OTMChunk):
+        """Writes data of ``chunk`` at its offset, into every file it spans (blocking)"""
+        view = memoryview(chunk.data)
+        with self._seek_lock:
+            for index, file_offset, start, count in spans(self._file_ends, chunk.offset, len(view)):
+                file_item = self.file_items[index]
+                fd = self._file_descriptors[index]
+                fd.seek(file_offset)
+                fd.write(view[start:start + count])  # possible: Storage Unavailable
+                file_item.seeked = max(file_item.seeked, file_offset + count)
+            end = min(chunk.offset + len(view), self.total_byte_count)
+            self.received += self.ranges.add(chunk.offset, end)
+
+    def read_range(self, offset, length):
+        """Reads back ``length`` bytes at ``offset`` written so far, for catch-ups and repairs (blocking)"""
+        data = bytearray(length)
+        with self._seek_lock:
+            for index, file_offset, start, count in spans(self._file_ends, offset, length):
+                fd = self._file_descriptors[index]
+                # done receiving, others can still be repaired from here
+                with open(self.file_items[index].path, 'rb') if fd.closed else nullcontext(fd) as fd:
+                    fd.seek(file_offset)
+                    fd.readinto(memoryview(data)[start:start + count])
+        return bytes(data)
+
+    def held(self, start, end):
+        """Parts of ``[start, end)`` written so far"""
+        with self._seek_lock:
+            return self.ranges.overlap(start, end)
+
+    def missing(self):
+        """Parts of all files back to back that are not written yet, see ``OTMFilesRelay.fill_partial_chunks``"""
+        with self._seek_lock:
+            return self.ranges.gaps(0, self.total_byte_count)
+
+    async def data_receiver(self) -> AsyncGenerator[None, OTMChunk]:
+        loop = asyncio.get_running_loop()
         with self._open_files():
-            while self.current_file_index <= len(self.file_items):
+            while True:
                 chunk = yield
-                self._align_corresponding_chunk()
-                await self._write_chunk(chunk)
-
-    @asynccontextmanager
-    async def _open_files(self):
-        async with ExitStack() as exit_stack:
-            for file in self.file_items:
-                exit_stack.enter_context(fd := open(file.path, 'wb+'))
-                self._file_descriptors[file] = fd
+                await loop.run_in_executor(thread_pool_for_disk_io, self._write_chunk, chunk)
+
+    @contextmanager
+    def _open_files(self):
+        with ExitStack() as exit_stack:
+            for file_item in self.file_items:
+                validatename(file_item, self.download_path)
+                fd = exit_stack.enter_context(open(file_item.path, 'x+b'))
+                fd.truncate(file_item.size)  # chunks can come in any order, every offset is there to write at
+                self._file_descriptors.append(fd)
             yield
 
-    def _align_corresponding_chunk(self):
-
-        # Internals:
-        # we treat all the bytes related to different files as a single byte stream
-        # upon reading different chunks and treating them as a single stream
-        # this code dynamically writes data into corresponding file on disk
-        # based on the metadata received upfront
-
-        #     chunk_size = 2B
-        #     % 5 files with these sizes
-        #
-        #     -----  ------- ------ ------- ------
-        #     | 1B | | 10B | | 5B | | 30B | | 9B |
-        #     -----  ------- ------ ------- ------
-
-        # say we got chunk_count = 8
-        # chunk alignment::
-        # chunk belongs to file no. 3
-
-        # sums::
-        #     ------  ------- ------- ------- -------
-        #     | 1B |  | 11B | | 16B | | 46B | | 55B |
-        #     ------  ------- ------- ------- -------
-        #     ---------------------------------------
-        #        1       2       3       4       5
-        #     ---------------------------------------
-        #     ---------------------------------------
-        #     //////////////////////16B
-        #     ---------------------------------------
-
-        #   8 * chunk_size = 16B
-        #   we get f seek of a combined byte stream
-        #   now writing chunk at seek pointer 16 of length chunk_len
-        _i = bisect_left(self._file_sizes_summed, self.relay.chunk_counter * self.session.chunk_size)
-        self.current_file_index = _i
-
     def close(self):
         self._relay_task.cancel()
 
@@ -3,14 +3,50 @@ import collections
 from contextlib import aclosing
 from typing import TYPE_CHECKING, override
 
-from src.avails import WireData, constants as const
-from src.avails.useables import LONG_INT, recv_int
+from src.avails import OTMChunk, Wire, WireData, connect, constants as const, use
+from src.avails.exceptions import InvalidPacket, TransferIncomplete
 from src.core import get_this_remote_peer
-from src.transfers import HEADERS
+from src.transfers import HEADERS, thread_pool_for_disk_io
 from src.transfers.otm.palm_tree import PalmTreeLink, PalmTreeProtocol, PalmTreeRelay, TreeLink
+from src.transfers.scheduler import Priority, get_scheduler
+
+
+class OTMLink(PalmTreeLink):
+    """A link to a child of an otm relay, frames wait in ``buffer`` for its writer
+
+    Attributes:
+        catch_up_from(int | None): offset of the first data frame this link missed while it lagged,
+            None while it gets the live stream
+        full_since(float | None): loop time since when ``buffer`` was found full by every frame queued for it
+    """
+
+    def __init__(self, a: tuple, b: tuple, peer_id, connection=None, link_type: int = PalmTreeLink.PASSIVE, *,
+                 buffer_len=const.MAX_OTM_BUFFERING):
+        super().__init__(a, b, peer_id, connection, link_type)
+        self.buffer = asyncio.Queue(maxsize=buffer_len)
+        self.catch_up_from = None
+        self.full_since = None
 
 
 class OTMFilesRelay(PalmTreeRelay):
+    """Reads :class:`OTMChunk` frames off parent link, writes them through ``file_receiver``
+    and forwards them to children as they arrived
+
+    the sender's relay has no ``file_receiver``, it only forwards what ``send_file_chunk`` is given
+
+    every child link has a bounded queue (``const.MAX_OTM_BUFFERING`` frames) drained by a writer task of
+    its own, so children are sent to in parallel and a slow one does not hold up its siblings:
+
+    - a child whose queue is full for ``const.OTM_LAG_TIMEOUT`` while a sibling keeps up drops to catch-up
+      mode, live data frames skip it and its writer reads what it missed back from disk (``chunk_source``)
+      till it is level with the live stream again
+    - when no child keeps up, frames wait, which slows down reading from parent, it is up to the parent
+      to let this relay catch up on its own
+
+    what never came (parent link broke for a while, or for good) is repaired once the stream ends,
+    see :meth:`fill_partial_chunks`
+    """
+    link_init_class = OTMLink
     # :todo: try using temporary-spooled files
     if TYPE_CHECKING:
         from src.transfers.otm.receiver import FilesReceiver
@@ -18,20 +54,23 @@ class OTMFilesRelay(PalmTreeRelay):
 
     def __init__(
             self,
-            file_receiver,
             session,
             passive_endpoint_addr,
             active_endpoint_addr,
+            file_receiver=None,
     ):
         super().__init__(session, passive_endpoint_addr, active_endpoint_addr)
         self._read_link = None
         self.file_receiver = file_receiver
-        # this is a generator `:method: OTMFilesReceiver.data_receiver` that takes byte-chunk inside it
-        self.chunk_recv_gen = self.file_receiver.data_receiver()
-        self._forward_limiter = asyncio.Semaphore(self.session.fanout)
+        # this is a generator `:method: OTMFilesReceiver.data_receiver` that takes OTMChunk-s inside it
+        self.chunk_recv_gen = self.file_receiver.data_receiver() if file_receiver else None
+        self.chunk_source = file_receiver  # reads back written data for children catching up, see read_range
+        self._writers: dict[OTMLink, asyncio.Task] = {}
+        self.scheduler = None  # transfers.scheduler.get_scheduler() if not set
         self.recv_buffer_queue = collections.deque(maxlen=const.MAX_OTM_BUFFERING)
-        self.chunk_counter = 0
-        self.missing_chunks = []  # type:list[tuple[int,int]]
+        self.chunk_counter = 0  # seq of the frame expected next
+        self.next_offset = 0  # end of the furthest data received
+        self._metadata = None  # (header, chunk) of file metadata, for peers that missed it, see otm_serve_repair
 
     async def start_read_side(self):
         """Starts reading and forwarding part of the protocol
@@ -40,98 +79,345 @@ class OTMFilesRelay(PalmTreeRelay):
 
         """
         await super().session_init()
-        await self._recv_file_metadata()
+        try:
+            parent_online = await self._recv_file_metadata()
+        except TransferIncomplete:
+            for link in self._get_forward_links():
+                link.clear()  # children would wait on a stream that never comes, they ask others instead
+            raise
 
         async with aclosing(self.chunk_recv_gen) as chunk_reciever:
             await anext(chunk_reciever)  # starting the reverse generator
-            await self._start_reader()
+            if parent_online:
+                await self._start_reader()
+                return
+            # parent went away before sending any data, pulling all of it from other peers
+            await self.fill_partial_chunks()
+            await self._end_of_transfer()
 
     async def _recv_file_metadata(self):
-        self._read_link = await self._parent_link_fut
-        # this future is set when a sender makes a connection
-
-        files_metadata = await self._read_link.recv(self.session.chunk_size)
+        """Reads file metadata off parent link, if link breaks before it arrives waits for parent
+        to come back as :meth:`_start_reader` does and asks for metadata with a repair request
 
-        self.file_receiver.update_metadata(files_metadata)
+        Returns:
+            bool: False if parent is gone for good
 
-        await self.send_file_metadata(files_metadata)
+        Raises:
+            TransferIncomplete: if parent link broke and no adjacent peer has file metadata
+        """
+        self._read_link = await self._parent_link_fut
+        # this future is set when a sender makes a connection
 
-    async def send_file_metadata(self, data):
+        parent_online = True
+        try:
+            header, metadata = await self._recv_frame()
+        except OSError as e:
+            self.print_state("OS error encountered while reading file metadata", e)
+            parent_online = await self._handle_read_link_broken()
+            # whatever parent sent before link broke is lost, metadata included
+            header, metadata = await self._repair_metadata()
+        if metadata.kind != OTMChunk.METADATA:
+            raise InvalidPacket(f"expected file metadata, got an otm chunk of kind {metadata.kind}")
+
+        self.file_receiver.update_metadata(metadata.data)
+        self.chunk_counter = metadata.seq + 1
+        self._metadata = header, metadata
+
+        await self.forward_links_settled()  # children linking up would miss metadata
+        await self._forward_frame(header, metadata)
+        return parent_online
+
+    async def send_file_metadata(self, chunk: OTMChunk):
         # this is the first step of a file transfer
-        await self._forward_chunk(data)
+        self._metadata = chunk.header(), chunk
+        await self.forward_links_settled()
+        await self.send_file_chunk(chunk)
 
-    async def _forward_chunk(self, chunk: bytes):
-        async with self._forward_limiter:
-            for link in self._get_forward_links():
-                try:
-                    if link.is_lagging:
-                        print(f"found {link} lagging ignoring")
-                        continue
+    async def _recv_frame(self, recv=None):
+        """Reads next frame off the read link, or off ``recv`` if given
 
-                    await asyncio.wait_for(link.send(chunk), self.session.link_wait_timeout)
-                except TimeoutError:
-                    link.status = TreeLink.LAGGING
+        Returns:
+            tuple[bytes, OTMChunk]: header as it arrived (forwarded as is) and the frame
+
+        Raises:
+            InvalidPacket: if frame is ill-formed or larger than chunks of session
+            ConnectionResetError: if link closes in the middle of a frame
+        """
+        recv = recv or self._read_link.recv
+        header = await use.recv_exactly(recv, OTMChunk.HEADER.size)
+        kind, seq, offset, length = OTMChunk.unpack_header(header)
+        if length > self.session.chunk_size:
+            raise InvalidPacket(f"otm chunk of {length} bytes, session chunks are at most {self.session.chunk_size}")
+        data = await use.recv_exactly(recv, length) if length else b''
+        return header, OTMChunk(kind, seq, offset, data)
+
+    async def _forward_frame(self, header, chunk: OTMChunk):
+        """Queues frame for every child link, waits only while children are behind, see class docstring"""
+        blocked = []
+        accepted = False
+        for link in self._get_forward_links():
+            if link not in self._writers:
+                self._writers[link] = asyncio.create_task(self._link_writer(link))
+            if chunk.kind == OTMChunk.DATA and link.catch_up_from is not None:
+                continue  # read back from disk once its writer gets to it
+            try:
+                link.buffer.put_nowait((header, chunk))
+                link.full_since = None
+                accepted = True
+            except asyncio.QueueFull:
+                if link.full_since is None:
+                    link.full_since = asyncio.get_running_loop().time()
+                blocked.append(link)
+
+        if blocked:
+            await self._wait_for_lagging(blocked, header, chunk, accepted)
+
+        if chunk.kind == OTMChunk.END:
+            await asyncio.gather(*self._writers.values(), return_exceptions=True)
+
+    async def _wait_for_lagging(self, links, header, chunk, accepted):
+        loop = asyncio.get_running_loop()
+        lag_timeout = const.OTM_LAG_TIMEOUT
+        # metadata and end are never skipped, nor is the only child that is still being sent to
+        droppable = chunk.kind == OTMChunk.DATA and lag_timeout is not None
+        puts = {asyncio.ensure_future(link.buffer.put((header, chunk))): link for link in links}
+        while puts:
+            timeout = None
+            if droppable and accepted:
+                timeout = max(min(link.full_since for link in puts.values()) + lag_timeout - loop.time(), 0)
+            done, _ = await asyncio.wait(puts, timeout=timeout)
+            for put in done:
+                del puts[put]
+            accepted = accepted or bool(done)
+            if not (droppable and accepted):
+                continue
+            now = loop.time()
+            for put, link in list(puts.items()):
+                if now - link.full_since < lag_timeout:
+                    continue
+                # found full by every frame for this long, while a sibling kept up
+                put.cancel()
+                del puts[put]
+                link.full_since = None
+                link.catch_up_from = chunk.offset
+                self.print_state(f"{link} is lagging, catching up from {chunk.offset}")
+
+    async def _link_writer(self, link: OTMLink):
+        """Sends frames queued for ``link`` in order, catches it up once its queue is drained"""
+        try:
+            while True:
+                if link.catch_up_from is not None and link.buffer.empty():
+                    await self._catch_up(link)
+                header, chunk = await link.buffer.get()
+                if chunk.kind == OTMChunk.END and link.catch_up_from is not None:
+                    await self._catch_up(link)
+                await self._send_to(link, header, chunk.data)
+                if chunk.kind == OTMChunk.END:
+                    return
+        except TimeoutError:
+            link.status = TreeLink.LAGGING
+        except OSError as oe:
+            self.print_state(f"forwarding to {link} failed", oe)
+            link.status = TreeLink.OFFLINE
+        while not link.buffer.empty():
+            link.buffer.get_nowait()  # nothing waits on a link that is given up on
+
+    async def _catch_up(self, link: OTMLink):
+        """Sends data ``link`` missed, read back from disk, till it is level with what this relay has"""
+        while link.catch_up_from < self.next_offset:
+            end = self.next_offset
+            async for chunk in self._read_held(link.catch_up_from, end):
+                await self._send_to(link, chunk.header(), chunk.data)
+            link.catch_up_from = end
+        # frames from here on have offsets past next_offset, they are queued for it again
+        link.catch_up_from = None
+        self.print_state(f"{link} caught up")
+
+    async def _read_held(self, start, end):
+        """Yields data frames of what ``chunk_source`` has in ``[start, end)``, gaps are left for repairs"""
+        loop = asyncio.get_running_loop()
+        seq = max(self.chunk_counter - 1, 0)
+        for held_start, held_end in self.chunk_source.held(start, end):
+            offset = held_start
+            while offset < held_end:
+                size = min(self.session.chunk_size, held_end - offset)
+                data = await loop.run_in_executor(thread_pool_for_disk_io, self.chunk_source.read_range, offset, size)
+                yield OTMChunk(OTMChunk.DATA, seq, offset, data)
+                offset += size
+
+    async def _send_to(self, link, header, data):
+        scheduler = self.scheduler or get_scheduler()
+        # waiting for a turn is not lagging, only the send itself is timed
+        async with scheduler.slot(link.peer_id, len(header) + len(data), Priority.BULK):
+            await asyncio.wait_for(link.send_parts((header, data)), self.session.link_wait_timeout)
 
     async def _start_reader(self):
         """
-        Continuously reads data from the link in chunks and forwards them.
+        Continuously reads frames from the link, writes and forwards them.
         Handles errors and broken links appropriately.
         """
-        chunk_size = self.session.chunk_size
-        total_bytes_len = self.file_receiver.total_byte_count
         receiver_generator = self.chunk_recv_gen.asend
 
         while True:
             try:
-                chunk = await self._read_link.recv(chunk_size)
+                header, chunk = await self._recv_frame()
             except OSError as e:
-                # Handle any OS-level errors during read
+                # Handle any OS-level errors during read, a link closed midway included
                 self.print_state("OS error encountered while reading link", e)
-                await self._handle_read_link_broken()
-                continue
+                if await self._handle_read_link_broken():
+                    continue
+                # parent is gone for good, pulling what is left from other peers
+                await self.fill_partial_chunks()
+                await self._end_of_transfer()
+                return
 
-            if not chunk:
-                await self._handle_read_link_broken()
-                continue
+            if chunk.kind == OTMChunk.METADATA:
+                continue  # sent again by a parent that came back, metadata was repaired meanwhile
 
-            await receiver_generator((self.chunk_counter, chunk))
-            await self._forward_chunk(chunk)
-            if self.chunk_counter * len(chunk) >= total_bytes_len:
+            if chunk.kind == OTMChunk.END:
                 # end of bulk transfer, now filling up any chunks missed during link broken states
                 await self.fill_partial_chunks()
+                await self._forward_frame(header, chunk)
                 return
-            self.chunk_counter += 1
+
+            # written before it is queued for children, a child catching up reads back anything before next_offset
+            await receiver_generator(chunk)
+            self.chunk_counter = chunk.seq + 1
+            self.next_offset = max(self.next_offset, chunk.offset + len(chunk.data))
+            # children get it byte for byte as it came
+            await self._forward_frame(header, chunk)
 
     async def _handle_read_link_broken(self):
         """
         Logic to handle scenarios when the read link is broken.
-        """
-        # TODO: Implement missing chunk handling logic during broken/reattached state
 
-        # Notify parent link about the broken state
+        Returns:
+            bool: True if parent came back and reading can go on, frames sent meanwhile are left for repairs
+        """
         # underlying algorithms make sure that we get a valid link
-
-        await super()._parent_link_broken()
-
-        # Re-establish the read link
-        self._read_link = await self._parent_link_fut
-        try:
-            current_counter = await recv_int(self._read_link.recv, LONG_INT)
-        except ConnectionResetError:  # again broken
-            return await self._handle_read_link_broken()
-
-        if current_counter == self.chunk_counter:
-            return  # we are luckly that states are in sync
+        if not await super()._parent_link_broken():
+            return False
+        self._read_link = self._parent_link_fut.result()
+        return True
 
     async def fill_partial_chunks(self):
-        ...
+        """Requests ranges file receiver is missing from other peers of session, see :meth:`otm_serve_repair`
 
-    def _end_of_transfer(self):
+        parent is asked first, then originator of session (if it is adjacent) and then every other adjacent peer,
+        rounds over them are repeated while one of them has something to give
+        """
+        missing = self.file_receiver.missing()
+        while missing:
+            repaired = 0
+            for peer_id, addr in self._repair_sources():
+                try:
+                    repaired += await self._repair_from(addr, missing)
+                except (OSError, InvalidPacket) as e:
+                    self.print_state(f"repair from {peer_id} failed", e)
+                    continue
+                missing = self.file_receiver.missing()
+                if not missing:
+                    break
+            else:
+                if not repaired:
+                    self.print_state("could not repair", missing)
+                    return
+        self.print_state("no chunks missing")
+
+    def _repair_sources(self):
+        parent_id = self._read_link.peer_id if self._read_link else None
+        seen = set()
+        for peer_id in (parent_id, self.session.originate_id, *self.all_links):
+            if peer_id in seen or peer_id not in self.all_links:
+                continue
+            seen.add(peer_id)
+            yield peer_id, self.all_links[peer_id][TreeLink.ACTIVE].right
 
-        ...
+    async def _repair_metadata(self):
+        """Asks peers in the order of :meth:`_repair_sources` for file metadata
 
-    async def send_file_chunk(self, chunk):
-        return await self._forward_chunk(chunk)
+        Returns:
+            tuple[bytes, OTMChunk]: header as it arrived and metadata frame
+
+        Raises:
+            TransferIncomplete: if none of them has it
+        """
+        for peer_id, addr in self._repair_sources():
+            try:
+                if metadata := await self._metadata_from(addr):
+                    return metadata
+            except (OSError, InvalidPacket) as e:
+                self.print_state(f"metadata repair from {peer_id} failed", e)
+        raise TransferIncomplete("parent link broke before file metadata, no adjacent peer has it")
+
+    async def _metadata_from(self, addr):
+        timeout = self.session.link_wait_timeout
+        connection = await connect.create_connection_async(addr, timeout)
+        with connection:
+            request = WireData(
+                header=HEADERS.OTM_REPAIR,
+                msg_id=get_this_remote_peer().peer_id,
+                session_id=self.session.session_id,
+                ranges=[],
+                metadata=True,
+            )
+            await Wire.send_async(connection, bytes(request))
+            header, chunk = await asyncio.wait_for(self._recv_frame(connection.arecv), timeout)
+            # peers that do not have it yet (or are older) end right away
+            return (header, chunk) if chunk.kind == OTMChunk.METADATA else None
+
+    async def _repair_from(self, addr, missing):
+        """Asks peer at ``addr`` for ``missing`` ranges, writes whatever it has of them
+
+        Returns:
+            int: bytes repaired
+        """
+        timeout = self.session.link_wait_timeout
+        connection = await connect.create_connection_async(addr, timeout)
+        with connection:
+            request = WireData(
+                header=HEADERS.OTM_REPAIR,
+                msg_id=get_this_remote_peer().peer_id,
+                session_id=self.session.session_id,
+                ranges=missing,
+            )
+            await Wire.send_async(connection, bytes(request))
+            repaired = 0
+            while True:
+                _, chunk = await asyncio.wait_for(self._recv_frame(connection.arecv), timeout)
+                if chunk.kind != OTMChunk.DATA:
+                    return repaired
+                await self.chunk_recv_gen.asend(chunk)
+                self.next_offset = max(self.next_offset, chunk.offset + len(chunk.data))
+                repaired += len(chunk.data)
+
+    async def otm_serve_repair(self, connection, request: WireData):
+        """Sends what this relay has of ``request['ranges']`` as data frames, followed by an end frame,
+        file metadata goes first if ``request['metadata']`` is set and this relay has it
+
+        the other end keeps only what it is missing, nothing is forwarded from here
+        """
+        scheduler = self.scheduler or get_scheduler()
+        timeout = self.session.link_wait_timeout
+        if request.body.get('metadata') and self._metadata:
+            header, metadata = self._metadata
+            await asyncio.wait_for(connection.asendmsg_all((header, metadata.data)), timeout)
+        for start, end in request['ranges']:
+            async for chunk in self._read_held(start, end):
+                async with scheduler.slot(request.id, OTMChunk.HEADER.size + len(chunk.data), Priority.BULK):
+                    await asyncio.wait_for(connection.asendmsg_all((chunk.header(), chunk.data)), timeout)
+        await connection.asendall(bytes(OTMChunk(OTMChunk.END, max(self.chunk_counter - 1, 0), self.next_offset)))
+
+    async def _end_of_transfer(self):
+        """Ends stream for children when parent could not, they repair whatever they missed from here"""
+        end = OTMChunk(OTMChunk.END, self.chunk_counter, self.file_receiver.total_byte_count)
+        await self._forward_frame(end.header(), end)
+
+    async def send_file_chunk(self, chunk: OTMChunk):
+        if chunk.kind == OTMChunk.DATA:
+            self.chunk_counter = chunk.seq + 1
+            self.next_offset = max(self.next_offset, chunk.offset + len(chunk.data))
+        return await self._forward_frame(chunk.header(), chunk)
 
     async def otm_add_stream_link(self, connection, hand_shake):
         return await super().gossip_add_stream_link(connection, hand_shake)
@@ -160,10 +446,3 @@ class OTMFilesRelay(PalmTreeRelay):
 class OTMPalmTreeProtocol(PalmTreeProtocol):
     mediator_class = OTMFilesRelay
     relay: OTMFilesRelay
-
-
-class OTMLink(PalmTreeLink):
-    def __init__(self, a: tuple, b: tuple, peer_id, connection=None, link_type: int = PalmTreeLink.PASSIVE, *,
-                 buffer_len):
-        super().__init__(a, b, peer_id, connection, link_type)
-        self.buffer = asyncio.Queue(maxsize=buffer_len)
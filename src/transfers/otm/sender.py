@@ -1,14 +1,15 @@
-import asyncio
 import mmap
+import time
 from pathlib import Path
 
 import umsgpack
 
-from src.avails import OTMSession, RemotePeer, WireData, const, use
+from src.avails import OTMChunk, OTMSession, RemotePeer, WireData, const, use
 from src.core import get_this_remote_peer
 from src.transfers import HEADERS
-from src.transfers.files._fileobject import FileItem, calculate_chunk_size
+from src.transfers.files._fileobject import AdaptiveChunkSize, FileItem, calculate_chunk_size
 from src.transfers.otm.relay import OTMFilesRelay, OTMPalmTreeProtocol
+from src.transfers.otm.spans import file_ends, spans
 
 
 class FilesSender:
@@ -17,6 +18,9 @@ class FilesSender:
         self.peer_list = peers
         self.file_items = [FileItem(file_path, 0) for file_path in file_list]
         self.timeout = timeout
+        self.chunk_sizer = None
+        self._seq = 0  # of the next frame
+        self._offset = 0  # of the current file in all files back to back
 
         self.session = self._make_session()
         self.palm_tree = OTMPalmTreeProtocol(
@@ -26,6 +30,8 @@ class FilesSender:
         )
 
         self.relay: OTMFilesRelay = self.palm_tree.relay
+        self.relay.chunk_source = self  # children lagging behind are caught up from source files
+        self._file_ends = file_ends(self.file_items)
 
     def _make_session(self):
         return OTMSession(
@@ -36,20 +42,20 @@ class FilesSender:
             file_count=len(self.file_items),
             adjacent_peers=[],
             link_wait_timeout=self.timeout,
-            chunk_size=calculate_chunk_size(sum(file.size for file in self.file_items)),
+            chunk_size=const.MAX_CHUNK_SIZE,  # upper bound, actual chunks adapt, see send_file
         )
 
     async def start(self):
         #
         # call order :
-        # inform peers
-        # relay.session_init
-        # update states
+        # inform peers, relay.session_init alongside
+        # update states, peers are laid out and get theirs as they confirm, waits for acks,
+        # peers that never ack are taken out and the rest laid out again
         # trigger_spanning_formation
+        # send files, metadata goes out once children have linked up
         #
         inform_req = self._create_inform_packet()
         yield await self.palm_tree.inform_peers(inform_req)
-        await self.relay.session_init()
         yield await self.palm_tree.update_states()
 
         # setting this future, as we are the actual sender
@@ -57,35 +63,60 @@ class FilesSender:
 
         yield await self.palm_tree.trigger_spanning_formation()
 
-        # ========> debug
-        print_signal = WireData(
-            header='gossip_print_every_onces_states',
-            msg_id=get_this_remote_peer().peer_id,
-        )
-        await asyncio.sleep(1)  # debug
-        await self.relay.gossip_print_every_onces_states(print_signal, tuple())
-        # ========> debug
+        async for _ in self.send_files():
+            yield
 
-        yield await self.relay.send_file_metadata(self._make_file_metadata())
+    async def send_files(self):
+        """Sends file metadata, every file and an END frame down the tree, yields after each file
 
+        every frame is an :class:`OTMChunk`, data is addressed by its offset in all files back to back
+        """
+        total = sum(file_item.size for file_item in self.file_items)
+        await self.relay.send_file_metadata(OTMChunk(OTMChunk.METADATA, 0, total, self._make_file_metadata()))
+        self._seq = 1
+        self._offset = 0
         for file_item in self.file_items:
             yield await self.send_file(file_item)
-        """
-        References:
-        https://en.wikipedia.org/wiki/Leaky_bucket
-        https://en.wikipedia.org/wiki/Token_bucket        
-        https://en.wikipedia.org/wiki/Generic_cell_rate_algorithm
-        
-        """
+            self._offset += file_item.size
+        await self.relay.send_file_chunk(OTMChunk(OTMChunk.END, self._seq, self._offset))
 
     async def send_file(self, file_item):
-        chunk_size = self.session.chunk_size
+        if not file_item.size:
+            return  # receivers create it from metadata, an empty file can not be mapped either
+        if self.chunk_sizer is None:
+            self.chunk_sizer = AdaptiveChunkSize(
+                calculate_chunk_size(file_item.size),
+                max_size=self.session.chunk_size,  # receivers never read more than this at once
+            )
+        chunk_sizer = self.chunk_sizer
         with open(file_item.path, 'rb') as f:
             seek = file_item.seeked
-            f_mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-            for offset in range(seek, file_item.size, chunk_size):
-                chunk = f_mapped[offset: offset + chunk_size]
-            await self.relay.send_file_chunk(chunk)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as f_mapped:
+                while seek < file_item.size:
+                    data = f_mapped[seek: seek + chunk_sizer.size]
+                    chunk = OTMChunk(OTMChunk.DATA, self._seq, self._offset + seek, data)
+                    started = time.perf_counter()
+                    # paced per link by transfers.scheduler, alongside every other transfer of this peer
+                    await self.relay.send_file_chunk(chunk)
+                    # time taken by the slowest forward link decides
+                    chunk_sizer.update(len(chunk.data), time.perf_counter() - started)
+                    self._seq += 1
+                    seek += len(chunk.data)
+                    file_item.seeked = seek
+
+    def read_range(self, offset, length):
+        """Reads ``length`` bytes at ``offset`` of all files back to back, for catch-ups and repairs (blocking)"""
+        data = bytearray(length)
+        for index, file_offset, start, count in spans(self._file_ends, offset, length):
+            with open(self.file_items[index].path, 'rb') as f:
+                f.seek(file_offset)
+                f.readinto(memoryview(data)[start:start + count])
+        return bytes(data)
+
+    def held(self, start, end):
+        """Parts of ``[start, end)`` that can be read, all of it that is within files"""
+        end = min(end, self._file_ends[-1] if self._file_ends else 0)
+        return [(start, end)] if start < end else []
 
     def _create_inform_packet(self):
         return WireData(
@@ -99,7 +130,7 @@ class FilesSender:
             link_wait_timeout=self.session.link_wait_timeout,
             adjacent_peers=self.session.adjacent_peers,
             file_count=self.session.file_count,
-            chunk_size=const.MAX_DATAGRAM_RECV_SIZE,
+            chunk_size=self.session.chunk_size,
         )
 
     def _make_file_metadata(self):
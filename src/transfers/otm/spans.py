@@ -0,0 +1,92 @@
+"""Where bytes of an otm session go
+
+all files of a session are treated as a single byte stream, frames address it by offset::
+
+    sizes  | 1B | 10B | 5B | 30B | 9B |
+    ends   | 1  | 11  | 16 | 46  | 55 |
+
+    14 bytes at offset 14: 2 bytes at 3 of file no. 3 and 12 bytes at 0 of file no. 4
+
+what a peer has of that stream is kept as :class:`Ranges`, gaps in it are repaired at the end of a session
+"""
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+
+def file_ends(file_items):
+    """Offset where each of ``file_items`` ends in the stream"""
+    return list(accumulate(file_item.size for file_item in file_items))
+
+
+def spans(ends, offset, length):
+    """Parts of ``length`` bytes at ``offset`` of the stream, one per file they fall in
+
+    Yields:
+        tuple[int, int, int, int]: index of file, offset in that file, offset in the bytes asked for, count
+    """
+    index = bisect_right(ends, offset)
+    done = 0
+    while done < length and index < len(ends):
+        file_start = ends[index - 1] if index else 0
+        count = min(length - done, ends[index] - offset - done)
+        if count:
+            yield index, offset + done - file_start, done, count
+        done += count
+        index += 1
+
+
+class Ranges:
+    """Sorted, non overlapping ``[start, end)`` ranges of the stream, ranges that touch are merged
+
+    data mostly comes in order, so this stays a single range that grows at its end,
+    a link that broke for a while leaves a gap until it is repaired
+
+    Attributes:
+        covered(int): bytes in all ranges
+    """
+    __slots__ = 'starts', 'ends', 'covered'
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.covered = 0
+
+    def add(self, start, end):
+        """Adds ``[start, end)``
+
+        Returns:
+            int: bytes that were not covered before
+        """
+        if start >= end:
+            return 0
+        lo = bisect_left(self.ends, start)
+        hi = bisect_right(self.starts, end)
+        starts, ends = self.starts[lo:hi], self.ends[lo:hi]
+        added = end - start - sum(min(e, end) - max(s, start) for s, e in zip(starts, ends))
+        if starts:
+            start, end = min(start, starts[0]), max(end, ends[-1])
+        self.starts[lo:hi] = [start]
+        self.ends[lo:hi] = [end]
+        self.covered += added
+        return added
+
+    def overlap(self, start, end):
+        """Parts of ``[start, end)`` that are covered"""
+        lo = bisect_right(self.ends, start)
+        hi = bisect_left(self.starts, end)
+        return [(max(s, start), min(e, end)) for s, e in zip(self.starts[lo:hi], self.ends[lo:hi])]
+
+    def gaps(self, start, end):
+        """Parts of ``[start, end)`` that are not covered"""
+        gaps = []
+        at = start
+        for s, e in self.overlap(start, end):
+            if s > at:
+                gaps.append((at, s))
+            at = e
+        if at < end:
+            gaps.append((at, end))
+        return gaps
+
+    def __repr__(self):
+        return f"<Ranges({', '.join(f'[{s}, {e})' for s, e in zip(self.starts, self.ends))})>"
@@ -0,0 +1,65 @@
+"""Who is adjacent to whom in a palm tree session
+
+sender informs every peer at once and times their replies (``PalmTreeProtocol.inform_peers``), lays
+peers confirmed so far out as a tree and again as more confirm, before any of them hears of the others, relays are
+told only of their tree neighbours, so tree checks flooding out from the sender can only settle into that tree::
+
+    peers sorted by round trip    | a b c d e f g h i j k l m n o |
+    children of the sender        | a . . d . . g . . j . . m . . |   fanout of them, each heads a run
+    children of a                 |   b c                         |   and so on within its run
+
+only round trips to the sender are known, ``|rtt(a) - rtt(b)|`` is a lower bound on the round trip between
+a and b (triangle inequality), peers of one site have alike round trips and fall in the same runs, so they
+end up under one another and data crosses slow links between sites as few times as it can
+
+peers that never ack their state are taken out and the rest laid out again the same way
+(``PalmTreeProtocol.update_states``), :func:`latency_tree` takes ``(root, rtts, fanout)`` and returns an adjacency list
+
+References:
+    https://en.wikipedia.org/wiki/Degree-constrained_spanning_tree
+"""
+import math
+
+
+def ranked_parents(count, fanout):
+    """Rank of the parent of every rank in the tree of module docstring, over ``count`` peers sorted by round trip
+
+    rank 0 is the root, 1 is the closest peer and so on, a parent always has a lower rank than its children
+
+    Returns:
+        list[int | None]: parent of every rank from 0 to ``count``, None for root
+    """
+    parents = [None] * (count + 1)
+
+    def attach(parent, start, end):
+        # ranks in [start, end) are a run, every child heads a consecutive part of it
+        if start >= end:
+            return
+        size = math.ceil((end - start) / fanout)
+        for head in range(start, end, size):
+            parents[head] = parent
+            attach(head, head + 1, min(head + size, end))
+
+    attach(0, 1, count + 1)
+    return parents
+
+
+def latency_tree(root, rtts, fanout):
+    """Tree over ``root`` and peers of ``rtts`` as in module docstring, about as shallow as a ``fanout``-ary heap
+
+    Args:
+        root(str): id of the sender
+        rtts(dict[str, float]): round trip from root to every other peer
+        fanout(int): children a peer can have
+
+    Returns:
+        dict[str, list[str]]: tree neighbours of every peer, children first and parent last
+    """
+    ranked = [root, *sorted(rtts, key=rtts.get)]
+    adjacency = {peer_id: [] for peer_id in ranked}
+    parents = ranked_parents(len(rtts), fanout)
+    for rank, peer_id in enumerate(ranked[1:], start=1):
+        adjacency[ranked[parents[rank]]].append(peer_id)
+    for rank, peer_id in enumerate(ranked[1:], start=1):
+        adjacency[peer_id].append(ranked[parents[rank]])
+    return adjacency
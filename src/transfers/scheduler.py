@@ -0,0 +1,307 @@
+"""One budget for every transfer leaving this peer
+
+file, directory and otm senders ask :class:`TransferScheduler` before every chunk they send
+(:class:`ScheduledSender` in place of ``connect.Sender``, ``slot`` where there is no such function),
+so concurrent transfers share the link instead of each writing as fast as it can::
+
+    CONTROL, CHAT     never queued, their bytes are charged to the buckets and files make up for them,
+                      no file chunk is granted while one of them is being sent (connectivity checks
+                      hold their slot till they are answered)
+    INTERACTIVE       a user sending files to a peer
+    BULK              directories and otm sessions, only get what INTERACTIVE leaves
+
+- a global token bucket (``const.TRANSFER_RATE_LIMIT``) paces all chunks together,
+  and a bucket per peer (``set_peer_rate``) paces chunks to that peer on top of it
+- within a class, peers take turns by deficit round-robin, a peer gets its share
+  no matter how many transfers (or stripes) it has going
+- chunks in flight (granted, not yet sent) are bounded by ``const.TRANSFER_WINDOW``,
+  without a rate limit this is what keeps control and chat from waiting behind megabytes of file data,
+  a chunk that takes longer than ``const.TRANSFER_STALL_TIMEOUT`` to leave gives its share back,
+  so a peer that stopped reading does not hold the window up till its send times out
+
+rates can be changed while transfers run, see ``webpage_handlers.handlesignals.set_rate_limits``
+
+References:
+    https://en.wikipedia.org/wiki/Token_bucket
+    https://en.wikipedia.org/wiki/Deficit_round_robin
+
+"""
+import asyncio
+import enum
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from src.avails import connect, const
+
+
+class Priority(enum.IntEnum):
+    CONTROL = 0
+    CHAT = 1
+    INTERACTIVE = 2
+    BULK = 3
+
+
+_QUEUED = (Priority.INTERACTIVE, Priority.BULK)
+
+
+class TokenBucket:
+    """Bytes per second, a bucket with ``rate`` 0 lets everything through
+
+    a chunk goes as soon as bucket is not in debt and takes the bucket into debt by its size,
+    so chunks larger than what the bucket holds go through too, only later ones wait longer
+    """
+    __slots__ = 'rate', 'capacity', 'tokens', 'stamp'
+
+    def __init__(self, rate=0):
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = 0
+        self.stamp = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self._refill()
+        self.rate = max(int(rate or 0), 0)
+        self.capacity = self.rate * const.TRANSFER_BURST
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self):
+        """Seconds until bucket is out of debt, 0 if a chunk can go now"""
+        if not self.rate:
+            return 0
+        self._refill()
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def consume(self, size):
+        if self.rate:
+            self._refill()
+            self.tokens -= size
+
+
+class _FairQueue:
+    """Chunks waiting in one priority class, peers take turns by deficit round-robin
+
+    peer at the front gets ``quantum`` bytes of credit per turn and is served while its credit
+    covers its next chunk, a peer with nothing waiting leaves the round and loses its credit
+    """
+    __slots__ = 'quantum', 'queues', 'deficits', 'turn'
+
+    def __init__(self, quantum):
+        self.quantum = quantum
+        self.queues = OrderedDict()  # peer id -> deque of (future, size)
+        self.deficits = {}
+        self.turn = None  # peer credited for the current turn
+
+    def push(self, peer_id, waiter):
+        if peer_id not in self.queues:
+            self.queues[peer_id] = deque()
+            self.deficits[peer_id] = 0
+        self.queues[peer_id].append(waiter)
+
+    def peek(self):
+        while True:
+            peer_id, waiters = next(iter(self.queues.items()))
+            if waiters[0][1] <= self.deficits[peer_id]:
+                return peer_id, waiters[0]
+            if self.turn == peer_id:
+                self.queues.move_to_end(peer_id)
+                self.turn = None
+                continue
+            self.turn = peer_id
+            self.deficits[peer_id] += self.quantum
+
+    def pop(self, peer_id):
+        future, size = self.queues[peer_id].popleft()
+        self.deficits[peer_id] -= size
+        if not self.queues[peer_id]:
+            self._leave(peer_id)
+        return future, size
+
+    def remove(self, peer_id, waiter):
+        waiters = self.queues.get(peer_id)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            self._leave(peer_id)
+
+    def _leave(self, peer_id):
+        del self.queues[peer_id]
+        del self.deficits[peer_id]
+        if self.turn == peer_id:
+            self.turn = None
+
+    def __bool__(self):
+        return bool(self.queues)
+
+
+class TransferScheduler:
+    """Grants chunks of transfers their turn, see module docstring
+
+    Attributes:
+        bucket(TokenBucket): global budget
+        window(int): bytes of file data granted at once, a larger chunk is granted alone
+        in_flight(int): bytes granted and not yet released
+        urgent_in_flight(int): bytes of control and chat messages being sent, file chunks wait till they are
+    """
+    __slots__ = 'bucket', 'peer_buckets', 'window', 'in_flight', 'urgent_in_flight', '_queues', '_changed', '_pump_task'
+
+    def __init__(self, rate=0, window=const.TRANSFER_WINDOW, quantum=const.MAX_CHUNK_SIZE):
+        self.bucket = TokenBucket(rate)
+        self.peer_buckets = {}
+        self.window = window
+        self.in_flight = 0
+        self.urgent_in_flight = 0
+        self._queues = {priority: _FairQueue(quantum) for priority in _QUEUED}
+        self._changed = asyncio.Event()
+        self._pump_task = None
+
+    def set_rate(self, rate):
+        """Global limit in bytes per second, 0 for none, applies to chunks granted from now on"""
+        self.bucket.set_rate(rate)
+        self._changed.set()
+
+    def set_peer_rate(self, peer_id, rate):
+        """Limit for chunks to ``peer_id`` in bytes per second, 0 for none"""
+        if rate:
+            self.peer_buckets.setdefault(peer_id, TokenBucket()).set_rate(rate)
+        else:
+            self.peer_buckets.pop(peer_id, None)
+
+    @property
+    def rates(self):
+        return self.bucket.rate, {peer_id: bucket.rate for peer_id, bucket in self.peer_buckets.items()}
+
+    async def acquire(self, peer_id, size, priority):
+        """Waits till a chunk of ``size`` bytes to ``peer_id`` can be sent,
+        every acquire is to be followed by :meth:`release` once chunk is sent
+        """
+        if peer_bucket := self.peer_buckets.get(peer_id):
+            if priority in _QUEUED:
+                while delay := peer_bucket.delay():
+                    await asyncio.sleep(delay)
+            peer_bucket.consume(size)
+
+        if priority not in _QUEUED:
+            self.bucket.consume(size)
+            self.urgent_in_flight += size
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, size)
+        self._queues[priority].push(peer_id, waiter)
+        self._changed.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(size, priority)  # granted just as we were cancelled
+            else:
+                self._queues[priority].remove(peer_id, waiter)
+            raise
+
+    def release(self, size, priority):
+        if priority in _QUEUED:
+            self.in_flight -= size
+        else:
+            self.urgent_in_flight -= size
+        self._changed.set()
+
+    @asynccontextmanager
+    async def slot(self, peer_id, size, priority):
+        """:meth:`acquire` and :meth:`release` around sending a chunk,
+        its share is given back early if it stalls for ``const.TRANSFER_STALL_TIMEOUT``
+        """
+        await self.acquire(peer_id, size, priority)
+        held = size
+
+        def stalled():
+            nonlocal held
+            self.release(held, priority)
+            held = 0
+
+        stall_timer = asyncio.get_running_loop().call_later(const.TRANSFER_STALL_TIMEOUT, stalled)
+        try:
+            yield
+        finally:
+            stall_timer.cancel()
+            self.release(held, priority)
+
+    async def _pump(self):
+        while any(self._queues.values()):
+            self._changed.clear()
+            granted = self._grant_next()
+            if granted is None:
+                await self._changed.wait()  # window is full, or a rate change
+            elif granted:
+                await self._wait_changed(granted)
+
+    def _grant_next(self):
+        """Grants the next chunk in line
+
+        Returns:
+            None if window is full or control or chat is being sent, seconds to wait if bucket is in debt,
+            0 if a chunk was granted
+        """
+        if self.urgent_in_flight:
+            return None
+        queue = next(queue for queue in self._queues.values() if queue)  # strictly by priority
+        peer_id, (future, size) = queue.peek()
+        if future.done():  # cancelled, its acquire removes it once it gets to run
+            queue.pop(peer_id)
+            return 0
+        if self.in_flight and self.in_flight + size > self.window:
+            return None
+        if delay := self.bucket.delay():
+            return delay
+        queue.pop(peer_id)
+        self.bucket.consume(size)
+        self.in_flight += size
+        future.set_result(None)
+        return 0
+
+    async def _wait_changed(self, timeout):
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except TimeoutError:
+            pass
+
+
+class ScheduledSender(connect.Sender):
+    """``connect.Sender`` whose every send waits for its turn in a :class:`TransferScheduler`"""
+    __slots__ = 'peer_id', 'priority', 'scheduler'
+
+    def __init__(self, sock, peer_id, priority, scheduler=None):
+        super().__init__(sock)
+        self.peer_id = peer_id
+        self.priority = priority
+        self.scheduler = scheduler or get_scheduler()
+
+    async def __call__(self, buf: bytes):
+        await self._stopper.wait()  # a paused transfer does not hold on to a slot
+        async with self.scheduler.slot(self.peer_id, len(buf), self.priority):
+            return await self.send_func(self.sock, buf)
+
+    async def sendfile(self, file, offset, count):
+        await self._stopper.wait()
+        async with self.scheduler.slot(self.peer_id, count, self.priority):
+            return await super().sendfile(file, offset, count)
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """Scheduler shared by every transfer of this peer, set up with ``const.TRANSFER_RATE_LIMIT``"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = TransferScheduler(const.TRANSFER_RATE_LIMIT)
+    return _scheduler
@@ -81,6 +81,7 @@ class StatusMixIn:
             # total=initial_limit
         )
         self.progress_bar.update(initial_limit)
+        self.current_status = initial_limit
 
         if self.yield_freq < 2:
             self.next_yield_point = final_limit + 1
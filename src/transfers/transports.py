@@ -1,10 +1,15 @@
+import asyncio
+import collections
+import logging
 import struct
 from asyncio import BaseTransport
 from typing import override
 
-from src.avails import WireData, connect, use
+from src.avails import FrameReader, FrameWriter, Wire, WireData, connect, const
 from src.transfers import REQUESTS_HEADERS
 
+_logger = logging.getLogger(__name__)
+
 
 class RequestsTransport(BaseTransport):  # just for type hinting
     """Wraps datagram to multiplex at Requests Endpoint
@@ -62,17 +67,221 @@ class GossipTransport(RequestsTransport):
 
 
 class StreamTransport:
-    __slots__ = 'socket',
+    __slots__ = 'socket', '_reader', '_writer'
 
     def __init__(self, socket_transport: connect.Socket):
         super().__init__()
         self.socket = socket_transport
+        # created on first recv, connections that are handed over for raw reads never pay for the buffer
+        self._reader = None
+        self._writer = FrameWriter(socket_transport)
 
     async def send(self, data: bytes):
-        data_size = struct.pack("!I", len(data))
-        return await self.socket.asendall(data_size + data)
+        return await Wire.send_async(self.socket, data)
+
+    def queue(self, data: bytes):
+        """Queues a frame to be sent on next :meth:`flush`"""
+        self._writer.queue(data)
+
+    async def flush(self):
+        """Sends all the queued frames in one go"""
+        return await self._writer.flush()
 
     async def recv(self):
-        data_size = await use.recv_int(self.socket.arecv)
-        data = await self.socket.arecv(data_size)
-        return data
+        """Receives a frame
+
+        Returns:
+            memoryview: valid only until next call to recv, see :class:`FrameReader`
+        """
+        if self._reader is None:
+            self._reader = FrameReader(self.socket)
+        return await self._reader.read_frame()
+
+
+class BatchedDatagramTransport(asyncio.DatagramTransport):
+    """Datagram transport that works on batches of datagrams rather than one at a time
+
+    asyncio's datagram transport reads one datagram per readiness event
+
+    This one drains up to ``max_batch`` datagrams from the socket on every readiness event
+    (python has no recvmmsg, this is the nearest we get) into one reusable buffer
+
+    Only the receive side is batched, ``sendto`` still costs one syscall per datagram and
+    goes to the socket right away, datagrams are queued only while the kernel buffer is full
+
+    Datagrams are still delivered one by one through ``protocol.datagram_received``,
+    so any :class:`asyncio.DatagramProtocol` works unchanged
+
+    Use :func:`create_batched_datagram_endpoint` to create one
+    """
+
+    __slots__ = (
+        '_loop', '_sock', '_fileno', '_protocol', '_max_batch', '_recv_buffer', '_recv_view',
+        '_send_queue', '_send_queue_bytes', '_writing', '_closing', 'stats',
+    )
+
+    def __init__(self, loop, sock, protocol, *, max_batch=const.DATAGRAM_BATCH_SIZE):
+        super().__init__(extra={'socket': sock, 'sockname': sock.getsockname()})
+        self._loop = loop
+        self._sock = sock
+        self._fileno = sock.fileno()
+        self._protocol = protocol
+        self._max_batch = max_batch
+        self._recv_buffer = bytearray(const.MAX_DATAGRAM_SIZE)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._send_queue = collections.deque()
+        self._send_queue_bytes = 0
+        self._writing = False
+        self._closing = False
+        self.stats = collections.Counter()
+
+        self._loop.call_soon(self._protocol.connection_made, self)
+        self._loop.call_soon(self._loop.add_reader, self._fileno, self._read_ready)
+
+    def _read_ready(self):
+        recvfrom_into = self._sock.recvfrom_into
+        buffer, view = self._recv_buffer, self._recv_view
+        batch = []
+        for _ in range(self._max_batch):
+            try:
+                size, addr = recvfrom_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exp:
+                self._protocol.error_received(exp)
+                break
+            batch.append((view[:size].tobytes(), addr))
+
+        self.stats['wakeups'] += 1
+        self.stats['received'] += len(batch)
+
+        datagram_received = self._protocol.datagram_received
+        for data, addr in batch:
+            if self._closing:
+                return
+            try:
+                datagram_received(data, addr)
+            except Exception as exp:
+                # one bad datagram should not cost the rest of the batch
+                self._loop.call_exception_handler({
+                    'message': 'exception in datagram_received',
+                    'exception': exp,
+                    'transport': self,
+                    'protocol': self._protocol,
+                })
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            _logger.debug(f"dropping datagram to {addr}, transport is closing")
+            return
+
+        if not self._send_queue:
+            try:
+                self._send(data, addr)
+                self.stats['sent'] += 1
+                return
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as exp:
+                # same as asyncio, the datagram is dropped and protocol is informed
+                self._protocol.error_received(exp)
+                return
+
+        data = bytes(data)
+        self._send_queue.append((data, addr))
+        self._send_queue_bytes += len(data)
+        if not self._writing:
+            self._loop.add_writer(self._fileno, self._flush)
+            self._writing = True
+
+    def _send(self, data, addr):
+        if addr is None:
+            self._sock.send(data)
+        else:
+            self._sock.sendto(data, addr)
+
+    def _flush(self):
+        # called once the socket is writable again, drains what piled up meanwhile
+        queue = self._send_queue
+        sent = 0
+        while queue:
+            data, addr = queue[0]
+            try:
+                self._send(data, addr)
+            except (BlockingIOError, InterruptedError):
+                break  # still full, the writer stays registered
+            except OSError as exp:
+                # same as asyncio, the datagram is dropped and protocol is informed
+                self._protocol.error_received(exp)
+            queue.popleft()
+            self._send_queue_bytes -= len(data)
+            sent += 1
+
+        self.stats['sent'] += sent
+        self.stats['flushes'] += 1
+
+        if queue:
+            return
+
+        if self._writing:
+            self._loop.remove_writer(self._fileno)
+            self._writing = False
+
+        if self._closing:
+            self._loop.call_soon(self._call_connection_lost, None)
+
+    def get_write_buffer_size(self):
+        return self._send_queue_bytes
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fileno)
+        if not self._send_queue:
+            self._loop.call_soon(self._call_connection_lost, None)
+        # else: the last flush schedules connection_lost
+
+    def abort(self):
+        self._send_queue.clear()
+        self._send_queue_bytes = 0
+        if self._writing:
+            self._loop.remove_writer(self._fileno)
+            self._writing = False
+        self._closing = True
+        self._loop.remove_reader(self._fileno)
+        self._loop.call_soon(self._call_connection_lost, None)
+
+    def _call_connection_lost(self, exc):
+        if self._sock is None:
+            return
+        try:
+            self._protocol.connection_lost(exc)
+        finally:
+            self._sock.close()
+            self._sock = None
+            self._protocol = None
+
+    def __repr__(self):
+        return f"<BatchedDatagramTransport(fd={self._fileno}, queued={len(self._send_queue)}, {dict(self.stats)})>"
+
+
+async def create_batched_datagram_endpoint(protocol_factory, *, sock, max_batch=const.DATAGRAM_BATCH_SIZE):
+    """Batched counterpart of ``loop.create_datagram_endpoint(protocol_factory, sock=sock)``
+
+    Args:
+        protocol_factory: callable returning an :class:`asyncio.DatagramProtocol`
+        sock: bound non-blocking datagram socket, owned by the transport from here on
+        max_batch: max number of datagrams read per readiness event
+
+    Returns:
+        tuple[BatchedDatagramTransport, asyncio.DatagramProtocol]
+    """
+    loop = asyncio.get_running_loop()
+    sock.setblocking(False)
+    protocol = protocol_factory()
+    transport = BatchedDatagramTransport(loop, sock, protocol, max_batch=max_batch)
+    return transport, protocol
@@ -2,12 +2,13 @@ import asyncio
 import traceback
 from pathlib import Path
 
-from src.avails import BaseDispatcher, DataWeaver, Wire, WireData, get_dialog_handler
+from src.avails import BaseDispatcher, DataWeaver, WireData, get_dialog_handler
 from src.core import Dock, get_this_remote_peer, peers
 from src.core.connections import Connector
 from src.managers import directorymanager, filemanager
 from src.managers.directorymanager import send_directory
 from src.transfers import HEADERS
+from src.transfers.scheduler import Priority, get_scheduler
 from src.webpage_handlers import logger
 from src.webpage_handlers.headers import HANDLE
 
@@ -29,6 +30,7 @@ class FrontEndDataDispatcher(BaseDispatcher):
                 HANDLE.SEND_TEXT: send_text,
                 HANDLE.SEND_FILE_TO_MULTIPLE_PEERS: send_files_to_multiple_peers,
                 HANDLE.SEND_DIR_TO_MULTIPLE_PEERS: send_dir_to_multiple_peers,
+                HANDLE.RESUME_TRANSFER: resume_transfer,
             }
         )
 
@@ -78,8 +80,27 @@ async def send_text(command_data: DataWeaver):
         msg_id=get_this_remote_peer().peer_id,
         message=command_data.content,
     )
+    payload = bytes(data)
     # :todo: wrap around with try except, signal page status update
-    await Wire.send_async(connection, bytes(data))
+    try:
+        await _send_chat(connection, peer_obj.peer_id, payload)
+    except OSError:
+        # pooled connection went stale in between health checks, retry once on a fresh one
+        Dock.connected_peers.discard(connection)
+        connection = await Connector.get_connection(peer_obj)
+        await _send_chat(connection, peer_obj.peer_id, payload)
+
+
+async def _send_chat(connection, peer_id, payload):
+    # chat never waits behind transfers, it is counted against the rate limit and holds file chunks back,
+    # only while it is being sent, connecting is left out of the slot
+    async with get_scheduler().slot(peer_id, len(payload), Priority.CHAT):
+        await connection.send(payload)
+
+
+async def resume_transfer(command_data: DataWeaver):
+    """Resumes a paused file transfer, one brought back from last run too"""
+    await filemanager.resume_files_to_peer(command_data.peer_id, command_data.content['transferId'])
 
 
 async def send_files_to_multiple_peers(command_data: DataWeaver):
@@ -1,6 +1,7 @@
 from src.avails import BaseDispatcher, DataWeaver
 from src.core import Dock, peers
 from src.managers.statemanager import State
+from src.transfers.scheduler import get_scheduler
 from src.webpage_handlers import logger, webpage
 from src.webpage_handlers.handleprofiles import (
     align_profiles,
@@ -29,6 +30,7 @@ class FrontEndSignalDispatcher(BaseDispatcher):
             HANDLE.SET_PROFILE: set_selected_profile,
             HANDLE.SEARCH_FOR_NAME: search_for_user,
             HANDLE.SEND_PEER_LIST: send_list,
+            HANDLE.SET_RATE_LIMITS: set_rate_limits,
         })
 
 
@@ -59,6 +61,19 @@ async def send_list(data: DataWeaver):
     await webpage.search_response(data.msg_id, peer_list)
 
 
+async def set_rate_limits(data: DataWeaver):
+    """Sets rate limit of transfers (bytes per second, 0 for none) while they run,
+    of transfers to ``peerId`` if there is one, of all of them together otherwise
+    """
+    rate = int(data.content['rate'])
+    scheduler = get_scheduler()
+    if data.peer_id:
+        scheduler.set_peer_rate(data.peer_id, rate)
+    else:
+        scheduler.set_rate(rate)
+    logger.info(f"transfer rate limits set to {scheduler.rates}")
+
+
 async def connect_peer(handle_data: DataWeaver): ...
 
 
@@ -25,11 +25,14 @@ class HANDLE(enum.StrEnum):
     SET_PROFILE = "1set selected profile"
     TRANSFER_UPDATE = "1transfer update"
     REQ_PEER_NAME_FOR_DISCOVERY = '1get a peer name for discovery'
+    SET_RATE_LIMITS = "1set rate limits"
+    TRANSFER_RESUMABLE = "1transfer resumable"
     SEND_DIR = "0send_a_directory"
     SEND_FILE = "0send_file_to_peer"
     SEND_TEXT = "0send_text"
     SEND_FILE_TO_MULTIPLE_PEERS = "0send_file_to_multiple_peers"
     SEND_DIR_TO_MULTIPLE_PEERS = "0send_dir_to_multiple_peers"
+    RESUME_TRANSFER = "0resume_transfer"
     REQ_FOR_FILE_TRANSFER = "0a file recv request has been arrived"
 
 
@@ -55,9 +58,12 @@ if TYPE_CHECKING:
     SET_PROFILE = "1set selected profile"
     TRANSFER_UPDATE = "1transfer update"
     REQ_PEER_NAME_FOR_DISCOVERY = '1get a peer name for discovery'
+    SET_RATE_LIMITS = "1set rate limits"
+    TRANSFER_RESUMABLE = "1transfer resumable"
     SEND_DIR = "0send_a_directory"
     SEND_FILE = "0send_file_to_peer"
     SEND_TEXT = "0send_text"
     SEND_FILE_TO_MULTIPLE_PEERS = "0send_file_to_multiple_peers"
     SEND_DIR_TO_MULTIPLE_PEERS = "0send_dir_to_multiple_peers"
+    RESUME_TRANSFER = "0resume_transfer"
     REQ_FOR_FILE_TRANSFER = "0a file recv request has been arrived"
@@ -46,19 +46,41 @@ async def transfer_confirmation(peer_id, transfer_id, confirmation):
     )
 
 
-async def transfer_update(peer_id, transfer_id, file_item):
+async def transfer_update(peer_id, transfer_id, file_item, chunk_sizer=None):
+    content = {
+        'item_path': str(file_item.path),
+        'received': file_item.seeked,
+        'transfer_id': transfer_id,
+    }
+    if chunk_sizer is not None:
+        content.update({'chunk_size': chunk_sizer.size,
+                        'throughput': int(chunk_sizer.throughput),
+                        })
+
     status_update = DataWeaver(
         header=headers.TRANSFER_UPDATE,
-        content={
-            'item_path': str(file_item.path),
-            'received': file_item.seeked,
-            'transfer_id': transfer_id,
-        },
+        content=content,
         peer_id=peer_id,
     )
     front_end_data_dispatcher(status_update)
 
 
+async def transfer_resumable(peer_id, transfer_id, file_item):
+    content = {'transferId': transfer_id}
+    if file_item is not None:
+        content.update({'item_path': str(file_item.path),
+                        'received': file_item.seeked,
+                        })
+
+    front_end_data_dispatcher(
+        DataWeaver(
+            header=headers.TRANSFER_RESUMABLE,
+            content=content,
+            peer_id=peer_id,
+        )
+    )
+
+
 async def transfer_incomplete(peer_id, transfer_id, file_item, detail=None):
     content = {
         'transfer_id': transfer_id,
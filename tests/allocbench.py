@@ -0,0 +1,145 @@
+"""Receiving into preallocated and sparse files against growing files a write at a time
+
+a multi GB file is received with and without preallocation (extents counted with filefrag, where present),
+a sparse file (a quarter of it data, rest holes) is sent with and without ``sparse``, bytes on the wire and
+disk space taken at receiver are counted, and a file larger than the free space of receiver's disk shows
+how soon the transfer fails, results are printed as tables:
+
+    python tests/allocbench.py [file size in MB]
+"""
+import asyncio
+import contextlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from types import SimpleNamespace
+
+import _path  # noqa
+from filebench import QuietStatus, _drain, connection_pairs, digest, make_file
+from src.avails import connect
+from src.transfers import files
+
+DEFAULT_SIZE_MB = 2048
+SPARSE_EXTENT = 8 * 2 ** 20  # data extents of sparse file, one every four
+
+
+class CountingSender(connect.Sender):
+    """counts bytes handed to the socket"""
+    __slots__ = 'sent',
+
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.sent = 0
+
+    async def __call__(self, buf):
+        result = await super().__call__(buf)
+        self.sent += len(buf)
+        return result
+
+    async def sendfile(self, file, offset, count):
+        sent = await super().sendfile(file, offset, count)
+        self.sent += sent
+        return sent
+
+
+def make_sparse(path: Path, size):
+    block = os.urandom(SPARSE_EXTENT)
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        for offset in range(0, size, 4 * SPARSE_EXTENT):
+            f.seek(offset)
+            f.write(block[:size - offset])
+
+
+def extents(path: Path):
+    if shutil.which('filefrag') is None:
+        return '-'
+    output = subprocess.run(['filefrag', str(path)], capture_output=True, text=True).stdout
+    return output.rsplit(':', 1)[-1].split()[0] if output else '-'
+
+
+def disk_usage(path: Path):
+    return path.stat().st_blocks * 512
+
+
+async def transfer(source: Path, download_dir: Path, preallocate, sparse):
+    peer = SimpleNamespace(peer_id='allocbench')
+    with ExitStack() as exit_stack:
+        (client, server), = await connection_pairs(1, exit_stack)
+        sender = files.Sender(peer, '1', [source], QuietStatus(1), sparse=sparse)
+        receiver = files.Receiver(peer, '1', download_dir, QuietStatus(1), sparse=sparse, preallocate=preallocate)
+        counting = CountingSender(client)
+        sender.connection_made(counting, connect.Receiver(client))
+        receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+
+        async def receive():
+            try:
+                await _drain(receiver.recv_files())
+            finally:
+                # as file manager does once receiver is done with, failed or not
+                server.close()
+                receive.elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results = await asyncio.gather(_drain(sender.send_files()), receive(), return_exceptions=True)
+    error = next((result for result in reversed(results) if isinstance(result, BaseException)), None)
+    return receive.elapsed, counting.sent, receiver.file_items[0].path if receiver.file_items else None, error
+
+
+async def main(size):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp, 'source.bin')
+        make_file(source, size)
+        expected = digest(source)
+        print(f"file size {size / 2 ** 20:.0f} MB")
+        print(f"{'writes':>11} | {'seconds':>7} | {'MB/s':>7} | {'extents':>7} | {'intact':>6}")
+        for name, preallocate in (('growing', False), ('preallocate', True)):
+            download_dir = Path(tmp, name)
+            download_dir.mkdir()
+            elapsed, _, received, _ = await transfer(source, download_dir, preallocate, False)
+            print(
+                f"{name:>11} | {elapsed:>7.2f} | {size / 2 ** 20 / elapsed:>7.1f} | {extents(received):>7} |"
+                f" {str(digest(received) == expected):>6}"
+            )
+            shutil.rmtree(download_dir)
+        source.unlink()
+
+        source = Path(tmp, 'sparse.bin')
+        make_sparse(source, size)
+        expected = digest(source)
+        print()
+        print(f"sparse file of {size / 2 ** 20:.0f} MB, {disk_usage(source) / 2 ** 20:.0f} MB of it data")
+        print(f"{'sparse':>11} | {'seconds':>7} | {'wire MB':>8} | {'disk MB':>7} | {'intact':>6}")
+        for name, sparse in (('off', False), ('on', True)):
+            download_dir = Path(tmp, f'sparse-{name}')
+            download_dir.mkdir()
+            elapsed, sent, received, _ = await transfer(source, download_dir, True, sparse)
+            print(
+                f"{name:>11} | {elapsed:>7.2f} | {sent / 2 ** 20:>8.1f} | {disk_usage(received) / 2 ** 20:>7.0f} |"
+                f" {str(digest(received) == expected):>6}"
+            )
+            shutil.rmtree(download_dir)
+        source.unlink()
+
+        # all holes, sent whole (sparse off) it needs more than the disk has
+        source = Path(tmp, 'huge.bin')
+        huge = shutil.disk_usage(tmp).free + 2 ** 40
+        with open(source, 'wb') as f:
+            f.truncate(huge)
+        download_dir = Path(tmp, 'huge')
+        download_dir.mkdir()
+        print()
+        print(f"file of {huge / 2 ** 30:.0f} GB against {shutil.disk_usage(tmp).free / 2 ** 30:.0f} GB free")
+        elapsed, sent, received, error = await transfer(source, download_dir, True, False)
+        print(f"failed after {elapsed * 1000:.1f} ms, {sent / 2 ** 20:.1f} MB sent, left behind: {os.listdir(download_dir)}")
+        print(f"  {error!r} from {error.__cause__!r}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main((int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE_MB) * 2 ** 20))
@@ -0,0 +1,163 @@
+"""Many small files (thumbnails) through files.Sender and files.Receiver, one by one against batched
+
+progress bars are real (tqdm, written to devnull) as rendering them per file is part of the cost,
+files are not verified but in the last row (one by one, verifying costs a round trip per file),
+a second table breaks a batched transfer halfway and resumes it over a new connection,
+results are printed as tables:
+
+    python tests/batchbench.py [file count]
+"""
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from types import SimpleNamespace
+
+import _path  # noqa
+from dirbench import tree_digest
+from filebench import _drain, connection_pairs
+from src.avails import connect
+from src.transfers import TransferState, files
+from src.transfers.status import StatusMixIn
+
+DEFAULT_FILE_COUNT = 10_000
+MIN_FILE_SIZE = 2 * 1024
+MAX_FILE_SIZE = 40 * 1024
+
+
+class CountingStatus(StatusMixIn):
+    """counts progress bars set up"""
+    __slots__ = 'bars',
+
+    def __init__(self, yield_freq):
+        super().__init__(yield_freq)
+        self.bars = 0
+
+    def status_setup(self, prefix, initial_limit, final_limit):
+        self.bars += 1
+        super().status_setup(prefix, initial_limit, final_limit)
+
+
+class BreakingSender(connect.Sender):
+    """fails once ``limit`` bytes are sent, as a dropped connection would"""
+    __slots__ = 'limit', 'sent'
+
+    def __init__(self, sock, limit):
+        super().__init__(sock)
+        self.limit = limit
+        self.sent = 0
+
+    async def __call__(self, buf):
+        if self.sent + len(buf) > self.limit:
+            raise ConnectionResetError("connection broken by batchbench")
+        self.sent += len(buf)
+        return await super().__call__(buf)
+
+    async def sendfile(self, file, offset, count):
+        sent = await super().sendfile(file, offset, count)
+        self.sent += sent
+        return sent
+
+
+def make_thumbnails(root: Path, count):
+    rng = random.Random(7)
+    block = os.urandom(MAX_FILE_SIZE)
+    total = 0
+    for index in range(count):
+        size = rng.randrange(MIN_FILE_SIZE, MAX_FILE_SIZE)
+        (root / f"thumb{index:05}.jpg").write_bytes(block[:size])
+        total += size
+    return total
+
+
+def make_handles(sources, download_dir, batch, verify):
+    peer = SimpleNamespace(peer_id='batchbench')
+    total = sum(path.stat().st_size for path in sources)
+    sender = files.Sender(peer, '1', sources, CountingStatus(10), verify=verify, batch=batch)
+    receiver = files.Receiver(
+        peer, '1', download_dir, CountingStatus(10), verify=verify, batch=batch, total_size=total
+    )
+    return sender, receiver
+
+
+async def run(sender_gen, receiver_gen):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        return await asyncio.gather(_drain(sender_gen), _drain(receiver_gen), return_exceptions=True)
+
+
+async def _closing(generator, sock):
+    """drains ``generator`` and closes ``sock`` after, as file manager does once sender is done with"""
+    try:
+        async for item in generator:
+            yield item
+    finally:
+        sock.close()
+
+
+async def transfer(sources, download_dir, batch, verify):
+    sender, receiver = make_handles(sources, download_dir, batch, verify)
+    with ExitStack() as exit_stack:
+        (client, server), = await connection_pairs(1, exit_stack)
+        sender.connection_made(connect.Sender(client), connect.Receiver(client))
+        receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+        start = time.perf_counter()
+        await run(sender.send_files(), receiver.recv_files())
+        elapsed = time.perf_counter() - start
+    return elapsed, sender.status_updater.bars + receiver.status_updater.bars
+
+
+async def broken_and_resumed(sources, download_dir, break_at):
+    sender, receiver = make_handles(sources, download_dir, True, True)
+    with ExitStack() as exit_stack:
+        (client, server), = await connection_pairs(1, exit_stack)
+        sender.connection_made(BreakingSender(client, break_at), connect.Receiver(client))
+        receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+        await run(_closing(sender.send_files(), client), receiver.recv_files())
+    files_before = receiver._files_done  # noqa
+    assert sender.state == receiver.state == TransferState.PAUSED, (sender.state, receiver.state)
+
+    with ExitStack() as exit_stack:
+        (client, server), = await connection_pairs(1, exit_stack)
+        sender.connection_made(connect.Sender(client), connect.Receiver(client))
+        # a fresh connection for the paused receiver, as a new file connection would bring
+        receiver.connection_wait = asyncio.get_running_loop().create_future()
+        receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+        await run(sender.continue_transfer(), receiver.continue_transfer())
+    return files_before, receiver.state
+
+
+async def main(count):
+    with tempfile.TemporaryDirectory() as tmp:
+        source_dir = Path(tmp, 'thumbnails')
+        source_dir.mkdir()
+        total = make_thumbnails(source_dir, count)
+        sources = sorted(source_dir.iterdir())
+        expected = tree_digest(source_dir)
+
+        print(f"{count} files, {total / 2 ** 20:.1f} MB")
+        print(f"{'mode':>9} | {'seconds':>7} | {'files/s':>8} | {'MB/s':>6} | {'bars':>6} | {'intact':>6}")
+        for name, batch, verify in (('per file', False, False), ('batched', True, False), ('+ verify', True, True)):
+            download_dir = Path(tmp, name)
+            download_dir.mkdir()
+            elapsed, bars = await transfer(sources, download_dir, batch, verify)
+            intact = tree_digest(download_dir) == expected
+            print(
+                f"{name:>9} | {elapsed:>7.2f} | {count / elapsed:>8.0f} | {total / 2 ** 20 / elapsed:>6.1f} |"
+                f" {bars:>6} | {str(intact):>6}"
+            )
+
+        print()
+        print(f"{'resume':>9} | {'files before break':>18} | {'state':>9} | {'intact':>6}")
+        download_dir = Path(tmp, 'resumed')
+        download_dir.mkdir()
+        files_before, state = await broken_and_resumed(sources, download_dir, total // 2)
+        print(f"{'halfway':>9} | {files_before:>18} | {state.name:>9} | {str(tree_digest(download_dir) == expected):>6}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FILE_COUNT))
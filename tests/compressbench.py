@@ -0,0 +1,160 @@
+"""Compressed file and directory transfers against uncompressed ones, over loopback and throttled links
+
+text (log lines), csv, random (already compressed, skipped by entropy sampling) files and a source tree
+(this repository's src copied over and over), links are loopback or throttled to 1 GbE / Wi-Fi like rates
+at the sender, event loop lag (how late a 10 ms sleep wakes up) is probed all along to show that codecs
+stay off the loop, results are printed as a table:
+
+    python tests/compressbench.py [file size in MB]
+"""
+import asyncio
+import contextlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from types import SimpleNamespace
+
+import _path  # noqa
+from dirbench import LagProbe, tree_digest
+from filebench import QuietStatus, _drain, connection_pairs, digest
+from src.avails import connect
+from src.transfers import files
+from src.transfers.files import DirReceiver, DirSender
+
+DEFAULT_SIZE_MB = 128
+TREE_COPIES = 20
+LINKS = (('loopback', None), ('1 GbE', 117 * 2 ** 20), ('wi-fi', 30 * 2 ** 20))
+CODECS = ('none', 'zlib', 'lzma')
+
+
+class ThrottledSender(connect.Sender):
+    """counts bytes handed to the socket and holds them back to ``rate`` bytes per second, if given"""
+    __slots__ = 'rate', 'sent', '_due'
+
+    def __init__(self, sock, rate):
+        super().__init__(sock)
+        self.rate = rate
+        self.sent = 0
+        self._due = 0.0
+
+    async def _throttle(self, nbytes):
+        self.sent += nbytes
+        if self.rate is None:
+            return
+        now = time.perf_counter()
+        self._due = max(self._due, now) + nbytes / self.rate
+        await asyncio.sleep(self._due - now)
+
+    async def __call__(self, buf):
+        result = await super().__call__(buf)
+        await self._throttle(len(buf))
+        return result
+
+    async def sendfile(self, file, offset, count):
+        sent = await super().sendfile(file, offset, count)
+        await self._throttle(sent)
+        return sent
+
+
+def make_text(path: Path, size):
+    rng = random.Random(7)
+    levels = ('INFO', 'DEBUG', 'WARNING', 'ERROR')
+    words = 'peer connection transfer file chunk socket gossip request stripe manifest'.split()
+    with open(path, 'w') as f:
+        while f.tell() < size:
+            f.write(
+                f"2024-05-{rng.randrange(1, 29):02} 12:{rng.randrange(60):02}:{rng.randrange(60):02},"
+                f"{rng.randrange(1000):03} {rng.choice(levels)} [{rng.choice(words)}] "
+                f"{' '.join(rng.choices(words, k=rng.randrange(4, 12)))} id={rng.randrange(10 ** 6)}\n"
+            )
+
+
+def make_csv(path: Path, size):
+    rng = random.Random(7)
+    with open(path, 'w') as f:
+        f.write("id,timestamp,peer,bytes,latency_ms,status\n")
+        row = 0
+        while f.tell() < size:
+            f.write(
+                f"{row},{1700000000 + row * 3},{rng.randrange(256)}.{rng.randrange(256)},"
+                f"{rng.randrange(10 ** 7)},{rng.random() * 50:.3f},{rng.choice(('ok', 'retry', 'fail'))}\n"
+            )
+            row += 1
+
+
+def make_random(path: Path, size):
+    with open(path, 'wb') as f:
+        for offset in range(0, size, 2 ** 20):
+            f.write(os.urandom(min(2 ** 20, size - offset)))
+
+
+def make_tree(root: Path):
+    source = Path(_path.__file__).parent.parent / 'src'
+    for copy in range(TREE_COPIES):
+        shutil.copytree(source, root / f"src{copy}", ignore=shutil.ignore_patterns('__pycache__'))
+
+
+async def transfer(source: Path, download_dir: Path, codec, rate):
+    peer = SimpleNamespace(peer_id='compressbench')
+    with ExitStack() as exit_stack:
+        (client, server), = await connection_pairs(1, exit_stack)
+        if source.is_dir():
+            sender = DirSender(peer, '1', source, QuietStatus(1), pipelined=True, compression=codec)
+            receiver = DirReceiver(peer, '1', download_dir, QuietStatus(1), pipelined=True, compression=codec)
+        else:
+            sender = files.Sender(peer, '1', [source], QuietStatus(1), compression=codec)
+            receiver = files.Receiver(peer, '1', download_dir, QuietStatus(1), compression=codec)
+        throttled = ThrottledSender(client, rate)
+        sender.connection_made(throttled, connect.Receiver(client))
+        receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), LagProbe() as probe:
+            await asyncio.gather(_drain(sender.send_files()), _drain(receiver.recv_files()))
+        elapsed = time.perf_counter() - start
+    return elapsed, throttled.sent, probe, sender.compression_level
+
+
+async def main(size):
+    print(f"files of {size / 2 ** 20:.0f} MB, source tree is {TREE_COPIES} copies of src")
+    print(
+        f"{'data':>7} | {'link':>8} | {'codec':>5} | {'wire MB':>8} | {'seconds':>7} | {'MB/s':>7} |"
+        f" {'level':>5} | {'p99 lag ms':>10} | {'intact':>6}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = []
+        for name, make in (('text', make_text), ('csv', make_csv), ('random', make_random)):
+            path = Path(tmp, f"{name}.dat")
+            make(path, size)
+            sources.append((name, path))
+        tree = Path(tmp, 'tree')
+        make_tree(tree)
+        sources.append(('tree', tree))
+
+        for name, source in sources:
+            is_tree = source.is_dir()
+            expected = tree_digest(source) if is_tree else digest(source)
+            total = sum(path.stat().st_size for path in source.rglob('*') if path.is_file()) if is_tree else size
+            for link, rate in LINKS:
+                for codec in CODECS:
+                    download_dir = Path(tmp, 'received')
+                    download_dir.mkdir()
+                    elapsed, sent, probe, level = await transfer(source, download_dir, codec, rate)
+                    received = download_dir if is_tree else Path(download_dir, source.name)
+                    intact = (tree_digest(received) if is_tree else digest(received)) == expected
+                    shutil.rmtree(download_dir)
+                    _, p99_lag = probe.summary()
+                    print(
+                        f"{name:>7} | {link:>8} | {codec:>5} | {sent / 2 ** 20:>8.1f} | {elapsed:>7.2f} |"
+                        f" {total / 2 ** 20 / elapsed:>7.1f} | {str(level.level if level else '-'):>5} |"
+                        f" {p99_lag:>10.1f} | {str(intact):>6}"
+                    )
+
+
+if __name__ == '__main__':
+    asyncio.run(main((int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE_MB) * 2 ** 20))
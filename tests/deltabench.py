@@ -0,0 +1,127 @@
+"""Delta transfers of files the receiver has an older version of, against sending them whole
+
+the older version sits in the download directory under the same name, the new one has 1% or 10% of its
+blocks changed in place (or a few bytes inserted, shifting everything after them),
+bytes put on the wire are counted at both ends (receiver sends block signatures), results are printed as a table:
+
+    python tests/deltabench.py [file size in MB]
+"""
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from types import SimpleNamespace
+
+import _path  # noqa
+from filebench import QuietStatus, _drain, connection_pairs, digest
+from src.avails import connect
+from src.transfers import files
+from src.transfers.files import delta
+
+DEFAULT_SIZE_MB = 256
+INSERTIONS = 3
+
+
+class CountingSender(connect.Sender):
+    """counts bytes handed to the socket"""
+    __slots__ = 'sent',
+
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.sent = 0
+
+    async def __call__(self, buf):
+        self.sent += len(buf)
+        return await super().__call__(buf)
+
+    async def sendfile(self, file, offset, count):
+        sent = await super().sendfile(file, offset, count)
+        self.sent += sent
+        return sent
+
+
+def make_file(path: Path, size):
+    """random all the way through, a repeating pattern would let blocks be found anywhere"""
+    with open(path, 'wb') as f:
+        for offset in range(0, size, 2 ** 20):
+            f.write(os.urandom(min(2 ** 20, size - offset)))
+
+
+def modify_blocks(path: Path, fraction, seed=7):
+    """flips a byte in ``fraction`` of blocks (as receiver splits the file) chosen at random"""
+    data = bytearray(path.read_bytes())
+    block_size = delta.block_size_for(len(data))
+    block_count = len(data) // block_size
+    rng = random.Random(seed)
+    for index in rng.sample(range(block_count), max(1, int(block_count * fraction))):
+        data[index * block_size + rng.randrange(block_size)] ^= 0xFF
+    path.write_bytes(data)
+
+
+def insert_bytes(path: Path, seed=7):
+    data = bytearray(path.read_bytes())
+    rng = random.Random(seed)
+    for offset in sorted(rng.sample(range(len(data)), INSERTIONS), reverse=True):
+        data[offset:offset] = rng.randbytes(rng.randrange(1, 64))
+    path.write_bytes(data)
+
+
+async def transfer(source: Path, download_dir: Path, use_delta):
+    peer = SimpleNamespace(peer_id='deltabench')
+    with ExitStack() as exit_stack:
+        (client, server), = await connection_pairs(1, exit_stack)
+        sender = files.Sender(peer, '1', [source], QuietStatus(1), delta=use_delta)
+        receiver = files.Receiver(peer, '1', download_dir, QuietStatus(1), delta=use_delta)
+        counting, signing = CountingSender(client), CountingSender(server)
+        sender.connection_made(counting, connect.Receiver(client))
+        receiver.connection_made(signing, connect.Receiver(server))
+
+        start = time.perf_counter()
+        await asyncio.gather(_drain(sender.send_files()), _drain(receiver.recv_files()))
+        elapsed = time.perf_counter() - start
+    return elapsed, counting.sent, signing.sent, receiver.file_items[0].path
+
+
+async def main(size):
+    cases = (
+        ('unchanged', lambda path: None, True),
+        ('1% blocks', lambda path: modify_blocks(path, 0.01), True),
+        ('10% blocks', lambda path: modify_blocks(path, 0.10), True),
+        ('inserted', insert_bytes, True),
+        ('10% whole', lambda path: modify_blocks(path, 0.10), False),
+    )
+    print(f"file size {size / 2 ** 20:.0f} MB, block size {delta.block_size_for(size) // 1024} KB")
+    print(
+        f"{'case':>10} | {'sent MB':>8} | {'of file':>7} | {'back MB':>7} | {'seconds':>7} | {'MB/s':>7} |"
+        f" {'intact':>6}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        older = Path(tmp, 'older.bin')
+        make_file(older, size)
+        for name, modify, use_delta in cases:
+            source_dir, download_dir = Path(tmp, 'source'), Path(tmp, 'received')
+            source_dir.mkdir()
+            download_dir.mkdir()
+            source = Path(source_dir, 'data.bin')
+            shutil.copyfile(older, source)
+            shutil.copyfile(older, Path(download_dir, 'data.bin'))
+            modify(source)
+
+            elapsed, sent, sent_back, received = await transfer(source, download_dir, use_delta)
+            intact = digest(received) == digest(source)
+            new_size = source.stat().st_size
+            print(
+                f"{name:>10} | {sent / 2 ** 20:>8.2f} | {sent / new_size * 100:>6.1f}% | {sent_back / 2 ** 20:>7.2f} |"
+                f" {elapsed:>7.2f} | {new_size / 2 ** 20 / elapsed:>7.1f} | {str(intact):>6}"
+            )
+            shutil.rmtree(source_dir)
+            shutil.rmtree(download_dir)
+
+
+if __name__ == '__main__':
+    asyncio.run(main((int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE_MB) * 2 ** 20))
@@ -0,0 +1,243 @@
+"""Directory transfers over loopback, per file acknowledgements against pipelined mode
+
+a synthetic tree of many small files (and a couple of large ones) is sent with DirSender to DirReceiver,
+per file acknowledgements cost a round trip each, so that mode runs on a smaller tree,
+event loop lag (how late a 10 ms sleep wakes up) is probed all along,
+a second table compares scanning the tree on the event loop against the scanner thread,
+a third one breaks a pipelined transfer halfway and resumes it over a new connection
+(receiver rebuilt from the manifest it kept on disk), results are printed as tables:
+
+    python tests/dirbench.py [file count]
+"""
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, aclosing
+from pathlib import Path
+from types import SimpleNamespace
+
+import _path  # noqa
+from filebench import QuietStatus, connection_pairs
+from src.avails import connect
+from src.transfers import TransferState
+from src.transfers.files import DirManifest, DirReceiver, DirSender
+from src.transfers.files.directory import _scan_tree
+
+DEFAULT_FILE_COUNT = 50_000
+FILES_PER_DIR = 100
+LARGE_FILES = 2
+LARGE_FILE_SIZE = 8 * 2 ** 20
+LEGACY_FILE_COUNT = 1000
+LAG_PROBE_INTERVAL = 0.01
+
+
+def make_tree(root: Path, file_count):
+    rng = random.Random(7)
+    block = os.urandom(16 * 1024)
+    total = 0
+    for index in range(file_count):
+        directory = root / f"d{index // FILES_PER_DIR // 10}" / f"d{index // FILES_PER_DIR}"
+        if index % FILES_PER_DIR == 0:
+            directory.mkdir(parents=True, exist_ok=True)
+        size = rng.randrange(0, len(block))
+        (directory / f"f{index}.bin").write_bytes(block[:size])
+        total += size
+    for index in range(LARGE_FILES):
+        (root / f"large{index}.bin").write_bytes(os.urandom(LARGE_FILE_SIZE))
+        total += LARGE_FILE_SIZE
+    return total
+
+
+def tree_digest(root: Path):
+    digest = hashlib.blake2b()
+    for path in sorted(root.rglob('*')):
+        digest.update(path.relative_to(root).as_posix().encode())
+        if path.is_file():
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+async def _drain(generator):
+    async with aclosing(generator) as items:
+        async for _ in items:
+            pass
+
+
+class LagProbe:
+    """Sleeps ``LAG_PROBE_INTERVAL`` in a loop and records how late each wake up is"""
+
+    def __init__(self):
+        self.lags = []
+        self._task = None
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            self.lags.append(loop.time() - started - LAG_PROBE_INTERVAL)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._probe())
+        return self
+
+    def __exit__(self, *exc_info):
+        self._task.cancel()
+
+    def summary(self):
+        if not self.lags:
+            return 0.0, 0.0
+        lags = sorted(self.lags)
+        return lags[-1] * 1000, lags[int(len(lags) * 0.99)] * 1000
+
+
+async def scan_on_loop(root: Path):
+    count = 0
+    for path in root.rglob('*'):
+        if path.is_file():
+            path.stat()
+        count += 1
+        await asyncio.sleep(0)  # what the legacy sender loop amounts to, yielding between entries
+    return count
+
+
+async def scan_in_thread(root: Path):
+    count = 0
+    async with aclosing(_scan_tree(root)) as scanner:
+        async for batch in scanner:
+            count += len(batch)
+    return count
+
+
+async def transfer(source: Path, download_dir: Path, pipelined):
+    peer = SimpleNamespace(peer_id='dirbench')
+    with ExitStack() as exit_stack:
+        (client, server), = await connection_pairs(1, exit_stack)
+        sender = DirSender(peer, '1', source, QuietStatus(1), pipelined=pipelined)
+        receiver = DirReceiver(peer, '1', download_dir, QuietStatus(1), pipelined=pipelined)
+        sender.connection_made(connect.Sender(client), connect.Receiver(client))
+        receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), LagProbe() as probe:
+            await asyncio.gather(_drain(sender.send_files()), _drain(receiver.recv_files()))
+        return time.perf_counter() - start, probe
+
+
+async def interrupted_transfer(source: Path, download_dir: Path, manifests: Path, break_at):
+    """Breaks the connection once ``break_at`` bytes are sent, resumes over a new one
+
+    Returns:
+        tuple[int, int, float]: bytes sent before the break, bytes sent after resuming, seconds taken to resume
+    """
+    peer = SimpleNamespace(peer_id='dirbench')
+    with ExitStack() as exit_stack:
+        (client, server), (resumed_client, resumed_server) = await connection_pairs(2, exit_stack)
+        sender = DirSender(
+            peer, '1', source, QuietStatus(1), pipelined=True, manifest_path=Path(manifests, 'sending')
+        )
+        receiver = DirReceiver(
+            peer, '1', download_dir, QuietStatus(1), pipelined=True, manifest_path=Path(manifests, 'receiving')
+        )
+        sender.connection_made(connect.Sender(client), connect.Receiver(client))
+        receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+
+        sent_before = 0
+
+        async def send_until_broken():
+            nonlocal sent_before
+            async with aclosing(sender.send_files()) as sending:
+                async for sent_before in sending:
+                    if sent_before >= break_at and client.fileno() != -1:
+                        client.shutdown(socket.SHUT_RDWR)
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            logging.disable(logging.ERROR)  # both ends log the broken connection as they pause
+            try:
+                await asyncio.gather(send_until_broken(), _drain(receiver.recv_files()), return_exceptions=True)
+            finally:
+                logging.disable(logging.NOTSET)
+            assert sender.state is receiver.state is TransferState.PAUSED, (sender.state, receiver.state)
+
+            # as if receiving end restarted in between
+            manifest = await asyncio.to_thread(DirManifest.load, Path(manifests, 'receiving'))
+            receiver = DirReceiver.from_manifest(peer, '1', manifest, QuietStatus(1))
+            sender.connection_made(connect.Sender(resumed_client), connect.Receiver(resumed_client))
+            receiver.connection_made(connect.Sender(resumed_server), connect.Receiver(resumed_server))
+
+            sent_after = 0
+
+            async def resume():
+                nonlocal sent_after
+                async with aclosing(sender.continue_transfer()) as sending:
+                    async for sent_after in sending:
+                        pass
+
+            start = time.perf_counter()
+            await asyncio.gather(resume(), _drain(receiver.continue_transfer()))
+        return sent_before, sent_after, time.perf_counter() - start
+
+
+async def main(file_count):
+    print(f"small files up to 16 KB, {LARGE_FILES} large files of {LARGE_FILE_SIZE // 2 ** 20} MB")
+    print(
+        f"{'mode':>12} | {'files':>7} | {'MB':>6} | {'seconds':>7} | {'files/s':>8} | {'MB/s':>7} | {'intact':>6} |"
+        f" {'max lag ms':>10} | {'p99 lag ms':>10}"
+    )
+    modes = (('per file ack', False, min(file_count, LEGACY_FILE_COUNT)), ('pipelined', True, file_count))
+    for name, pipelined, count in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            source, download_dir = Path(tmp, 'source'), Path(tmp, 'received')
+            source.mkdir()
+            download_dir.mkdir()
+            total = make_tree(source, count)
+            elapsed, probe = await transfer(source, download_dir, pipelined)
+            intact = tree_digest(download_dir) == tree_digest(source)
+            max_lag, p99_lag = probe.summary()
+            print(
+                f"{name:>12} | {count + LARGE_FILES:>7} | {total / 2 ** 20:>6.1f} | {elapsed:>7.2f} |"
+                f" {(count + LARGE_FILES) / elapsed:>8.0f} | {total / 2 ** 20 / elapsed:>7.1f} | {str(intact):>6} |"
+                f" {max_lag:>10.1f} | {p99_lag:>10.1f}"
+            )
+
+    print()
+    print(f"{'scan':>12} | {'entries':>7} | {'seconds':>7} | {'entries/s':>9} | {'max lag ms':>10} | {'p99 lag ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        make_tree(Path(tmp), file_count)
+        for name, scan in (('on loop', scan_on_loop), ('thread', scan_in_thread)):
+            with LagProbe() as probe:
+                start = time.perf_counter()
+                entries = await scan(Path(tmp))
+                elapsed = time.perf_counter() - start
+            max_lag, p99_lag = probe.summary()
+            print(
+                f"{name:>12} | {entries:>7} | {elapsed:>7.2f} | {entries / elapsed:>9.0f} |"
+                f" {max_lag:>10.1f} | {p99_lag:>10.1f}"
+            )
+
+
+    print()
+    print(f"{'resume':>12} | {'files':>7} | {'MB':>6} | {'sent MB':>7} | {'resent MB':>9} | {'seconds':>7} | {'intact':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        source, download_dir, manifests = Path(tmp, 'source'), Path(tmp, 'received'), Path(tmp, 'manifests')
+        source.mkdir()
+        download_dir.mkdir()
+        total = make_tree(source, file_count)
+        sent_before, sent_after, elapsed = await interrupted_transfer(source, download_dir, manifests, total // 2)
+        intact = tree_digest(download_dir) == tree_digest(source)
+        print(
+            f"{'half way':>12} | {file_count + LARGE_FILES:>7} | {total / 2 ** 20:>6.1f} |"
+            f" {sent_before / 2 ** 20:>7.1f} | {sent_after / 2 ** 20:>9.1f} | {elapsed:>7.2f} | {str(intact):>6}"
+        )
+        print(f"manifests left behind: {sorted(path.name for path in manifests.iterdir())}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FILE_COUNT))
@@ -0,0 +1,210 @@
+"""Loopback throughput of file transfers between files.Sender and files.Receiver
+
+send paths (mmap, sendfile), receive paths (recv, recv_into, recv_into + pwrite),
+fixed chunk sizes from ``calculate_chunk_size`` against adaptive ones over a single connection,
+striped transfers, chunk hashing throughput and verified transfers (with one byte flipped on the way),
+results are printed as tables, cpu % is of the whole process (both ends and disk io threads):
+
+    python tests/filebench.py [file size in MB]
+"""
+import asyncio
+import hashlib
+import os
+import socket
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, aclosing
+from pathlib import Path
+from types import SimpleNamespace
+
+import _path  # noqa
+from src.avails import connect, const
+from src.transfers import files
+from src.transfers.files import integrity
+from src.transfers.files._fileobject import calculate_chunk_size
+from src.transfers.status import StatusMixIn
+
+STRIPES = (1, 2, 4, 8)
+SEND_PATHS = (('mmap', False), ('sendfile', True))
+RECV_PATHS = (('recv', False, False), ('recv_into', True, False), ('pwrite', True, True))
+DEFAULT_SIZE_MB = 512
+
+
+class QuietStatus(StatusMixIn):
+    """keeps progress bars out of the table"""
+
+    def status_setup(self, prefix, initial_limit, final_limit):
+        self.current_status = initial_limit
+
+    def update_status(self, status):
+        self.current_status = status
+
+
+class CorruptingReceiver(connect.Receiver):
+    """flips one byte of the stream at ``offset``, as a faulty link or disk would, counts bytes received"""
+    __slots__ = 'offset', 'received'
+
+    def __init__(self, sock, offset):
+        super().__init__(sock)
+        self.offset = offset
+        self.received = 0
+
+    def _corrupt(self, view, count):
+        if self.received <= self.offset < self.received + count:
+            view[self.offset - self.received] ^= 0xFF
+        self.received += count
+
+    async def __call__(self, nbytes):
+        data = bytearray(await super().__call__(nbytes))
+        self._corrupt(data, len(data))
+        return bytes(data)
+
+    async def recv_into(self, buffer):
+        received = await super().recv_into(buffer)
+        self._corrupt(memoryview(buffer), received)
+        return received
+
+
+def make_file(path: Path, size):
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size // len(block)):
+            f.write(block)
+        f.write(block[:size % len(block)])
+
+
+def digest(path: Path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'blake2b').hexdigest()
+
+
+async def connection_pairs(count, exit_stack):
+    loop = asyncio.get_running_loop()
+    server = exit_stack.enter_context(socket.create_server(('127.0.0.1', 0)))
+    server.setblocking(False)
+    pairs = []
+    for _ in range(count):
+        client = exit_stack.enter_context(connect.Socket(socket.AF_INET, socket.SOCK_STREAM))
+        client.setblocking(False)
+        await loop.sock_connect(client, server.getsockname())
+        accepted, _ = await loop.sock_accept(server)
+        accepted = exit_stack.enter_context(connect.Socket(fileno=accepted.detach()))
+        accepted.setblocking(False)
+        pairs.append((client, accepted))
+    return pairs
+
+
+async def _drain(generator):
+    async with aclosing(generator) as items:
+        async for _ in items:
+            pass
+
+
+async def transfer(source: Path, download_dir: Path, stripes, verify=False, corrupt_at=None):
+    peer = SimpleNamespace(peer_id='filebench')
+    with ExitStack() as exit_stack:
+        pairs = await connection_pairs(stripes, exit_stack)
+        sender = files.Sender(peer, '1', [source], QuietStatus(1), stripes=stripes, verify=verify)
+        receiver = files.Receiver(peer, '1', download_dir, QuietStatus(1), stripes=stripes, verify=verify)
+        for index, (client, server) in enumerate(pairs):
+            if index == 0:
+                sender.connection_made(connect.Sender(client), connect.Receiver(client))
+                if corrupt_at is None:
+                    recv_func = connect.Receiver(server)
+                else:
+                    recv_func = transfer.corrupting = CorruptingReceiver(server, corrupt_at)
+                receiver.connection_made(connect.Sender(server), recv_func)
+            else:
+                sender.stripe_made(index, connect.Sender(client), connect.Receiver(client))
+                receiver.stripe_made(index, connect.Sender(server), connect.Receiver(server))
+
+        start = time.perf_counter()
+        await asyncio.gather(_drain(sender.send_files()), _drain(receiver.recv_files()))
+        elapsed = time.perf_counter() - start
+    return elapsed, receiver.file_items[0].path
+
+
+async def _compare_path(name, source, download_dir, expected, size):
+    download_dir.mkdir()
+    cpu_start = time.process_time()
+    elapsed, received = await transfer(source, download_dir, 1)
+    cpu = time.process_time() - cpu_start
+    intact = digest(received) == expected
+    received.unlink()
+    print(
+        f"{name:>9} | {elapsed:>7.2f} | {size / 2 ** 20 / elapsed:>8.1f} |"
+        f" {cpu / elapsed * 100:>6.1f} | {str(intact):>6}"
+    )
+
+
+async def main(size):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp, 'source.bin')
+        make_file(source, size)
+        expected = digest(source)
+
+        print(f"file size {size / 2 ** 20:.0f} MB")
+        print(f"{'path':>9} | {'seconds':>7} | {'MB/s':>8} | {'cpu %':>6} | {'intact':>6}")
+        for name, use_sendfile in SEND_PATHS:
+            const.FILE_SENDFILE = use_sendfile
+            await _compare_path(name, source, Path(tmp, name), expected, size)
+        const.FILE_SENDFILE = True
+
+        recv_defaults = const.FILE_RECV_INTO, const.FILE_PWRITE
+        for name, use_recv_into, use_pwrite in RECV_PATHS:
+            const.FILE_RECV_INTO, const.FILE_PWRITE = use_recv_into, use_pwrite
+            await _compare_path(name, source, Path(tmp, name), expected, size)
+        const.FILE_RECV_INTO, const.FILE_PWRITE = recv_defaults
+
+        chunk_bounds = const.MIN_CHUNK_SIZE, const.MAX_CHUNK_SIZE
+        const.MIN_CHUNK_SIZE = const.MAX_CHUNK_SIZE = calculate_chunk_size(size)
+        await _compare_path('fixed', source, Path(tmp, 'fixed'), expected, size)
+        const.MIN_CHUNK_SIZE, const.MAX_CHUNK_SIZE = chunk_bounds
+        await _compare_path('adaptive', source, Path(tmp, 'adaptive'), expected, size)
+
+        print()
+        print(f"{'stripes':>7} | {'seconds':>7} | {'MB/s':>8} | {'speedup':>7} | {'intact':>6}")
+        baseline = None
+        for stripes in STRIPES:
+            download_dir = Path(tmp, f'stripes-{stripes}')
+            download_dir.mkdir()
+            elapsed, received = await transfer(source, download_dir, stripes)
+            baseline = baseline or elapsed
+            intact = digest(received) == expected
+            received.unlink()
+            print(
+                f"{stripes:>7} | {elapsed:>7.2f} | {size / 2 ** 20 / elapsed:>8.1f} |"
+                f" {baseline / elapsed:>6.2f}x | {str(intact):>6}"
+            )
+
+        print()
+        print(f"{'hashing':>9} | {'seconds':>7} | {'MB/s':>8} | {'of 1 GB/s':>9}   ({os.cpu_count()} cpus)")
+        started = time.perf_counter()
+        integrity.hash_range(source, 0, size)
+        elapsed = time.perf_counter() - started
+        print(f"{'1 thread':>9} | {elapsed:>7.2f} | {size / 2 ** 20 / elapsed:>8.1f} | {size / 2 ** 30 / elapsed:>8.1f}x")
+        with integrity.ChunkHasher(source, size) as hasher:
+            started = time.perf_counter()
+            await hasher.digests()
+            elapsed = time.perf_counter() - started
+        print(f"{'pool':>9} | {elapsed:>7.2f} | {size / 2 ** 20 / elapsed:>8.1f} | {size / 2 ** 30 / elapsed:>8.1f}x")
+
+        print()
+        print(f"{'verify':>9} | {'seconds':>7} | {'MB/s':>8} | {'resent MB':>9} | {'intact':>6}")
+        for name, verify, corrupt_at in (('off', False, None), ('on', True, None), ('corrupted', True, size // 2)):
+            download_dir = Path(tmp, f'verify-{name}')
+            download_dir.mkdir()
+            elapsed, received = await transfer(source, download_dir, 1, verify=verify, corrupt_at=corrupt_at)
+            resent = transfer.corrupting.received - size if corrupt_at is not None else 0
+            intact = digest(received) == expected
+            received.unlink()
+            print(
+                f"{name:>9} | {elapsed:>7.2f} | {size / 2 ** 20 / elapsed:>8.1f} |"
+                f" {resent / 2 ** 20:>9.2f} | {str(intact):>6}"
+            )
+
+
+if __name__ == '__main__':
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE_MB
+    asyncio.run(main(size_mb * 2 ** 20))
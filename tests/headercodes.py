@@ -0,0 +1,96 @@
+"""Pins one byte header codes of WireData's binary envelope, they are part of the wire format
+
+a peer on an older build decodes headers by these codes, changing one routes its messages to a wrong handler:
+
+    python tests/headercodes.py
+"""
+import unittest
+
+import _path  # noqa
+from src.avails import WireData
+from src.transfers import DISCOVERY, GOSSIP, HEADERS, REQUESTS_HEADERS
+
+HEADER_CODE_OFFSET = 3  # | 0xC1 | ENVELOPE VERSION | FLAGS | HEADER CODE | ...
+UNREGISTERED = 0xFF
+
+PINNED = {
+    HEADERS.REQ_FOR_LIST: 0x01,
+    HEADERS.REDIRECT: 0x02,
+    HEADERS.SERVER_OK: 0x03,
+    HEADERS.REMOVAL_PING: 0x04,
+    HEADERS.CMD_RECV_FILE_AGAIN: 0x05,
+    HEADERS.CMD_VERIFY_HEADER: 0x06,
+    HEADERS.CMD_RECV_FILE: 0x07,
+    HEADERS.CMD_CLOSING_HEADER: 0x08,
+    HEADERS.CMD_TEXT: 0x09,
+    HEADERS.CMD_RECV_DIR: 0x0A,
+    HEADERS.CMD_FILE_CONN: 0x0B,
+    HEADERS.CMD_DIR_CONN: 0x0C,
+    HEADERS.GOSSIP_CREATE_SESSION: 0x0D,
+    HEADERS.GOSSIP_DOWNGRADE_CONN: 0x0E,
+    HEADERS.GOSSIP_UPGRADE_CONN: 0x0F,
+    HEADERS.GOSSIP_SESSION_STATE_UPDATE: 0x10,
+    HEADERS.GOSSIP_UPDATE_STREAM_LINK: 0x11,
+    HEADERS.GOSSIP_LINK_OK: 0x12,
+    HEADERS.GOSSIP_TREE_CHECK: 0x13,
+    HEADERS.GOSSIP_TREE_REJECT: 0x14,
+    HEADERS.GOSSIP_TREE_GATHER: 0x15,
+    HEADERS.OTM_FILE_TRANSFER: 0x16,
+    HEADERS.OTM_UPDATE_STREAM_LINK: 0x17,
+    REQUESTS_HEADERS.REDIRECT: 0x18,
+    REQUESTS_HEADERS.LIST_SYNC: 0x19,
+    REQUESTS_HEADERS.ACTIVE_PING: 0x1A,
+    REQUESTS_HEADERS.REQ_FOR_LIST: 0x1B,
+    REQUESTS_HEADERS.I_AM_ACTIVE: 0x1C,
+    REQUESTS_HEADERS.KADEMLIA: 0x1D,
+    DISCOVERY.NETWORK_FIND: 0x1D,
+    REQUESTS_HEADERS.DISCOVERY: 0x1E,
+    DISCOVERY.NETWORK_FIND_REPLY: 0x1E,
+    REQUESTS_HEADERS.GOSSIP: 0x1F,
+    GOSSIP.MESSAGE: 0x20,
+    GOSSIP.SEARCH_REQ: 0x21,
+    GOSSIP.SEARCH_REPLY: 0x22,
+    GOSSIP.CREATE_SESSION: 0x23,
+}
+
+# added after codes were frozen, peers of any build know them by name only
+BY_NAME = (
+    HEADERS.OTM_REPAIR,
+    HEADERS.GOSSIP_SESSION_STATE_ACK,
+)
+
+
+def header_code(header):
+    return bytes(WireData(header=header, msg_id=1))[HEADER_CODE_OFFSET]
+
+
+class HeaderCodes(unittest.TestCase):
+
+    def test_codes_are_pinned(self):
+        for header, code in PINNED.items():
+            with self.subTest(header=header):
+                self.assertEqual(header_code(header), code)
+
+    def test_later_headers_have_no_code(self):
+        for header in BY_NAME:
+            with self.subTest(header=header):
+                self.assertEqual(header_code(header), UNREGISTERED)
+
+    def test_headers_added_later_go_by_name(self):
+        for header_class in (HEADERS, REQUESTS_HEADERS, DISCOVERY, GOSSIP):
+            for name, header in vars(header_class).items():
+                if name.startswith('_') or header in PINNED:
+                    continue
+                with self.subTest(header=header):
+                    self.assertEqual(header_code(header), UNREGISTERED)
+                    self.assertEqual(WireData.load_from(bytes(WireData(header=header))).header, header)
+
+    def test_unknown_code_decodes_by_name(self):
+        # a peer with a newer table names the header as well
+        data = bytearray(bytes(WireData(header='some newer header', msg_id=1)))
+        data[HEADER_CODE_OFFSET] = 0xF0
+        self.assertEqual(WireData.load_from(bytes(data)).header, 'some newer header')
+
+
+if __name__ == '__main__':
+    unittest.main()
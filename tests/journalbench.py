@@ -0,0 +1,221 @@
+"""File transfers journaled by files.TransferJournal, what it costs and what it brings back after a restart
+
+first table sends a file with no journal, with one kept in memory and with one on disk, both ends note progress
+every time status is updated (as file manager does), second one breaks transfers halfway, closes the journal as
+a shutdown would, opens it anew, restores what it brought back and resumes it over a new connection,
+third one tears the last record of the log (a crash while appending) and appends to a log with a small
+``compact_size``, results are printed as tables:
+
+    python tests/journalbench.py [file size in MB]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from types import SimpleNamespace
+
+import _path  # noqa
+from batchbench import BreakingSender, make_thumbnails, run
+from dirbench import tree_digest
+from filebench import connection_pairs, digest, make_file
+from src.avails import connect, const
+from src.transfers import TransferState, files
+from src.transfers.files import journal as journaling
+from src.transfers.status import StatusMixIn
+
+DEFAULT_SIZE_MB = 256
+THUMBNAILS = 2000
+PEER = SimpleNamespace(peer_id='journalbench')
+
+
+async def journaled(generator, handle, journal, sock=None):
+    """drains ``generator`` noting progress of ``handle`` in ``journal`` (if any) as file manager does"""
+    should_yield = handle.status_updater.should_yield
+    try:
+        async for item in generator:
+            if journal is not None and should_yield():
+                journal.progressed(handle)
+            yield item
+    finally:
+        if journal is not None:
+            if handle.state == TransferState.COMPLETED:
+                journal.finished(handle)
+            else:
+                journal.progressed(handle)
+        if sock is not None:
+            sock.close()
+
+
+def raise_failed(results):
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+def make_handles(sources, download_dir, batch):
+    total = sum(path.stat().st_size for path in sources)
+    sender = files.Sender(PEER, '1', sources, StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ), batch=batch)
+    receiver = files.Receiver(
+        PEER, '1', download_dir, StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ), batch=batch, total_size=total
+    )
+    return sender, receiver
+
+
+async def transfer(sources, download_dir, journal):
+    sender, receiver = make_handles(sources, download_dir, False)
+    if journal is not None:
+        journal.started(sender)
+        journal.started(receiver)
+    with ExitStack() as exit_stack:
+        (client, server), = await connection_pairs(1, exit_stack)
+        sender.connection_made(connect.Sender(client), connect.Receiver(client))
+        receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+        start = time.perf_counter()
+        results = await run(
+            journaled(sender.send_files(), sender, journal, client),
+            journaled(receiver.recv_files(), receiver, journal),
+        )
+        raise_failed(results)
+        if journal is not None:
+            await journal.flush()
+        return time.perf_counter() - start
+
+
+async def break_halfway(sources, download_dir, batch, journal_dir):
+    sender, receiver = make_handles(sources, download_dir, batch)
+    total = sum(path.stat().st_size for path in sources)
+    async with files.TransferJournal(journal_dir) as journal:
+        journal.started(sender)
+        journal.started(receiver)
+        with ExitStack() as exit_stack:
+            (client, server), = await connection_pairs(1, exit_stack)
+            sender.connection_made(BreakingSender(client, total // 2), connect.Receiver(client))
+            receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+            await run(
+                journaled(sender.send_files(), sender, journal, client),
+                journaled(receiver.recv_files(), receiver, journal),
+            )
+    assert sender.state == receiver.state == TransferState.PAUSED, (sender.state, receiver.state)
+
+
+async def restart_and_resume(journal_dir):
+    """opens journal in ``journal_dir`` as a restart would and resumes what it brings back
+
+    Returns:
+        seconds taken to load and restore, transfers restored
+    """
+    start = time.perf_counter()
+    async with files.TransferJournal(journal_dir) as journal:
+        restored = {}
+        for entry in journal.resumable():
+            handle = journaling.restore(entry, PEER, StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ))
+            restored[entry.side] = handle
+        elapsed = time.perf_counter() - start
+
+        sender, receiver = restored[journaling.SEND], restored[journaling.RECV]
+        with ExitStack() as exit_stack:
+            (client, server), = await connection_pairs(1, exit_stack)
+            sender.connection_made(connect.Sender(client), connect.Receiver(client))
+            receiver.connection_made(connect.Sender(server), connect.Receiver(server))
+            results = await run(
+                journaled(sender.continue_transfer(), sender, journal, client),
+                journaled(receiver.continue_transfer(), receiver, journal),
+            )
+        raise_failed(results)
+        left = len(journal.entries)
+    return elapsed, len(restored), left
+
+
+async def torn_tail(journal_dir, source):
+    """tears last record of the log in half and loads the journal"""
+    sender = files.Sender(PEER, '7', [source], StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ))
+    async with files.TransferJournal(journal_dir) as journal:
+        journal.started(sender)
+        await journal.flush()
+        sender.state = TransferState.PAUSED
+        journal.progressed(sender)
+        await journal.flush()
+    log = Path(journal_dir, journaling.LOG_NAME)
+    size = log.stat().st_size
+    os.truncate(log, size - 3)
+    async with files.TransferJournal(journal_dir) as journal:
+        entries = list(journal.entries.values())
+    return entries
+
+
+async def compaction(journal_dir, source, updates, compact_size):
+    sender = files.Sender(PEER, '9', [source], StatusMixIn(const.TRANSFER_STATUS_UPDATE_FREQ))
+    log = Path(journal_dir, journaling.LOG_NAME)
+    largest = 0
+    async with files.TransferJournal(journal_dir, compact_size=compact_size) as journal:
+        journal.started(sender)
+        for update in range(updates):
+            sender._sent_before = update  # noqa
+            journal.progressed(sender)
+            await journal.flush()
+            largest = max(largest, log.stat().st_size)
+    start = time.perf_counter()
+    async with files.TransferJournal(journal_dir) as journal:
+        state = next(iter(journal.entries.values())).state
+    return largest, time.perf_counter() - start, state['sent_before'] == updates - 1
+
+
+async def main(size_mb):
+    size = size_mb * 2 ** 20
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = tmp / 'source.bin'
+        make_file(source, size)
+        expected = digest(source)
+
+        print(f"{size_mb} MB file, status every {const.TRANSFER_STATUS_UPDATE_FREQ} chunks")
+        print(f"{'journal':>7} | {'seconds':>7} | {'MB/s':>7} | {'log KB':>6} | {'intact':>6}")
+        for name in ('none', 'memory', 'disk'):
+            download_dir = tmp / f'overhead {name}'
+            download_dir.mkdir()
+            journal_dir = tmp / f'journal {name}' if name == 'disk' else None
+            if name == 'none':
+                elapsed = await transfer([source], download_dir, None)
+            else:
+                async with files.TransferJournal(journal_dir) as journal:
+                    elapsed = await transfer([source], download_dir, journal)
+            log = journal_dir / journaling.LOG_NAME if journal_dir else None
+            log_size = log.stat().st_size / 1024 if log and log.exists() else 0
+            intact = digest(download_dir / source.name) == expected
+            print(f"{name:>7} | {elapsed:>7.2f} | {size_mb / elapsed:>7.1f} | {log_size:>6.1f} | {str(intact):>6}")
+
+        print()
+        thumbnails = tmp / 'thumbnails'
+        thumbnails.mkdir()
+        make_thumbnails(thumbnails, THUMBNAILS)
+        cases = (
+            ('large file', [source], False, lambda path: digest(path / source.name) == expected),
+            ('batched', sorted(thumbnails.iterdir()), True, lambda path: tree_digest(path) == tree_digest(thumbnails)),
+        )
+        print(f"{'restart':>10} | {'restored':>8} | {'restore ms':>10} | {'left in journal':>15} | {'intact':>6}")
+        for name, sources, batch, check in cases:
+            download_dir = tmp / f'restart {name}'
+            download_dir.mkdir()
+            journal_dir = tmp / f'journal restart {name}'
+            await break_halfway(sources, download_dir, batch, journal_dir)
+            elapsed, restored, left = await restart_and_resume(journal_dir)
+            print(
+                f"{name:>10} | {restored:>8} | {elapsed * 1000:>10.1f} | {left:>15} | {str(check(download_dir)):>6}"
+            )
+
+        print()
+        entries = await torn_tail(tmp / 'journal torn', source)
+        print(f"torn tail: {len(entries)} entry loaded, resumable {bool(entries) and entries[0].resumable}")
+        for compact_size in (2 ** 30, 16 * 1024):
+            largest, load_time, current = await compaction(tmp / f'journal {compact_size}', source, 5000, compact_size)
+            print(
+                f"compact at {compact_size / 1024:>8.0f} KB: largest log {largest / 1024:>7.1f} KB,"
+                f" load {load_time * 1000:>6.1f} ms, latest state {current}"
+            )
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE_MB))
@@ -0,0 +1,124 @@
+"""One to many file transfer over loopback, otm.FilesSender through a tree of otm.FilesReceiver relays
+
+tree formation (inform, update states, tree check) is skipped, relays are linked up directly as a
+complete tree of ``const.DEFAULT_GOSSIP_FANOUT`` children per node, every relay has a scheduler of its own
+as it would on its own peer, results are printed as a table, aggregate MB/s counts bytes delivered to every receiver:
+
+    python tests/otmbench.py [size of each file in MB]
+"""
+import asyncio
+import contextlib
+import dataclasses
+import os
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import _path  # noqa
+from filebench import connection_pairs, digest, make_file
+from src.avails import RemotePeer, const
+from src.avails.connect import get_free_port
+from src.core import set_current_remote_peer_object
+from src.transfers import otm
+from src.transfers.otm.relay import OTMLink
+from src.transfers.otm.tree import TreeLink
+from src.transfers.scheduler import TransferScheduler
+
+DEFAULT_SIZE_MB = 16
+FILE_COUNT = 3
+RECEIVER_COUNTS = (5, 10, 20)
+HOST = '127.0.0.1'
+
+
+def link_up(parent, child, peer_id, connection_pair, parent_id='parent'):
+    """makes ``child`` read from ``parent`` over ``connection_pair``, as an accepted tree check would"""
+    client, server = connection_pair
+    loop = asyncio.get_running_loop()
+    client.set_loop(loop)
+    server.set_loop(loop)
+    outgoing = OTMLink(client.getsockname(), client.getpeername(), peer_id, link_type=TreeLink.ACTIVE)
+    outgoing.connection = client  # brings it online
+    parent.active_links[peer_id] = outgoing
+    incoming = OTMLink(server.getsockname(), server.getpeername(), parent_id, link_type=TreeLink.ACTIVE)
+    incoming.connection = server
+    incoming.direction = TreeLink.INCOMING
+    child._parent_link_fut.set_result(incoming)  # noqa
+
+
+def depth(count, fanout):
+    levels, width, covered = 0, 1, 0
+    while covered < count:
+        width *= fanout
+        covered += width
+        levels += 1
+    return levels
+
+
+async def run(sources, receiver_count, root):
+    sender = otm.FilesSender(sources, [], timeout=10)
+    sender.relay.scheduler = TransferScheduler()
+    receivers = []
+    for index in range(receiver_count):
+        download_path = root / f'receiver{index}'
+        download_path.mkdir()
+        receiver = otm.FilesReceiver(
+            dataclasses.replace(sender.session),
+            (HOST, get_free_port()),
+            (HOST, get_free_port()),
+            download_path,
+        )
+        receiver.relay.scheduler = TransferScheduler()
+        receivers.append(receiver)
+
+    fanout = const.DEFAULT_GOSSIP_FANOUT
+    relays = [sender.relay] + [receiver.relay for receiver in receivers]
+    with ExitStack() as exit_stack:
+        pairs = await connection_pairs(receiver_count, exit_stack)
+        for index, pair in enumerate(pairs, start=1):
+            link_up(relays[(index - 1) // fanout], relays[index], f'receiver{index - 1}', pair)
+
+        start = time.perf_counter()
+        async for _ in sender.send_files():
+            pass
+        await asyncio.gather(*(receiver._relay_task for receiver in receivers))  # noqa
+        elapsed = time.perf_counter() - start
+
+    for relay in relays:
+        relay.stop_session()
+    return elapsed, receivers
+
+
+async def main(size_mb):
+    size = size_mb * 2 ** 20
+    set_current_remote_peer_object(RemotePeer(b'otmbench', 'otmbench', HOST, get_free_port(), get_free_port()))
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        sources = []
+        for index in range(FILE_COUNT):
+            source = root / f'source{index}.bin'
+            make_file(source, size + index * 4099)  # not a multiple of any chunk size
+            sources.append(source)
+        expected = {source.name: digest(source) for source in sources}
+        total = sum(source.stat().st_size for source in sources)
+
+        print(f"{FILE_COUNT} files, {total / 2 ** 20:.1f} MB, fanout {const.DEFAULT_GOSSIP_FANOUT}")
+        print(f"{'receivers':>9} | {'depth':>5} | {'seconds':>7} | {'aggregate MB/s':>14} | {'intact':>6}")
+        for receiver_count in RECEIVER_COUNTS:
+            run_root = root / f'{receiver_count} receivers'
+            run_root.mkdir()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                elapsed, receivers = await run(sources, receiver_count, run_root)
+            intact = all(
+                {file_item.path.name: digest(file_item.path) for file_item in receiver.file_items} == expected
+                for receiver in receivers
+            )
+            print(
+                f"{receiver_count:>9} | {depth(receiver_count, const.DEFAULT_GOSSIP_FANOUT):>5} | {elapsed:>7.2f} |"
+                f" {receiver_count * total / 2 ** 20 / elapsed:>14.1f} | {str(intact):>6}"
+            )
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE_MB))
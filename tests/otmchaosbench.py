@@ -0,0 +1,176 @@
+"""One to many file transfer where relay links are killed mid-stream, and what repairs bring back
+
+linked up as in otmbench, every relay also listens for repair connections as a peer's acceptor would
+(``OTMFilesRelay.otm_serve_repair``) and knows its parent, the sender and its siblings as adjacent peers,
+``KILLED`` links are shut down once the sender is a third of the way through (or before the first frame,
+orphans then ask for file metadata too), orphans wait ``link_wait_timeout`` for their parent and then pull
+what is left, last row gives relays no adjacent peers to repair from, results are printed as a table:
+
+    python tests/otmchaosbench.py [size of each file in MB]
+"""
+import asyncio
+import contextlib
+import dataclasses
+import os
+import socket
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import _path  # noqa
+from filebench import connection_pairs, digest, make_file
+from otmbench import FILE_COUNT, HOST, link_up
+from src.avails import RemotePeer, Wire, WireData, connect, const
+from src.avails.connect import get_free_port
+from src.core import get_this_remote_peer, set_current_remote_peer_object
+from src.transfers import otm
+from src.transfers.otm.relay import OTMLink
+from src.transfers.otm.tree import TreeLink
+from src.transfers.scheduler import TransferScheduler
+
+DEFAULT_SIZE_MB = 16
+RECEIVER_COUNT = 20
+KILLED = (0, 9, 16)  # links into these receivers, 0 has children of its own
+KILL_AT = 1 / 3
+LINK_WAIT_TIMEOUT = 1
+
+
+async def serve_repairs(server, relay):
+    """accepts repair connections on ``server`` for ``relay``"""
+    loop = asyncio.get_running_loop()
+
+    async def serve(connection):
+        with connection:
+            connection.set_loop(loop)
+            request = WireData.load_from(await Wire.receive_async(connection))
+            await relay.otm_serve_repair(connection, request)
+
+    tasks = set()
+    while True:
+        accepted, _ = await loop.sock_accept(server)
+        connection = connect.Socket(fileno=accepted.detach())
+        connection.setblocking(False)
+        task = asyncio.create_task(serve(connection))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+
+def adjacent(relay, peer_ids, addresses):
+    """makes ``peer_ids`` adjacent to ``relay``, as an update state would"""
+    for peer_id in peer_ids:
+        address = addresses[peer_id]
+        passive_link = OTMLink(relay.passive_endpoint_addr, address, peer_id)
+        active_link = OTMLink(relay.active_endpoint_addr, address, peer_id, link_type=TreeLink.ACTIVE)
+        relay.all_links[peer_id] = (passive_link, active_link)
+
+
+async def run(sources, root, kill_at, repair_sources):
+    sender = otm.FilesSender(sources, [], timeout=LINK_WAIT_TIMEOUT)
+    sender.relay.scheduler = TransferScheduler()
+    receivers = []
+    for index in range(RECEIVER_COUNT):
+        download_path = root / f'receiver{index}'
+        download_path.mkdir()
+        receiver = otm.FilesReceiver(
+            dataclasses.replace(sender.session),
+            (HOST, get_free_port()),
+            (HOST, get_free_port()),
+            download_path,
+        )
+        receiver.relay.scheduler = TransferScheduler()
+        receivers.append(receiver)
+
+    fanout = const.DEFAULT_GOSSIP_FANOUT
+    origin = get_this_remote_peer().peer_id
+    peer_ids = [origin] + [f'receiver{index}' for index in range(RECEIVER_COUNT)]
+    relays = [sender.relay] + [receiver.relay for receiver in receivers]
+    with ExitStack() as exit_stack:
+        servers = [exit_stack.enter_context(socket.create_server((HOST, 0))) for _ in relays]
+        addresses = {}
+        for peer_id, server in zip(peer_ids, servers):
+            server.setblocking(False)
+            addresses[peer_id] = server.getsockname()
+        serving = [asyncio.create_task(serve_repairs(server, relay)) for server, relay in zip(servers, relays)]
+
+        pairs = await connection_pairs(RECEIVER_COUNT, exit_stack)
+        for index, pair in enumerate(pairs, start=1):
+            parent = (index - 1) // fanout
+            link_up(relays[parent], relays[index], peer_ids[index], pair, peer_ids[parent])
+            if repair_sources:
+                siblings = peer_ids[parent * fanout + 1: parent * fanout + fanout + 1]
+                adjacent(relays[index], dict.fromkeys([peer_ids[parent], origin, *siblings]), addresses)
+                relays[index].all_links.pop(peer_ids[index])
+
+        def kill():
+            for index in KILLED:
+                pairs[index][0].shutdown(socket.SHUT_RDWR)
+
+        async def chaos():
+            while sender.relay.next_offset < kill_at * total:
+                await asyncio.sleep(0.001)
+            kill()
+
+        total = sum(source.stat().st_size for source in sources)
+        start = time.perf_counter()
+        killing = None
+        if kill_at == 0:
+            kill()
+        elif kill_at is not None:
+            killing = asyncio.create_task(chaos())
+        async for _ in sender.send_files():
+            pass
+        # without adjacent peers, an orphan that never got metadata gives up (TransferIncomplete)
+        await asyncio.gather(*(receiver._relay_task for receiver in receivers), return_exceptions=True)  # noqa
+        elapsed = time.perf_counter() - start
+        for task in serving + [killing]:
+            if task:
+                task.cancel()
+
+    for relay in relays:
+        relay.stop_session()
+    return elapsed, receivers
+
+
+async def main(size_mb):
+    size = size_mb * 2 ** 20
+    const.PROTOCOL = connect.TCPProtocol  # as configure.py sets it up
+    set_current_remote_peer_object(RemotePeer(b'otmchaos', 'otmchaos', HOST, get_free_port(), get_free_port()))
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        sources = []
+        for index in range(FILE_COUNT):
+            source = root / f'source{index}.bin'
+            make_file(source, size + index * 4099)
+            sources.append(source)
+        expected = {source.name: digest(source) for source in sources}
+        total = sum(source.stat().st_size for source in sources)
+
+        print(
+            f"{FILE_COUNT} files, {total / 2 ** 20:.1f} MB, {RECEIVER_COUNT} receivers,"
+            f" fanout {const.DEFAULT_GOSSIP_FANOUT}, link wait timeout {LINK_WAIT_TIMEOUT}s"
+        )
+        print(f"{'case':>20} | {'killed':>6} | {'seconds':>7} | {'complete':>8} | {'intact':>6}")
+        cases = (
+            ('no chaos', None, True),
+            ('killed, repaired', KILL_AT, True),
+            ('killed before first', 0, True),
+            ('killed, no adjacent', KILL_AT, False),
+        )
+        for name, kill_at, repair_sources in cases:
+            run_root = root / name
+            run_root.mkdir()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                elapsed, receivers = await run(sources, run_root, kill_at, repair_sources)
+            complete = sum(receiver.received == total for receiver in receivers)
+            intact = all(
+                {file_item.path.name: digest(file_item.path) for file_item in receiver.file_items} == expected
+                for receiver in receivers
+            )
+            killed = 0 if kill_at is None else len(KILLED)
+            print(f"{name:>20} | {killed:>6} | {elapsed:>7.2f} | {complete:>8} | {str(intact):>6}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE_MB))
@@ -0,0 +1,132 @@
+"""One to many file transfer with one child reading slowly, how much it holds up the rest of the tree
+
+linked up as in otmbench, one leaf at depth 2 reads at ``SLOW_MB_PER_SECOND``, first row has no slow child,
+second one waits on it as forwarding used to (``const.OTM_LAG_TIMEOUT`` of None), third one lets its parent
+catch it up from disk, seconds taken for every receiver to get all bytes are printed as a table:
+
+    python tests/otmlagbench.py [size of each file in MB]
+"""
+import asyncio
+import contextlib
+import dataclasses
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+import _path  # noqa
+from filebench import connection_pairs, digest, make_file
+from otmbench import FILE_COUNT, HOST, link_up
+from src.avails import RemotePeer, const
+from src.avails.connect import get_free_port
+from src.core import set_current_remote_peer_object
+from src.transfers import otm
+from src.transfers.scheduler import TransferScheduler
+
+DEFAULT_SIZE_MB = 32
+RECEIVER_COUNT = 10
+SLOW_MB_PER_SECOND = 20
+SOCKET_BUFFER = 256 * 1024
+
+
+def slow_down(link, rate):
+    """makes reads off ``link`` take as long as they would at ``rate`` bytes per second"""
+    recv = link.recv
+
+    async def slow_recv(length):
+        data = await recv(length)
+        await asyncio.sleep(len(data) / rate)
+        return data
+
+    link.recv = slow_recv
+
+
+async def run(sources, root, slow):
+    sender = otm.FilesSender(sources, [], timeout=60)
+    sender.relay.scheduler = TransferScheduler()
+    receivers = []
+    for index in range(RECEIVER_COUNT):
+        download_path = root / f'receiver{index}'
+        download_path.mkdir()
+        receiver = otm.FilesReceiver(
+            dataclasses.replace(sender.session),
+            (HOST, get_free_port()),
+            (HOST, get_free_port()),
+            download_path,
+        )
+        receiver.relay.scheduler = TransferScheduler()
+        receivers.append(receiver)
+
+    fanout = const.DEFAULT_GOSSIP_FANOUT
+    relays = [sender.relay] + [receiver.relay for receiver in receivers]
+    done_at = {}
+    with ExitStack() as exit_stack:
+        pairs = await connection_pairs(RECEIVER_COUNT, exit_stack)
+        for index, pair in enumerate(pairs, start=1):
+            link_up(relays[(index - 1) // fanout], relays[index], f'receiver{index - 1}', pair)
+        if slow:
+            for sock in pairs[-1]:  # or kernel buffers of loopback take in most of what it falls behind on
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+            slow_down(await receivers[-1].relay._parent_link_fut, SLOW_MB_PER_SECOND * 2 ** 20)  # noqa
+
+        async def watch(receiver):
+            while receiver.total_byte_count is None or receiver.received < receiver.total_byte_count:
+                await asyncio.sleep(0.005)
+            done_at[receiver] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        watchers = [asyncio.create_task(watch(receiver)) for receiver in receivers]
+        async for _ in sender.send_files():
+            pass
+        await asyncio.gather(*(receiver._relay_task for receiver in receivers), *watchers)  # noqa
+
+    for relay in relays:
+        relay.stop_session()
+    return [done_at[receiver] for receiver in receivers], receivers
+
+
+async def main(size_mb):
+    size = size_mb * 2 ** 20
+    set_current_remote_peer_object(RemotePeer(b'otmlagbench', 'otmlagbench', HOST, get_free_port(), get_free_port()))
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        sources = []
+        for index in range(FILE_COUNT):
+            source = root / f'source{index}.bin'
+            make_file(source, size + index * 4099)
+            sources.append(source)
+        expected = {source.name: digest(source) for source in sources}
+        total = sum(source.stat().st_size for source in sources)
+
+        print(
+            f"{FILE_COUNT} files, {total / 2 ** 20:.1f} MB, {RECEIVER_COUNT} receivers,"
+            f" fanout {const.DEFAULT_GOSSIP_FANOUT}, slow child at {SLOW_MB_PER_SECOND} MB/s"
+        )
+        print(f"{'case':>9} | {'median s':>8} | {'slowest other s':>15} | {'slow child s':>12} | {'intact':>6}")
+        lag_timeout = const.OTM_LAG_TIMEOUT
+        cases = (('no slow', False, lag_timeout), ('stalling', True, None), ('catch-up', True, lag_timeout))
+        for name, slow, timeout in cases:
+            run_root = root / name
+            run_root.mkdir()
+            const.OTM_LAG_TIMEOUT = timeout
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                times, receivers = await run(sources, run_root, slow)
+            const.OTM_LAG_TIMEOUT = lag_timeout
+            intact = all(
+                {file_item.path.name: digest(file_item.path) for file_item in receiver.file_items} == expected
+                for receiver in receivers
+            )
+            others = times[:-1]
+            print(
+                f"{name:>9} | {statistics.median(others):>8.2f} | {max(others):>15.2f} |"
+                f" {times[-1]:>12.2f} | {str(intact):>6}"
+            )
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE_MB))
@@ -0,0 +1,227 @@
+"""Session bring-up of one to many file transfer over loopback, time till receivers get their first byte
+
+unlike otmbench nothing is skipped, ``FilesSender.start`` informs peers, sends their states and floods
+tree checks, every peer has a requests endpoint answering inform requests as ``filemanager.new_otm_request_arrived``
+does and an acceptor handing stream links to its relay as ``filemanager.OTMConnectionHandler`` does,
+all peers live in this process, each one's tasks run in a context of their own where ``get_this_remote_peer``
+gives that peer, ``LOSSY`` peers drop the first state update that reaches them, a ``DEAD`` peer drops every one
+of them and is taken out of the tree, a silent one never replies to its inform request,
+results are printed as a table:
+
+    python tests/otmstartbench.py [peer count] ...
+"""
+import asyncio
+import contextlib
+import contextvars
+import gc
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import _path  # noqa
+from filebench import make_file
+from otmbench import HOST
+from src.avails import OTMInformResponse, OTMSession, RemotePeer, Wire, WireData, connect, const, wire
+from src.avails.connect import get_free_port
+from src.core import Dock, set_current_remote_peer_object
+from src.transfers import otm
+from src.transfers.otm import palm_tree, relay
+from src.transfers.scheduler import TransferScheduler
+
+PEER_COUNTS = (10, 50)
+SIZE = 2 ** 20
+LINK_WAIT_TIMEOUT = 3
+LOSSY = 5  # every fifth peer drops its first state update
+DEAD = 1  # this many peers drop every state update, or never reply to inform requests when silent
+MODES = ('none', 'lossy', 'silent', 'dead')
+
+this_peer = contextvars.ContextVar('this_peer')
+# relays ask who they are whenever they put their id on a packet
+palm_tree.get_this_remote_peer = relay.get_this_remote_peer = this_peer.get
+
+
+def free_datagram_port():
+    """``connect.get_free_port`` looks for a free stream port, with this many peers on one host it can be a taken datagram one"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+class Peer(asyncio.DatagramProtocol):
+    """requests endpoint and acceptor of one peer, a receiver is made when an inform request comes in"""
+
+    def __init__(self, download_path, drops, silent=False):
+        self.remote_peer = None
+        self.download_path = download_path
+        self.drops = drops
+        self.silent = silent
+        self.receiver = None
+        self.transport = None
+        self.first_byte_at = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.silent:
+            return
+        req_data = wire.unpack_datagram(data)
+        session = OTMSession(
+            originate_id=req_data.id,
+            session_id=req_data['session_id'],
+            key=req_data['key'],
+            fanout=req_data['fanout'],
+            link_wait_timeout=req_data['link_wait_timeout'],
+            adjacent_peers=req_data['adjacent_peers'],
+            file_count=req_data['file_count'],
+            chunk_size=req_data['chunk_size'],
+        )
+        passive_endpoint_address = (HOST, free_datagram_port())
+        self.receiver = otm.FilesReceiver(session, passive_endpoint_address, self.remote_peer.uri, self.download_path)
+        self.receiver.relay.scheduler = TransferScheduler()
+        if self.drops:
+            self._drop_state_updates(self.receiver.relay, self.drops)
+        reply = OTMInformResponse(
+            peer_id=self.remote_peer.peer_id,
+            passive_addr=passive_endpoint_address,
+            active_addr=self.remote_peer.uri,
+            session_key=session.key,
+        )
+        Wire.send_datagram(self.transport, addr, bytes(reply))
+
+    @staticmethod
+    def _drop_state_updates(peer_relay, count):
+        gossip_update_state = peer_relay.gossip_update_state
+        dropped = 0
+
+        async def drop(state_data, addr=None):
+            nonlocal dropped
+            dropped += 1
+            if dropped >= count:
+                peer_relay.gossip_update_state = gossip_update_state
+
+        peer_relay.gossip_update_state = drop
+
+    async def accept(self, server):
+        loop = asyncio.get_running_loop()
+        tasks = set()
+        while True:
+            accepted, _ = await loop.sock_accept(server)
+            connection = connect.Socket(fileno=accepted.detach())
+            connection.setblocking(False)
+            connection.set_loop(loop)
+            task = asyncio.create_task(self._add_stream_link(connection))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    async def _add_stream_link(self, connection):
+        link_data = WireData.load_from(await Wire.receive_async(connection))
+        await self.receiver.relay.otm_add_stream_link(connection, link_data)
+
+    async def watch(self, start):
+        while self.receiver is None or not self.receiver.received:
+            await asyncio.sleep(0.001)
+        self.first_byte_at = time.perf_counter() - start
+
+
+def drops_of(mode, index):
+    if mode == 'lossy' and index % LOSSY == 0:
+        return 1
+    if mode == 'dead' and index < DEAD:
+        return float('inf')
+    return 0
+
+
+async def run(sources, root, peer_count, mode):
+    loop = asyncio.get_running_loop()
+    peers = []
+    tasks = []
+    with contextlib.ExitStack() as exit_stack:
+        for index in range(peer_count):
+            download_path = root / f'peer{index}'
+            download_path.mkdir()
+            peer = Peer(download_path, drops_of(mode, index), mode == 'silent' and index < DEAD)
+            server = exit_stack.enter_context(socket.create_server((HOST, 0)))
+            server.setblocking(False)
+            requests_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            requests_sock.bind((HOST, 0))
+            remote_peer = RemotePeer(
+                f'peer{index}'.encode(), f'peer{index}', HOST,
+                server.getsockname()[1], requests_sock.getsockname()[1],
+            )
+            peer.remote_peer = remote_peer
+            Dock.peer_list.add_peer(remote_peer)
+
+            context = contextvars.copy_context()
+            context.run(this_peer.set, remote_peer)
+            transport, _ = await asyncio.create_task(
+                loop.create_datagram_endpoint(lambda: peer, sock=requests_sock),
+                context=context,
+            )
+            exit_stack.callback(transport.close)
+            tasks.append(asyncio.create_task(peer.accept(server), context=context))
+            peers.append(peer)
+
+        sender = otm.FilesSender(sources, [peer.remote_peer for peer in peers], timeout=LINK_WAIT_TIMEOUT)
+        sender.relay.scheduler = TransferScheduler()
+        start = time.perf_counter()
+        alive = [peer for peer in peers if peer.drops != float('inf') and not peer.silent]
+        watchers = [asyncio.create_task(peer.watch(start)) for peer in alive]
+        phases = []
+        async for _ in sender.start():
+            if len(phases) < 3:  # informed, states acked, tree checks out
+                phases.append(time.perf_counter() - start)
+        await asyncio.gather(*watchers, *(peer.receiver._relay_task for peer in alive))  # noqa
+        for task in tasks:
+            task.cancel()
+        for peer in peers:
+            if peer not in alive and peer.receiver:
+                peer.receiver._relay_task.cancel()  # noqa: taken out of tree, it never hears of the session again
+
+    for peer in peers:
+        if peer.receiver:
+            peer.receiver.relay.stop_session()
+        Dock.peer_list.remove_peer(peer.remote_peer.peer_id)
+    sender.relay.stop_session()
+    gc.collect()  # links close their connections once collected (PalmTreeLink.__del__), while loop still runs
+    return phases, [peer.first_byte_at for peer in alive]
+
+
+async def main(peer_counts):
+    const.PROTOCOL = connect.TCPProtocol  # as configure.py sets it up
+    this_peer.set(RemotePeer(b'otmstart', 'otmstart', HOST, get_free_port(), get_free_port()))
+    set_current_remote_peer_object(this_peer.get())
+    Dock.peer_list.add_peer(this_peer.get())
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        source = root / 'source.bin'
+        make_file(source, SIZE)
+
+        print(
+            f"{SIZE / 2 ** 20:.1f} MB, fanout {const.DEFAULT_GOSSIP_FANOUT},"
+            f" link wait timeout {LINK_WAIT_TIMEOUT}s, lossy drops first state update of every {LOSSY}th peer,"
+            f" dead drops all of {DEAD} peer(s), silent does not reply to inform"
+        )
+        print(
+            f"{'peers':>5} | {'drops':>6} | {'informed ms':>11} | {'states acked ms':>15} |"
+            f" {'first byte median ms':>20} | {'first byte last ms':>18}"
+        )
+        for peer_count in peer_counts:
+            for mode in MODES:
+                run_root = root / f'{peer_count}-{mode}'
+                run_root.mkdir()
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    phases, first_bytes = await run([source], run_root, peer_count, mode)
+                informed, acked, _ = phases
+                print(
+                    f"{peer_count:>5} | {mode:>6} | {informed * 1000:>11.1f} | {acked * 1000:>15.1f} |"
+                    f" {statistics.median(first_bytes) * 1000:>20.1f} | {max(first_bytes) * 1000:>18.1f}"
+                )
+
+
+if __name__ == '__main__':
+    asyncio.run(main([int(count) for count in sys.argv[1:]] or PEER_COUNTS))
@@ -0,0 +1,176 @@
+"""Palm tree layouts on a simulated topology of peers spread over sites, hypercube against latency tree
+
+nothing goes over the network, peers sit at sites on a plane, round trips are distances between sites
+(``INTRA_SITE_RTT`` within one), every peer's uplink is shared by its children and every site's way out is
+shared by tree links leaving it, for each layout (``topology.latency_tree`` and the hypercube it replaced):
+
+- sender measures round trips to every peer, with some jitter, and builds adjacency lists
+- tree checks flood out from the sender as ``PalmTreeRelay.forward_tree_check_packet`` and
+  ``gossip_tree_reject`` send them, a peer takes the first one that reaches it
+- every peer then gets ``SIZE_MB`` down its path as fast as the slowest link on it lets it
+  (children that lag do not hold up their siblings, see ``OTMFilesRelay``)
+
+time to last byte counts from when tree checks go out, results are printed as a table:
+
+    python tests/otmtreebench.py [peer count]
+"""
+import heapq
+import math
+import random
+import statistics
+import sys
+
+import _path  # noqa
+from src.avails import const
+from src.transfers.otm import topology
+
+DEFAULT_PEER_COUNT = 50
+SITES = 6
+SITE_SPREAD = 0.040  # seconds, largest round trip between sites
+INTRA_SITE_RTT = 0.0004
+JITTER = 0.1  # of a measured round trip
+UPLINK = 100 * 2 ** 20  # bytes per second, of every peer
+SITE_EGRESS = 40 * 2 ** 20  # out of a site, tree links leaving it share this
+SIZE_MB = 256
+SEEDS = (1, 2, 3, 4, 5)
+
+
+def make_topology(peer_count, rng):
+    """sites on a plane and peers spread over them, peer 0 is the sender"""
+    sites = [(rng.uniform(0, SITE_SPREAD), rng.uniform(0, SITE_SPREAD)) for _ in range(SITES)]
+    site_of = [0] + [rng.randrange(SITES) for _ in range(peer_count)]
+
+    def rtt(a, b):
+        if site_of[a] == site_of[b]:
+            return INTRA_SITE_RTT
+        return math.dist(sites[site_of[a]], sites[site_of[b]]) + INTRA_SITE_RTT
+
+    return site_of, rtt
+
+
+def hypercube(root, rtts, fanout):  # noqa: fanout is bounded by tree checks
+    """Hypercube over ``root`` and peers of ``rtts`` wired by their order, round trips are not looked at
+
+    was the only layout before ``topology.latency_tree``, its depth depends on which tree check gets where first
+    """
+    peer_ids = [root, *rtts]
+    dimensions = (2 ** math.ceil(math.log2(len(peer_ids)))).bit_length() - 1
+    adjacency = {peer_id: [] for peer_id in peer_ids}
+    for i, peer_id in enumerate(peer_ids):
+        for j in range(dimensions):
+            neighbor = i ^ (1 << j)
+            if neighbor < len(peer_ids):
+                adjacency[peer_id].append(peer_ids[neighbor])
+    return adjacency
+
+
+def form_tree(adjacency, fanout, rtt):
+    """floods tree checks from peer 0 over ``adjacency``
+
+    Returns:
+        dict[int, int], float: parent of every peer that was reached, seconds till the last one settled
+    """
+    parent_of = {0: None}
+    window = dict.fromkeys(adjacency, 0)
+    asked = {peer: set() for peer in adjacency}  # active links, including the ones that were rejected
+    children = {peer: 0 for peer in adjacency}
+    events = []  # (time, kind, from, to)
+    settled = 0
+
+    def forward(peer, sender, now):
+        links = adjacency[peer]
+        peer_fanout = min(len(links), fanout)
+        start = window[peer]
+        end = min(len(links), start + peer_fanout) - children[peer]
+        window[peer] = end
+        for other in set(links[start: end + 1]) - {sender} - asked[peer]:
+            asked[peer].add(other)
+            heapq.heappush(events, (now + rtt(peer, other) / 2, 'check', peer, other))
+
+    forward(0, 0, 0)
+    while events:
+        now, kind, sender, peer = heapq.heappop(events)
+        if kind == 'reject':
+            if window[peer] < len(adjacency[peer]) and len(asked[peer]) < fanout:
+                forward(peer, sender, now)
+            continue
+        if peer in parent_of or sender not in adjacency[peer]:
+            heapq.heappush(events, (now + rtt(peer, sender) / 2, 'reject', peer, sender))
+            continue
+        # upgrade request goes back and a stream connection comes in, then it forwards
+        now += rtt(peer, sender) * 1.5
+        parent_of[peer] = sender
+        children[sender] += 1
+        settled = max(settled, now)
+        forward(peer, sender, now)
+    return parent_of, settled
+
+
+def last_byte(parent_of, site_of, rtt, size):
+    """seconds till every peer has ``size`` bytes, each as fast as the slowest link on its path"""
+    children = {peer: 0 for peer in parent_of}
+    leaving = [0] * SITES
+    for peer, parent in parent_of.items():
+        if parent is not None:
+            children[parent] += 1
+            if site_of[peer] != site_of[parent]:
+                leaving[site_of[parent]] += 1
+
+    done = {}
+
+    def arrival(peer):
+        if peer not in done:
+            parent = parent_of[peer]
+            if parent is None:
+                done[peer] = (0, math.inf, 0)
+            else:
+                latency, slowest, depth = arrival(parent)
+                link = UPLINK / children[parent]
+                if site_of[peer] != site_of[parent]:
+                    link = min(link, SITE_EGRESS / leaving[site_of[parent]])
+                done[peer] = (latency + rtt(parent, peer) / 2, min(slowest, link), depth + 1)
+        return done[peer]
+
+    finish = 0
+    depth = 0
+    for peer in parent_of:
+        latency, slowest, peer_depth = arrival(peer)
+        if slowest != math.inf:
+            finish = max(finish, latency + size / slowest)
+        depth = max(depth, peer_depth)
+    return finish, depth, sum(leaving)
+
+
+def run(peer_count, builder, seed):
+    rng = random.Random(seed)
+    site_of, rtt = make_topology(peer_count, rng)
+    peers = list(range(1, peer_count + 1))
+    rng.shuffle(peers)  # order peers come in, hypercube wires by it
+    rtts = {peer: rtt(0, peer) * rng.uniform(1 - JITTER, 1 + JITTER) for peer in peers}
+    adjacency = builder(0, rtts, const.DEFAULT_GOSSIP_FANOUT)
+    parent_of, formed = form_tree(adjacency, const.DEFAULT_GOSSIP_FANOUT, rtt)
+    finish, depth, crossings = last_byte(parent_of, site_of, rtt, SIZE_MB * 2 ** 20)
+    return len(parent_of) - 1, depth, crossings, formed, formed + finish
+
+
+def main(peer_count):
+    print(
+        f"{peer_count} peers over {SITES} sites, fanout {const.DEFAULT_GOSSIP_FANOUT}, {SIZE_MB} MB,"
+        f" uplinks {UPLINK / 2 ** 20:.0f} MB/s, {SITE_EGRESS / 2 ** 20:.0f} MB/s out of a site,"
+        f" median of {len(SEEDS)} topologies"
+    )
+    print(
+        f"{'layout':>12} | {'reached':>7} | {'depth':>5} | {'site crossings':>14} |"
+        f" {'tree formed ms':>14} | {'last byte s':>11}"
+    )
+    for builder in (hypercube, topology.latency_tree):
+        results = [run(peer_count, builder, seed) for seed in SEEDS]
+        reached, depth, crossings, formed, finish = (statistics.median(column) for column in zip(*results))
+        print(
+            f"{builder.__name__:>12} | {reached:>7.0f} | {depth:>5.0f} | {crossings:>14.0f} |"
+            f" {formed * 1000:>14.1f} | {finish:>11.2f}"
+        )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PEER_COUNT)
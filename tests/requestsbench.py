@@ -0,0 +1,142 @@
+"""Datagrams/sec through RequestsEndPoint under synthetic load
+
+a sender thread paces datagrams at a fixed rate onto a loopback udp socket served by
+RequestsEndPoint + RequestsDispatcher, over asyncio's datagram transport and over
+BatchedDatagramTransport, results are printed as a table:
+
+    python tests/requestsbench.py
+"""
+import asyncio
+import socket
+import threading
+import time
+
+import _path  # noqa
+from src.avails import InvalidPacket, WireData, unpack_datagram
+from src.avails.events import RequestEvent
+from src.core.requests import RequestsDispatcher, RequestsEndPoint
+from src.core.requests import _logger as requests_logger  # noqa
+from src.transfers import REQUESTS_HEADERS
+from src.transfers.transports import create_batched_datagram_endpoint
+
+RATES = (10_000, 50_000, 100_000)
+DURATION = 2  # seconds per run
+TICK = 0.001  # sender wakes up every millisecond and sends the datagrams due
+
+_PEER_ID = str(0xA3F1_0C22_9E4B_77D0_1B55_6C0E_F2D9_3A81_44E7_06B2)
+
+
+class LegacyEndPoint(RequestsEndPoint):
+    """what datagram_received used to do, eager body decoding and formatting the body for logging"""
+
+    def datagram_received(self, actual_data, addr):
+        code, stripped_data = actual_data[:1], actual_data[1:]
+        try:
+            req_data = unpack_datagram(stripped_data)
+        except InvalidPacket as ip:
+            requests_logger.info(f"error:", exc_info=ip)
+            return
+
+        requests_logger.info(f"received: {code} from : {addr}, {req_data.dict=}")
+        event = RequestEvent(root_code=code, request=req_data, from_addr=addr)
+        self.dispatcher(event)
+
+
+def _datagrams():
+    # mix of traffic, half of it has no handler registered (dropped by dispatcher after header routing)
+    handled = WireData(REQUESTS_HEADERS.ACTIVE_PING, '42', _PEER_ID, status=1, addr=['10.0.0.4', 45000])
+    unhandled = WireData(REQUESTS_HEADERS.LIST_SYNC, '43', _PEER_ID, peers=[_PEER_ID] * 8)
+    return [
+        REQUESTS_HEADERS.GOSSIP + _pack(handled),
+        REQUESTS_HEADERS.KADEMLIA + _pack(unhandled),
+    ]
+
+
+def _pack(wire_data):
+    raw = bytes(wire_data)
+    return len(raw).to_bytes(4) + raw
+
+
+def _sender(address, rate, stop):
+    datagrams = _datagrams()
+    per_tick = max(int(rate * TICK), 1)
+    sent = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        start = time.perf_counter()
+        while not stop.is_set():
+            due = int((time.perf_counter() - start) * rate)
+            for _ in range(min(due - sent, per_tick * 4)):
+                try:
+                    sock.sendto(datagrams[sent & 1], address)
+                except BlockingIOError:
+                    pass
+                sent += 1
+            time.sleep(TICK)
+    return sent
+
+
+async def _asyncio_endpoint(protocol_factory, *, sock):
+    return await asyncio.get_running_loop().create_datagram_endpoint(protocol_factory, sock=sock)
+
+
+async def _run(endpoint_class, create_endpoint, rate):
+
+    async def handler(event):
+        event.request.header  # noqa, routing only needs the header
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    sock.setblocking(False)
+
+    async with RequestsDispatcher(None, lambda: False) as dispatcher:
+        dispatcher.register_handler(REQUESTS_HEADERS.GOSSIP, handler)
+        dispatched = 0
+
+        def counting_dispatch(event):
+            nonlocal dispatched
+            dispatched += 1
+            return dispatcher(event)
+
+        transport, _ = await create_endpoint(lambda: endpoint_class(counting_dispatch), sock=sock)
+        stop = threading.Event()
+        sent_box = []
+        thread = threading.Thread(target=lambda: sent_box.append(_sender(sock.getsockname(), rate, stop)))
+        cpu_start = time.process_time()
+        thread.start()
+        await asyncio.sleep(DURATION)
+        stop.set()
+        await asyncio.to_thread(thread.join)
+        await asyncio.sleep(0.1)  # let the remaining datagrams through
+        cpu = time.process_time() - cpu_start
+        transport.close()
+
+    sent = sent_box[0]
+    stats = getattr(transport, 'stats', None)
+    per_wakeup = stats['received'] / stats['wakeups'] if stats else 1
+    return sent, dispatched, cpu, per_wakeup
+
+
+async def main():
+    print(
+        f"{'target/s':>9} | {'endpoint':>12} | {'sent/s':>8} | {'dispatched/s':>12} | {'loss %':>6} |"
+        f" {'cpu us/msg':>10} | {'msgs/wakeup':>11}"
+    )
+    rows = (
+        ('legacy', LegacyEndPoint, _asyncio_endpoint),
+        ('lazy', RequestsEndPoint, _asyncio_endpoint),
+        ('lazy+batched', RequestsEndPoint, create_batched_datagram_endpoint),
+    )
+    for rate in RATES:
+        for name, endpoint_class, create_endpoint in rows:
+            sent, dispatched, cpu, per_wakeup = await _run(endpoint_class, create_endpoint, rate)
+            loss = 100 * (1 - dispatched / sent) if sent else 0
+            per_msg = cpu / max(dispatched, 1) * 1e6  # process cpu time, sender thread included
+            print(
+                f"{rate:>9} | {name:>12} | {sent / DURATION:>8.0f} | {dispatched / DURATION:>12.0f} |"
+                f" {loss:>6.1f} | {per_msg:>10.1f} | {per_wakeup:>11.1f}"
+            )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
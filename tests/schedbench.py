@@ -0,0 +1,169 @@
+"""Concurrent transfers sharing one uplink, with and without transfers.scheduler
+
+an uplink of ``LINK_RATE`` is emulated in front of every socket (bytes leave in the order they were
+handed over as from a NIC queue, a send returns once the rest of it fits the socket buffer),
+peer A has a bulk transfer going, peer B has one striped over four connections, and a chat message
+goes to A every 100 ms, first table shows what each peer gets and how long chat messages wait,
+second one has peer C start an interactive transfer on top, third one has C stop reading instead
+(its sends never return), last one changes the global rate limit while transfers run:
+
+    python tests/schedbench.py [seconds per run]
+"""
+import asyncio
+import collections
+import statistics
+import sys
+import time
+from contextlib import ExitStack, nullcontext
+
+import _path  # noqa
+from filebench import connection_pairs
+from src.avails import connect, const
+from src.transfers.scheduler import Priority, ScheduledSender, TransferScheduler
+
+DEFAULT_SECONDS = 3
+LINK_RATE = 50 * 2 ** 20
+CHUNK = const.MAX_CHUNK_SIZE
+CHAT_INTERVAL = 0.1
+SEND_BUFFER = 4 * 2 ** 20
+BULK_FLOWS = (  # peer, connections, priority
+    ('A', 1, Priority.BULK),
+    ('B', 4, Priority.BULK),
+)
+ALL_FLOWS = BULK_FLOWS + (('C', 1, Priority.INTERACTIVE),)
+STALLED = 'C'  # peer of ALL_FLOWS that stops reading in the stalled run
+
+
+class Link:
+    """one uplink every socket shares, bytes leave at ``rate`` in the order they were handed over
+
+    a send returns once what is left of it fits the socket buffer (``SEND_BUFFER``), as sendall does
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.sent = collections.Counter()
+        self._free_at = 0.0
+
+    def wrap(self, sender, name, buffered=True):
+        send_func = sender.send_func
+        buffer_time = SEND_BUFFER / self.rate if buffered else 0
+
+        async def send(sock, buf):
+            now = time.perf_counter()
+            self._free_at = max(self._free_at, now) + len(buf) / self.rate
+            await asyncio.sleep(self._free_at - now - buffer_time)
+            self.sent[name] += len(buf)
+            return await send_func(sock, buf)
+
+        sender.send_func = send
+        return sender
+
+
+def stall(sender):
+    async def send(sock, buf):  # noqa
+        await asyncio.Event().wait()
+
+    sender.send_func = send
+    return sender
+
+
+async def drain(sock):
+    loop = asyncio.get_running_loop()
+    buffer = bytearray(4 * 2 ** 20)
+    while await loop.sock_recv_into(sock, buffer):
+        pass
+
+
+async def flow(send_function, chunk):
+    while True:
+        await send_function(chunk)
+
+
+async def chat(send_function, scheduler, latencies):
+    message = b'hi' * 64
+    while True:
+        await asyncio.sleep(CHAT_INTERVAL)
+        started = time.perf_counter()
+        async with scheduler.slot('A', len(message), Priority.CHAT) if scheduler else nullcontext():
+            await send_function(message)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(seconds, scheduler, flows, rate_steps=(), stalled=None):
+    """runs ``flows`` for ``seconds``, ``rate_steps`` are (at second, rate) changes of the global limit,
+    sends to ``stalled`` peer never return
+
+    Returns:
+        bytes sent per peer, chat latencies, bytes sent in between rate steps
+    """
+    link = Link(LINK_RATE)
+    chunk = bytes(CHUNK)
+    latencies = []
+    connections = sum(count for _, count, _ in flows) + 1
+    with ExitStack() as exit_stack:
+        pairs = await connection_pairs(connections, exit_stack)
+        tasks = [asyncio.create_task(drain(server)) for _, server in pairs]
+        clients = iter(client for client, _ in pairs)
+        for peer, count, priority in flows:
+            for _ in range(count):
+                client = next(clients)
+                if scheduler is None:
+                    sender = connect.Sender(client)
+                else:
+                    sender = ScheduledSender(client, peer, priority, scheduler)
+                sender = stall(sender) if peer == stalled else link.wrap(sender, peer)
+                tasks.append(asyncio.create_task(flow(sender, chunk)))
+        chat_sender = link.wrap(connect.Sender(next(clients)), 'chat', buffered=False)  # timed till it leaves
+        tasks.append(asyncio.create_task(chat(chat_sender, scheduler, latencies)))
+
+        steps = []
+        started = time.perf_counter()
+        for at, rate in rate_steps:
+            await asyncio.sleep(max(0.0, started + at - time.perf_counter()))
+            steps.append(sum(link.sent.values()))
+            scheduler.set_rate(rate)
+        await asyncio.sleep(max(0.0, started + seconds - time.perf_counter()))
+        steps.append(sum(link.sent.values()))
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return link.sent, latencies, steps
+
+
+async def main(seconds):
+    print(f"uplink {LINK_RATE / 2 ** 20:.0f} MB/s, {CHUNK / 2 ** 20:.0f} MB chunks, {seconds} s per run")
+    limit = LINK_RATE * 0.9
+    modes = (
+        ('none', None),
+        ('no limit', TransferScheduler()),
+        (f'limit {limit / 2 ** 20:.0f} MB/s', TransferScheduler(limit)),
+    )
+    for flows, stalled in ((BULK_FLOWS, None), (ALL_FLOWS, None), (ALL_FLOWS, STALLED)):
+        if stalled:
+            print(f"{stalled} stopped reading")
+        print(
+            f"{'scheduler':>17} | {'A MB/s':>6} | {'B MB/s':>6} | {'C MB/s':>6} |"
+            f" {'chat p50 ms':>11} | {'chat max ms':>11}"
+        )
+        for name, scheduler in modes:
+            sent, latencies, _ = await run(seconds, scheduler, flows, stalled=stalled)
+            rates = [sent[peer] / 2 ** 20 / seconds for peer in 'ABC']
+            print(
+                f"{name:>17} | {rates[0]:>6.1f} | {rates[1]:>6.1f} | {rates[2]:>6.1f} |"
+                f" {statistics.median(latencies) * 1000:>11.1f} | {max(latencies) * 1000:>11.1f}"
+            )
+        print()
+
+    print(f"{'rate limit MB/s':>15} | {'measured MB/s':>13}")
+    limits = (40, 20, 10)
+    step = seconds / len(limits)
+    rate_steps = [(index * step, limit * 2 ** 20) for index, limit in enumerate(limits)]
+    _, _, steps = await run(seconds, TransferScheduler(), BULK_FLOWS, rate_steps)
+    for limit, before, after in zip(limits, steps, steps[1:]):
+        print(f"{limit:>15} | {(after - before) / 2 ** 20 / step:>13.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SECONDS))
@@ -15,7 +15,7 @@ from src.avails import RemotePeer, const
 from src.avails.connect import UDPProtocol
 from src.configurations import bootup, configure
 from src.core import Dock, connections, connectivity, requests, set_current_remote_peer_object
-from src.managers import profilemanager
+from src.managers import filemanager, profilemanager
 from src.managers.statemanager import State
 from src.webpage_handlers import pagehandle
 
@@ -96,10 +96,11 @@ def test_initial_states():
     s4 = State("loading profiles", profilemanager.load_profiles_to_program)
     s5 = State("mocking profile", mock_profile)
     s6 = State("configuring this remote peer object", bootup.configure_this_remote_peer)
-    s7 = State("printing configurations", configure.print_constants)
-    s8 = State("initiating requests", requests.initiate)
-    s9 = State("initiating comms", connections.initiate_connections, is_blocking=True)
-    s10 = State("connectivity checker", connectivity.initiate)
+    s7 = State("loading transfer journal", filemanager.initiate_journal)
+    s8 = State("printing configurations", configure.print_constants)
+    s9 = State("initiating requests", requests.initiate)
+    s10 = State("initiating comms", connections.initiate_connections, is_blocking=True)
+    s11 = State("connectivity checker", connectivity.initiate)
     return tuple(locals().values())
 
 
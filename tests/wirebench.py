@@ -0,0 +1,187 @@
+"""Micro benchmarks for wire level framing and WireData encoding
+
+run as a script, results are printed as a table:
+
+    python tests/wirebench.py
+"""
+import asyncio
+import socket
+import struct
+import time
+
+import umsgpack
+
+import _path  # noqa
+from src.avails import FrameReader, FrameWriter, Wire, WireData, connect, wire
+from src.transfers import DISCOVERY, HEADERS, REQUESTS_HEADERS
+
+PAYLOAD_SIZES = (64, 4 * 1024, 1024 * 1024)
+DATA_PER_RUN = 64 * 1024 * 1024  # bytes pushed through per payload size
+
+
+class CountingSocket(connect.Socket):
+    """counts send side syscalls"""
+    syscalls = 0
+
+    def send(self, *args, **kwargs):
+        self.syscalls += 1
+        return super().send(*args, **kwargs)
+
+    def sendmsg(self, *args, **kwargs):
+        self.syscalls += 1
+        return super().sendmsg(*args, **kwargs)
+
+
+def socket_pair(loop, sock_class=connect.Socket):
+    a, b = socket.socketpair()
+    pair = []
+    for s in (a, b):
+        sock = sock_class(s.family, s.type, s.proto, fileno=s.detach())
+        sock.setblocking(False)
+        sock.set_loop(loop)
+        pair.append(sock)
+    return pair
+
+
+async def _legacy_receive(sock):
+    # what Wire.receive_async and StreamTransport.recv used to do,
+    # looping on the remainder so that large frames do not get truncated
+    data_size = struct.unpack("!I", await sock.arecv(4))[0]
+    data = await sock.arecv(data_size)
+    while len(data) < data_size:
+        data += await sock.arecv(data_size - len(data))
+    return data
+
+
+async def _send_frames(sock, payload, count):
+    frame = struct.pack("!I", len(payload)) + payload
+    for _ in range(count):
+        await sock.asendall(frame)
+
+
+async def _measure(receive, payload_size):
+    loop = asyncio.get_running_loop()
+    writer, reader_sock = socket_pair(loop)
+    count = max(DATA_PER_RUN // payload_size, 1000)
+    payload = bytes(payload_size)
+    receive_one = receive(reader_sock)
+    with writer, reader_sock:
+        sender = asyncio.create_task(_send_frames(writer, payload, count))
+        start = time.perf_counter()
+        for _ in range(count):
+            frame = await receive_one()
+            assert len(frame) == payload_size
+        elapsed = time.perf_counter() - start
+        await sender
+    return count / elapsed
+
+
+def legacy_path(sock):
+    return lambda: _legacy_receive(sock)
+
+
+def frame_reader_path(sock):
+    return FrameReader(sock).read_frame
+
+
+async def _drain(sock, total):
+    buf = bytearray(1024 * 1024)
+    while total > 0:
+        total -= await sock.arecv_into(buf)
+
+
+async def _concat_send(sock, payload):
+    await sock.asendall(struct.pack("!I", len(payload)) + payload)
+
+
+async def _gather_send(sock, payload):
+    await Wire.send_async(sock, payload)
+
+
+async def _measure_send(send, payload_size, batch=1):
+    loop = asyncio.get_running_loop()
+    writer, reader_sock = socket_pair(loop, CountingSocket)
+    count = max(DATA_PER_RUN // payload_size, 1000)
+    payload = bytes(payload_size)
+    with writer, reader_sock:
+        drainer = asyncio.create_task(_drain(reader_sock, count * (payload_size + 4)))
+        start = time.perf_counter()
+        if batch == 1:
+            for _ in range(count):
+                await send(writer, payload)
+        else:
+            frame_writer = FrameWriter(writer)
+            for i in range(1, count + 1):
+                frame_writer.queue(payload)
+                if i % batch == 0:
+                    await frame_writer.flush()
+            await frame_writer.flush()
+        elapsed = time.perf_counter() - start
+        await drainer
+    return count / elapsed, writer.syscalls / count
+
+
+async def send_side():
+    print()
+    print(f"{'payload':>10} | {'path':>14} | {'frames/s':>10} | {'syscalls/frame':>14} | {'bytes copied/frame':>18}")
+    for size in PAYLOAD_SIZES:
+        # Wire.send_async still joins payloads below the gather threshold
+        copied_by_wire = size + 4 if size < wire._GATHER_THRESHOLD else 0  # noqa
+        rows = (
+            ('concat', _concat_send, 1, size + 4),
+            ('Wire.send', _gather_send, 1, copied_by_wire),
+            ('FrameWriter16', None, 16, 0),
+        )
+        for name, send, batch, copied in rows:
+            rate, syscalls = await _measure_send(send, size, batch)
+            print(f"{size:>10} | {name:>14} | {rate:>10.0f} | {syscalls:>14.3f} | {copied:>18}")
+
+
+async def receive_side():
+    print(f"{'payload':>10} | {'legacy frames/s':>16} | {'FrameReader frames/s':>21} | {'speedup':>7}")
+    for size in PAYLOAD_SIZES:
+        legacy = await _measure(legacy_path, size)
+        buffered = await _measure(frame_reader_path, size)
+        print(f"{size:>10} | {legacy:>16.0f} | {buffered:>21.0f} | {buffered / legacy:>6.2f}x")
+
+
+_PEER_ID = str(0xA3F1_0C22_9E4B_77D0_1B55_6C0E_F2D9_3A81_44E7_06B2)  # looks like a kademlia long_id
+ENCODING_SAMPLES = (
+    ('discovery', WireData(DISCOVERY.NETWORK_FIND, None, _PEER_ID, connect=['10.0.0.4', 45000])),
+    ('ping', WireData(REQUESTS_HEADERS.ACTIVE_PING, '42', _PEER_ID)),
+    ('file conn', WireData(HEADERS.CMD_FILE_CONN, '1093', _PEER_ID, file_id=1093)),
+)
+ENCODE_ROUNDS = 100_000
+
+
+def _legacy_bytes(wire_data):
+    return umsgpack.dumps([wire_data.header, wire_data.id, wire_data.version, wire_data.body, wire_data.peer_id])
+
+
+def _rate(func, arg):
+    start = time.perf_counter()
+    for _ in range(ENCODE_ROUNDS):
+        func(arg)
+    return ENCODE_ROUNDS / (time.perf_counter() - start)
+
+
+def encoding():
+    print()
+    print(f"{'message':>10} | {'format':>8} | {'bytes':>5} | {'encodes/s':>10} | {'decodes/s':>10}")
+    for name, wire_data in ENCODING_SAMPLES:
+        for fmt, encode in (('legacy', _legacy_bytes), ('envelope', bytes)):
+            raw = encode(wire_data)
+            assert WireData.load_from(raw).body == wire_data.body
+            encodes = _rate(encode, wire_data)
+            decodes = _rate(WireData.load_from, raw)
+            print(f"{name:>10} | {fmt:>8} | {len(raw):>5} | {encodes:>10.0f} | {decodes:>10.0f}")
+
+
+async def main():
+    await receive_side()
+    await send_side()
+    encoding()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())